@@ -0,0 +1,5 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Benchmarks for the SUMO-Web3D server.
+
+Run these from the repository root, e.g. python -m benchmarks.startup
+"""
@@ -0,0 +1,77 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Compare round_vehicles + diff_dicts with the NumPy-backed VehicleTable.
+
+Usage:
+    python -m benchmarks.deltas
+"""
+import copy
+import random
+import time
+
+from sumo_web3d.server.deltas import diff_dicts, round_vehicles
+from sumo_web3d.server.vehicle_table import VehicleTable
+
+SCALES = [1000, 10000, 50000]
+STEPS = 5
+
+
+def make_frames(n, rng):
+    """A sequence of frames in which every vehicle moves and ~1% arrive or depart per step."""
+    vehicles = {
+        'veh%d' % i: {
+            'x': rng.uniform(0, 10000), 'y': rng.uniform(0, 10000), 'z': 0.0,
+            'speed': rng.uniform(0, 20), 'angle': rng.uniform(0, 360), 'signals': 0,
+            'type': 'passenger', 'length': 5.0, 'width': 1.8, 'vClass': 'passenger',
+        } for i in range(n)
+    }
+    frames = []
+    next_id = n
+    for step in range(STEPS + 1):
+        for veh_id in rng.sample(sorted(vehicles), n // 100):
+            del vehicles[veh_id]
+            vehicles['veh%d' % next_id] = dict(vehicles[next(iter(vehicles))])
+            next_id += 1
+        for v in vehicles.values():
+            v['x'] += rng.uniform(0, 2)
+            v['y'] += rng.uniform(0, 2)
+            if rng.random() < 0.3:
+                v['speed'] = rng.uniform(0, 20)
+        frames.append(copy.deepcopy(vehicles))
+    return frames
+
+
+def time_dicts(frames):
+    frames = copy.deepcopy(frames)
+    last = {}
+    total_secs = 0
+    for i, vehicles in enumerate(frames):
+        start_secs = time.perf_counter()
+        round_vehicles(vehicles)
+        diff_dicts(last, vehicles)
+        if i > 0:  # the first frame is all creations.
+            total_secs += time.perf_counter() - start_secs
+        last = vehicles
+    return total_secs / (len(frames) - 1)
+
+
+def time_table(frames):
+    table = VehicleTable()
+    total_secs = 0
+    for i, vehicles in enumerate(frames):
+        start_secs = time.perf_counter()
+        table.update(vehicles)
+        if i > 0:
+            total_secs += time.perf_counter() - start_secs
+    return total_secs / (len(frames) - 1)
+
+
+def main():
+    rng = random.Random(0)
+    print('%8s %18s %18s' % ('vehicles', 'diff_dicts (ms)', 'VehicleTable (ms)'))
+    for n in SCALES:
+        frames = make_frames(n, rng)
+        print('%8d %18.1f %18.1f' % (n, time_dicts(frames) * 1000, time_table(frames) * 1000))
+
+
+if __name__ == '__main__':
+    main()
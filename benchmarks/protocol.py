@@ -0,0 +1,97 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Compare the JSON and binary snapshot protocols.
+
+Usage:
+    python -m benchmarks.protocol
+
+Reports bytes per frame and encode time for a frame in which every vehicle is created and for a
+typical frame in which every vehicle moves, with vehicle IDs, and with integer handles and the
+catalog of vehicle types (see sumo_web3d/server/vtypes.py).
+"""
+import random
+import time
+
+from sumo_web3d.server.handles import SnapshotInterner
+from sumo_web3d.server.protocol import encode_binary, encode_json
+
+SCALES = [1000, 10000, 50000]
+REPEATS = 5
+
+# Like those of bologna-acosta's joined_vtypes.add.xml.
+VTYPES = [
+    {'type': 'passenger1', 'length': 5.0, 'width': 1.8, 'vClass': 'passenger'},
+    {'type': 'passenger2a', 'length': 4.5, 'width': 1.8, 'vClass': 'passenger'},
+    {'type': 'passenger3', 'length': 5.0, 'width': 1.8, 'vClass': 'passenger'},
+    {'type': 'bus', 'length': 12.0, 'width': 2.5, 'vClass': 'bus'},
+    {'type': 'DEFAULT_PEDTYPE', 'length': 0.215, 'width': 0.478, 'vClass': 'pedestrian'},
+]
+
+
+def make_vehicle(rng):
+    vehicle = {
+        'x': round(rng.uniform(0, 10000), 2),
+        'y': round(rng.uniform(0, 10000), 2),
+        'z': 0.0,
+        'speed': rng.randint(0, 20),
+        'angle': rng.randint(0, 359),
+        'signals': rng.choice([0, 1, 2, 8]),
+    }
+    vehicle.update(rng.choice(VTYPES))
+    return vehicle
+
+
+def make_update(rng, vehicle):
+    update = {'x': vehicle['x'] + 1.25, 'y': vehicle['y'] - 0.5}
+    if rng.random() < 0.5:
+        update['speed'] = vehicle['speed'] + 1
+    if rng.random() < 0.2:
+        update['angle'] = (vehicle['angle'] + 5) % 360
+    return update
+
+
+def make_snapshot(creations, updates):
+    return {
+        'type': 'snapshot',
+        'time': 100000,
+        'vehicles': {'creations': creations, 'updates': updates, 'removals': []},
+        'lights': {'creations': {}, 'updates': {}, 'removals': []},
+        'vehicle_counts': {'passenger': len(creations) + len(updates)},
+        'simulate_secs': 0.1,
+        'snapshot_secs': 0.1,
+    }
+
+
+def time_encode(encode_fn, snapshot):
+    best_secs = float('inf')
+    for _ in range(REPEATS):
+        start_secs = time.perf_counter()
+        data = encode_fn(snapshot)
+        best_secs = min(best_secs, time.perf_counter() - start_secs)
+    return len(data), best_secs
+
+
+def main():
+    rng = random.Random(0)
+    print('%8s %-9s %-15s %12s %10s %12s' % (
+        'vehicles', 'frame', 'format', 'bytes', 'ms', 'bytes/veh'))
+    for n in SCALES:
+        # IDs like SUMO's for vehicles from flows.
+        vehicles = {'flow_%d.%d' % (i % 97, i): make_vehicle(rng) for i in range(n)}
+        creation = make_snapshot(vehicles, {})
+        update = make_snapshot({}, {k: make_update(rng, v) for k, v in vehicles.items()})
+        interner = SnapshotInterner()
+        frames = [
+            ('creation', '', creation),
+            ('update', '', update),
+            ('creation', '+handles', interner.intern(creation)),
+            ('update', '+handles', interner.intern(update)),
+        ]
+        for frame_name, suffix, snapshot in frames:
+            for format_name, encode_fn in [('json', encode_json), ('binary', encode_binary)]:
+                size, secs = time_encode(encode_fn, snapshot)
+                print('%8d %-9s %-15s %12d %10.2f %12.1f' % (
+                    n, frame_name, format_name + suffix, size, secs * 1000, size / n))
+
+
+if __name__ == '__main__':
+    main()
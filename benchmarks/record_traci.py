@@ -0,0 +1,46 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Record what SUMO returns over TraCI for a scenario, as a fixture for benchmarks.suite.
+
+Usage:
+    python -m benchmarks.record_traci bologna-acosta --steps 500 -o acosta.traci.gz
+
+This needs SUMO. The fixture replays without it; see sumo_web3d/server/traci_fixture.py.
+"""
+import argparse
+import os
+import shlex
+
+from sumo_web3d.server.cache import ParsedFileCache
+from sumo_web3d.server.scenario import DIR, load_scenarios_file
+from sumo_web3d.server.simulation import Simulation
+from sumo_web3d.server.traci_fixture import RecordingTraci
+
+parser = argparse.ArgumentParser(description='Record TraCI responses for benchmarks.')
+parser.add_argument('scenario', help='Name of the scenario to run.')
+parser.add_argument('-o', '--output', required=True, help='Fixture file to write.')
+parser.add_argument('--steps', type=int, default=500, help='Steps to record. (%(default)s)')
+parser.add_argument('--sumo-args', dest='sumo_args', default='',
+                    help='Additional arguments to pass to sumo, e.g. "--scale 10".')
+
+
+def main(args):
+    from sumo_web3d.server import constants  # noqa: F401 (this puts SUMO's tools on the path)
+    import sumolib
+    import traci
+
+    scenarios = load_scenarios_file(
+        {}, os.path.join(DIR, 'scenarios.json'), ParsedFileCache(None))
+    recorder = RecordingTraci(traci)
+    simulation = Simulation(recorder)
+    simulation.start([sumolib.checkBinary('sumo'), '-c', scenarios[args.scenario].config_file] +
+                     shlex.split(args.sumo_args))
+    for _ in range(args.steps):
+        step = simulation.step()
+    simulation.close()
+    recorder.save(args.output)
+    print('Recorded %d steps (%d vehicles at the end) and %d calls to %s' % (
+        args.steps, len(step['vehicles']), len(recorder.log), args.output))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
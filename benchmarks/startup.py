@@ -0,0 +1,70 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Measure server startup time and the cost of the first request for each scenario.
+
+Usage:
+    python -m benchmarks.startup [path/to/scenarios.json]
+
+This compares the old behavior (parse every file of every scenario at startup) with lazy loading,
+both with a cold and a warm on-disk cache.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sumo_web3d.server.cache import ParsedFileCache
+from sumo_web3d.server.scenario import DIR, load_scenarios_file
+
+ATTRIBUTES = ['network', 'additional', 'settings', 'water']
+
+
+def touch_all(scenarios):
+    """Access every lazily-loaded attribute, as the first page load of each scenario would."""
+    for scenario in scenarios.values():
+        if not os.path.exists(scenario.net_file):
+            continue  # e.g. downtown-toronto, whose network isn't checked in.
+        for attribute in ATTRIBUTES:
+            getattr(scenario, attribute)
+
+
+def timed(fn):
+    start_secs = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start_secs
+
+
+def main(scenarios_file):
+    cache_dir = tempfile.mkdtemp()
+    try:
+        rows = []
+
+        def load(cache_dir):
+            return load_scenarios_file({}, scenarios_file, ParsedFileCache(cache_dir))
+
+        # What the server used to do: parse everything before binding a port.
+        scenarios, startup = timed(lambda: load(None))
+        _, parse = timed(lambda: touch_all(scenarios))
+        rows.append(('eager parsing (no cache)', startup + parse, 0))
+
+        scenarios, startup = timed(lambda: load(cache_dir))
+        _, first_requests = timed(lambda: touch_all(scenarios))
+        rows.append(('lazy, cold cache', startup, first_requests))
+
+        scenarios, startup = timed(lambda: load(cache_dir))
+        _, first_requests = timed(lambda: touch_all(scenarios))
+        rows.append(('lazy, warm cache (restart)', startup, first_requests))
+
+        cache_bytes = sum(os.path.getsize(os.path.join(cache_dir, f))
+                          for f in os.listdir(cache_dir))
+    finally:
+        shutil.rmtree(cache_dir)
+
+    print('%-28s %12s %20s' % ('mode', 'startup (s)', 'first requests (s)'))
+    for name, startup, first_requests in rows:
+        print('%-28s %12.3f %20.3f' % (name, startup, first_requests))
+    print('cache size: %.1f MB' % (cache_bytes / 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else os.path.join(DIR, 'scenarios.json'))
@@ -0,0 +1,222 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Time the server's hot paths at several scales, and flag regressions against a baseline.
+
+Usage:
+    python -m benchmarks.suite -o before.json
+    # ... make changes ...
+    python -m benchmarks.suite --baseline before.json
+
+This exits with status 1 if any case is more than --threshold slower than in the baseline. Each
+case is timed as the best of several runs, to reduce noise; results are in ms per operation.
+
+Simulation steps run against FakeTraci, with --churn of the vehicles arriving (and as many
+departing) each step. To also time steps against what a real SUMO returned, record a fixture with
+benchmarks.record_traci and pass it with --traci-fixture.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from benchmarks.deltas import make_frames
+from benchmarks.protocol import make_snapshot, make_update, make_vehicle
+from sumo_web3d.server.deltas import diff_dicts, round_vehicles
+from sumo_web3d.server.fake_traci import FakeTraci
+from sumo_web3d.server.protocol import encode_json
+from sumo_web3d.server.scenario import DIR
+from sumo_web3d.server.simulation import Simulation
+from sumo_web3d.server.tessellation import encode_geometry, tessellate_network
+from sumo_web3d.server.traci_fixture import RecordedTraci
+from sumo_web3d.server.vehicle_table import VehicleTable
+from sumo_web3d.server.xml_utils import iterparse_xml_file
+
+VEHICLE_SCALES = [1000, 10000, 50000]
+SIMULATION_SCALES = [100, 1000, 10000]  # FakeTraci itself is slow beyond this.
+XML_FILES = [
+    'scenarios/cross3ltl/net.net.xml',
+    'scenarios/bologna-acosta/acosta-poly.xml',
+    'scenarios/queens-quay/qq.net.xml',
+]
+NETWORK_FILES = [
+    'scenarios/bologna-acosta/joined_buslanes.net.xml',
+    'scenarios/queens-quay/qq.net.xml',
+]
+REPEATS = 5
+SIMULATION_STEPS = 5  # per repeat.
+
+parser = argparse.ArgumentParser(description='Benchmark the server and flag regressions.')
+parser.add_argument('-o', '--output', help='Write the results to this JSON file.')
+parser.add_argument('--baseline', help='Compare with results written by an earlier run.')
+parser.add_argument(
+    '--threshold', type=float, default=0.2,
+    help='Flag cases which are more than this fraction slower than the baseline. (%(default)s)')
+parser.add_argument(
+    '--churn', type=float, default=0.01,
+    help='Fraction of FakeTraci vehicles which arrive each step. (%(default)s)')
+parser.add_argument(
+    '--traci-fixture', dest='traci_fixtures', action='append', default=[],
+    help='Also time Simulation.step against a fixture from benchmarks.record_traci.')
+parser.add_argument(
+    '--cases', nargs='+', help='Only run cases whose names start with one of these.')
+
+
+def simulation_step(num_vehicles, churn):
+    trip_steps = max(2, int(1 / churn))
+    simulation = Simulation(FakeTraci(
+        num_vehicles=num_vehicles, num_persons=num_vehicles // 10, trip_steps=trip_steps))
+    simulation.start(['sumo'])
+    for _ in range(trip_steps):  # Ramp up to the target population.
+        simulation.step()
+
+    def run():
+        for _ in range(SIMULATION_STEPS):
+            simulation.step()
+    return run, SIMULATION_STEPS
+
+
+def simulation_step_fixture(path):
+    traci = RecordedTraci(path)
+    simulation = Simulation(traci)
+
+    def run():
+        simulation.start(['sumo'])
+        for _ in range(traci.steps):
+            simulation.step()
+        simulation.close()
+    return run, traci.steps
+
+
+def vehicle_frames(num_vehicles):
+    # make_frames is slow at scale, so the cases share its output.
+    if num_vehicles not in vehicle_frames.cache:
+        vehicle_frames.cache[num_vehicles] = make_frames(num_vehicles, random.Random(0))
+    return vehicle_frames.cache[num_vehicles]
+
+
+vehicle_frames.cache = {}
+
+
+def round_vehicles_case(num_vehicles):
+    vehicles = vehicle_frames(num_vehicles)[-1]
+    return lambda: round_vehicles(vehicles), 1
+
+
+def diff_dicts_case(num_vehicles):
+    before, after = vehicle_frames(num_vehicles)[-2:]
+    return lambda: diff_dicts(before, after), 1
+
+
+def vehicle_table_case(num_vehicles):
+    frames = vehicle_frames(num_vehicles)
+    table = VehicleTable()
+    table.update(frames[0])
+    frames = itertools.cycle(frames[1:])
+    return lambda: table.update(next(frames)), 1
+
+
+def json_encode_case(num_vehicles):
+    rng = random.Random(0)
+    vehicles = {'flow_%d.%d' % (i % 97, i): make_vehicle(rng) for i in range(num_vehicles)}
+    snapshot = make_snapshot({}, {k: make_update(rng, v) for k, v in vehicles.items()})
+    return lambda: encode_json(snapshot), 1
+
+
+def xml_parsing_case(path):
+    return lambda: iterparse_xml_file(path), 1
+
+
+def tessellation_case(path):
+    network = iterparse_xml_file(path)
+    return lambda: encode_geometry(tessellate_network(network)), 1
+
+
+def make_cases(args):
+    """(name, scale, setup) for each case, where setup() returns (fn, operations per call)."""
+    cases = []
+    for n in SIMULATION_SCALES:
+        cases.append(('simulation_step', n, lambda n=n: simulation_step(n, args.churn)))
+    for path in args.traci_fixtures:
+        cases.append(('simulation_step_fixture', os.path.basename(path),
+                      lambda path=path: simulation_step_fixture(path)))
+    for name, setup in [('round_vehicles', round_vehicles_case),
+                        ('diff_dicts', diff_dicts_case),
+                        ('vehicle_table', vehicle_table_case),
+                        ('json_encode', json_encode_case)]:
+        for n in VEHICLE_SCALES:
+            cases.append((name, n, lambda setup=setup, n=n: setup(n)))
+    for path in XML_FILES:
+        cases.append(('xml_parsing', os.path.basename(path),
+                      lambda path=path: xml_parsing_case(os.path.join(DIR, path))))
+    for path in NETWORK_FILES:
+        cases.append(('tessellation', os.path.basename(path),
+                      lambda path=path: tessellation_case(os.path.join(DIR, path))))
+    if args.cases:
+        cases = [case for case in cases if case[0].startswith(tuple(args.cases))]
+    return cases
+
+
+def time_case(setup):
+    """The best time of REPEATS calls, in ms per operation."""
+    fn, operations = setup()
+    best_secs = float('inf')
+    for _ in range(REPEATS):
+        start_secs = time.perf_counter()
+        fn()
+        best_secs = min(best_secs, time.perf_counter() - start_secs)
+    return best_secs * 1000 / operations
+
+
+def find_regressions(results, baseline, threshold):
+    """The (key, baseline ms, ms) of results which are more than threshold slower."""
+    return [(key, baseline[key]['ms'], result['ms'])
+            for key, result in sorted(results.items())
+            if key in baseline and result['ms'] > baseline[key]['ms'] * (1 + threshold)]
+
+
+def main(args):
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            old = json.load(f)
+        baseline = old['results']
+        if old.get('churn') != args.churn:
+            print('Warning: the baseline was run with --churn %s' % old.get('churn'))
+
+    results = {}
+    print('%-45s %12s %12s %8s' % ('case', 'ms', 'baseline', 'change'))
+    for name, scale, setup in make_cases(args):
+        key = '%s/%s' % (name, scale)
+        ms = time_case(setup)
+        results[key] = {'ms': ms}
+        if key in baseline:
+            old_ms = baseline[key]['ms']
+            print('%-45s %12.3f %12.3f %+7.0f%%%s' % (
+                key, ms, old_ms, (ms / old_ms - 1) * 100,
+                ' REGRESSION' if ms > old_ms * (1 + args.threshold) else ''))
+        else:
+            print('%-45s %12.3f' % (key, ms))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'churn': args.churn,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    if regressions:
+        print('%d cases are more than %.0f%% slower than the baseline' % (
+            len(regressions), args.threshold * 100))
+    return regressions
+
+
+if __name__ == '__main__':
+    if main(parser.parse_args()):
+        sys.exit(1)
@@ -0,0 +1,91 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Count the TraCI round trips per simulation step, as the number of agents grows.
+
+Compares Simulation.step, which reads batched subscription results, with the old approach of
+re-subscribing to every person and listing every domain's IDs each step. Batched steps only
+make calls to subscribe to new departures, of which FakeTraci has about 2% of the population per
+step. This runs against FakeTraci, so the times leave out the socket; against SUMO, each call is
+a round trip.
+
+Usage:
+    python -m benchmarks.traci_calls
+"""
+from collections import Counter
+import time
+
+from sumo_web3d.server.fake_traci import FakeTraci
+from sumo_web3d.server.simulation import Simulation
+
+SCALES = [(100, 10), (1000, 100), (10000, 1000)]
+TRIP_STEPS = 100
+WARM_UP_STEPS = 60
+STEPS = 10
+
+
+class PerAgentSimulation(Simulation):
+    """Simulation.start and Simulation.step as they were before batching."""
+
+    def start(self, args):
+        traci = self.traci
+        traci.start(args)
+        traci.simulation.subscribe()
+        for light_id in traci.trafficlights.getIDList():
+            traci.trafficlights.subscribe(light_id, self.light_vars)
+
+    def step(self):
+        traci = self.traci
+        tc = self.tc
+        traci.simulationStep()
+        for veh_id in traci.simulation.getDepartedIDList():
+            traci.vehicle.subscribe(veh_id, self.vehicle_vars)
+        ids = tuple(set(traci.vehicle.getIDList() +
+                        traci.simulation.getSubscriptionResults()
+                        [tc.VAR_DEPARTED_VEHICLES_IDS]))
+        vehicles = {veh_id: self.vehicle_to_dict(traci.vehicle.getSubscriptionResults(veh_id))
+                    for veh_id in ids}
+        for ped_id in traci.person.getIDList():
+            traci.person.subscribe(ped_id, self.person_vars)
+        person_ids = traci.person.getIDList()
+        vehicles.update({p_id: self.person_to_dict(traci.person.getSubscriptionResults(p_id))
+                         for p_id in person_ids})
+        light_ids = traci.trafficlight.getIDList()
+        lights = {l_id: self.light_to_dict(traci.trafficlight.getSubscriptionResults(l_id))
+                  for l_id in light_ids}
+        return {
+            'time': traci.simulation.getCurrentTime(),
+            'vehicles': vehicles,
+            'lights': lights,
+            'vehicle_counts': Counter(v['vClass'] for v in vehicles.values()),
+        }
+
+
+def run(simulation_class, num_vehicles, num_persons):
+    """Returns the mean calls and seconds per step once warmed up, and the final state."""
+    traci = FakeTraci(num_vehicles=num_vehicles, num_persons=num_persons, trip_steps=TRIP_STEPS)
+    simulation = simulation_class(traci)
+    simulation.start(['sumo'])
+    for _ in range(WARM_UP_STEPS):  # Ramp up to the target population.
+        simulation.step()
+    start_calls = traci.calls
+    start_secs = time.perf_counter()
+    for _ in range(STEPS):
+        step = simulation.step()
+    secs = time.perf_counter() - start_secs
+    return (traci.calls - start_calls) / STEPS, secs / STEPS, step
+
+
+def main():
+    print('%8s %8s %18s %18s %14s %14s' % (
+        'vehicles', 'persons', 'per-agent calls', 'batched calls',
+        'per-agent (ms)', 'batched (ms)'))
+    for num_vehicles, num_persons in SCALES:
+        old_calls, old_secs, old_step = run(PerAgentSimulation, num_vehicles, num_persons)
+        new_calls, new_secs, new_step = run(Simulation, num_vehicles, num_persons)
+        for key in ('time', 'vehicles', 'lights', 'vehicle_counts'):
+            assert old_step[key] == new_step[key], key
+        print('%8d %8d %18.1f %18.1f %14.2f %14.2f' % (
+            num_vehicles, num_persons, old_calls, new_calls, old_secs * 1000, new_secs * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Compare whole-document xmltodict parsing with the streaming, projected parser.
+
+Usage:
+    python -m benchmarks.xml_parsing [file.net.xml ...]
+
+Each measurement runs in a fresh subprocess so that peak RSS is attributable to one parser. The
+reported peak includes producing the JSON response, since that's what the server holds in memory.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from sumo_web3d.server.scenario import DIR
+from sumo_web3d.server.xml_utils import iterparse_xml_file, parse_xml_file
+
+PARSERS = {
+    'xmltodict': parse_xml_file,
+    'iterparse': iterparse_xml_file,
+}
+
+DEFAULT_FILES = [
+    'scenarios/bologna-acosta/joined_buslanes.net.xml',
+    'scenarios/bologna-acosta/acosta-poly.xml',
+    'scenarios/queens-quay/qq.net.xml',
+    'scenarios/downtown-toronto/toronto.poly.xml',
+]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1e6 if sys.platform == 'darwin' else 1e3)
+
+
+def measure(parser, path):
+    """Run in the child process: parse and serialize path, report stats as JSON."""
+    baseline_mb = peak_rss_mb()
+    start_secs = time.perf_counter()
+    text = json.dumps(PARSERS[parser](path))
+    parse_secs = time.perf_counter() - start_secs
+    print(json.dumps({
+        'secs': parse_secs,
+        'peak_rss_mb': peak_rss_mb() - baseline_mb,
+        'json_bytes': len(text),
+    }))
+
+
+def main(paths):
+    print('%-45s %-10s %8s %14s %12s' % ('file', 'parser', 'secs', 'peak RSS (MB)', 'JSON (KB)'))
+    for path in paths:
+        if not os.path.exists(path):
+            print('%-45s (missing)' % os.path.basename(path))
+            continue
+        for parser in PARSERS:
+            output = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.xml_parsing', '--child', parser, path])
+            stats = json.loads(output.decode('utf-8'))
+            print('%-45s %-10s %8.3f %14.1f %12.1f' % (
+                os.path.basename(path), parser, stats['secs'], stats['peak_rss_mb'],
+                stats['json_bytes'] / 1e3))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main(sys.argv[1:] or [os.path.join(DIR, f) for f in DEFAULT_FILES])
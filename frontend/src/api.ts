@@ -15,6 +15,18 @@ export interface VehicleInfo {
   signals: number; // bitset of Signals.
   vehicle: string | null; // for a person, are they in a vehicle?
   vClass: string;
+  vType?: number; // index of a VehicleType with the fields which a creation leaves out.
+}
+
+/**
+ * Fields which are the same for every vehicle of a type. Creations refer to these by index rather
+ * than repeating them; see sumo_web3d/server/vtypes.py.
+ */
+export interface VehicleType {
+  type: string;
+  vClass?: string;
+  length?: number;
+  width?: number;
 }
 
 export enum Signals {
@@ -38,24 +50,50 @@ export interface SimulationStateMessage extends SimulationState {
   type: 'state';
 }
 
-export type WebsocketMessage = SnapshotMessage | SimulationStateMessage;
+export interface ErrorMessage {
+  type: 'error';
+  message: string;
+}
 
+export type WebsocketMessage = SnapshotMessage | SimulationStateMessage | ErrorMessage;
+
+/**
+ * Objects are keyed by integer handles, which are only valid for this websocket connection.
+ * Creations carry the object's ID; see sumo_web3d/server/handles.py. Removals must be applied
+ * first, since a handle may be removed and reused in the same delta.
+ */
 export interface Delta<T> {
-  creations: {[id: string]: T};
-  updates: {[id: string]: T};
-  removals: string[];
+  creations: {[handle: number]: T & {id: string}};
+  updates: {[handle: number]: T};
+  removals: number[];
 }
 
+/**
+ * The area which a viewer's camera can see, as [left, bottom, right, top] in SUMO coordinates.
+ * Viewers which report this are only sent the vehicles near it; see sumo_web3d/server/interest.py.
+ */
+export type ViewportBounds = [number, number, number, number];
+
 /** Return type for /snap endpoint. */
 export interface Snapshot {
   time: number;
   vehicles: Delta<VehicleInfo>;
   lights: Delta<LightInfo>;
+  /** vehicle types which this snapshot's creations are the first to refer to, by index */
+  vTypes?: {[index: number]: VehicleType};
   vehicle_counts: {[vClass: string]: number};
   /** time to run one step of the SUMO simulation */
   simulate_secs: number;
   /** time to construct the snapshot of the update */
   snapshot_secs: number;
+  /** how late this frame was sent; at least the time between frames if the server can't keep up */
+  frame_lag_secs: number;
+  /** the span of recent simulation time which the viewer can rewind to, if the server keeps it */
+  history?: ReplayInfo | null;
+  /** set on frames played back from the history, after rewinding */
+  rewinding?: boolean;
+  /** set on frames which create everything: drop all vehicles before applying them */
+  reset?: boolean;
 }
 
 /** Response type for /state endpoint */
@@ -63,17 +101,105 @@ export interface SimulationState {
   scenario: string;
   simulationStatus: SimulationStatus;
   delayMs: number;
+  /** set if the server is replaying a recording rather than running SUMO */
+  replay: ReplayInfo | null;
+}
+
+/** The span of simulation time in a recording, or in the server's history. */
+export interface ReplayInfo {
+  startMs: number;
+  endMs: number;
 }
 
 export type SimulationStatus = 'off' | 'running' | 'paused';
 
+/**
+ * Response type for POST /scenarios/<name>/vehicle_routes, with body {ids: string[], geometry?}.
+ * Vehicles which don't exist are left out. shape is only included with geometry: true.
+ */
+export interface VehicleRoutesResponse {
+  [vehicleId: string]: {
+    edges: string[];
+    shape?: [number, number][]; // [x, y] in SUMO coordinates.
+  };
+}
+
+/**
+ * Header of the binary /scenarios/<name>/geometry endpoint: the network's lanes, junctions and bus
+ * stops, tessellated by the server. See sumo_web3d/server/tessellation.py for the format.
+ */
+export interface GeometryHeader {
+  version: number;
+  layers: GeometryLayer[];
+}
+
+export interface GeometryLayer {
+  name: string;
+  materials: string[]; // names of materials, see LAYER_MATERIALS in network.ts.
+  vertexCount: number;
+  indexCount: number;
+  // [offset, length] in bytes, relative to the end of the header.
+  position: [number, number]; // float32 x, y, z in three.js coordinates.
+  normal: [number, number]; // float32
+  uv: [number, number]; // float32
+  index: [number, number]; // uint32
+  groups: {start: number; count: number; materialIndex: number}[];
+  objects: GeometryObject[]; // sorted by start.
+}
+
+/** A lane, junction or bus stop within a layer, as a range of its index buffer. */
+export interface GeometryObject {
+  start: number;
+  count: number;
+  center: [number, number, number];
+  keys: string[]; // IDs to look the object up by, e.g. its edge's and its lane's.
+  userData: {type?: string; name: string; osmId?: {id: string; type: string}};
+}
+
+/**
+ * Response type for /scenarios/<name>/tiles: the tiles into which the server partitions edges,
+ * junctions and polygons. See sumo_web3d/server/tiles.py.
+ */
+export interface TileManifest {
+  origin: [number, number]; // SUMO x, y of the bottom-left corner of tile 0/0/0.
+  size: number; // width and height of tile 0/0/0, in meters.
+  maxZoom: number;
+  tiles: TileInfo[]; // only the non-empty ones.
+}
+
+export interface TileInfo {
+  z: number;
+  x: number;
+  y: number;
+  bounds: [number, number, number, number]; // xmin, ymin, xmax, ymax of its contents.
+  counts: {[kind: string]: number};
+}
+
+/** Response type for /scenarios/<name>/tiles/<z>/<x>/<y>. */
+export interface NetworkTile {
+  net: {
+    edge: Edge[];
+    junction: Junction[];
+  };
+  additional: {
+    poly: Polygon[];
+  };
+}
+
 /** Response type for /scenario endpoint */
 export interface ScenarioName {
   displayName: string;
   kebabCase: string;
 }
 
-/** Response type for /network endpoint */
+/**
+ * Response type for /network endpoint.
+ *
+ * The server only sends the elements and attributes declared here, see NET_PROJECTION in
+ * sumo_web3d/server/xml_utils.py. With ?slim, it only sends the location, traffic light programs
+ * and the connections controlled by traffic lights with the edges they come from; the rest is
+ * empty. See untessellated_network in sumo_web3d/server/tessellation.py.
+ */
 export interface Network {
   net: Net;
 }
@@ -126,7 +252,7 @@ export interface Junction {
   id: string;
   incLanes: string;
   intLanes: string;
-  request: any;
+  request?: any; // not sent by the server
   shape: string;
   type: JunctionType;
   x: string;
@@ -173,8 +299,8 @@ export interface Net {
   location: Location;
   tlLogic: TlLogic | TlLogic[];
   version: string;
-  'xmlns:xsi': string;
-  'xsi:noNamespaceSchemaLocation': string;
+  'xmlns:xsi'?: string;
+  'xsi:noNamespaceSchemaLocation'?: string;
 }
 
 export interface AdditionalResponse {
@@ -123,6 +123,7 @@ export default (props: RootProps) => {
   const payloadKb = stats.payloadSize / 1024;
   const simulateMs = stats.simulateSecs * 1000;
   const snapshotMs = stats.snapshotSecs * 1000;
+  const lagMs = stats.lagSecs * 1000;
 
   return (
     <div className="metadata-info">
@@ -132,6 +133,7 @@ export default (props: RootProps) => {
         <div>payload: {payloadKb.toFixed(1)} KB</div>
         <div>simulate: {simulateMs.toFixed(2)} ms</div>
         <div>snapshot: {snapshotMs.toFixed(2)} ms</div>
+        {lagMs > 0 && <div>behind schedule: {lagMs.toFixed(0)} ms</div>}
       </div>
       <h3>Vehicle Summary</h3>
       <div className="metadata-section">
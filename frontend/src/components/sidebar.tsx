@@ -30,6 +30,58 @@ const PauseOrResume = (props: RootProps) =>
     <FlatButton label="resume" onClick={props.onResume} />
   );
 
+interface ReplaySliderState {
+  seekMs: number | null; // while the slider is being dragged
+}
+
+/**
+ * Seeks within a recording which the server is replaying, or rewinds within the recent history of
+ * a live simulation.
+ */
+class ReplaySlider extends React.Component<RootProps, ReplaySliderState> {
+  constructor(props: RootProps) {
+    super(props);
+    this.state = {seekMs: null};
+  }
+
+  render() {
+    const {replay, history, rewinding} = this.props;
+    const range = replay || history;
+    if (!range || range.startMs >= range.endMs) {
+      return null;
+    }
+    const onSeek = replay ? this.props.onSeek : this.props.onRewind;
+    const timeMs =
+      this.state.seekMs !== null
+        ? this.state.seekMs
+        : _.clamp(this.props.stats.time, range.startMs, range.endMs);
+    return (
+      <div className="slider-row">
+        <span>{replay ? 'replay' : 'rewind'}</span>
+        <div id="replay-slider">
+          <Slider
+            value={timeMs}
+            min={range.startMs}
+            max={range.endMs}
+            onChange={(e, v) => this.setState({seekMs: v})}
+            onDragStop={() => {
+              if (this.state.seekMs !== null) {
+                onSeek(this.state.seekMs);
+              }
+              this.setState({seekMs: null});
+            }}
+          />
+          <div className="speed-control-slider-label">
+            Time: {(timeMs / 1000).toFixed(1)} s of {(range.endMs / 1000).toFixed(1)} s
+          </div>
+        </div>
+        {!replay &&
+          rewinding && <FlatButton label="live" onClick={() => this.props.onRewind(null)} />}
+      </div>
+    );
+  }
+}
+
 const VehicleInfo = (props: {id: string; info: VehicleInfo}) => (
   <div className="clicked-vehicle-info">
     {props.id}: {JSON.stringify(props.info, null, '  ')}
@@ -89,6 +141,7 @@ class Sidebar extends React.Component<RootProps, SidebarState> {
             </div>
             <span id="fast-symbol">fast</span>
           </div>
+          <ReplaySlider {...this.props} />
           {this.props.followingVehicle && (
             <UnfollowButton unfollowObjectPOV={this.props.unfollowObjectPOV} />
           )}
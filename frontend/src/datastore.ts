@@ -1,10 +1,24 @@
 // Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
 import * as _ from 'lodash';
 
-import {Delta, ScenarioName, SimulationStatus, VehicleInfo, WebsocketMessage} from './api';
+import {
+  Delta,
+  ReplayInfo,
+  ScenarioName,
+  SimulationStatus,
+  VehicleInfo,
+  VehicleType,
+  WebsocketMessage,
+} from './api';
 import {SUPPORTED_VEHICLE_CLASSES} from './constants';
 import {LatLng} from './coords';
 import {InitResources} from './initialization';
+import {
+  BinarySnapshotMessage,
+  decodeBinarySnapshot,
+  VehicleColumns,
+  withVehicleType,
+} from './protocol';
 import Sumo3D, {NameAndUserData, SumoState, SUMO_ENDPOINT} from './sumo3d';
 
 export interface State {
@@ -17,9 +31,12 @@ export interface State {
   followingVehicle: boolean;
   edgesHighlighted: boolean;
   delayMs: number;
+  history: ReplayInfo | null;
+  rewinding: boolean;
   simulationStatus: SimulationStatus;
   isLoading: boolean;
   isProjection: boolean;
+  replay: ReplayInfo | null;
   scenario: string;
   searchBoxErrorMessage: string;
   stats: SumoState;
@@ -35,12 +52,15 @@ export default function createStore(init: InitResources) {
     clickedVehicleInfo: null,
     followingVehicle: false,
     edgesHighlighted: false,
+    history: null,
+    rewinding: false,
     stats: {
       time: 0,
       payloadSize: 0,
       vehicleCounts: {},
       simulateSecs: 0,
       snapshotSecs: 0,
+      lagSecs: 0,
     },
     isLoading: false,
     isProjection: false,
@@ -56,29 +76,61 @@ export default function createStore(init: InitResources) {
     onUnfollow: unfollowObjectPOV,
     onRemove: removeVehicleCallback,
     onUnhighlight,
+    onViewportChange(bounds, camera) {
+      webSocket.send(JSON.stringify({type: 'viewport', bounds, camera}));
+    },
   });
 
   state.isProjection = init.isProjection;
 
+  // Maps from the handles in snapshots to vehicle and light IDs. Handles are small integers, so
+  // these are arrays. Every creation sets its handle's ID, so stale entries never need clearing.
+  const vehicleIds: string[] = [];
+  const lightIds: string[] = [];
+  // Likewise, the vehicle types which creations refer to. Indices aren't reused by the server.
+  const vehicleTypes: VehicleType[] = [];
+  // Binary snapshots' vehicle updates are decoded into these.
+  const vehicleColumns = new VehicleColumns();
+
   webSocket.onmessage = event => {
-    const msg: WebsocketMessage = JSON.parse(event.data);
+    // Snapshots arrive as ArrayBuffers if the server agreed to the binary subprotocol.
+    const isBinary = event.data instanceof ArrayBuffer;
+    const msg: WebsocketMessage = isBinary
+      ? decodeBinarySnapshot(event.data, vehicleColumns)
+      : JSON.parse(event.data);
     if (msg.type === 'snapshot') {
-      const payloadSize = event.data.length;
+      const payloadSize = isBinary ? event.data.byteLength : event.data.length;
       state.stats = {
         time: msg.time,
         payloadSize,
         vehicleCounts: msg.vehicle_counts,
         simulateSecs: msg.simulate_secs,
         snapshotSecs: msg.snapshot_secs,
+        lagSecs: msg.frame_lag_secs,
       };
+      state.history = msg.history || null;
+      state.rewinding = !!msg.rewinding;
+      if (msg.reset) {
+        // The viewer switched between the live simulation and its history.
+        sumo3d.purgeVehicles();
+      }
 
-      processDelta(msg.vehicles, {
-        enter: (vehicleId, info) => sumo3d.createVehicleObject(vehicleId, info),
+      _.forEach(msg.vTypes, (vType, index) => {
+        vehicleTypes[Number(index)] = vType;
+      });
+      processDelta(msg.vehicles, vehicleIds, {
+        enter: (vehicleId, info) =>
+          sumo3d.createVehicleObject(vehicleId, withVehicleType(info, vehicleTypes)),
         update: (vehicleId, info) => sumo3d.updateVehicleObject(vehicleId, info),
         exit: vehicleId => sumo3d.removeVehicleObject(vehicleId),
       });
+      if (isBinary) {
+        for (const handle of (msg as BinarySnapshotMessage).columnUpdates) {
+          sumo3d.updateVehicleFromColumns(vehicleIds[handle], vehicleColumns, handle);
+        }
+      }
 
-      processDelta(msg.lights, {
+      processDelta(msg.lights, lightIds, {
         enter: (lightId, delta) => sumo3d.updateLightObject(lightId, delta),
         update: (lightId, delta) => sumo3d.updateLightObject(lightId, delta),
         exit: id => console.warn('Disappearing traffic lights!', id),
@@ -89,9 +141,18 @@ export default function createStore(init: InitResources) {
       sumo3d.updateStats(state.stats);
       stateChanged();
     } else if (msg.type === 'state') {
+      if (msg.simulationStatus === 'off' && state.simulationStatus !== 'off') {
+        // Another viewer may have cancelled the simulation.
+        sumo3d.purgeVehicles();
+      }
+      state.scenario = msg.scenario;
       state.simulationStatus = msg.simulationStatus;
       state.delayMs = msg.delayMs;
+      state.replay = msg.replay;
       stateChanged();
+    } else if (msg.type === 'error') {
+      // e.g. the server is already running as many simulations as it can.
+      window.alert(msg.message);
     } else {
       console.error('unrecognized message: ', msg);
     }
@@ -99,20 +160,23 @@ export default function createStore(init: InitResources) {
 
   function processDelta<T>(
     delta: Delta<T>,
+    ids: string[],
     callbacks: {
       enter: (id: string, t: T) => any;
       update: (id: string, t: T) => any;
       exit: (id: string) => any;
     },
   ) {
-    _.forEach(delta.creations, (v, k) => {
-      callbacks.enter(k, v);
+    // Removals come first, since a merged delta may remove a handle and then reuse it.
+    _.forEach(delta.removals, handle => {
+      callbacks.exit(ids[handle]);
     });
-    _.forEach(delta.updates, (v, k) => {
-      callbacks.update(k, v);
+    _.forEach(delta.creations, (v, handle) => {
+      ids[Number(handle)] = v.id;
+      callbacks.enter(v.id, v);
     });
-    _.forEach(delta.removals, v => {
-      callbacks.exit(v);
+    _.forEach(delta.updates, (v, handle) => {
+      callbacks.update(ids[Number(handle)], v);
     });
   }
 
@@ -134,12 +198,15 @@ export default function createStore(init: InitResources) {
     state.clickedObjects = [];
     state.clickedVehicleId = null;
     state.clickedVehicleInfo = null;
+    state.history = null;
+    state.rewinding = false;
     state.stats = {
       time: 0,
       payloadSize: 0,
       vehicleCounts: {},
       simulateSecs: 0,
       snapshotSecs: 0,
+      lagSecs: 0,
     };
     sumo3d.unselectMeshes();
     sumo3d.purgeVehicles();
@@ -150,6 +217,15 @@ export default function createStore(init: InitResources) {
     webSocket.send(JSON.stringify({type: 'action', action: 'changeDelay', delayLengthMs: delayMs}));
   }
 
+  async function seekTo(timeMs: number) {
+    webSocket.send(JSON.stringify({type: 'action', action: 'seek', timeMs}));
+  }
+
+  /** Watch the server's history from timeMs, or the live simulation again if it's null. */
+  async function rewindTo(timeMs: number | null) {
+    webSocket.send(JSON.stringify({type: 'rewind', timeMs}));
+  }
+
   async function changeScenario(scenario: string) {
     window.location.pathname = `/scenarios/${scenario}/`;
   }
@@ -223,7 +299,7 @@ export default function createStore(init: InitResources) {
       stateChanged();
       return;
     }
-    const url = `${SUMO_ENDPOINT}/vehicle_route?${vehicleId}`;
+    const url = `${SUMO_ENDPOINT}/scenarios/${state.scenario}/vehicle_route?${vehicleId}`;
     const response = await fetch(url);
     if (response.status !== 200) {
       console.log('non-200', url);
@@ -340,6 +416,8 @@ export default function createStore(init: InitResources) {
       changeScenario,
       followObjectPOV,
       changeDelay,
+      seekTo,
+      rewindTo,
       handleSearch,
       deselectSearch,
       unfollowObjectPOV,
@@ -22,6 +22,8 @@ import init from './initialization';
         unfollowObjectPOV={store.actions.unfollowObjectPOV}
         toggleRouteObjectHighlighted={store.actions.toggleRouteObjectHighlighted}
         onChangeDelayMs={store.actions.changeDelay}
+        onSeek={store.actions.seekTo}
+        onRewind={store.actions.rewindTo}
         onFocusOnVehicleOfClass={store.actions.focusOnVehicleOfClass}
         onFocusOnTrafficLight={store.actions.focusOnTrafficLight}
         handleSearch={store.actions.handleSearch}
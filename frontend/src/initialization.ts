@@ -5,7 +5,15 @@ import * as _ from 'lodash';
 import * as three from 'three';
 import * as MTLLoader from 'three-mtl-loader';
 
-import {AdditionalResponse, Network, ScenarioName, SimulationState, SumoSettings} from './api';
+import {
+  AdditionalResponse,
+  Network,
+  ScenarioName,
+  SimulationState,
+  SumoSettings,
+  TileManifest,
+} from './api';
+import {BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL} from './protocol';
 import {loadOBJFile} from './three-utils';
 import {promiseObject, FeatureCollection} from './utils';
 
@@ -15,8 +23,10 @@ export interface InitResources {
   availableScenarios: ScenarioName[];
   settings: SumoSettings | null;
   network: Network;
+  geometry: ArrayBuffer | null; // the network, tessellated by the server.
   vehicles: {[vehicleClass: string]: three.Object3D[]};
-  additional: AdditionalResponse | null;
+  additional: AdditionalResponse | null; // without the polygons if there are tiles.
+  tiles: TileManifest | null;
   arrows: {
     left: three.Object3D;
     right: three.Object3D;
@@ -31,8 +41,19 @@ export interface InitResources {
   isProjection: boolean;
 }
 
-const {hostname} = window.location;
-const WEB_SOCKETS_ENDPOINT = `ws://${hostname}:5678/`;
+const {hostname, pathname} = window.location;
+// The page is at /scenarios/<name>/, and the server routes websockets with the same path to that
+// scenario's session.
+const WEB_SOCKETS_ENDPOINT = `ws://${hostname}:5678${pathname}`;
+
+/** The binary snapshot protocol is opt-in, via a ?protocol=binary query parameter. */
+function getWebSocketSubprotocols(): string[] {
+  const useBinary = /[?&]protocol=binary\b/.test(window.location.search);
+  return useBinary ? [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL] : [JSON_SUBPROTOCOL];
+}
+
+/** Matches the server's sumo_web3d/server/session.py DEFAULT_DELAY_MS. */
+const DEFAULT_DELAY_MS = 30;
 
 const textureLoader = new three.TextureLoader();
 const mtlLoader = new MTLLoader() as three.MTLLoader;
@@ -121,12 +142,27 @@ async function fetchJsonAllowFail<T>(url: string): Promise<T | null> {
   return val;
 }
 
+async function fetchArrayBufferAllowFail(url: string): Promise<ArrayBuffer | null> {
+  const response = await fetch(url);
+  if (response.status !== 200) {
+    console.log(`Request for ${url} failed, response: ${response.status}`);
+    return null;
+  }
+  const val = await response.arrayBuffer();
+  console.log(`Loaded ${url}`);
+  return val;
+}
+
 export default async function init(): Promise<InitResources> {
   const loadStartMs = window.performance.now();
-  const simulationState = await fetchJson<SimulationState>('/state');
-  const network = await fetchJson<Network>('network');
-  const isProjection =
-    network.net.location.projParameter.length > 0 && network.net.location.projParameter !== '!';
+  // Until a viewer connects there's no session to report on; the websocket sends the state once
+  // it's been created.
+  const simulationState = (await fetchJsonAllowFail<SimulationState>('state')) || {
+    scenario: '',
+    simulationStatus: 'off',
+    delayMs: DEFAULT_DELAY_MS,
+    replay: null,
+  };
 
   const domPromise = new Promise((resolve, reject) => {
     if (document.readyState !== 'loading') {
@@ -136,15 +172,33 @@ export default async function init(): Promise<InitResources> {
     }
   });
 
-  const webSocket = new WebSocket(WEB_SOCKETS_ENDPOINT);
+  const webSocket = new WebSocket(WEB_SOCKETS_ENDPOINT, getWebSocketSubprotocols());
+  webSocket.binaryType = 'arraybuffer';
   const webSocketPromise = new Promise((resolve, reject) => {
     webSocket.onopen = () => resolve(webSocket);
     webSocket.onerror = reject;
   });
 
+  const geometryPromise = fetchArrayBufferAllowFail('geometry');
+  // If the tiles can't be loaded, the page loads without them rather than failing.
+  const tilesPromise = fetchJsonAllowFail<TileManifest>('tiles').catch(e => {
+    console.warn('Unable to load tiles', e);
+    return null;
+  });
+
   try {
     const {dom, ...resources} = await promiseObject({
-      additional: fetchJsonAllowFail<AdditionalResponse>('additional'),
+      // ?tiled leaves out the polygons, so it's only asked for if they can come from tiles.
+      additional: tilesPromise.then(tiles =>
+        fetchJsonAllowFail<AdditionalResponse>(tiles ? 'additional?tiled' : 'additional'),
+      ),
+      tiles: tilesPromise,
+      geometry: geometryPromise,
+      // The geometry has the network's lanes and junctions, so without it we need all of the
+      // network to draw them. With it, only its location and traffic lights are left.
+      network: geometryPromise.then(geometry =>
+        fetchJson<Network>(geometry ? 'network?slim' : 'network'),
+      ),
       availableScenarios: fetchJson<ScenarioName[]>('/scenarios'),
       vehicles: promiseObject(loadVehicles()),
       water: fetchJson<FeatureCollection>('water'),
@@ -164,10 +218,12 @@ export default async function init(): Promise<InitResources> {
     const loadEndMs = window.performance.now();
     console.log('Loaded static resources in ', loadEndMs - loadStartMs, ' ms.');
 
+    const {location} = resources.network.net;
+    const isProjection = location.projParameter.length > 0 && location.projParameter !== '!';
+
     return {
       ...resources,
       simulationState,
-      network,
       webSocket,
       isProjection,
       reactRootEl: getOrThrow('sidebar'),
@@ -5,7 +5,19 @@
 import * as _ from 'lodash';
 import * as three from 'three';
 
-import {AdditionalResponse, BusStop, Edge, Lane, Network, Polygon, Type} from './api';
+import {
+  AdditionalResponse,
+  BusStop,
+  Edge,
+  GeometryHeader,
+  GeometryLayer,
+  GeometryObject,
+  Lane,
+  Network,
+  NetworkTile,
+  Polygon,
+  Type,
+} from './api';
 import {Transform} from './coords';
 import {offsetLineSegment, pointAlongPolyline} from './geometry';
 import * as materials from './materials';
@@ -282,6 +294,19 @@ function makeMergedPolygons(polygons: Polygon[], t: Transform): three.Mesh {
   return mesh;
 }
 
+/** Make a mesh of the buildings in a tile, if it has any. */
+export function makeTileBuildings(tile: NetworkTile, t: Transform): three.Mesh | null {
+  const polygons = tile.additional.poly;
+  return polygons.length ? makeMergedPolygons(polygons, t) : null;
+}
+
+/** Forget the buildings in a tile, once it's been unloaded. */
+export function forgetTileBuildings(tile: NetworkTile) {
+  for (const polygon of tile.additional.poly) {
+    delete osmIdToMeshes[polygon.id];
+  }
+}
+
 function makeBusStop(busStop: BusStop, lane: Lane, t: Transform): three.Mesh {
   const shape = parseShape(lane.shape);
   const start = pointAlongPolyline(shape, Number(busStop.startPos));
@@ -352,17 +377,131 @@ function makeMergedLakes(lakes: FeatureCollection, t: Transform): three.Mesh {
   return mesh;
 }
 
+const GEOMETRY_MAGIC = 'SW3M';
+
+const LAYER_MATERIALS: {[name: string]: three.Material} = {
+  road: materials.ROAD,
+  crossing: materials.CROSSING,
+  cycleway: materials.CYCLEWAY,
+  railway: materials.RAILWAY,
+  walkway: materials.WALKWAY,
+  junction: materials.JUNCTION,
+  bus_stop: materials.BUS_STOP,
+};
+
+// Bytes to decode at a time. Decoding too many at once overflows the stack.
+const DECODE_CHUNK_BYTES = 8192;
+
+/** Decode ASCII bytes as a string. */
+function decodeAscii(bytes: Uint8Array): string {
+  let text = '';
+  for (let i = 0; i < bytes.length; i += DECODE_CHUNK_BYTES) {
+    text += String.fromCharCode.apply(null, bytes.subarray(i, i + DECODE_CHUNK_BYTES));
+  }
+  return text;
+}
+
+/** Parse the header of the /geometry endpoint, returning it and the offset of the buffers. */
+function parseGeometryHeader(buffer: ArrayBuffer): [GeometryHeader, number] {
+  const bytes = new Uint8Array(buffer);
+  if (decodeAscii(bytes.subarray(0, 4)) !== GEOMETRY_MAGIC) {
+    throw new Error('Not tessellated geometry');
+  }
+  const headerLength = new DataView(buffer).getUint32(4, true);
+  // The server escapes any non-ASCII characters in the JSON header.
+  const json = decodeAscii(bytes.subarray(8, 8 + headerLength));
+  return [JSON.parse(json) as GeometryHeader, 8 + headerLength];
+}
+
+/**
+ * The userData of the object which a face of a tessellated layer belongs to.
+ *
+ * Tessellated layers are single meshes, so their faces don't have userData of their own.
+ */
+export function userDataForFace(object: three.Object3D, faceIndex: number): any {
+  const objects: GeometryObject[] | undefined = object.userData.geometryObjects;
+  if (!objects) return null;
+  const start = faceIndex * 3;
+  const i = _.sortedLastIndexBy(objects, {start} as GeometryObject, o => o.start) - 1;
+  const found = objects[i];
+  return found && start < found.start + found.count ? found.userData : null;
+}
+
+/**
+ * Make a mesh for a layer of tessellated geometry. The buffers are used as they are.
+ *
+ * Each object in the layer also gets a mesh of its own in osmIdToMeshes, for highlighting. These
+ * share the layer's vertices, and only have indices of their own.
+ */
+function makeLayerMesh(buffer: ArrayBuffer, offset: number, layer: GeometryLayer): three.Mesh {
+  const floats = ([start, length]: [number, number], itemSize: number) =>
+    new three.BufferAttribute(new Float32Array(buffer, offset + start, length / 4), itemSize);
+  const position = floats(layer.position, 3);
+  const normal = floats(layer.normal, 3);
+  const uv = floats(layer.uv, 2);
+  const indices = new Uint32Array(buffer, offset + layer.index[0], layer.index[1] / 4);
+
+  const makeGeometry = (index: Uint32Array) => {
+    const geometry = new three.BufferGeometry();
+    geometry.addAttribute('position', position);
+    geometry.addAttribute('normal', normal);
+    geometry.addAttribute('uv', uv);
+    geometry.setIndex(new three.BufferAttribute(index, 1));
+    return geometry;
+  };
+
+  const layerMaterials = layer.materials.map(name => LAYER_MATERIALS[name]);
+  const geometry = makeGeometry(indices);
+  for (const {start, count, materialIndex} of layer.groups) {
+    geometry.addGroup(start, count, materialIndex);
+  }
+  const mesh = new three.Mesh(geometry, new three.MeshFaceMaterial(layerMaterials));
+  mesh.userData = {geometryObjects: layer.objects};
+
+  let group = 0;
+  for (const object of layer.objects) {
+    while (object.start >= layer.groups[group].start + layer.groups[group].count) group++;
+    const objectMesh = new three.Mesh(
+      makeGeometry(indices.subarray(object.start, object.start + object.count)),
+      layerMaterials[layer.groups[group].materialIndex],
+    );
+    objectMesh.userData = object.userData;
+    const [x, y, z] = object.center;
+    const m = {mesh: objectMesh, position: new three.Vector3(x, y, z)};
+    for (const key of object.keys) {
+      osmIdToMeshes[key] = osmIdToMeshes[key] ? osmIdToMeshes[key].concat([m]) : [m];
+    }
+  }
+  return mesh;
+}
+
+/** Make meshes for the edges, junctions and bus stops tessellated by the server. */
+function makeTessellatedNetwork(buffer: ArrayBuffer): three.Mesh[] {
+  const [header, offset] = parseGeometryHeader(buffer);
+  return header.layers.map(layer => {
+    const mesh = makeLayerMesh(buffer, offset, layer);
+    mesh.receiveShadow = true;
+    // Roads don't cast shadows, for the reasons in makeMergedEdgeGeometry.
+    mesh.castShadow = layer.name === 'busStops';
+    return mesh;
+  });
+}
+
 /**
  * Create a group of three.js objects representing the static elements of the scene.
  *
  * This includes the road network, terrain and buildings, but not the moving objects like cars or
  * changing objects like traffic lights.
  *
+ * If the server tessellated the network (geometry), its buffers are used as they are. Otherwise,
+ * the meshes are built from the network here, which takes a while for larger networks.
+ *
  * Note that this function is asynchronous -- it will add more (non-essential)
  * features to the group after it returns.
  */
 export function makeStaticObjects(
   network: Network,
+  geometry: ArrayBuffer | null,
   additionalResponse: AdditionalResponse | null,
   lakes: FeatureCollection | null,
   t: Transform,
@@ -376,16 +515,21 @@ export function makeStaticObjects(
   bgMesh.receiveShadow = true;
   group.add(bgMesh);
 
-  const {mesh: edgeMesh, osmIdToMeshes: osmIdToMesh} = makeMergedEdgeGeometry(network, t);
-  group.add(edgeMesh);
-  group.add(makeMergedJunctions(network, t));
+  if (geometry) {
+    for (const mesh of makeTessellatedNetwork(geometry)) {
+      group.add(mesh);
+    }
+  } else {
+    group.add(makeMergedEdgeGeometry(network, t).mesh);
+    group.add(makeMergedJunctions(network, t));
+  }
   if (lakes) {
     group.add(makeMergedLakes(lakes, t));
   }
 
   if (additionalResponse) {
     const {busStop} = additionalResponse;
-    if (busStop) {
+    if (busStop && !geometry) {
       group.add(makeMergedBusStops(network, busStop, t));
     }
 
@@ -395,5 +539,5 @@ export function makeStaticObjects(
     }
   }
 
-  return [group, osmIdToMesh];
+  return [group, osmIdToMeshes];
 }
@@ -0,0 +1,171 @@
+// Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+/**
+ * Decoder for the binary snapshot protocol.
+ *
+ * See sumo_web3d/server/protocol.py for a description of the format.
+ */
+
+import {SnapshotMessage, VehicleInfo, VehicleType} from './api';
+
+export const JSON_SUBPROTOCOL = 'sumo-web3d-json';
+export const BINARY_SUBPROTOCOL = 'sumo-web3d-binary';
+
+// Numeric fields, in the order that their columns appear.
+const FLOAT32_FIELDS: Array<keyof VehicleInfo> = ['x', 'y', 'z'];
+const INT16_FIELDS: Array<keyof VehicleInfo> = ['speed', 'angle'];
+const UINT16_FIELDS: Array<keyof VehicleInfo> = ['signals'];
+const COLUMN_FIELDS = [...FLOAT32_FIELDS, ...INT16_FIELDS, ...UINT16_FIELDS];
+
+/**
+ * The latest numeric fields of each vehicle, in columns indexed by handle. Binary snapshots'
+ * updates are decoded straight into these, rather than into an object per vehicle.
+ */
+export class VehicleColumns {
+  /** One column per field, in the order of the message's columns. */
+  columns: Float32Array[];
+  /** For each handle, a bitmask of the columns which its latest update set. */
+  mask: Uint8Array;
+
+  constructor(capacity = 1024) {
+    this.columns = COLUMN_FIELDS.map(() => new Float32Array(capacity));
+    this.mask = new Uint8Array(capacity);
+  }
+
+  /** Make room for handles up to maxHandle, doubling so that growth is rare. */
+  reserve(maxHandle: number) {
+    let capacity = this.mask.length;
+    if (maxHandle < capacity) {
+      return;
+    }
+    while (capacity <= maxHandle) {
+      capacity *= 2;
+    }
+    this.columns = this.columns.map(column => {
+      const grown = new Float32Array(capacity);
+      grown.set(column);
+      return grown;
+    });
+    const mask = new Uint8Array(capacity);
+    mask.set(this.mask);
+    this.mask = mask;
+  }
+
+  /** Copy the fields which a handle's latest update set into a vehicle's info. */
+  copyTo(handle: number, info: VehicleInfo) {
+    const rowMask = this.mask[handle];
+    for (let i = 0; i < COLUMN_FIELDS.length; i++) {
+      if (rowMask & (1 << i)) {
+        (info as any)[COLUMN_FIELDS[i]] = this.columns[i][handle];
+      }
+    }
+  }
+}
+
+/** A snapshot whose vehicle updates were decoded into VehicleColumns. */
+export interface BinarySnapshotMessage extends SnapshotMessage {
+  /**
+   * The handles whose numeric fields were updated. Their other fields, if any changed, are in
+   * vehicles.updates as usual.
+   */
+  columnUpdates: number[];
+}
+
+interface BinaryVehiclesHeader {
+  ids: number[];
+  numCreations: number;
+  extra: {[handle: number]: Partial<VehicleInfo> & {id?: string}};
+  removals: number[];
+}
+
+function decodeUtf8(bytes: Uint8Array): string {
+  // TextDecoder is unavailable in some browsers; the header is ASCII apart from IDs.
+  if (typeof TextDecoder !== 'undefined') {
+    return new TextDecoder('utf-8').decode(bytes);
+  }
+  let s = '';
+  for (let i = 0; i < bytes.length; i++) {
+    s += String.fromCharCode(bytes[i]);
+  }
+  return decodeURIComponent(escape(s));
+}
+
+/** Fill in the fields which a vehicle's creation leaves to its vType. */
+export function withVehicleType(info: VehicleInfo, types: VehicleType[]): VehicleInfo {
+  if (info.vType === undefined) {
+    return info;
+  }
+  return Object.assign({}, types[info.vType], info);
+}
+
+/**
+ * Decode a binary snapshot. Creations are decoded into the same shape as a JSON SnapshotMessage's,
+ * while updates are written into the vehicles' columns.
+ */
+export function decodeBinarySnapshot(
+  buffer: ArrayBuffer,
+  table: VehicleColumns,
+): BinarySnapshotMessage {
+  const headerLength = new DataView(buffer).getUint32(0, true);
+  let offset = 4 + headerLength;
+  const header = JSON.parse(decodeUtf8(new Uint8Array(buffer, 4, headerLength)));
+  const vehicles: BinaryVehiclesHeader = header.vehicles;
+  const {ids, numCreations, extra} = vehicles;
+  const n = ids.length;
+
+  // The columns are views onto the message, not copies.
+  // Note: typed arrays use the platform's byte order, which is little-endian in all browsers.
+  const columns: Array<ArrayLike<number>> = [];
+  for (let i = 0; i < FLOAT32_FIELDS.length; i++) {
+    columns.push(new Float32Array(buffer, offset, n));
+    offset += 4 * n;
+  }
+  for (let i = 0; i < INT16_FIELDS.length; i++) {
+    columns.push(new Int16Array(buffer, offset, n));
+    offset += 2 * n;
+  }
+  for (let i = 0; i < UINT16_FIELDS.length; i++) {
+    columns.push(new Uint16Array(buffer, offset, n));
+    offset += 2 * n;
+  }
+  const mask = new Uint8Array(buffer, offset, n);
+
+  // Creations are rare, and carry IDs and types, so they're still decoded into objects.
+  const creations: {[handle: number]: VehicleInfo & {id: string}} = {};
+  for (let row = 0; row < numCreations; row++) {
+    const id = ids[row];
+    const info: any = {};
+    const rowMask = mask[row];
+    for (let i = 0; i < columns.length; i++) {
+      if (rowMask & (1 << i)) {
+        info[COLUMN_FIELDS[i]] = columns[i][row];
+      }
+    }
+    creations[id] = Object.assign(info, extra[id]);
+  }
+
+  const updates: {[handle: number]: Partial<VehicleInfo>} = {};
+  const columnUpdates = ids.slice(numCreations);
+  let maxHandle = -1;
+  for (const handle of columnUpdates) {
+    maxHandle = Math.max(maxHandle, handle);
+  }
+  table.reserve(maxHandle);
+  for (let i = 0; i < columns.length; i++) {
+    const column = columns[i];
+    const tableColumn = table.columns[i];
+    for (let row = numCreations; row < n; row++) {
+      tableColumn[ids[row]] = column[row];
+    }
+  }
+  for (let row = numCreations; row < n; row++) {
+    const id = ids[row];
+    table.mask[id] = mask[row];
+    if (extra[id]) {
+      updates[id] = extra[id];
+    }
+  }
+
+  header.vehicles = {creations, updates, removals: vehicles.removals};
+  header.columnUpdates = columnUpdates;
+  return header as BinarySnapshotMessage;
+}
@@ -35,17 +35,50 @@ function angleForFace(
   return three.Math.radToDeg(Math.atan2(z - cameraPos.z, x - cameraPos.x));
 }
 
+/** Like angleForFace, but for the triangle a, b, c of an indexed BufferGeometry. */
+function angleForTriangle(
+  positions: ArrayLike<number>,
+  a: number,
+  b: number,
+  c: number,
+  obj: three.Mesh,
+  cameraPos: three.Vector3,
+) {
+  temp.set(
+    positions[3 * a] + positions[3 * b] + positions[3 * c],
+    positions[3 * a + 1] + positions[3 * b + 1] + positions[3 * c + 1],
+    positions[3 * a + 2] + positions[3 * b + 2] + positions[3 * c + 2],
+  );
+  temp.divideScalar(3);
+  obj.localToWorld(temp);
+  const {x, z} = temp;
+  return three.Math.radToDeg(Math.atan2(z - cameraPos.z, x - cameraPos.x));
+}
+
 /** Returns a 360-element array, with counts of faces whose centers are in each direction. */
 function getAngleCounts(scene: three.Object3D, cameraPos: three.Vector3): number[] {
   const angleCounts = _.range(0, 360).map(() => 0);
+  const count = (angleDegs: number) => {
+    angleCounts[Math.floor((360 + angleDegs) % 360)] += 1;
+  };
   scene.traverse(obj => {
     if (!(obj instanceof three.Mesh)) return;
     const {geometry} = obj;
+    if (geometry instanceof three.BufferGeometry) {
+      // e.g. the network, as tessellated by the server.
+      const index = geometry.getIndex();
+      const position = geometry.getAttribute('position');
+      if (!index || !position) return;
+      const indices = index.array;
+      for (let i = 0; i < indices.length; i += 3) {
+        const [a, b, c] = [indices[i], indices[i + 1], indices[i + 2]];
+        count(angleForTriangle(position.array, a, b, c, obj, cameraPos));
+      }
+      return;
+    }
     if (!(geometry instanceof three.Geometry)) return;
     for (const face of geometry.faces) {
-      let angleDegs = angleForFace(face, geometry, obj, cameraPos);
-      angleDegs = Math.floor((360 + angleDegs) % 360);
-      angleCounts[angleDegs] += 1;
+      count(angleForFace(face, geometry, obj, cameraPos));
     }
   });
   return angleCounts;
@@ -4,7 +4,7 @@ import * as _ from 'lodash';
 import Stats = require('stats.js');
 import * as three from 'three';
 
-import {LightInfo, SimulationState, VehicleInfo} from './api';
+import {LightInfo, SimulationState, VehicleInfo, ViewportBounds} from './api';
 import FollowVehicleControls from './controls/follow-controls';
 import PanAndRotateControls from './controls/pan-and-rotate-controls';
 import {XZPlaneMatrix4} from './controls/utils';
@@ -13,8 +13,17 @@ import Postprocessing, {FOG_RATE} from './effects/postprocessing';
 import addSky from './effects/sky';
 import {InitResources} from './initialization';
 import {HIGHLIGHT} from './materials';
-import {makeStaticObjects, MeshAndPosition, OsmIdToMesh} from './network';
+import {
+  forgetTileBuildings,
+  makeStaticObjects,
+  makeTileBuildings,
+  MeshAndPosition,
+  OsmIdToMesh,
+  userDataForFace,
+} from './network';
+import {VehicleColumns} from './protocol';
 import {pointCameraAtScene} from './scene-finder';
+import TileLoader from './tiles';
 import TrafficLights from './traffic-lights';
 import {forceArray} from './utils';
 import Vehicle from './vehicle';
@@ -22,12 +31,18 @@ import Vehicle from './vehicle';
 const {hostname} = window.location;
 export const SUMO_ENDPOINT = `http://${hostname}:5000`;
 
+// How often to check whether the camera has moved, and how far (in meters) an edge of the
+// viewport has to move before the server is told.
+const VIEWPORT_CHECK_MS = 250;
+const VIEWPORT_TOLERANCE_M = 20;
+
 export interface SumoState {
   time: number;
   payloadSize: number;
   vehicleCounts: {[vClass: string]: number};
   simulateSecs: number;
   snapshotSecs: number;
+  lagSecs: number;
 }
 
 export interface NameAndUserData extends UserData {
@@ -52,6 +67,7 @@ export interface SumoParams {
   onUnfollow: () => any;
   onRemove: (id: string) => any;
   onUnhighlight: () => any;
+  onViewportChange: (bounds: ViewportBounds, camera: [number, number]) => any;
 }
 
 interface HighlightedMesh {
@@ -83,6 +99,7 @@ export default class Sumo3D {
   public simulationState: SimulationState;
   private vClassObjects: {[vehicleClass: string]: three.Object3D[]};
   private trafficLights: TrafficLights;
+  private tileLoader: TileLoader | null = null;
   public highlightedMeshes: HighlightedMesh[];
   private highlightedVehicles: HighlightedVehicle[];
   private gui: typeof dat.gui.GUI;
@@ -93,6 +110,8 @@ export default class Sumo3D {
   private highlightedRoute: HighlightedMesh[];
   private groundPlane: three.Object3D;
   private cancelNextClick = false;
+  private lastViewport: ViewportBounds | null = null;
+  private lastViewportCheckMs = 0;
 
   constructor(parentElement: HTMLElement, init: InitResources, private params: SumoParams) {
     const startMs = window.performance.now();
@@ -153,6 +172,7 @@ export default class Sumo3D {
     let staticGroup: three.Group;
     [staticGroup, this.osmIdToMeshes] = makeStaticObjects(
       init.network,
+      init.geometry,
       init.additional,
       init.water,
       this.transform,
@@ -161,6 +181,15 @@ export default class Sumo3D {
     this.scene.add(staticGroup);
     pointCameraAtScene(this.camera, this.scene);
 
+    // Buildings are streamed in from tiles near the camera, see checkViewport.
+    if (init.tiles) {
+      this.tileLoader = new TileLoader(init.tiles, {
+        makeObject: tile => makeTileBuildings(tile, this.transform),
+        onUnload: forgetTileBuildings,
+      });
+      this.scene.add(this.tileLoader.group);
+    }
+
     this.scene.add(this.trafficLights.loadNetwork(init.network, this.transform));
     this.trafficLights.addLogic(forceArray(init.network.net.tlLogic));
     if (init.additional && init.additional.tlLogic) {
@@ -248,6 +277,15 @@ export default class Sumo3D {
     }
   }
 
+  /** Like updateVehicleObject, for an update which was decoded into columns. */
+  updateVehicleFromColumns(vehicleId: string, table: VehicleColumns, handle: number) {
+    const vehicle = this.vehicles[vehicleId];
+    if (vehicle) {
+      table.copyTo(handle, vehicle.vehicleInfo);
+      this.updateVehicleMesh(vehicle);
+    }
+  }
+
   removeVehicleObject(vehicleId: string) {
     let highlightedIndex = null;
     this.highlightedVehicles.forEach(({id}, index) => {
@@ -295,10 +333,58 @@ export default class Sumo3D {
     this.controls.update();
     this.postprocessing.render();
     this.stats.update();
+    this.checkViewport();
 
     requestAnimationFrame(this.animate);
   }
 
+  /** The area of the ground which the camera can see, in SUMO coordinates. */
+  getViewportBounds(): ViewportBounds {
+    const maxDistance = 0.5 / FOG_RATE; // beyond this, you can't see anything.
+    const ground = new three.Plane(new three.Vector3(0, 1, 0), 0);
+    const raycaster = new three.Raycaster();
+    const {position} = this.camera;
+    const xs = [position.x];
+    const zs = [position.z];
+    for (const [x, y] of [[-1, -1], [1, -1], [1, 1], [-1, 1]]) {
+      raycaster.setFromCamera(new three.Vector2(x, y), this.camera);
+      const {ray} = raycaster;
+      let point = ray.intersectPlane(ground, new three.Vector3());
+      if (!point || point.distanceTo(position) > maxDistance) {
+        // This corner of the screen is above the horizon or lost in the fog.
+        point = ray.at(maxDistance, new three.Vector3());
+      }
+      xs.push(point.x);
+      zs.push(point.z);
+    }
+    // z increases as SUMO's y decreases.
+    const [left, bottom] = this.transform.xzToSumoXy([_.min(xs) as number, _.max(zs) as number]);
+    const [right, top] = this.transform.xzToSumoXy([_.max(xs) as number, _.min(zs) as number]);
+    return [left, bottom, right, top];
+  }
+
+  /**
+   * Tell the server where the camera is and what it can see, if it's moved, and load the tiles
+   * around it.
+   */
+  checkViewport() {
+    const nowMs = window.performance.now();
+    if (nowMs - this.lastViewportCheckMs < VIEWPORT_CHECK_MS) {
+      return;
+    }
+    this.lastViewportCheckMs = nowMs;
+    const bounds = this.getViewportBounds();
+    const last = this.lastViewport;
+    if (!last || _.some(bounds, (v, i) => Math.abs(v - last[i]) > VIEWPORT_TOLERANCE_M)) {
+      this.lastViewport = bounds;
+      if (this.tileLoader) {
+        this.tileLoader.update(bounds);
+      }
+      const {x, z} = this.camera.position;
+      this.params.onViewportChange(bounds, this.transform.xzToSumoXy([x, z]));
+    }
+  }
+
   onSelectFollowPOV(vehicleId: string) {
     const vehicle = this.vehicles[vehicleId];
     if (vehicle) {
@@ -371,8 +457,9 @@ export default class Sumo3D {
   }
 
   checkParentsAndFaceForUserData(intersect: three.Intersection): any {
-    // first check the face for userData. This comes from a merged geometry.
-    const faceData = (intersect.face as any).userData;
+    // first check the face for userData. This comes from a merged or tessellated geometry.
+    const faceData =
+      (intersect.face as any).userData || userDataForFace(intersect.object, intersect.faceIndex);
     if (faceData) {
       return faceData;
     }
@@ -0,0 +1,93 @@
+// Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+/**
+ * Streams in the contents of a scenario's tiles as the camera moves.
+ *
+ * The server partitions edges, junctions and polygons into a pyramid of tiles (see
+ * sumo_web3d/server/tiles.py). Only the tiles at the deepest zoom which are near the viewport are
+ * loaded, and tiles which the camera has moved away from are unloaded again, so that memory use
+ * doesn't grow with the size of the map.
+ */
+import * as _ from 'lodash';
+import * as three from 'three';
+
+import {NetworkTile, TileInfo, TileManifest, ViewportBounds} from './api';
+
+// Tiles within this distance of the viewport are loaded, and those beyond twice it are unloaded.
+const LOAD_MARGIN_M = 250;
+
+export interface TileLoaderParams {
+  makeObject: (tile: NetworkTile) => three.Mesh | null;
+  onUnload: (tile: NetworkTile) => any;
+}
+
+interface LoadedTile {
+  tile: NetworkTile;
+  object: three.Mesh | null;
+}
+
+function tilePath({z, x, y}: TileInfo) {
+  return `${z}/${x}/${y}`;
+}
+
+/** Do two [xmin, ymin, xmax, ymax] bounds come within margin of each other? */
+function isNear(a: number[], b: number[], margin: number) {
+  return (
+    a[0] - margin <= b[2] && b[0] <= a[2] + margin && a[1] - margin <= b[3] && b[1] <= a[3] + margin
+  );
+}
+
+export default class TileLoader {
+  public group: three.Group;
+  private tiles: TileInfo[];
+  // Tiles which are loaded, or null while they're loading.
+  private loaded: {[path: string]: LoadedTile | null};
+
+  constructor(manifest: TileManifest, private params: TileLoaderParams) {
+    this.group = new three.Group();
+    this.group.name = 'Tiles';
+    this.tiles = manifest.tiles.filter(tile => tile.z === manifest.maxZoom);
+    this.loaded = {};
+  }
+
+  /** Load the tiles near the viewport, and unload those far from it. */
+  update(bounds: ViewportBounds) {
+    for (const tile of this.tiles) {
+      const path = tilePath(tile);
+      const isLoaded = _.has(this.loaded, path);
+      if (!isLoaded && isNear(tile.bounds, bounds, LOAD_MARGIN_M)) {
+        this.load(path);
+      } else if (isLoaded && !isNear(tile.bounds, bounds, 2 * LOAD_MARGIN_M)) {
+        this.unload(path);
+      }
+    }
+  }
+
+  private async load(path: string) {
+    this.loaded[path] = null;
+    const response = await fetch(`tiles/${path}`);
+    if (response.status !== 200) {
+      console.warn(`Unable to load tile ${path}, response: ${response.status}`);
+      return; // It stays marked as loading, so it isn't requested again until it's unloaded.
+    }
+    const tile = (await response.json()) as NetworkTile;
+    if (this.loaded[path] !== null) {
+      return; // It was unloaded while it loaded.
+    }
+    const object = this.params.makeObject(tile);
+    if (object) {
+      this.group.add(object);
+    }
+    this.loaded[path] = {tile, object};
+  }
+
+  private unload(path: string) {
+    const loaded = this.loaded[path];
+    delete this.loaded[path];
+    if (!loaded) return;
+    if (loaded.object) {
+      this.group.remove(loaded.object);
+      loaded.object.geometry.dispose();
+    }
+    this.params.onUnload(loaded.tile);
+  }
+}
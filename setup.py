@@ -11,6 +11,8 @@ setup(
     entry_points={
         'console_scripts': [
             'sumo-web3d = sumo_web3d.server.server:run',
+            'sumo-web3d-batch = sumo_web3d.server.batch:run',
+            'sumo-web3d-polygons = sumo_web3d.server.polygons:run',
         ],
     },
     include_package_data=True,
@@ -27,7 +29,12 @@ setup(
         'aiohttp>=2.2',
         'chardet>=3.0',
         'lxml>=3.8',
+        'numpy>=1.13',
         'websockets>=3.4',
         'xmltodict>=0.11',
     ],
+    extras_require={
+        # Serve scenario assets with brotli compression as well as gzip.
+        'brotli': ['brotli>=1.0'],
+    },
 )
@@ -0,0 +1,163 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Static JSON assets which are serialized and compressed once, then served many times.
+
+Binary assets, like tessellated geometry, are already serialized and are only compressed.
+
+Scenario networks can be several MB of JSON. Rather than calling json.dumps on every request, we
+keep each asset as identity, gzip and (if the brotli package is installed) brotli byte blobs.
+Responses carry a strong ETag so that browsers can revalidate with If-None-Match and get a 304
+with no body. Each encoding is a different representation with its own bytes, so each gets its own
+ETag: the SHA-1 of the identity body, with a suffix like '-gzip' for the others.
+
+Compressing a multi-MB network takes seconds, so AssetCache builds assets on a thread of its own
+rather than on the event loop.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import gzip
+import hashlib
+import json
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred encodings, best first.
+ENCODINGS = ['br', 'gzip', 'identity']
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+def parse_accept_encoding(header):
+    """Parse an Accept-Encoding header into a dict from encoding to q-value."""
+    accepted = {}
+    for part in (header or '').split(','):
+        fields = [f.strip() for f in part.split(';')]
+        encoding = fields[0].lower()
+        if not encoding:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[encoding] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding, available):
+    """Pick the best of the available encodings which the client will accept.
+
+    Identity is always acceptable unless the client explicitly refuses it.
+    """
+    accepted = parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get('*')
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, wildcard)
+        if q is None and encoding == 'identity':
+            q = 1.0
+        if q:
+            return encoding
+    return None
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(',')]
+    # Weak comparison is appropriate for If-None-Match (RFC 7232 section 3.2).
+    return '*' in tags or etag in tags or ('W/' + etag) in tags
+
+
+class Asset(object):
+    """A JSON-serializable object (or bytes), pre-encoded for serving over HTTP."""
+
+    def __init__(self, obj):
+        if isinstance(obj, bytes):
+            identity, self.content_type = obj, 'application/octet-stream'
+        else:
+            identity, self.content_type = json.dumps(obj).encode('utf-8'), 'application/json'
+        self.etag = hashlib.sha1(identity).hexdigest()
+        self.bodies = {
+            'identity': identity,
+            'gzip': gzip.compress(identity, GZIP_LEVEL),
+        }
+        if brotli:
+            self.bodies['br'] = brotli.compress(identity, quality=BROTLI_QUALITY)
+
+    def etag_for(self, encoding):
+        """The strong ETag of the body in an encoding."""
+        if encoding == 'identity':
+            return '"%s"' % self.etag
+        return '"%s-%s"' % (self.etag, encoding)
+
+    def response(self, request_headers):
+        """Build a web.Response for a request with the given headers."""
+        encoding = choose_encoding(request_headers.get('Accept-Encoding'), self.bodies)
+        if not encoding:
+            return web.Response(status=406, text='No acceptable encoding')
+        headers = {
+            'ETag': self.etag_for(encoding),
+            'Vary': 'Accept-Encoding',
+            # Browsers may store the asset, but must revalidate it before each use.
+            'Cache-Control': 'no-cache',
+        }
+        if etag_matches(request_headers.get('If-None-Match'), headers['ETag']):
+            return web.Response(status=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return web.Response(
+            body=self.bodies[encoding], headers=headers, content_type=self.content_type)
+
+
+class AssetCache(object):
+    """Lazily-built Assets, keyed by an arbitrary hashable key.
+
+    make_obj_fn returns the object to serialize. If it returns a falsy value, there is no asset
+    and get() returns None.
+
+    Assets are built one at a time on the cache's thread, since make_obj_fn often parses or
+    tessellates a scenario, which isn't thread-safe. Requests for an asset which is being built
+    wait for it rather than building it again.
+    """
+
+    def __init__(self):
+        self.assets = {}
+        self.pending = {}  # key -> future of an asset being built
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def run(self, fn, *args):
+        """Run fn on the cache's thread, returning an awaitable for its result."""
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+    def build(self, make_obj_fn):
+        obj = make_obj_fn()
+        return Asset(obj) if obj else None
+
+    async def get(self, key, make_obj_fn):
+        if key not in self.assets:
+            if key not in self.pending:
+                self.pending[key] = asyncio.ensure_future(self.run(self.build, make_obj_fn))
+            future = self.pending[key]
+            try:
+                asset = await asyncio.shield(future)
+            finally:
+                if future.done() and self.pending.get(key) is future:
+                    del self.pending[key]
+            self.assets[key] = asset
+        return self.assets[key]
+
+    async def response(self, key, make_obj_fn, request):
+        asset = await self.get(key, make_obj_fn)
+        if not asset:
+            return web.Response(status=404, text='Not found')
+        return asset.response(request.headers)
@@ -0,0 +1,113 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import asyncio
+import gzip
+import json
+import threading
+
+from nose.tools import eq_
+
+from .assets import Asset, AssetCache, brotli, choose_encoding, parse_accept_encoding
+from .fake_websocket import run
+
+
+def test_parse_accept_encoding():
+    eq_({'gzip': 1.0, 'br': 0.5, '*': 0.0}, parse_accept_encoding('gzip, br;q=0.5, *;q=0'))
+    eq_({}, parse_accept_encoding(None))
+
+
+def test_choose_encoding():
+    available = {'identity', 'gzip', 'br'}
+    eq_('br', choose_encoding('gzip, deflate, br', available))
+    eq_('gzip', choose_encoding('gzip, deflate, br', {'identity', 'gzip'}))
+    eq_('gzip', choose_encoding('gzip, br;q=0', available))
+    eq_('identity', choose_encoding('', available))
+    eq_('identity', choose_encoding('deflate', available))
+    eq_(None, choose_encoding('identity;q=0', {'identity'}))
+
+
+def test_asset_response():
+    obj = {'net': {'edge': [{'id': 'a'}, {'id': 'b'}]}}
+    asset = Asset(obj)
+
+    response = asset.response({'Accept-Encoding': 'gzip'})
+    eq_(200, response.status)
+    eq_('gzip', response.headers['Content-Encoding'])
+    eq_('Accept-Encoding', response.headers['Vary'])
+    gzip_etag = response.headers['ETag']
+    eq_('"%s-gzip"' % asset.etag, gzip_etag)
+    eq_(obj, json.loads(gzip.decompress(response.body).decode('utf-8')))
+
+    response = asset.response({})
+    eq_(None, response.headers.get('Content-Encoding'))
+    eq_('Accept-Encoding', response.headers['Vary'])
+    identity_etag = response.headers['ETag']
+    eq_('"%s"' % asset.etag, identity_etag)
+    eq_(obj, json.loads(response.body.decode('utf-8')))
+
+    if brotli:
+        response = asset.response({'Accept-Encoding': 'gzip, br'})
+        eq_('br', response.headers['Content-Encoding'])
+        eq_('"%s-br"' % asset.etag, response.headers['ETag'])
+        eq_(obj, json.loads(brotli.decompress(response.body).decode('utf-8')))
+
+    # Revalidation with the ETag of the encoding it would be sent gets a 304 and no body.
+    response = asset.response({'If-None-Match': gzip_etag, 'Accept-Encoding': 'gzip'})
+    eq_(304, response.status)
+    eq_(None, response.body)
+    eq_(gzip_etag, response.headers['ETag'])
+    eq_('Accept-Encoding', response.headers['Vary'])
+    eq_(304, asset.response({'If-None-Match': 'W/' + identity_etag}).status)
+    eq_(200, asset.response({'If-None-Match': '"stale"'}).status)
+
+    # A cached body in one encoding doesn't validate another, e.g. a gzip body cached by a proxy
+    # for a client which doesn't accept gzip.
+    response = asset.response({'If-None-Match': gzip_etag})
+    eq_(200, response.status)
+    eq_(identity_etag, response.headers['ETag'])
+    eq_(200, asset.response({'If-None-Match': identity_etag, 'Accept-Encoding': 'gzip'}).status)
+
+    # ETags are stable for the same content.
+    eq_(asset.etag, Asset(obj).etag)
+
+
+def test_binary_asset():
+    asset = Asset(b'\x00\x01binary')
+    response = asset.response({'Accept-Encoding': 'gzip'})
+    eq_('application/octet-stream', response.content_type)
+    eq_(b'\x00\x01binary', gzip.decompress(response.body))
+
+
+def test_asset_cache():
+    calls = []
+
+    def make_obj():
+        calls.append(1)
+        return {'x': 1}
+
+    async def go():
+        assets = AssetCache()
+        asset, again = await asyncio.gather(
+            assets.get('key', make_obj), assets.get('key', make_obj))
+        eq_(asset, again)
+        eq_(asset, await assets.get('key', make_obj))
+        eq_(1, len(calls))
+        eq_(None, await assets.get('empty', lambda: None))
+
+    run(go)
+
+
+def test_asset_cache_builds_off_loop():
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def make_obj():
+        threads.append(threading.get_ident())
+        return {'x': 1}
+
+    async def go():
+        assets = AssetCache()
+        await assets.get('key', make_obj)
+
+    run(go)
+    eq_(1, len(threads))
+    assert threads[0] != loop_thread
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Run scenarios headless, as fast as SUMO can, and record them for --replay.
+
+    sumo-web3d-batch bologna-acosta cross3ltl --seeds 1 2 3 -o runs/
+
+Each scenario (all of those in scenarios.json by default) is run once per seed, with no websocket
+and no delay between steps, until everything in it has arrived. Runs happen in parallel in a pool
+of processes, one per core by default, each with a SUMO of its own. Each run is recorded to
+<output-dir>/<scenario>[-seed<N>].rec, for `sumo-web3d --replay`.
+"""
+import argparse
+from collections import namedtuple
+from concurrent.futures import as_completed, ProcessPoolExecutor
+import os
+import shlex
+import sys
+import time
+
+from .cache import ParsedFileCache
+from .deltas import diff_dicts
+from .recording import DEFAULT_KEYFRAME_INTERVAL, Recorder
+from .scenario import DIR, load_scenarios_file
+from .simulation import Simulation
+from .vehicle_table import VehicleTable
+
+SCENARIOS_PATH = os.path.join(DIR, 'scenarios.json')
+
+parser = argparse.ArgumentParser(
+    description='Run scenarios without a viewer, as fast as possible, and record them.')
+parser.add_argument(
+    'scenarios', nargs='*', metavar='SCENARIO',
+    help='Names of scenarios to run. The default is all of them.')
+parser.add_argument(
+    '--scenarios-file', dest='scenarios_file', default=SCENARIOS_PATH,
+    help='The list of scenarios. The default is the built-in one.')
+parser.add_argument(
+    '--seeds', dest='seeds', type=int, nargs='+', default=None,
+    help='Run each scenario once with each of these random seeds, rather than once with the ' +
+         'seed in its configuration.')
+parser.add_argument(
+    '-o', '--output-dir', dest='output_dir', default='.',
+    help='Directory to write the recordings to. The default is the current directory.')
+parser.add_argument(
+    '-j', '--jobs', dest='jobs', type=int, default=os.cpu_count(),
+    help='Number of simulations to run at once. The default is the number of cores, %(default)s.')
+parser.add_argument(
+    '--max-steps', dest='max_steps', type=int, default=None,
+    help='Stop each run after this many steps, even if there are vehicles left.')
+parser.add_argument(
+    '--keyframe-interval', dest='keyframe_interval', type=int, default=DEFAULT_KEYFRAME_INTERVAL,
+    help='Steps between the full-state keyframes of the recordings. The default is %(default)s.')
+parser.add_argument(
+    '--sumo-args', dest='sumo_args', default='',
+    help='Additional arguments to pass to each sumo process, e.g. "--scale 10".')
+
+# A run of a scenario: its SUMO configuration, the seed (or None) and where to record it.
+Job = namedtuple('Job', [
+    'scenario', 'config_file', 'seed', 'path', 'sumo_args', 'max_steps', 'keyframe_interval'])
+
+
+def make_jobs(scenarios, names, seeds, output_dir, sumo_args='', max_steps=None,
+              keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+    """A Job for each of the named scenarios (or all of them) and seeds."""
+    names = names or sorted(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        raise ValueError('Unknown scenarios: %s (try one of %s)' % (
+            ', '.join(unknown), ', '.join(sorted(scenarios))))
+    jobs = []
+    for name in names:
+        for seed in seeds or [None]:
+            filename = name if seed is None else '%s-seed%d' % (name, seed)
+            jobs.append(Job(name, scenarios[name].config_file, seed,
+                            os.path.join(output_dir, filename + '.rec'), sumo_args, max_steps,
+                            keyframe_interval))
+    return jobs
+
+
+def record_simulation(simulation, args, path, scenario,
+                      keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, max_steps=None, end_errors=()):
+    """Run a Simulation until it's empty, recording every step to path. Returns the last step.
+
+    end_errors are exceptions which mean that SUMO has stopped, e.g. at the configured end time.
+    """
+    simulation.start(args)
+    table = VehicleTable()
+    lights = {}
+    recorder = Recorder(path, scenario, keyframe_interval)
+    step = None
+    steps = 0
+    try:
+        while max_steps is None or steps < max_steps:
+            try:
+                step = simulation.step()
+            except end_errors:
+                break
+            snapshot = {
+                'time': step['time'],
+                'vehicles': table.update(step['vehicles']),
+                'lights': diff_dicts(lights, step['lights']),
+                'vehicle_counts': step['vehicle_counts'],
+            }
+            lights = step['lights']
+            recorder.record(snapshot, lambda: (table.to_dict(), lights))
+            steps += 1
+            if step['expected_vehicles'] <= 0:
+                break
+    finally:
+        recorder.close()
+        try:
+            simulation.close()
+        except end_errors:
+            pass
+    return step
+
+
+def run_job(job):
+    """Run and record a Job. This runs in a worker process, with a traci connection of its own."""
+    from . import constants  # noqa: F401 (this puts SUMO's tools on the path)
+    import sumolib
+    import traci
+
+    args = [sumolib.checkBinary('sumo'), '-c', job.config_file]
+    if job.seed is not None:
+        args += ['--seed', str(job.seed)]
+    args += shlex.split(job.sumo_args)
+    start_secs = time.time()
+    last_step = record_simulation(
+        Simulation(traci), args, job.path, job.scenario, job.keyframe_interval, job.max_steps,
+        end_errors=(traci.FatalTraCIError,))
+    return {
+        'path': job.path,
+        'end_ms': last_step and last_step['time'],
+        'secs': time.time() - start_secs,
+    }
+
+
+def run_jobs(jobs, num_processes):
+    """Run jobs in a pool of processes. Returns the number which failed."""
+    failures = 0
+    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+        futures = {executor.submit(run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures += 1
+                print('%s failed: %s' % (job.path, e))
+            else:
+                print('%s: %.1f s of simulation in %.1f s' % (
+                    result['path'], (result['end_ms'] or 0) / 1000, result['secs']))
+    return failures
+
+
+def main(args):
+    scenarios = load_scenarios_file({}, args.scenarios_file, ParsedFileCache(None))
+    try:
+        jobs = make_jobs(scenarios, args.scenarios, args.seeds, args.output_dir, args.sumo_args,
+                         args.max_steps, args.keyframe_interval)
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(args.output_dir, exist_ok=True)
+    print('Running %d simulations, %d at a time' % (len(jobs), args.jobs))
+    return run_jobs(jobs, args.jobs)
+
+
+def run():
+    args = parser.parse_args()
+    if main(args):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,48 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+from collections import namedtuple
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_raises, eq_
+
+from .batch import make_jobs, record_simulation
+from .fake_traci import FakeTraci
+from .recording import Replay
+from .simulation import Simulation
+
+FakeScenario = namedtuple('FakeScenario', ['config_file'])
+
+
+def test_make_jobs():
+    scenarios = {'a': FakeScenario('a.sumocfg'), 'b': FakeScenario('b.sumocfg')}
+    eq_([('a', 'a.sumocfg', None, os.path.join('out', 'a.rec')),
+         ('b', 'b.sumocfg', None, os.path.join('out', 'b.rec'))],
+        [job[:4] for job in make_jobs(scenarios, [], None, 'out')])
+    eq_([os.path.join('out', 'b-seed1.rec'), os.path.join('out', 'b-seed2.rec')],
+        [job.path for job in make_jobs(scenarios, ['b'], [1, 2], 'out')])
+    assert_raises(ValueError, make_jobs, scenarios, ['c'], None, 'out')
+
+
+def test_record_simulation():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'fake.rec')
+        traci = FakeTraci(num_vehicles=20, num_persons=5, trip_steps=10, end_step=30)
+        last_step = record_simulation(Simulation(traci), ['sumo'], path, 'fake', 10)
+        # It runs until everything which departed by step 30 has arrived.
+        eq_(0, last_step['expected_vehicles'])
+        assert 30000 < last_step['time'] <= 45000, last_step['time']
+
+        replay = Replay(path)
+        eq_(('fake', 1000, last_step['time']), (replay.scenario, replay.start_ms, replay.end_ms))
+        replay.start()
+        replay.seek(replay.end_ms)
+        eq_({}, replay.step()['vehicles'])
+        replay.close()
+
+        last_step = record_simulation(Simulation(FakeTraci()), ['sumo'], path, 'fake',
+                                      max_steps=5)
+        eq_(5000, last_step['time'])
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,339 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Fan out the snapshots of one simulation to many websocket viewers.
+
+Each snapshot is interned (see handles.py) and encoded once per subprotocol in use, however many
+viewers there are. All viewers share one set of handles, so a viewer which joins late is first
+sent a full-state frame: the current vehicles and lights as creations.
+
+Broadcasting never waits for the network. Each viewer has a queue of frames which a task of its
+own sends. When a slow viewer's queue is full, new snapshots are merged into the last queued one
+(see compose_snapshots), so it gets fewer, larger frames rather than falling further behind.
+
+Viewers which report a viewport get frames of their own, with just the vehicles near it (see
+interest.py), throttled by distance from their camera if the hub has level of detail tiers. They
+still share handles with everyone else.
+
+If the hub keeps a History, viewers can rewind: they're then sent the history from the time they
+asked for, with handles of their own, until they ask to go back to the live simulation or catch up
+with it. Each rewinding viewer has a task which plays its history at the session's frame rate,
+whether or not the simulation is paused. Switching between the two starts with a frame which has
+'reset' set and creates everything, which makes any frames still queued obsolete.
+"""
+import asyncio
+from collections import deque
+import time
+
+from websockets.exceptions import ConnectionClosed
+
+from .deltas import compose_snapshots
+from .handles import SnapshotInterner
+from .interest import ViewportFilter
+from .protocol import encode_snapshot
+from .scheduler import FrameScheduler
+
+# Frames which may be waiting for a viewer before new snapshots are coalesced.
+MAX_QUEUE_DEPTH = 4
+
+# The time between rewound frames, for hubs without a frame_period_fn.
+DEFAULT_FRAME_PERIOD_SECS = 0.03
+
+
+class Frame(object):
+    """An interned snapshot, encoded on demand at most once per subprotocol."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.encoded = {}
+
+    def encode(self, subprotocol):
+        if subprotocol not in self.encoded:
+            self.encoded[subprotocol] = encode_snapshot(self.snapshot, subprotocol)
+        return self.encoded[subprotocol]
+
+
+class Subscriber(object):
+    """A websocket watching the simulation, and its queue of outgoing messages.
+
+    Queued messages are either Frames or text. With metrics, a SessionMetrics, the time taken
+    to encode and send frames is recorded there.
+    """
+
+    def __init__(self, websocket, max_queue_depth=MAX_QUEUE_DEPTH, metrics=None):
+        self.websocket = websocket
+        self.max_queue_depth = max_queue_depth
+        self.metrics = metrics
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.task = None
+        self.viewport = None  # A ViewportFilter, if the viewer has reported its viewport.
+        self.cursor = None  # A HistoryCursor, while the viewer is rewinding.
+        self.interner = None  # Handles of the frames played back by cursor.
+        self.rewind_task = None  # Plays back cursor.
+        # Metrics
+        self.frames_sent = 0
+        self.frames_coalesced = 0
+        self.max_depth_seen = 0
+
+    def push(self, message):
+        self.queue.append(message)
+        self.max_depth_seen = max(self.max_depth_seen, len(self.queue))
+        self.ready.set()
+
+    def push_frame(self, frame):
+        queue = self.queue
+        if frame.snapshot.get('reset'):
+            self.queue = queue = deque(m for m in queue if not isinstance(m, Frame))
+        if len(queue) >= self.max_queue_depth and isinstance(queue[-1], Frame):
+            queue[-1] = Frame(compose_snapshots(queue[-1].snapshot, frame.snapshot))
+            self.frames_coalesced += 1
+            if self.metrics:
+                self.metrics.frames_coalesced += 1
+        else:
+            self.push(frame)
+
+    async def send_forever(self):
+        """Send queued messages until the websocket closes."""
+        subprotocol = self.websocket.subprotocol
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                message = self.queue.popleft()
+                if isinstance(message, Frame):
+                    if self.metrics:
+                        await self.send_frame_with_metrics(message, subprotocol)
+                    else:
+                        await self.websocket.send(message.encode(subprotocol))
+                    self.frames_sent += 1
+                else:
+                    await self.websocket.send(message)
+
+    async def send_frame_with_metrics(self, frame, subprotocol):
+        metrics = self.metrics
+        start_secs = time.perf_counter()
+        # Only the first viewer with each subprotocol pays to encode a frame.
+        encoded = subprotocol in frame.encoded
+        data = frame.encode(subprotocol)
+        sending_secs = time.perf_counter()
+        if not encoded:
+            metrics.observe_stage('serialize', sending_secs - start_secs)
+        await self.websocket.send(data)
+        metrics.observe_stage('send', time.perf_counter() - sending_secs)
+        metrics.frame_bytes.observe(len(data))
+        metrics.frames_sent += 1
+
+    def stats(self):
+        return {
+            'remote_address': getattr(self.websocket, 'remote_address', None),
+            'subprotocol': self.websocket.subprotocol,
+            'queue_depth': len(self.queue),
+            'max_queue_depth': self.max_depth_seen,
+            'frames_sent': self.frames_sent,
+            'frames_coalesced': self.frames_coalesced,
+            'rewinding': self.cursor is not None,
+            'viewport': self.viewport and self.viewport.bounds,
+            'visible_vehicles': self.viewport and len(self.viewport.visible),
+            'level_of_detail': self.viewport and self.viewport.detail and
+            self.viewport.detail.stats(),
+        }
+
+
+class BroadcastHub(object):
+    """The set of websockets watching the simulation.
+
+    full_state_fn returns (vehicles, lights) as of the last snapshot, as dicts keyed by ID. It's
+    only called when a viewer joins. grid is a SpatialGrid of the vehicles as of the last snapshot.
+    Without one, viewports are ignored. lod_tiers are the LodTiers for viewers which report their
+    camera position, if any. history is a History of the snapshots, for viewers to rewind.
+    metrics is a SessionMetrics, to record how long frames take to encode and send. vtypes are the
+    scenario's vType definitions, for the catalogs of vehicle types (see vtypes.py).
+    frame_period_fn(snapshot, last_snapshot) is the time in seconds to wait between sending two
+    snapshots of the history, like Session.frame_period_secs. last_snapshot may be None.
+    """
+
+    def __init__(self, full_state_fn, max_queue_depth=MAX_QUEUE_DEPTH, grid=None,
+                 lod_tiers=None, history=None, metrics=None, vtypes=None, frame_period_fn=None):
+        self.full_state_fn = full_state_fn
+        self.frame_period_fn = frame_period_fn or (lambda *_: DEFAULT_FRAME_PERIOD_SECS)
+        self.vtypes = vtypes
+        self.max_queue_depth = max_queue_depth
+        self.grid = grid
+        self.lod_tiers = lod_tiers
+        self.history = history
+        self.metrics = metrics
+        self.subscribers = {}  # websocket -> Subscriber
+        self.reset()
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def reset(self):
+        """Forget the handles and last snapshot, e.g. when the simulation is restarted."""
+        self.interner = SnapshotInterner(self.vtypes)
+        self.last_snapshot = None
+        if self.history is not None:
+            self.history.clear()
+        for subscriber in self.subscribers.values():
+            self._stop_rewinding(subscriber)
+
+    def full_state_snapshot(self):
+        """A snapshot which creates everything in the simulation, or None if there's nothing."""
+        if self.last_snapshot is None:
+            return None
+        vehicles, lights = self.full_state_fn()
+        return self.interner.full_snapshot(self.last_snapshot, vehicles, lights)
+
+    def subscribe(self, websocket):
+        subscriber = Subscriber(websocket, self.max_queue_depth, self.metrics)
+        snapshot = self.full_state_snapshot()
+        if snapshot:
+            subscriber.push_frame(Frame(snapshot))
+        self.subscribers[websocket] = subscriber
+        subscriber.task = asyncio.ensure_future(self._send_forever(subscriber))
+        return subscriber
+
+    async def _send_forever(self, subscriber):
+        try:
+            await subscriber.send_forever()
+        except ConnectionClosed:
+            self.unsubscribe(subscriber.websocket)
+
+    def unsubscribe(self, websocket):
+        subscriber = self.subscribers.pop(websocket, None)
+        if subscriber and subscriber.task:
+            subscriber.task.cancel()
+        if subscriber:
+            self._stop_rewinding(subscriber)
+
+    def set_viewport(self, websocket, bounds, camera=None):
+        """Only send a subscriber the vehicles near bounds, or all of them if bounds is None.
+
+        camera is the subscriber's position as (x, y), for level of detail.
+        """
+        subscriber = self.subscribers.get(websocket)
+        if not subscriber or self.grid is None:
+            return
+        if subscriber.viewport:
+            subscriber.viewport.bounds = bounds
+            subscriber.viewport.camera = camera
+        elif bounds is not None:
+            # So far, the subscriber has been sent every vehicle. The next frame will remove the
+            # ones which are out of view.
+            subscriber.viewport = ViewportFilter(
+                bounds, self.grid.table.ids, camera=camera, lod_tiers=self.lod_tiers)
+
+    def history_range(self):
+        if self.history is None or not len(self.history):
+            return None
+        return {'startMs': self.history.start_ms, 'endMs': self.history.end_ms}
+
+    def rewind(self, websocket, time_ms):
+        """Play a subscriber the history from time_ms, or the live simulation if it's None."""
+        subscriber = self.subscribers.get(websocket)
+        if not subscriber or self.history is None:
+            return
+        if time_ms is None:
+            if subscriber.cursor:
+                self._stop_rewinding(subscriber)
+                self._go_live(subscriber)
+            return
+        self._stop_rewinding(subscriber)
+        subscriber.cursor = self.history.cursor(time_ms)
+        if subscriber.cursor:
+            subscriber.rewind_task = asyncio.ensure_future(self._play_rewound(subscriber))
+
+    def _stop_rewinding(self, subscriber):
+        if subscriber.rewind_task:
+            subscriber.rewind_task.cancel()
+        subscriber.cursor = subscriber.interner = subscriber.rewind_task = None
+
+    async def _play_rewound(self, subscriber):
+        """Send a rewinding subscriber its history until it catches up, paced like the session.
+
+        The first frame is sent right away.
+        """
+        scheduler = FrameScheduler()
+        last_snapshot = None
+        while True:
+            snapshot = subscriber.cursor.next()
+            if snapshot is None:
+                subscriber.rewind_task = None  # So that it doesn't cancel itself.
+                self._stop_rewinding(subscriber)
+                self._go_live(subscriber)
+                return
+            # After a reset, the time may have jumped, so the last snapshot says nothing.
+            period_secs = self.frame_period_fn(
+                snapshot, None if snapshot.get('reset') else last_snapshot)
+            await asyncio.sleep(scheduler.wait_secs(period_secs))
+            self._push_rewound(subscriber, snapshot)
+            last_snapshot = snapshot
+
+    def _push_rewound(self, subscriber, snapshot):
+        if snapshot.get('reset'):
+            subscriber.interner = SnapshotInterner(self.vtypes)
+        frame = dict(self.last_snapshot or {})
+        frame.update(subscriber.interner.intern(snapshot))
+        frame['history'] = self.history_range()
+        frame['rewinding'] = True
+        subscriber.push_frame(Frame(frame))
+
+    def _go_live(self, subscriber):
+        snapshot = self.full_state_snapshot()
+        if snapshot is None:
+            return
+        snapshot['reset'] = True
+        if subscriber.viewport:
+            # As when a viewport is first set, the next frame removes what's out of view.
+            subscriber.viewport.visible = set(self.grid.table.ids)
+            if subscriber.viewport.detail:
+                subscriber.viewport.detail.pending = {}
+                subscriber.viewport.detail.coarse = {}
+        subscriber.push_frame(Frame(snapshot))
+
+    def broadcast(self, snapshot, full_state_fn=None):
+        """Queue a snapshot, keyed by ID, for every subscriber.
+
+        The grid's table has to be up to date with the snapshot's vehicles. full_state_fn is used
+        instead of the hub's for the history's keyframes, so that a caller which also needs the
+        full state can build it once.
+        """
+        if self.history is not None:
+            self.history.append(snapshot, full_state_fn or self.full_state_fn)
+            snapshot = dict(snapshot, history=self.history_range())
+        # Filtering has to happen before interning, which forgets the removed vehicles.
+        filtered = {}
+        viewers = [s for s in self.subscribers.values() if s.viewport and not s.cursor]
+        if viewers:
+            # Indexing is only worth it if someone's looking.
+            self.grid.update()
+            for subscriber in viewers:
+                filtered[subscriber] = subscriber.viewport.filter(snapshot['vehicles'], self.grid)
+        # Interning has to happen even with no subscribers, to keep the handles up to date.
+        interned = self.interner.intern(snapshot)
+        frame = Frame(interned)
+        self.last_snapshot = {
+            k: v for k, v in snapshot.items() if k not in ('vehicles', 'lights')}
+        for subscriber in self.subscribers.values():
+            vehicles = filtered.get(subscriber)
+            if subscriber.cursor:
+                continue  # Its rewind_task sends it frames.
+            if vehicles is None:
+                subscriber.push_frame(frame)
+            else:
+                own = dict(interned)
+                own['vehicles'] = self.interner.handle_vehicles(vehicles)
+                subscriber.push_frame(Frame(own))
+
+    def send_message(self, websocket, message):
+        """Queue a text message, e.g. an error, for one subscriber."""
+        subscriber = self.subscribers.get(websocket)
+        if subscriber:
+            subscriber.push(message)
+
+    def broadcast_message(self, message):
+        """Queue a text message, e.g. a state change, for every subscriber."""
+        for subscriber in self.subscribers.values():
+            subscriber.push(message)
+
+    def stats(self):
+        return [subscriber.stats() for subscriber in self.subscribers.values()]
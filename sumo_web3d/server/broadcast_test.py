@@ -0,0 +1,270 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import json
+
+from nose.tools import eq_
+
+from .broadcast import BroadcastHub
+from .deltas_test import apply_delta
+from .fake_websocket import drain, FakeWebSocket, run
+from .history import History
+from .interest import SpatialGrid
+from .protocol import BINARY_SUBPROTOCOL, decode_binary
+from .vehicle_table import VehicleTable
+
+
+def make_snapshot(time, vehicles):
+    return {
+        'type': 'snapshot',
+        'time': time,
+        'vehicles': vehicles,
+        'lights': {'creations': {}, 'updates': {}, 'removals': []},
+    }
+
+
+def test_broadcast_encodes_once():
+    async def go():
+        hub = BroadcastHub(lambda: ({}, {}))
+        json_ws = [FakeWebSocket(), FakeWebSocket()]
+        binary_ws = [FakeWebSocket(BINARY_SUBPROTOCOL), FakeWebSocket(BINARY_SUBPROTOCOL)]
+        for ws in json_ws + binary_ws:
+            hub.subscribe(ws)
+        hub.broadcast(make_snapshot(
+            100, {'creations': {'veh0': {'x': 1}}, 'updates': {}, 'removals': []}))
+        await drain()
+        return json_ws, binary_ws
+
+    json_ws, binary_ws = run(go)
+    # Nothing had happened when they joined, so there was no full-state frame.
+    eq_([1, 1, 1, 1], [len(ws.sent) for ws in json_ws + binary_ws])
+    assert json_ws[0].sent[0] is json_ws[1].sent[0]
+    assert binary_ws[0].sent[0] is binary_ws[1].sent[0]
+    eq_({'0': {'id': 'veh0', 'x': 1}}, json.loads(json_ws[0].sent[0])['vehicles']['creations'])
+    eq_({0: {'id': 'veh0', 'x': 1}}, decode_binary(binary_ws[0].sent[0])['vehicles']['creations'])
+
+
+def test_late_join_gets_full_state():
+    vehicles = {}
+
+    async def go():
+        hub = BroadcastHub(lambda: (vehicles, {}))
+        early = FakeWebSocket()
+        hub.subscribe(early)
+        vehicles.update({'veh0': {'x': 1}, 'veh1': {'x': 2}})
+        hub.broadcast(make_snapshot(
+            100, {'creations': dict(vehicles), 'updates': {}, 'removals': []}))
+        del vehicles['veh0']
+        vehicles['veh1'] = {'x': 3}
+        hub.broadcast(make_snapshot(
+            200, {'creations': {}, 'updates': {'veh1': {'x': 3}}, 'removals': ['veh0']}))
+
+        late = FakeWebSocket()
+        hub.subscribe(late)
+        hub.broadcast(make_snapshot(
+            300, {'creations': {}, 'updates': {'veh1': {'x': 4}}, 'removals': []}))
+        await drain()
+        return early, late
+
+    early, late = run(go)
+    eq_(3, len(early.sent))
+    frames = [json.loads(m) for m in late.sent]
+    eq_([200, 300], [f['time'] for f in frames])
+    eq_({'creations': {'1': {'id': 'veh1', 'x': 3}}, 'updates': {}, 'removals': []},
+        frames[0]['vehicles'])
+    # Later frames are shared with the other viewers, and use the same handles.
+    eq_({'1': {'x': 4}}, frames[1]['vehicles']['updates'])
+    eq_(early.sent[-1], late.sent[-1])
+
+
+def test_slow_subscriber_coalesces():
+    async def go():
+        hub = BroadcastHub(lambda: ({}, {}), max_queue_depth=2)
+        fast = FakeWebSocket()
+        slow = FakeWebSocket()
+        slow.writable.clear()
+        hub.subscribe(fast)
+        slow_subscriber = hub.subscribe(slow)
+
+        vehicles = {}
+        for step in range(20):
+            delta = {'creations': {}, 'updates': {}, 'removals': []}
+            for veh_id in list(vehicles):
+                if step % 3 == 0:
+                    delta['removals'].append(veh_id)
+                    del vehicles[veh_id]
+                else:
+                    vehicles[veh_id] = {'x': step}
+                    delta['updates'][veh_id] = {'x': step}
+            veh_id = 'veh%d' % step
+            vehicles[veh_id] = {'x': step}
+            delta['creations'][veh_id] = {'x': step}
+            hub.broadcast(make_snapshot(step, delta))
+            await drain()
+            # The slow client never holds up the broadcaster or has an unbounded queue.
+            assert len(slow_subscriber.queue) <= 2
+
+        slow.writable.set()
+        await drain()
+        return fast, slow, slow_subscriber
+
+    fast, slow, slow_subscriber = run(go)
+    eq_(20, len(fast.sent))
+    eq_(3, len(slow.sent))
+    eq_(17, slow_subscriber.frames_coalesced)
+
+    def final_state(ws):
+        state = {}
+        for message in ws.sent:
+            delta = json.loads(message)['vehicles']
+            # JSON turns the handles in creations and updates into strings.
+            delta['creations'] = {int(k): v for k, v in delta['creations'].items()}
+            delta['updates'] = {int(k): v for k, v in delta['updates'].items()}
+            state = apply_delta(state, delta)
+        return {v.pop('id'): v for v in state.values()}
+
+    eq_(final_state(fast), final_state(slow))
+    eq_(19, json.loads(slow.sent[-1])['time'])
+
+
+def test_viewport():
+    table = VehicleTable()
+    grid = SpatialGrid(table)
+
+    async def go():
+        hub = BroadcastHub(lambda: (table.to_dict(), {}), grid=grid)
+        everything = FakeWebSocket()
+        hub.subscribe(everything)
+        nearby = FakeWebSocket()
+        hub.subscribe(nearby)
+
+        def step(time, vehicles):
+            delta = table.update(vehicles)
+            hub.broadcast(make_snapshot(time, delta))
+
+        step(100, {'veh0': {'x': 10, 'y': 10}, 'veh1': {'x': 5000, 'y': 10}})
+        hub.set_viewport(nearby, (0, 0, 50, 50))
+        step(200, {'veh0': {'x': 20, 'y': 10}, 'veh1': {'x': 5000, 'y': 20}})
+        step(300, {'veh1': {'x': 30, 'y': 20}, 'veh2': {'x': 5000, 'y': 30}})
+        await drain()
+        return everything, nearby
+
+    everything, nearby = run(go)
+    eq_(3, len(everything.sent))
+    frames = [json.loads(m)['vehicles'] for m in nearby.sent]
+    eq_(3, len(frames))
+    eq_(frames[0], json.loads(everything.sent[0])['vehicles'])
+    # veh1 is out of view, so it's removed.
+    eq_({'creations': {}, 'updates': {'0': {'x': 20}}, 'removals': [1]}, frames[1])
+    # veh0 arrives and veh1 comes into view. veh2 isn't sent, though the handle is assigned.
+    eq_({'creations': {'1': {'id': 'veh1', 'x': 30, 'y': 20}}, 'updates': {}, 'removals': [0]},
+        frames[2])
+    eq_({'2': {'id': 'veh2', 'x': 5000, 'y': 30}},
+        json.loads(everything.sent[2])['vehicles']['creations'])
+
+
+def test_rewind():
+    vehicles = {}
+    periods = []  # (time, last time) of each rewound frame
+    period_secs = [0]
+
+    def frame_period(snapshot, last_snapshot):
+        periods.append((snapshot['time'], last_snapshot and last_snapshot['time']))
+        return period_secs[0]
+
+    async def go():
+        hub = BroadcastHub(lambda: (vehicles, {}), history=History(keyframe_interval=2),
+                           frame_period_fn=frame_period)
+        live = FakeWebSocket()
+        hub.subscribe(live)
+        rewinder = FakeWebSocket()
+        hub.subscribe(rewinder)
+
+        def step(time, delta):
+            state = apply_delta(vehicles, delta)
+            vehicles.clear()
+            vehicles.update(state)
+            hub.broadcast(dict(make_snapshot(time, delta), vehicle_counts={}))
+
+        step(100, {'creations': {'veh0': {'x': 1}}, 'updates': {}, 'removals': []})
+        step(200, {'creations': {'veh1': {'x': 2}}, 'updates': {'veh0': {'x': 3}},
+                   'removals': []})
+        step(300, {'creations': {}, 'updates': {}, 'removals': ['veh0']})
+        await drain()
+        del rewinder.sent[:]
+        # The simulation is paused, but the history plays back at its own pace until it catches
+        # up with the simulation, and then the rewinder is live again.
+        hub.rewind(rewinder, 150)
+        await drain()
+        caught_up = rewinder.sent[:]
+        del rewinder.sent[:]
+
+        # Playback isn't driven by the live simulation.
+        period_secs[0] = 60
+        hub.rewind(rewinder, 150)
+        await drain()
+        step(400, {'creations': {}, 'updates': {'veh1': {'x': 4}}, 'removals': []})
+        await drain()
+        hub.rewind(rewinder, None)
+        step(500, {'creations': {}, 'updates': {'veh1': {'x': 5}}, 'removals': []})
+        await drain()
+        return live, caught_up, rewinder
+
+    live, caught_up, rewinder = run(go)
+    eq_(5, len(live.sent))
+    frames = [json.loads(m) for m in caught_up]
+    # The reset going live drops the last rewound frame if it's still queued.
+    eq_([(100, True), (200, None)], [(f['time'], f.get('reset')) for f in frames[:2]])
+    eq_((300, True, None), (frames[-1]['time'], frames[-1]['reset'], frames[-1].get('rewinding')))
+    eq_([(100, None), (200, 100), (300, 200)], periods[:3])
+    # Rewound frames have handles of their own.
+    eq_({'creations': {'0': {'id': 'veh0', 'x': 1}}, 'updates': {}, 'removals': []},
+        frames[0]['vehicles'])
+    eq_({'creations': {'1': {'id': 'veh1', 'x': 2}}, 'updates': {'0': {'x': 3}}, 'removals': []},
+        frames[1]['vehicles'])
+    eq_((True, {'startMs': 100, 'endMs': 300}), (frames[1]['rewinding'], frames[1]['history']))
+    # Going live creates everything with the live handles.
+    eq_({'creations': {'1': {'id': 'veh1', 'x': 2}}, 'updates': {}, 'removals': []},
+        frames[-1]['vehicles'])
+
+    frames = [json.loads(m) for m in rewinder.sent]
+    eq_([(100, True), (400, True), (500, None)], [(f['time'], f.get('reset')) for f in frames])
+    eq_({'creations': {'1': {'id': 'veh1', 'x': 4}}, 'updates': {}, 'removals': []},
+        frames[1]['vehicles'])
+    # Once live, frames are shared again.
+    eq_(live.sent[-1], rewinder.sent[-1])
+
+
+def test_history_uses_given_full_state():
+    calls = []
+
+    def full_state():
+        calls.append('hub')
+        return {}, {}
+
+    def shared_full_state():
+        calls.append('shared')
+        return {'veh0': {'x': 1}}, {}
+
+    hub = BroadcastHub(full_state, history=History(keyframe_interval=1))
+    hub.broadcast(dict(make_snapshot(100, {
+        'creations': {'veh0': {'x': 1}}, 'updates': {}, 'removals': []}), vehicle_counts={}),
+        shared_full_state)
+    eq_(['shared'], calls)
+    hub.broadcast(dict(make_snapshot(200, {
+        'creations': {}, 'updates': {}, 'removals': []}), vehicle_counts={}))
+    eq_(['shared', 'hub'], calls)
+
+
+def test_closed_subscribers_are_dropped():
+    async def go():
+        hub = BroadcastHub(lambda: ({}, {}))
+        open_ws = FakeWebSocket()
+        closed_ws = FakeWebSocket(closed=True)
+        hub.subscribe(open_ws)
+        hub.subscribe(closed_ws)
+        hub.broadcast_message('{"type": "state"}')
+        await drain()
+        return hub, open_ws
+
+    hub, open_ws = run(go)
+    eq_(1, len(hub))
+    eq_(['{"type": "state"}'], open_ws.sent)
@@ -0,0 +1,94 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""On-disk cache for parsed scenario files.
+
+Parsing the larger SUMO networks and polygon files takes several seconds. The parsed result of
+each file is stored in a content-addressed cache directory, keyed by the file's path,
+modification time and size, so that a restarted server can skip XML parsing entirely.
+
+Outputs which depend on several files, e.g. a network's geometry with the bus stops of its
+additional files, are keyed by all of them.
+
+Entries are pickled and zlib-compressed. Any entry which can't be read back (e.g. it was written
+by an incompatible version) is treated as a cache miss.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+
+# Bump this to invalidate all existing cache entries.
+CACHE_FORMAT_VERSION = 1
+CACHE_MAGIC = b'SW3D'
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'sumo-web3d')
+
+
+def file_fingerprint(path):
+    """Identify a version of a file by its absolute path, modification time and size."""
+    stat = os.stat(path)
+    return '%s:%d:%d' % (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+class ParsedFileCache(object):
+    """Content-addressed cache of parsed files.
+
+    If cache_dir is None, the cache is disabled and every load parses the file.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path, namespace):
+        """Cache key for the current version of path, or of a tuple of paths.
+
+        The namespace distinguishes the outputs of different parsers for the same file.
+        """
+        paths = path if isinstance(path, tuple) else (path,)
+        fingerprint = '%d:%s:%s' % (
+            CACHE_FORMAT_VERSION, namespace, '|'.join(file_fingerprint(p) for p in paths))
+        return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+
+    def load(self, path, namespace, parse_fn):
+        """Return parse_fn(path), using a cached copy if the file (or files) hasn't changed."""
+        if not self.cache_dir:
+            return parse_fn(path)
+
+        entry_path = os.path.join(self.cache_dir, self.key(path, namespace))
+        value = self._read(entry_path)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = parse_fn(path)
+        self._write(entry_path, value)
+        return value
+
+    def _read(self, entry_path):
+        try:
+            with open(entry_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if not data.startswith(CACHE_MAGIC):
+            return None
+        try:
+            return pickle.loads(zlib.decompress(data[len(CACHE_MAGIC):]))
+        except Exception:
+            return None
+
+    def _write(self, entry_path, value):
+        data = CACHE_MAGIC + zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file and rename it so that readers never see a partial entry.
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            # The cache is an optimization; failing to write it shouldn't break the server.
+            print('Unable to write cache entry %s: %s' % (entry_path, e))
@@ -0,0 +1,106 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+from .cache import ParsedFileCache
+
+
+class CountingParser(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path) as f:
+            return {'contents': f.read()}
+
+
+def setup_dirs():
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'net.xml')
+    with open(path, 'w') as f:
+        f.write('<net/>')
+    return tmp_dir, path
+
+
+def test_cache_hit():
+    tmp_dir, path = setup_dirs()
+    try:
+        parse = CountingParser()
+        cache = ParsedFileCache(os.path.join(tmp_dir, 'cache'))
+        eq_({'contents': '<net/>'}, cache.load(path, 'test', parse))
+        # A new cache object stands in for a restarted server.
+        cache = ParsedFileCache(os.path.join(tmp_dir, 'cache'))
+        eq_({'contents': '<net/>'}, cache.load(path, 'test', parse))
+        eq_(1, parse.calls)
+        eq_((1, 0), (cache.hits, cache.misses))
+
+        # Different parsers don't share entries.
+        cache.load(path, 'other', parse)
+        eq_(2, parse.calls)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_cache_invalidation():
+    tmp_dir, path = setup_dirs()
+    try:
+        parse = CountingParser()
+        cache = ParsedFileCache(os.path.join(tmp_dir, 'cache'))
+        cache.load(path, 'test', parse)
+        with open(path, 'w') as f:
+            f.write('<net version="2"/>')
+        eq_({'contents': '<net version="2"/>'}, cache.load(path, 'test', parse))
+        eq_(2, parse.calls)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_corrupt_entry():
+    tmp_dir, path = setup_dirs()
+    try:
+        parse = CountingParser()
+        cache = ParsedFileCache(os.path.join(tmp_dir, 'cache'))
+        cache.load(path, 'test', parse)
+        with open(os.path.join(cache.cache_dir, cache.key(path, 'test')), 'wb') as f:
+            f.write(b'SW3D garbage')
+        eq_({'contents': '<net/>'}, cache.load(path, 'test', parse))
+        eq_(2, parse.calls)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_disabled_cache():
+    tmp_dir, path = setup_dirs()
+    try:
+        parse = CountingParser()
+        cache = ParsedFileCache(None)
+        cache.load(path, 'test', parse)
+        cache.load(path, 'test', parse)
+        eq_(2, parse.calls)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_several_files():
+    tmp_dir, path = setup_dirs()
+    try:
+        other_path = os.path.join(tmp_dir, 'other.xml')
+        with open(other_path, 'w') as f:
+            f.write('<additional/>')
+        calls = []
+        cache = ParsedFileCache(os.path.join(tmp_dir, 'cache'))
+        paths = (path, other_path)
+        eq_(2, cache.load(paths, 'test', lambda paths: calls.append(paths) or len(paths)))
+        eq_(2, cache.load(paths, 'test', lambda paths: calls.append(paths) or len(paths)))
+        eq_([paths], calls)
+        # Changing any of the files invalidates the entry.
+        with open(other_path, 'w') as f:
+            f.write('<additional version="2"/>')
+        cache.load(paths, 'test', lambda paths: calls.append(paths) or len(paths))
+        eq_(2, len(calls))
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -60,3 +60,57 @@ def diff_dicts(before, after):
             creations[k] = v
 
     return {'creations': creations, 'updates': update, 'removals': deleted_keys}
+
+
+def compose_deltas(first, second):
+    """Merge two consecutive deltas into one with the same effect.
+
+    Clients apply a delta's removals before its creations and updates, so a key may be both
+    removed and created in one delta when it's reused (e.g. a recycled handle). Neither input is
+    mutated.
+    """
+    creations = dict(first['creations'])
+    updates = dict(first['updates'])
+    removals = list(first['removals'])
+    removed = set(removals)
+
+    for k in second['removals']:
+        if k in creations:
+            # The client never saw this object, so it needn't hear about it at all. A removal of
+            # whatever had the key before it was created still stands.
+            del creations[k]
+        else:
+            updates.pop(k, None)
+            if k not in removed:
+                removals.append(k)
+                removed.add(k)
+
+    for k, v in second['creations'].items():
+        creations[k] = v
+
+    for k, v in second['updates'].items():
+        if k in creations:
+            creations[k] = dict(creations[k], **v)
+        elif k in updates:
+            updates[k] = dict(updates[k], **v)
+        else:
+            updates[k] = v
+
+    return {'creations': creations, 'updates': updates, 'removals': removals}
+
+
+def compose_snapshots(first, second):
+    """Merge two consecutive snapshots. Everything other than the deltas comes from second.
+
+    If first resets the client's state (see broadcast.py), so does the result. The vehicle types
+    which either adds to the catalog (see vtypes.py) are kept.
+    """
+    snapshot = dict(second)
+    if first.get('reset'):
+        snapshot['reset'] = True
+    if first.get('vTypes'):
+        snapshot['vTypes'] = dict(first['vTypes'])
+        snapshot['vTypes'].update(second.get('vTypes') or {})
+    snapshot['vehicles'] = compose_deltas(first['vehicles'], second['vehicles'])
+    snapshot['lights'] = compose_deltas(first['lights'], second['lights'])
+    return snapshot
@@ -1,7 +1,9 @@
 # Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import random
+
 from nose.tools import eq_
 
-from .deltas import diff, round_vehicles, diff_dicts
+from .deltas import compose_deltas, compose_snapshots, diff, round_vehicles, diff_dicts
 
 
 def test_diff():
@@ -101,3 +103,100 @@ def test_diff_vehicles():
             'angle': 270,
         },
     }))
+
+
+def apply_delta(state, delta):
+    """Apply a delta the way clients do: removals first."""
+    state = {k: dict(v) for k, v in state.items()}
+    for k in delta['removals']:
+        del state[k]
+    for k, v in delta['creations'].items():
+        state[k] = dict(v)
+    for k, v in delta['updates'].items():
+        state[k].update(v)
+    return state
+
+
+def test_compose_deltas():
+    # An update to a creation is folded into it.
+    eq_({'creations': {'a': {'x': 2, 'y': 1}}, 'updates': {}, 'removals': []},
+        compose_deltas({'creations': {'a': {'x': 1, 'y': 1}}, 'updates': {}, 'removals': []},
+                       {'creations': {}, 'updates': {'a': {'x': 2}}, 'removals': []}))
+    # Updates are merged, with later values winning.
+    eq_({'creations': {}, 'updates': {'a': {'x': 2, 'y': 3}}, 'removals': []},
+        compose_deltas({'creations': {}, 'updates': {'a': {'x': 1, 'y': 3}}, 'removals': []},
+                       {'creations': {}, 'updates': {'a': {'x': 2}}, 'removals': []}))
+    # Something created and removed is never mentioned.
+    eq_({'creations': {}, 'updates': {}, 'removals': []},
+        compose_deltas({'creations': {'a': {'x': 1}}, 'updates': {}, 'removals': []},
+                       {'creations': {}, 'updates': {}, 'removals': ['a']}))
+    # Something updated and removed is just removed.
+    eq_({'creations': {}, 'updates': {}, 'removals': ['a']},
+        compose_deltas({'creations': {}, 'updates': {'a': {'x': 1}}, 'removals': []},
+                       {'creations': {}, 'updates': {}, 'removals': ['a']}))
+    # A key which is removed and then reused is both removed and created.
+    eq_({'creations': {'a': {'x': 5}}, 'updates': {}, 'removals': ['a']},
+        compose_deltas({'creations': {}, 'updates': {}, 'removals': ['a']},
+                       {'creations': {'a': {'x': 5}}, 'updates': {}, 'removals': []}))
+
+
+def test_compose_deltas_does_not_mutate():
+    first = {'creations': {'a': {'x': 1}}, 'updates': {'b': {'x': 1}}, 'removals': ['c']}
+    second = {'creations': {'d': {'x': 1}}, 'updates': {'a': {'x': 2}, 'b': {'y': 2}},
+              'removals': ['c']}
+    compose_deltas(first, second)
+    eq_({'creations': {'a': {'x': 1}}, 'updates': {'b': {'x': 1}}, 'removals': ['c']}, first)
+
+
+def test_compose_deltas_random():
+    # Composing any run of deltas has the same effect as applying them one at a time.
+    rng = random.Random(0)
+    for _ in range(200):
+        state = {}
+        free_keys = list(range(8))
+        deltas = []
+        for _ in range(rng.randint(1, 6)):
+            delta = {'creations': {}, 'updates': {}, 'removals': []}
+            for k in list(state.keys()):
+                if rng.random() < 0.3:
+                    delta['removals'].append(k)
+                elif rng.random() < 0.5:
+                    delta['updates'][k] = {rng.choice('xy'): rng.randint(0, 9)}
+            # Keys are recycled in the same delta which frees them, the hardest case.
+            free_keys.extend(delta['removals'])
+            rng.shuffle(free_keys)
+            for _ in range(rng.randint(0, len(free_keys))):
+                delta['creations'][free_keys.pop()] = {'x': rng.randint(0, 9), 'y': 0}
+            state = apply_delta(state, delta)
+            deltas.append(delta)
+
+        composed = deltas[0]
+        for delta in deltas[1:]:
+            composed = compose_deltas(composed, delta)
+        eq_(state, apply_delta({}, composed))
+
+
+def test_compose_snapshots():
+    empty = {'creations': {}, 'updates': {}, 'removals': []}
+    eq_({
+        'time': 200,
+        'vehicles': {'creations': {}, 'updates': {}, 'removals': ['a']},
+        'lights': {'creations': {}, 'updates': {'tl': {'phase': 2}}, 'removals': []},
+    }, compose_snapshots({
+        'time': 100,
+        'vehicles': {'creations': {}, 'updates': {}, 'removals': ['a']},
+        'lights': {'creations': {}, 'updates': {'tl': {'phase': 1}}, 'removals': []},
+    }, {
+        'time': 200,
+        'vehicles': empty,
+        'lights': {'creations': {}, 'updates': {'tl': {'phase': 2}}, 'removals': []},
+    }))
+    # A snapshot which resets the client's state still does when merged with the next one.
+    eq_(True, compose_snapshots(
+        {'time': 100, 'vehicles': empty, 'lights': empty, 'reset': True},
+        {'time': 200, 'vehicles': empty, 'lights': empty})['reset'])
+    # Vehicle types added by either are kept.
+    composed = compose_snapshots(
+        {'time': 100, 'vehicles': empty, 'lights': empty, 'vTypes': {0: {'type': 'car'}}},
+        {'time': 200, 'vehicles': empty, 'lights': empty, 'vTypes': {1: {'type': 'bus'}}})
+    eq_({0: {'type': 'car'}, 1: {'type': 'bus'}}, composed['vTypes'])
@@ -0,0 +1,295 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""A stand-in for the traci module, for tests and benchmarks which shouldn't need SUMO.
+
+FakeTraci implements the parts of the TraCI API which the server uses, backed by a toy
+simulation: vehicles and persons depart at a steady rate, drive in circles for a while and then
+arrive, and traffic lights cycle through their phases. It's deterministic for a given seed.
+
+Like the real traci module, subscription results are delivered with each simulation step (and
+on subscribing), so reading them doesn't count as a call to SUMO.
+"""
+import math
+import random
+import time
+
+
+class constants(object):
+    """The TraCI constants which the server uses, with the same values as traci.constants."""
+    TL_CURRENT_PHASE = 0x28
+    TL_CURRENT_PROGRAM = 0x29
+    VAR_POSITION3D = 0x39
+    VAR_SPEED = 0x40
+    VAR_POSITION = 0x42
+    VAR_ANGLE = 0x43
+    VAR_LENGTH = 0x44
+    VAR_VEHICLECLASS = 0x49
+    VAR_WIDTH = 0x4d
+    VAR_TYPE = 0x4f
+    VAR_ROUTE_ID = 0x53
+    VAR_SIGNALS = 0x5b
+    VAR_DEPARTED_PERSONS_IDS = 0x25
+    VAR_TIME_STEP = 0x70
+    VAR_DEPARTED_VEHICLES_IDS = 0x74
+    VAR_MIN_EXPECTED_VEHICLES = 0x7d
+    VAR_STAGES_REMAINING = 0xb2
+    VAR_VEHICLE = 0xc3
+
+
+tc = constants
+
+
+class TraCIException(Exception):
+    """Like traci.TraCIException, e.g. for an unknown ID."""
+
+
+# Versions of TraCI from before persons' departures could be subscribed to.
+legacy_constants = type('legacy_constants', (object,), {
+    name: value for name, value in vars(constants).items()
+    if name.isupper() and name != 'VAR_DEPARTED_PERSONS_IDS'
+})
+
+
+class FakeAgent(object):
+    def __init__(self, agent_id, rng, arrival_step):
+        self.id = agent_id
+        self.cx = rng.uniform(0, 1000)
+        self.cy = rng.uniform(0, 1000)
+        self.radius = rng.uniform(10, 100)
+        self.phase = rng.uniform(0, 2 * math.pi)
+        self.speed = rng.uniform(1, 15)
+        self.arrival_step = arrival_step
+        self.route = ['edge%d' % rng.randint(0, 99) for _ in range(rng.randint(1, 5))]
+        self.route_id = '!%s!var#0' % agent_id
+        # Only persons use these.
+        self.stages_remaining = 2
+        self.vehicle = ''
+
+    def reroute(self, edges):
+        """Like traci.vehicle.setRoute, which gives the vehicle a new route ID."""
+        self.route = list(edges)
+        self.route_id = '!%s!var#%d' % (self.id, int(self.route_id.split('#')[1]) + 1)
+
+    def next_stage(self, edges, vehicle=''):
+        """Like a person moving on to the next stage of their plan, e.g. riding a bus."""
+        self.route = list(edges)
+        self.vehicle = vehicle
+        self.stages_remaining -= 1
+
+    def advance(self, step_length_secs):
+        self.phase += self.speed * step_length_secs / self.radius
+
+    @property
+    def x(self):
+        return self.cx + self.radius * math.cos(self.phase)
+
+    @property
+    def y(self):
+        return self.cy + self.radius * math.sin(self.phase)
+
+    @property
+    def angle(self):
+        return math.degrees(self.phase) % 360
+
+
+class FakeDomain(object):
+    """Common parts of the vehicle, person and trafficlight domains."""
+
+    def __init__(self, traci):
+        self.traci = traci
+        self.subscriptions = {}  # ID -> variables
+        self.results = {}  # ID -> {variable: value}, as of the last step.
+
+    def subscribe(self, obj_id, variables):
+        self.traci.calls += 1
+        self.subscriptions[obj_id] = list(variables)
+        self.results[obj_id] = self.read(obj_id)
+
+    def getIDList(self):
+        self.traci.calls += 1
+        return tuple(self.agents())
+
+    def getSubscriptionResults(self, obj_id):
+        return self.results.get(obj_id, {})
+
+    def getAllSubscriptionResults(self):
+        return dict(self.results)
+
+    def read(self, obj_id):
+        values = self.values(self.agents()[obj_id])
+        return {v: values[v] for v in self.subscriptions[obj_id]}
+
+    def update_results(self):
+        """Like SUMO, drop the subscriptions of agents which have left and read the rest."""
+        agents = self.agents()
+        self.subscriptions = {k: v for k, v in self.subscriptions.items() if k in agents}
+        self.results = {obj_id: self.read(obj_id) for obj_id in self.subscriptions}
+
+
+class FakeVehicleDomain(FakeDomain):
+    def agents(self):
+        return self.traci.vehicles
+
+    def values(self, agent):
+        return {
+            tc.VAR_TYPE: 'passenger',
+            tc.VAR_SPEED: agent.speed,
+            tc.VAR_ANGLE: agent.angle,
+            tc.VAR_LENGTH: 5.0,
+            tc.VAR_WIDTH: 1.8,
+            tc.VAR_POSITION3D: (agent.x, agent.y, 0.0),
+            tc.VAR_SIGNALS: 8 if int(agent.phase) % 4 == 0 else 0,
+            tc.VAR_VEHICLECLASS: 'passenger',
+            tc.VAR_ROUTE_ID: agent.route_id,
+        }
+
+    def getRoute(self, veh_id):
+        self.traci.calls += 1
+        if veh_id not in self.traci.vehicles:
+            raise TraCIException('Vehicle \'%s\' is not known' % veh_id)
+        return list(self.traci.vehicles[veh_id].route)
+
+
+class FakePersonDomain(FakeDomain):
+    def agents(self):
+        return self.traci.persons
+
+    def values(self, agent):
+        return {
+            tc.VAR_TYPE: 'DEFAULT_PEDTYPE',
+            tc.VAR_SPEED: agent.speed / 10,
+            tc.VAR_ANGLE: agent.angle,
+            tc.VAR_LENGTH: 0.215,
+            tc.VAR_WIDTH: 0.478,
+            tc.VAR_POSITION: (agent.x, agent.y),
+            tc.VAR_VEHICLE: agent.vehicle,
+            tc.VAR_STAGES_REMAINING: agent.stages_remaining,
+        }
+
+    def getEdges(self, person_id):
+        self.traci.calls += 1
+        if person_id not in self.traci.persons:
+            raise TraCIException('Person \'%s\' is not known' % person_id)
+        return list(self.traci.persons[person_id].route)
+
+
+class FakeTrafficLightDomain(FakeDomain):
+    def agents(self):
+        return self.traci.lights
+
+    def values(self, phase):
+        return {tc.TL_CURRENT_PHASE: phase, tc.TL_CURRENT_PROGRAM: '0'}
+
+
+class FakeSimulationDomain(object):
+    def __init__(self, traci):
+        self.traci = traci
+        self.subscriptions = []
+
+    def subscribe(self, variables=(tc.VAR_DEPARTED_VEHICLES_IDS,)):
+        self.traci.calls += 1
+        self.subscriptions = list(variables)
+
+    def getSubscriptionResults(self):
+        values = {
+            tc.VAR_TIME_STEP: self.traci.time_ms,
+            tc.VAR_DEPARTED_VEHICLES_IDS: tuple(self.traci.departed_vehicles),
+            tc.VAR_DEPARTED_PERSONS_IDS: tuple(self.traci.departed_persons),
+            tc.VAR_MIN_EXPECTED_VEHICLES: len(self.traci.vehicles) + len(self.traci.persons),
+        }
+        return {v: values[v] for v in self.subscriptions}
+
+    def getDepartedIDList(self):
+        self.traci.calls += 1
+        return tuple(self.traci.departed_vehicles)
+
+    def getCurrentTime(self):
+        self.traci.calls += 1
+        return self.traci.time_ms
+
+
+class FakeTraci(object):
+    """A toy simulation with the traci module's interface.
+
+    num_vehicles and num_persons are the numbers of each in the simulation once it's warmed up.
+    Each simulationStep sleeps for step_secs, to stand in for a slow SUMO. calls counts the
+    TraCI calls made, each of which would be a round trip to SUMO. With legacy=True, the
+    constants are those of older versions of TraCI. With end_step, nothing departs after that
+    step, so the simulation empties.
+    """
+
+    TraCIException = TraCIException
+
+    def __init__(self, num_vehicles=100, num_persons=10, num_lights=10, step_secs=0,
+                 trip_steps=100, step_length_ms=1000, seed=0, legacy=False, end_step=None):
+        self.constants = legacy_constants if legacy else constants
+        self.num_vehicles = num_vehicles
+        self.num_persons = num_persons
+        self.num_lights = num_lights
+        self.step_secs = step_secs
+        self.trip_steps = trip_steps
+        self.step_length_ms = step_length_ms
+        self.seed = seed
+        self.end_step = end_step
+        self.simulation = FakeSimulationDomain(self)
+        self.vehicle = FakeVehicleDomain(self)
+        self.person = FakePersonDomain(self)
+        self.trafficlight = FakeTrafficLightDomain(self)
+        # Old versions of TraCI call this trafficlights.
+        self.trafficlights = self.trafficlight
+        self.calls = 0
+        self.reset()
+
+    def reset(self):
+        self.rng = random.Random(self.seed)
+        self.step = 0
+        self.time_ms = 0
+        self.next_id = 0
+        self.vehicles = {}
+        self.persons = {}
+        self.lights = {'tl%d' % i: 0 for i in range(self.num_lights)}
+        self.departed_vehicles = []
+        self.departed_persons = []
+        self.simulation.subscriptions = []
+        for domain in (self.vehicle, self.person, self.trafficlight):
+            domain.subscriptions = {}
+            domain.results = {}
+
+    def start(self, args):
+        self.calls += 1
+        self.reset()
+
+    def close(self):
+        self.calls += 1
+
+    def _depart(self, agents, departed, prefix, target):
+        # Ramp up over about half a trip, then replace arrivals to stay near the target.
+        rate = max(1, 2 * target // self.trip_steps)
+        for _ in range(min(rate, target - len(agents))):
+            agent_id = '%s%d' % (prefix, self.next_id)
+            self.next_id += 1
+            # Stagger the arrivals so that the population stays steady.
+            trip = self.rng.randint(self.trip_steps // 2 + 1, self.trip_steps * 3 // 2)
+            agents[agent_id] = FakeAgent(agent_id, self.rng, self.step + trip)
+            departed.append(agent_id)
+
+    def simulationStep(self, step=0):
+        self.calls += 1
+        if self.step_secs:
+            time.sleep(self.step_secs)
+        self.step += 1
+        self.time_ms += self.step_length_ms
+        self.departed_vehicles = []
+        self.departed_persons = []
+        for agents in (self.vehicles, self.persons):
+            for agent_id in [k for k, a in agents.items() if a.arrival_step <= self.step]:
+                del agents[agent_id]
+            for agent in agents.values():
+                agent.advance(self.step_length_ms / 1000)
+        if self.end_step is None or self.step <= self.end_step:
+            self._depart(self.vehicles, self.departed_vehicles, 'veh', self.num_vehicles)
+            self._depart(self.persons, self.departed_persons, 'ped', self.num_persons)
+        for i, light_id in enumerate(sorted(self.lights)):
+            if (self.step + i) % 10 == 0:
+                self.lights[light_id] = (self.lights[light_id] + 1) % 4
+        for domain in (self.vehicle, self.person, self.trafficlight):
+            domain.update_results()
@@ -0,0 +1,38 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Stand-ins for viewers' websockets, and helpers for running the server's coroutines in tests."""
+import asyncio
+
+from websockets.exceptions import ConnectionClosed
+
+
+class FakeWebSocket(object):
+    def __init__(self, subprotocol=None, closed=False):
+        self.subprotocol = subprotocol
+        self.closed = closed
+        self.sent = []
+        # Clear this to make sends block, like a slow client.
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    async def send(self, message):
+        if self.closed:
+            raise ConnectionClosed(None, None)
+        await self.writable.wait()
+        self.sent.append(message)
+
+
+def run(coroutine_fn):
+    """Run a coroutine function to completion on a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine_fn())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+async def drain():
+    """Let the subscribers' tasks send whatever they can."""
+    for _ in range(10):
+        await asyncio.sleep(0)
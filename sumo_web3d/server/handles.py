@@ -0,0 +1,143 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Compact integer handles for vehicle, person and light IDs on the wire.
+
+SUMO IDs (e.g. 'bike_1234.56' or long OSM-derived light IDs) would otherwise be repeated in every
+update and removal of every snapshot. Instead, each agent gets a small integer handle when it's
+created. Its creation carries the ID as an 'id' field; updates and removals only use the handle:
+
+    {'creations': {7: {'id': 'veh1', 'x': ...}}, 'updates': {3: {'x': ...}}, 'removals': [5]}
+
+Handles belong to a stream of snapshots. A client which joins (or rejoins) a stream part way
+through is sent a full delta, which rebuilds its mapping (see broadcast.py). Handles of removed
+agents are reused, which keeps them small and lets clients store the mapping in an array.
+"""
+from .vtypes import TypeCatalog
+
+
+class HandleTable(object):
+    """Assigns integer handles to IDs, recycling the handles of removed IDs."""
+
+    def __init__(self):
+        self.handles = {}  # ID -> handle
+        self.free_handles = []
+        self.next_handle = 0
+        self.released = {}  # ID -> handle, for the IDs removed by the last intern_delta.
+
+    def __len__(self):
+        return len(self.handles)
+
+    def get(self, obj_id):
+        return self.handles.get(obj_id)
+
+    def acquire(self, obj_id):
+        if self.free_handles:
+            handle = self.free_handles.pop()
+        else:
+            handle = self.next_handle
+            self.next_handle += 1
+        self.handles[obj_id] = handle
+        return handle
+
+    def release(self, obj_id):
+        handle = self.handles.pop(obj_id)
+        self.free_handles.append(handle)
+        return handle
+
+    def intern_delta(self, delta):
+        """Convert a delta keyed by ID to one keyed by handle."""
+        handles = self.handles
+        # Creations whose ID already has a handle (e.g. a light whose first delta was an update)
+        # keep it. Creations get their handles before removals release theirs, so a handle is
+        # never both created and removed in the same delta.
+        creations = {}
+        for obj_id, fields in delta['creations'].items():
+            handle = handles.get(obj_id)
+            if handle is None:
+                handle = self.acquire(obj_id)
+            creation = {'id': obj_id}
+            creation.update(fields)
+            creations[handle] = creation
+        updates = {}
+        for obj_id, fields in delta['updates'].items():
+            handle = handles.get(obj_id)
+            if handle is None:
+                # The client hasn't seen this ID, so it has to be sent as a creation.
+                handle = self.acquire(obj_id)
+                creation = {'id': obj_id}
+                creation.update(fields)
+                creations[handle] = creation
+            else:
+                updates[handle] = fields
+        self.released = {obj_id: self.release(obj_id)
+                         for obj_id in delta['removals'] if obj_id in handles}
+        removals = list(self.released.values())
+        return {'creations': creations, 'updates': updates, 'removals': removals}
+
+    def handle_delta(self, delta):
+        """Convert a delta keyed by ID to handles which were assigned by the last intern_delta.
+
+        This is for deltas derived from the last one interned, e.g. filtered for one client.
+        """
+        handles = self.handles
+        creations = {}
+        for obj_id, fields in delta['creations'].items():
+            creation = {'id': obj_id}
+            creation.update(fields)
+            creations[handles[obj_id]] = creation
+        return {
+            'creations': creations,
+            'updates': {handles[obj_id]: fields for obj_id, fields in delta['updates'].items()},
+            'removals': [handles.get(obj_id, self.released.get(obj_id))
+                         for obj_id in delta['removals']],
+        }
+
+    def full_delta(self, objects):
+        """A delta which creates all of objects, a dict keyed by ID, using their current handles.
+
+        This is for clients which join a stream of deltas part way through.
+        """
+        creations = {}
+        for obj_id, fields in objects.items():
+            creation = {'id': obj_id}
+            creation.update(fields)
+            creations[self.handles[obj_id]] = creation
+        return {'creations': creations, 'updates': {}, 'removals': []}
+
+
+class SnapshotInterner(object):
+    """Interns the vehicle and light IDs of a stream of snapshots for one client.
+
+    Vehicles' creations refer to their type in a TypeCatalog (see vtypes.py), whose new entries
+    are sent as the snapshot's 'vTypes'. vtypes are the scenario's vType definitions, if any.
+    """
+
+    def __init__(self, vtypes=None):
+        self.vehicles = HandleTable()
+        self.lights = HandleTable()
+        self.types = TypeCatalog(vtypes)
+
+    def intern(self, snapshot):
+        interned = dict(snapshot)
+        known_types = len(self.types)
+        interned['vehicles'] = self.types.compact_delta(
+            self.vehicles.intern_delta(snapshot['vehicles']), add=True)
+        interned['lights'] = self.lights.intern_delta(snapshot['lights'])
+        if len(self.types) > known_types:
+            interned['vTypes'] = self.types.entries_since(known_types)
+        return interned
+
+    def handle_vehicles(self, delta):
+        """Like HandleTable.handle_delta, for a delta of vehicles derived from the last one."""
+        return self.types.compact_delta(self.vehicles.handle_delta(delta))
+
+    def full_snapshot(self, snapshot, vehicles, lights):
+        """A copy of snapshot which creates vehicles and lights, with the whole type catalog.
+
+        This is for clients which join the stream part way through.
+        """
+        full = dict(snapshot)
+        full['vehicles'] = self.types.compact_delta(self.vehicles.full_delta(vehicles))
+        full['lights'] = self.lights.full_delta(lights)
+        if len(self.types):
+            full['vTypes'] = self.types.entries_since(0)
+        return full
@@ -0,0 +1,98 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+from nose.tools import eq_
+
+from .handles import HandleTable, SnapshotInterner
+
+
+def test_intern_delta():
+    table = HandleTable()
+    eq_({
+        'creations': {0: {'id': 'veh0', 'x': 1}, 1: {'id': 'veh1', 'x': 2}},
+        'updates': {},
+        'removals': [],
+    }, table.intern_delta({
+        'creations': {'veh0': {'x': 1}, 'veh1': {'x': 2}}, 'updates': {}, 'removals': [],
+    }))
+    eq_({
+        'creations': {2: {'id': 'veh2', 'x': 3}},
+        'updates': {1: {'x': 4}},
+        'removals': [0],
+    }, table.intern_delta({
+        'creations': {'veh2': {'x': 3}}, 'updates': {'veh1': {'x': 4}}, 'removals': ['veh0'],
+    }))
+    eq_(2, len(table))
+
+
+def test_handle_recycling():
+    table = HandleTable()
+    table.intern_delta({'creations': {'a': {}, 'b': {}}, 'updates': {}, 'removals': []})
+    # A handle released in a delta isn't reused within it, since clients apply creations first.
+    delta = table.intern_delta({'creations': {'c': {}}, 'updates': {}, 'removals': ['a']})
+    eq_({2: {'id': 'c'}}, delta['creations'])
+    eq_([0], delta['removals'])
+    delta = table.intern_delta({'creations': {'d': {}}, 'updates': {}, 'removals': []})
+    eq_({0: {'id': 'd'}}, delta['creations'])
+    eq_(3, table.next_handle)
+
+
+def test_unknown_update_is_creation():
+    table = HandleTable()
+    eq_({'creations': {0: {'id': 'tl0', 'phase': 1}}, 'updates': {}, 'removals': []},
+        table.intern_delta({'creations': {}, 'updates': {'tl0': {'phase': 1}}, 'removals': []}))
+
+
+def test_snapshot_interner():
+    interner = SnapshotInterner()
+    snapshot = {
+        'time': 100,
+        'vehicles': {'creations': {'veh0': {'x': 1}}, 'updates': {}, 'removals': []},
+        'lights': {'creations': {'tl0': {'phase': 0}}, 'updates': {}, 'removals': []},
+    }
+    eq_({
+        'time': 100,
+        'vehicles': {'creations': {0: {'id': 'veh0', 'x': 1}}, 'updates': {}, 'removals': []},
+        'lights': {'creations': {0: {'id': 'tl0', 'phase': 0}}, 'updates': {}, 'removals': []},
+    }, interner.intern(snapshot))
+    # The original snapshot is untouched, so it can be interned for other clients.
+    eq_({'veh0': {'x': 1}}, snapshot['vehicles']['creations'])
+
+
+def test_full_delta():
+    table = HandleTable()
+    table.intern_delta({'creations': {'a': {}, 'b': {}}, 'updates': {}, 'removals': ['x']})
+    eq_({'creations': {1: {'id': 'b', 'x': 2}}, 'updates': {}, 'removals': []},
+        table.full_delta({'b': {'x': 2}}))
+
+
+def test_handle_delta():
+    table = HandleTable()
+    table.intern_delta({'creations': {'a': {}, 'b': {}}, 'updates': {}, 'removals': []})
+    table.intern_delta({'creations': {'c': {}}, 'updates': {'b': {'x': 1}}, 'removals': ['a']})
+    # A client which hadn't been sent a can be sent b as a creation and still be told about c.
+    eq_({'creations': {1: {'id': 'b', 'x': 1}}, 'updates': {}, 'removals': [0]},
+        table.handle_delta({'creations': {'b': {'x': 1}}, 'updates': {}, 'removals': ['a']}))
+
+
+def test_snapshot_interner_types():
+    interner = SnapshotInterner({'bus': {'type': 'bus', 'vClass': 'bus', 'length': 12.0}})
+    empty = {'creations': {}, 'updates': {}, 'removals': []}
+    bus = {'type': 'bus', 'vClass': 'bus', 'length': 12.0, 'width': 2.5}
+    interned = interner.intern({
+        'vehicles': {'creations': {'bus0': dict(bus, x=1)}, 'updates': {}, 'removals': []},
+        'lights': empty,
+    })
+    eq_({0: {'id': 'bus0', 'x': 1, 'vType': 0}}, interned['vehicles']['creations'])
+    eq_({0: bus}, interned['vTypes'])
+    # Each type is only sent once.
+    interned = interner.intern({
+        'vehicles': {'creations': {'bus1': dict(bus, x=2)}, 'updates': {}, 'removals': []},
+        'lights': empty,
+    })
+    eq_({1: {'id': 'bus1', 'x': 2, 'vType': 0}}, interned['vehicles']['creations'])
+    eq_(False, 'vTypes' in interned)
+
+    # Clients which join part way through get the whole catalog.
+    full = interner.full_snapshot({'time': 100}, {'bus1': dict(bus, x=3)}, {})
+    eq_({1: {'id': 'bus1', 'x': 3, 'vType': 0}}, full['vehicles']['creations'])
+    eq_({0: bus}, full['vTypes'])
+    eq_(100, full['time'])
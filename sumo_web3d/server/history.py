@@ -0,0 +1,183 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""The last few minutes of a live simulation, kept in memory so that viewers can rewind.
+
+History is a ring buffer of segments. Each segment starts with a keyframe, the full state after a
+step, and holds the delta of every step from then until the next keyframe. Deltas are keyed by
+ID, as broadcast, and each is stored compressed (see recording.py). The oldest segments are
+dropped to keep within a span of simulation time and a number of bytes.
+
+A HistoryCursor plays the history back from any time in it: first the full state at that time,
+then the deltas which follow it.
+"""
+from collections import deque
+
+from .recording import apply_delta, decode_payload, encode_payload, RECORDED_FIELDS
+
+DEFAULT_HISTORY_SECS = 300
+DEFAULT_HISTORY_MB = 100
+DEFAULT_HISTORY_KEYFRAME_INTERVAL = 100
+
+# Compression is quick rather than thorough, since it happens on every frame.
+COMPRESSION_LEVEL = 1
+
+
+class Segment(object):
+    """A keyframe and the deltas of the steps from it until the next keyframe."""
+
+    def __init__(self, seq, time_ms, keyframe):
+        self.seq = seq
+        self.start_ms = time_ms
+        self.keyframe = keyframe
+        self.deltas = []  # (time, compressed delta)
+        self.size = len(keyframe)
+
+    def append(self, time_ms, delta):
+        self.deltas.append((time_ms, delta))
+        self.size += len(delta)
+
+
+class History(object):
+    """Keeps the snapshots of at least the last max_secs of simulation time, in max_bytes."""
+
+    def __init__(self, max_secs=DEFAULT_HISTORY_SECS, max_bytes=DEFAULT_HISTORY_MB * 2 ** 20,
+                 keyframe_interval=DEFAULT_HISTORY_KEYFRAME_INTERVAL):
+        self.max_secs = max_secs
+        self.max_bytes = max_bytes
+        self.keyframe_interval = keyframe_interval
+        # Sequence numbers aren't reused, so that cursors notice when the history is cleared.
+        self.next_seq = 0
+        self.clear()
+
+    def clear(self):
+        self.segments = deque()
+        self.size = 0
+        self.steps = 0
+
+    def __len__(self):
+        return len(self.segments)
+
+    @property
+    def start_ms(self):
+        return self.segments[0].start_ms if self.segments else None
+
+    @property
+    def end_ms(self):
+        return self.segments[-1].deltas[-1][0] if self.segments else None
+
+    def append(self, snapshot, full_state_fn):
+        """Add a snapshot keyed by ID.
+
+        full_state_fn returns (vehicles, lights) as of the snapshot. It's only called for
+        keyframes.
+        """
+        payload = {field: snapshot[field] for field in RECORDED_FIELDS}
+        if self.steps % self.keyframe_interval == 0:
+            keyframe = dict(payload)
+            keyframe['vehicles'], keyframe['lights'] = full_state_fn()
+            data = encode_payload(keyframe, COMPRESSION_LEVEL)
+            self.segments.append(Segment(self.next_seq, snapshot['time'], data))
+            self.next_seq += 1
+            self.size += len(data)
+        payload['vehicles'] = snapshot['vehicles']
+        payload['lights'] = snapshot['lights']
+        # The delta is kept even with a keyframe, for cursors which reach it from the last one.
+        data = encode_payload(payload, COMPRESSION_LEVEL)
+        self.segments[-1].append(snapshot['time'], data)
+        self.size += len(data)
+        self.steps += 1
+        self._evict()
+
+    def _evict(self):
+        segments = self.segments
+        min_ms = self.end_ms - self.max_secs * 1000
+        # The oldest segment can go if the next one still covers max_secs, or to save memory.
+        while len(segments) > 1 and (
+                segments[1].start_ms <= min_ms or self.size > self.max_bytes):
+            self.size -= segments.popleft().size
+
+    def segment(self, seq):
+        """The segment with a sequence number, or None if it's been dropped or isn't here yet."""
+        if not self.segments:
+            return None
+        index = seq - self.segments[0].seq
+        if 0 <= index < len(self.segments):
+            return self.segments[index]
+        return None
+
+    def cursor(self, time_ms):
+        """A HistoryCursor from the last step at or before time_ms, or None if it's empty."""
+        if not self.segments:
+            return None
+        return HistoryCursor(self, time_ms)
+
+    def stats(self):
+        return {
+            'start_ms': self.start_ms,
+            'end_ms': self.end_ms,
+            'keyframes': len(self.segments),
+            'bytes': self.size,
+        }
+
+
+class HistoryCursor(object):
+    """Plays back a History as snapshots keyed by ID.
+
+    The first snapshot, and the first after the cursor falls out of the history, creates the full
+    state and has 'reset' set: clients should drop their vehicles before applying it.
+    """
+
+    def __init__(self, history, time_ms):
+        self.history = history
+        self.seek(time_ms)
+
+    def seek(self, time_ms):
+        history = self.history
+        segments = history.segments
+        segment = segments[0]
+        for candidate in segments:
+            if candidate.start_ms > time_ms:
+                break
+            segment = candidate
+        state = decode_payload(segment.keyframe)
+        vehicles = state['vehicles']
+        lights = state['lights']
+        index = 1
+        for delta_ms, data in segment.deltas[1:]:
+            if delta_ms > time_ms:
+                break
+            payload = decode_payload(data)
+            apply_delta(vehicles, payload['vehicles'])
+            apply_delta(lights, payload['lights'])
+            state = payload
+            index += 1
+        self.seq = segment.seq
+        self.index = index  # of the next delta in the segment.
+        self.reset = {field: state[field] for field in RECORDED_FIELDS}
+        self.reset.update({
+            'vehicles': {'creations': vehicles, 'updates': {}, 'removals': []},
+            'lights': {'creations': lights, 'updates': {}, 'removals': []},
+            'reset': True,
+        })
+
+    def next(self):
+        """The next snapshot, or None once the cursor has caught up with the history."""
+        if self.reset:
+            snapshot = self.reset
+            self.reset = None
+            return snapshot
+        if not self.history.segments:
+            return None
+        segment = self.history.segment(self.seq)
+        if segment is None:
+            # It's been dropped, so start again from the oldest time which hasn't been.
+            self.seek(self.history.start_ms)
+            return self.next()
+        if self.index >= len(segment.deltas):
+            segment = self.history.segment(self.seq + 1)
+            if segment is None:
+                return None
+            self.seq = segment.seq
+            self.index = 0
+        _, data = segment.deltas[self.index]
+        self.index += 1
+        return decode_payload(data)
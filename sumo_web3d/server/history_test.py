@@ -0,0 +1,88 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+from nose.tools import eq_
+
+from .deltas import diff_dicts
+from .fake_traci import FakeTraci
+from .history import History
+from .recording import apply_delta
+from .simulation import Simulation
+from .vehicle_table import VehicleTable
+
+
+def fill(history, num_steps):
+    """Add the snapshots of a fake simulation to history, and return its states by time."""
+    simulation = Simulation(FakeTraci(num_vehicles=20, num_persons=5, num_lights=3,
+                                      trip_steps=10))
+    simulation.start(['sumo'])
+    table = VehicleTable()
+    lights = {}
+    states = {}
+    for _ in range(num_steps):
+        step = simulation.step()
+        snapshot = {
+            'time': step['time'],
+            'vehicles': table.update(step['vehicles']),
+            'lights': diff_dicts(lights, step['lights']),
+            'vehicle_counts': step['vehicle_counts'],
+        }
+        lights = step['lights']
+        history.append(snapshot, lambda: (table.to_dict(), lights))
+        states[step['time']] = (table.to_dict(), lights)
+    return states
+
+
+def play(cursor, states):
+    """Apply what a cursor plays back, checking it against states. Returns the times played."""
+    vehicles = {}
+    lights = {}
+    times = []
+    while True:
+        snapshot = cursor.next()
+        if snapshot is None:
+            return times
+        eq_(not times, snapshot.get('reset', False))
+        apply_delta(vehicles, snapshot['vehicles'])
+        apply_delta(lights, snapshot['lights'])
+        eq_(states[snapshot['time']], (vehicles, lights))
+        times.append(snapshot['time'])
+
+
+def test_cursor():
+    history = History(keyframe_interval=10)
+    states = fill(history, 25)
+    eq_(3, len(history))
+    eq_((1000, 25000), (history.start_ms, history.end_ms))
+    for time_ms in [1000, 9000, 10000, 11000, 14500, 25000]:
+        eq_(list(range(time_ms // 1000 * 1000, 26000, 1000)),
+            play(history.cursor(time_ms), states))
+    # Times before the history start from the oldest.
+    eq_(25, len(play(history.cursor(0), states)))
+    eq_(None, History().cursor(1000))
+
+
+def test_eviction():
+    history = History(max_secs=5, keyframe_interval=3)
+    states = fill(history, 20)
+    # The history covers at least the last five seconds, in whole segments.
+    eq_((13000, 20000), (history.start_ms, history.end_ms))
+    eq_(list(range(13000, 21000, 1000)), play(history.cursor(0), states))
+    eq_(sum(s.size for s in history.segments), history.size)
+
+    history = History(max_bytes=1, keyframe_interval=3)
+    fill(history, 20)
+    # The latest segment is always kept.
+    eq_(1, len(history))
+    eq_(19000, history.start_ms)
+
+
+def test_cursor_falls_out_of_history():
+    history = History(max_secs=5, keyframe_interval=3)
+    fill(history, 10)
+    cursor = history.cursor(0)
+    eq_(4000, cursor.next()['time'])
+    history.clear()
+    fill(history, 20)
+    # The cursor starts again from the oldest snapshot left.
+    snapshot = cursor.next()
+    eq_((13000, True), (snapshot['time'], snapshot['reset']))
+    eq_(list(range(14000, 21000, 1000)), [s['time'] for s in iter(cursor.next, None)])
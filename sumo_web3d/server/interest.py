@@ -0,0 +1,311 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Send each viewer only the vehicles near what its camera can see.
+
+Viewers report the area they're looking at as a bounding box in SUMO coordinates. Each step, the
+server indexes vehicles' positions in a uniform grid (SpatialGrid), and each viewer's deltas are
+filtered to the vehicles in grid cells which overlap its box plus a margin (ViewportFilter).
+Vehicles which come into view are sent as creations, with all their fields, and vehicles which
+leave it are sent as removals, so the client's state always matches what's in view.
+
+Viewers which haven't reported a viewport get every vehicle.
+
+Viewers may also report where their camera is, for level of detail (LevelOfDetail): updates of
+distant vehicles are sent less often, and with coarser positions, than those of nearby ones. When
+a vehicle comes into a finer tier, its position is sent again at that tier's precision, even if it
+hasn't moved.
+"""
+from collections import namedtuple
+import json
+import math
+
+import numpy as np
+
+# Side of a grid cell, in meters.
+DEFAULT_CELL_SIZE = 100.0
+
+# Distance around a viewport within which vehicles are sent, in meters, so that they're already
+# there when the camera pans.
+DEFAULT_MARGIN = 100.0
+
+# A level of detail for vehicles up to max_distance meters from the camera: their updates are sent
+# every `every` frames, with positions rounded to `places` decimal places.
+LodTier = namedtuple('LodTier', ['max_distance', 'every', 'places'])
+
+# Used by --lod-tiers when it's given without a value.
+DEFAULT_LOD_TIERS = '200:1:2,600:3:1,inf:10:0'
+
+# Level of detail measures the bytes it saves on one frame in this many, since measuring them
+# means serializing the updates twice more.
+STATS_EVERY = 10
+
+POSITION_FIELDS = ('x', 'y', 'z')
+
+
+def parse_bounds(bounds):
+    """Validate a [left, bottom, right, top] bounding box from a viewer, or None."""
+    if bounds is None:
+        return None
+    left, bottom, right, top = [float(v) for v in bounds]
+    if not all(math.isfinite(v) for v in (left, bottom, right, top)):
+        raise ValueError('Viewport bounds must be finite: %r' % (bounds,))
+    if left > right or bottom > top:
+        raise ValueError('Viewport bounds must be [left, bottom, right, top]: %r' % (bounds,))
+    return (left, bottom, right, top)
+
+
+def parse_camera(camera):
+    """Validate an [x, y, ...] camera position from a viewer as (x, y), or None."""
+    if camera is None:
+        return None
+    x, y = [float(v) for v in camera[:2]]
+    if not (math.isfinite(x) and math.isfinite(y)):
+        raise ValueError('Camera position must be finite: %r' % (camera,))
+    return (x, y)
+
+
+def parse_lod_tiers(spec):
+    """Parse tiers like '200:1:2,600:3:1,inf:10:0' (max_distance:every:places) into LodTiers.
+
+    Vehicles beyond the last tier's max_distance are treated as being in it.
+    """
+    tiers = []
+    for tier in spec.split(','):
+        max_distance, every, places = tier.split(':')
+        tiers.append(LodTier(float(max_distance), int(every), int(places)))
+    if not tiers or any(t.every < 1 for t in tiers):
+        raise ValueError('Invalid level of detail tiers: %s' % spec)
+    if [t.max_distance for t in tiers] != sorted(t.max_distance for t in tiers):
+        raise ValueError('Level of detail tiers must be in order of distance: %s' % spec)
+    return tiers
+
+
+class SpatialGrid(object):
+    """An index of the vehicles in a VehicleTable by position, rebuilt by each update()."""
+
+    def __init__(self, table, cell_size=DEFAULT_CELL_SIZE):
+        self.table = table
+        self.cell_size = cell_size
+        self.clear()
+
+    def clear(self):
+        self.ids = np.empty(0, dtype=object)  # vehicle IDs, sorted by cell.
+        self.cells = {}  # (column, row) -> (start, end) in ids.
+
+    def update(self):
+        table = self.table
+        ids = np.empty(len(table.ids), dtype=object)
+        ids[:] = table.ids
+        slots = np.array([table.slots[veh_id] for veh_id in table.ids], dtype=np.int64)
+        xs = table.columns['x'][slots]
+        ys = table.columns['y'][slots]
+        located = ~(np.isnan(xs) | np.isnan(ys))
+        ids = ids[located]
+        columns = np.floor(xs[located] / self.cell_size).astype(np.int64)
+        rows = np.floor(ys[located] / self.cell_size).astype(np.int64)
+
+        order = np.lexsort((rows, columns))
+        self.ids = ids[order]
+        columns = columns[order]
+        rows = rows[order]
+        if not len(order):
+            self.cells = {}
+            return
+        # Each cell is a run of the sorted IDs.
+        new_cell = (columns[1:] != columns[:-1]) | (rows[1:] != rows[:-1])
+        starts = np.flatnonzero(np.r_[True, new_cell])
+        ends = np.r_[starts[1:], len(order)]
+        self.cells = {
+            (column, row): (start, end)
+            for column, row, start, end in zip(
+                columns[starts].tolist(), rows[starts].tolist(), starts.tolist(), ends.tolist())
+        }
+
+    def query(self, bounds, margin=0.0):
+        """The set of IDs of vehicles in cells which overlap bounds, grown by margin."""
+        left, bottom, right, top = bounds
+        size = self.cell_size
+        min_column = math.floor((left - margin) / size)
+        max_column = math.floor((right + margin) / size)
+        min_row = math.floor((bottom - margin) / size)
+        max_row = math.floor((top + margin) / size)
+        num_cells = (max_column - min_column + 1) * (max_row - min_row + 1)
+        if num_cells > len(self.cells):
+            # A zoomed-out view: it's quicker to check the occupied cells.
+            spans = [span for (column, row), span in self.cells.items()
+                     if min_column <= column <= max_column and min_row <= row <= max_row]
+        else:
+            spans = [self.cells[cell] for cell in (
+                (column, row)
+                for column in range(min_column, max_column + 1)
+                for row in range(min_row, max_row + 1)) if cell in self.cells]
+        in_view = set()
+        for start, end in spans:
+            in_view.update(self.ids[start:end].tolist())
+        return in_view
+
+
+class LevelOfDetail(object):
+    """Throttles one viewer's vehicle updates by their distance from its camera.
+
+    Updates which aren't sent right away are merged, and sent on the vehicle's next turn. Turns
+    are staggered by table slot so that each frame carries a share of the distant vehicles.
+
+    The bytes saved are estimated from one frame in stats_every.
+    """
+
+    def __init__(self, tiers, stats_every=STATS_EVERY):
+        self.tiers = tiers
+        self.max_distances = np.array([t.max_distance for t in tiers])
+        self.every = np.array([t.every for t in tiers], dtype=np.int64)
+        self.max_places = max(t.places for t in tiers)
+        self.stats_every = stats_every
+        self.pending = {}  # vehicle ID -> merged fields which haven't been sent.
+        # vehicle ID -> the decimal places its position was last sent with, if fewer than
+        # max_places. Once it's in a finer tier, its position is sent again.
+        self.coarse = {}
+        self.frame = 0
+        # Per tier: estimated JSON bytes of the updates as they'd be sent without level of
+        # detail, and as they were sent.
+        self.full_bytes = [0] * len(tiers)
+        self.sent_bytes = [0] * len(tiers)
+
+    def forget(self, veh_ids):
+        """Drop the pending updates of vehicles which were removed or created."""
+        for veh_id in veh_ids:
+            self.pending.pop(veh_id, None)
+            self.coarse.pop(veh_id, None)
+
+    def flush(self, updates, table):
+        """All the pending updates and these, e.g. once the camera position is unknown.
+
+        Vehicles whose positions were rounded get their current ones.
+        """
+        sent = self.pending
+        self.pending = {}
+        for veh_id in self.coarse:
+            sent.setdefault(veh_id, {}).update(self.position(veh_id, table))
+        self.coarse = {}
+        for veh_id, fields in updates.items():
+            if veh_id in sent:
+                sent[veh_id].update(fields)
+            else:
+                sent[veh_id] = fields
+        return sent
+
+    def position(self, veh_id, table):
+        vehicle = table.get(veh_id, {})
+        return {field: vehicle[field] for field in POSITION_FIELDS if field in vehicle}
+
+    def tier_indices(self, slots, camera, table):
+        distances = np.hypot(table.columns['x'][slots] - camera[0],
+                             table.columns['y'][slots] - camera[1])
+        return np.minimum(np.searchsorted(self.max_distances, distances), len(self.tiers) - 1)
+
+    def restore_positions(self, camera, table):
+        """Queue the positions of vehicles which were sent coarser ones than their tier's."""
+        ids = list(self.coarse)
+        slots = np.array([table.slots[veh_id] for veh_id in ids], dtype=np.int64)
+        tiers = self.tier_indices(slots, camera, table)
+        for veh_id, tier_index in zip(ids, tiers.tolist()):
+            if self.tiers[tier_index].places > self.coarse[veh_id]:
+                self.pending.setdefault(veh_id, {}).update(self.position(veh_id, table))
+
+    def throttle(self, updates, camera, table):
+        """The updates to send this frame, given the viewer's camera position."""
+        pending = self.pending
+        for veh_id, fields in updates.items():
+            if veh_id in pending:
+                pending[veh_id].update(fields)
+            else:
+                pending[veh_id] = dict(fields)  # fields is shared with other viewers.
+        self.frame += 1
+        if self.coarse:
+            self.restore_positions(camera, table)
+        if not pending:
+            return {}
+
+        ids = list(pending)
+        slots = np.array([table.slots[veh_id] for veh_id in ids], dtype=np.int64)
+        tiers = self.tier_indices(slots, camera, table)
+        due = (self.frame + slots) % self.every[tiers] == 0
+
+        sent = {}
+        measure = self.frame % self.stats_every == 0
+        full_by_tier = [{} for _ in self.tiers]
+        sent_by_tier = [{} for _ in self.tiers]
+        for veh_id, tier_index, is_due in zip(ids, tiers.tolist(), due.tolist()):
+            if measure and veh_id in updates:
+                full_by_tier[tier_index][veh_id] = updates[veh_id]
+            if is_due:
+                fields = pending.pop(veh_id)
+                places = self.tiers[tier_index].places
+                rounded = False
+                for field in POSITION_FIELDS:
+                    if field in fields:
+                        fields[field] = round(fields[field], places)
+                        rounded = True
+                if rounded and places < self.max_places:
+                    self.coarse[veh_id] = places
+                elif rounded:
+                    self.coarse.pop(veh_id, None)
+                sent[veh_id] = fields
+                if measure:
+                    sent_by_tier[tier_index][veh_id] = fields
+        if measure:
+            for i in range(len(self.tiers)):
+                if full_by_tier[i]:
+                    self.full_bytes[i] += len(json.dumps(full_by_tier[i])) * self.stats_every
+                if sent_by_tier[i]:
+                    self.sent_bytes[i] += len(json.dumps(sent_by_tier[i])) * self.stats_every
+        return sent
+
+    def stats(self):
+        return [{
+            'max_distance': tier.max_distance,
+            'every': tier.every,
+            'places': tier.places,
+            'full_bytes': full_bytes,
+            'sent_bytes': sent_bytes,
+            'saved_bytes': full_bytes - sent_bytes,
+        } for tier, full_bytes, sent_bytes in zip(self.tiers, self.full_bytes, self.sent_bytes)]
+
+
+class ViewportFilter(object):
+    """Turns the deltas of all vehicles into deltas of the vehicles in one viewer's viewport.
+
+    visible is the set of IDs which the viewer has been sent and not told to remove. camera is
+    the viewer's position as (x, y); with lod_tiers, it's used for level of detail.
+    """
+
+    def __init__(self, bounds, visible, margin=DEFAULT_MARGIN, camera=None, lod_tiers=None):
+        self.bounds = bounds
+        self.visible = set(visible)
+        self.margin = margin
+        self.camera = camera
+        self.detail = LevelOfDetail(lod_tiers) if lod_tiers else None
+
+    def filter(self, delta, grid):
+        """Filter a delta keyed by ID, after grid has been updated with its vehicles."""
+        visible = self.visible
+        if self.bounds is None:
+            in_view = set(grid.table.ids)
+        else:
+            in_view = grid.query(self.bounds, self.margin)
+        removed = set(delta['removals'])
+        removals = [veh_id for veh_id in delta['removals'] if veh_id in visible]
+        removals.extend(veh_id for veh_id in visible - in_view if veh_id not in removed)
+        creations = {}
+        for veh_id in in_view - visible:
+            fields = delta['creations'].get(veh_id)
+            creations[veh_id] = fields if fields is not None else grid.table.get(veh_id)
+        updates = {veh_id: fields for veh_id, fields in delta['updates'].items()
+                   if veh_id in visible and veh_id in in_view}
+        if self.detail:
+            self.detail.forget(removals)
+            self.detail.forget(creations)
+            if self.camera is not None:
+                updates = self.detail.throttle(updates, self.camera, grid.table)
+            elif self.detail.pending or self.detail.coarse:
+                updates = self.detail.flush(updates, grid.table)
+        self.visible = in_view
+        return {'creations': creations, 'updates': updates, 'removals': removals}
@@ -0,0 +1,180 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import random
+
+from nose.tools import assert_raises, eq_
+
+from .deltas_test import apply_delta
+from .interest import (LodTier, parse_bounds, parse_camera, parse_lod_tiers, SpatialGrid,
+                       ViewportFilter)
+from .vehicle_table import VehicleTable
+
+
+def make_grid(vehicles, cell_size=100):
+    table = VehicleTable()
+    delta = table.update(vehicles)
+    grid = SpatialGrid(table, cell_size)
+    grid.update()
+    return grid, delta
+
+
+def test_parse_bounds():
+    eq_((0.0, 1.0, 2.0, 3.0), parse_bounds([0, 1, 2, 3]))
+    eq_(None, parse_bounds(None))
+    assert_raises(ValueError, parse_bounds, [2, 1, 0, 3])
+    assert_raises(ValueError, parse_bounds, [0, 1, float('nan'), 3])
+    assert_raises(ValueError, parse_bounds, [0, 1])
+    assert_raises(TypeError, parse_bounds, 3)
+
+
+def test_parse_camera():
+    eq_((1.0, 2.0), parse_camera([1, 2, 100]))
+    eq_(None, parse_camera(None))
+    assert_raises(ValueError, parse_camera, [1])
+    assert_raises(ValueError, parse_camera, [1, float('inf')])
+    assert_raises(ValueError, parse_camera, ['x', 2])
+
+
+def test_query():
+    grid, _ = make_grid({
+        'a': {'x': 10, 'y': 10},
+        'b': {'x': 150, 'y': 10},
+        'c': {'x': 150, 'y': 250},
+        'd': {'x': -50, 'y': -50},
+    })
+    eq_({'a'}, grid.query((0, 0, 50, 50)))
+    # Cells are the unit of interest: b's cell overlaps the box.
+    eq_({'a', 'b'}, grid.query((0, 0, 100, 50)))
+    eq_({'a', 'b', 'd'}, grid.query((0, 0, 50, 50), margin=100))
+    # A zoomed-out view which covers far more cells than are occupied.
+    eq_({'a', 'b', 'c', 'd'}, grid.query((-1e6, -1e6, 1e6, 1e6)))
+    eq_(set(), grid.query((1000, 1000, 2000, 2000)))
+
+
+def test_filter_enter_and_exit():
+    vehicles = {'a': {'x': 10, 'y': 10, 'type': 'bus'}, 'b': {'x': 500, 'y': 10, 'type': 'car'}}
+    grid, delta = make_grid(vehicles)
+    viewport = ViewportFilter((0, 0, 50, 50), visible=['a', 'b'], margin=0)
+    # b is out of view, so it's removed.
+    eq_({'creations': {}, 'updates': {}, 'removals': ['b']}, viewport.filter(
+        {'creations': {}, 'updates': {}, 'removals': []}, grid))
+
+    # b comes into view with all its fields, while a leaves it.
+    delta = grid.table.update({'a': {'x': 510, 'y': 10}, 'b': {'x': 20, 'y': 10, 'type': 'car'}})
+    grid.update()
+    eq_({'creations': {'b': {'x': 20, 'y': 10, 'type': 'car'}}, 'updates': {}, 'removals': ['a']},
+        viewport.filter(delta, grid))
+
+    # Arrivals are only sent if they were visible.
+    delta = grid.table.update({'c': {'x': 30, 'y': 10}})
+    grid.update()
+    eq_({'creations': {'c': {'x': 30, 'y': 10}}, 'updates': {}, 'removals': ['b']},
+        viewport.filter(delta, grid))
+
+
+def test_filter_matches_view():
+    """A viewer which applies its filtered deltas has exactly the vehicles in view."""
+    rng = random.Random(0)
+    table = VehicleTable()
+    grid = SpatialGrid(table, cell_size=50)
+    vehicles = {}
+    viewport = ViewportFilter((100, 100, 300, 300), visible=[], margin=25)
+    client = {}
+    for step in range(50):
+        for veh_id in rng.sample(sorted(vehicles), len(vehicles) // 10):
+            del vehicles[veh_id]
+        for i in range(10):
+            vehicles['veh%d-%d' % (step, i)] = {'x': rng.uniform(0, 500), 'y': rng.uniform(0, 500)}
+        for vehicle in vehicles.values():
+            vehicle['x'] += rng.uniform(-30, 30)
+            vehicle['y'] += rng.uniform(-30, 30)
+        if step % 10 == 5:
+            left, bottom = rng.uniform(0, 300), rng.uniform(0, 300)
+            viewport.bounds = (left, bottom, left + 200, bottom + 200)
+
+        delta = table.update(vehicles)
+        grid.update()
+        client = apply_delta(client, viewport.filter(delta, grid))
+        in_view = grid.query(viewport.bounds, viewport.margin)
+        eq_({veh_id: table.get(veh_id) for veh_id in in_view}, client)
+        assert 0 < len(client) < len(vehicles)
+
+
+def test_parse_lod_tiers():
+    eq_([LodTier(200.0, 1, 2), LodTier(float('inf'), 10, 0)], parse_lod_tiers('200:1:2,inf:10:0'))
+    assert_raises(ValueError, parse_lod_tiers, '600:1:2,200:3:1')
+    assert_raises(ValueError, parse_lod_tiers, '200:0:2')
+
+
+def test_level_of_detail():
+    table = VehicleTable()
+    grid = SpatialGrid(table)
+    viewport = ViewportFilter((-1e4, -1e4, 1e4, 1e4), visible=[], camera=(0, 0),
+                              lod_tiers=parse_lod_tiers('100:1:2,inf:4:0'))
+    viewport.detail.stats_every = 1
+    client = {}
+    far_steps = []
+    for step in range(13):
+        far = {'x': 1000.37 + step * 10, 'y': 10.0, 'signals': step // 3}
+        delta = table.update({'near': {'x': 10.25 + step, 'y': 10.0, 'signals': 0}, 'far': far})
+        grid.update()
+        filtered = viewport.filter(delta, grid)
+        client = apply_delta(client, filtered)
+        eq_(10.25 + step, client['near']['x'])
+        if step and 'far' in filtered['updates']:
+            far_steps.append(step)
+            # Changes made between its turns aren't lost, and its position is rounded to meters.
+            eq_({'x': round(far['x']), 'y': 10, 'signals': far['signals']}, client['far'])
+    # The distant vehicle is sent every fourth frame.
+    eq_(3, len(far_steps))
+    eq_([4, 4], [b - a for a, b in zip(far_steps, far_steps[1:])])
+
+    stats = viewport.detail.stats()
+    eq_([1, 4], [tier['every'] for tier in stats])
+    eq_(0, stats[0]['saved_bytes'])
+    assert stats[1]['saved_bytes'] > 0, stats
+
+
+def test_level_of_detail_stats_are_sampled():
+    table = VehicleTable()
+    grid = SpatialGrid(table)
+    viewport = ViewportFilter((-1e4, -1e4, 1e4, 1e4), visible=[], camera=(0, 0),
+                              lod_tiers=parse_lod_tiers('100:1:2,inf:4:0'))
+    for step in range(viewport.detail.stats_every):
+        delta = table.update({'far': {'x': 1000.37 + step, 'y': 10.0}})
+        grid.update()
+        viewport.filter(delta, grid)
+        # Nothing is measured until the stats_everyth frame, which counts for all of them.
+        full_bytes = viewport.detail.stats()[1]['full_bytes']
+        eq_(step == viewport.detail.stats_every - 1, full_bytes > 0)
+
+
+def test_level_of_detail_restores_position():
+    table = VehicleTable()
+    grid = SpatialGrid(table)
+    viewport = ViewportFilter((-1e4, -1e4, 1e4, 1e4), visible=[], camera=(0, 0),
+                              lod_tiers=parse_lod_tiers('100:1:2,inf:4:0'))
+    client = {}
+
+    def step(x, camera=(0, 0)):
+        nonlocal client
+        viewport.camera = camera
+        delta = table.update({'car': {'x': x, 'y': 10.25}})
+        grid.update()
+        client = apply_delta(client, viewport.filter(delta, grid))
+
+    step(1000.0)
+    # It moves while it's far away, and stops.
+    for _ in range(8):
+        step(1000.37)
+    eq_({'x': 1000, 'y': 10.25}, client['car'])
+    # It hasn't moved, but once the camera is close, its exact position is sent.
+    step(1000.37, camera=(1000, 0))
+    eq_({'x': 1000.37, 'y': 10.25}, client['car'])
+    eq_({}, viewport.detail.coarse)
+
+    # The same goes for a viewer which stops reporting its camera.
+    for _ in range(8):
+        step(1001.37)
+    eq_({'x': 1001, 'y': 10.25}, client['car'])
+    step(1001.37, camera=None)
+    eq_({'x': 1001.37, 'y': 10.25}, client['car'])
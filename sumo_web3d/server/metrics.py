@@ -0,0 +1,183 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Metrics for /metrics, in the Prometheus text format.
+
+Each Session has SessionMetrics, which time the stages of each step:
+
+- simulate: SUMO advancing the simulation (Simulation.step's simulationStep).
+- collect: reading the new state over TraCI.
+- diff: updating the vehicle table and diffing lights into a snapshot.
+- broadcast: filtering, interning and queueing the snapshot for every viewer.
+- serialize: encoding a frame, once per subprotocol in use.
+- send: waiting for a viewer's websocket to accept a frame.
+
+These are cheap enough to record all the time: each is a few additions, and the page is only
+rendered when it's scraped. The event loop's lag is measured for the whole server, by
+monitor_loop_lag.
+
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+import asyncio
+import bisect
+from collections import deque, OrderedDict
+import time
+
+PREFIX = 'sumo_web3d_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGES = ['simulate', 'collect', 'diff', 'broadcast', 'serialize', 'send']
+
+SECONDS_BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+BYTES_BUCKETS = [2 ** n for n in range(8, 26, 2)]  # 256 B to 16 MB
+
+# The achieved frame rate is averaged over this much time.
+FRAME_RATE_WINDOW_SECS = 10
+
+LOOP_LAG_INTERVAL_SECS = 0.5
+
+
+class Histogram(object):
+    """Counts of observations in cumulative buckets, as in a Prometheus histogram."""
+
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)  # Not cumulative; see cumulative_counts.
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in sorted(labels.items()))
+
+
+class Exposition(object):
+    """A page of metrics. Samples of the same metric are grouped, whatever order they're added."""
+
+    def __init__(self):
+        self.families = OrderedDict()  # name -> (type, help, [lines])
+
+    def _lines(self, name, metric_type, help_text):
+        name = PREFIX + name
+        if name not in self.families:
+            self.families[name] = (metric_type, help_text, [])
+        return name, self.families[name][2]
+
+    def gauge(self, name, help_text, value, labels=None):
+        name, lines = self._lines(name, 'gauge', help_text)
+        lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+
+    def counter(self, name, help_text, value, labels=None):
+        name, lines = self._lines(name, 'counter', help_text)
+        lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+
+    def histogram(self, name, help_text, histogram, labels=None):
+        name, lines = self._lines(name, 'histogram', help_text)
+        labels = labels or {}
+        for bound, count in histogram.cumulative_counts():
+            lines.append('%s_bucket%s %d' % (
+                name, format_labels(dict(labels, le=format_value(bound))), count))
+        lines.append('%s_bucket%s %d' % (name, format_labels(dict(labels, le='+Inf')),
+                                         histogram.count))
+        lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(histogram.sum)))
+        lines.append('%s_count%s %d' % (name, format_labels(labels), histogram.count))
+
+    def render(self):
+        out = []
+        for name, (metric_type, help_text, lines) in self.families.items():
+            out.append('# HELP %s %s' % (name, help_text))
+            out.append('# TYPE %s %s' % (name, metric_type))
+            out.extend(lines)
+        return '\n'.join(out) + '\n'
+
+
+class SessionMetrics(object):
+    """Step timings, frame sizes and frame rates of a session."""
+
+    def __init__(self):
+        self.stage_secs = OrderedDict((stage, Histogram()) for stage in STAGES)
+        self.frame_bytes = Histogram(BYTES_BUCKETS)
+        self.frame_times = deque()  # monotonic times of the frames in the last window.
+        self.period_secs = None  # The time which frames are meant to take, while running.
+        self.vehicle_counts = {}  # vClass -> count, as of the last frame.
+        # Totals over all of the session's viewers, including those which have left.
+        self.frames_sent = 0
+        self.frames_coalesced = 0
+
+    def observe_stage(self, stage, secs):
+        self.stage_secs[stage].observe(secs)
+
+    def observe_frame(self, vehicle_counts, period_secs, now=None):
+        now = time.monotonic() if now is None else now
+        self.frame_times.append(now)
+        self._expire(now)
+        self.period_secs = period_secs
+        self.vehicle_counts = vehicle_counts
+
+    def _expire(self, now):
+        while self.frame_times and self.frame_times[0] < now - FRAME_RATE_WINDOW_SECS:
+            self.frame_times.popleft()
+
+    def frame_rate(self, now=None):
+        """Frames per second over the last FRAME_RATE_WINDOW_SECS."""
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        if len(self.frame_times) < 2:
+            return 0
+        return (len(self.frame_times) - 1) / (now - self.frame_times[0])
+
+    def export(self, exposition, labels, running=True):
+        for stage, histogram in self.stage_secs.items():
+            exposition.histogram(
+                'stage_seconds', 'Time spent in each stage of a step, per frame.', histogram,
+                dict(labels, stage=stage))
+        exposition.histogram(
+            'frame_bytes', 'Size of the frames sent to each viewer.', self.frame_bytes, labels)
+        exposition.counter(
+            'frames_sent_total', 'Frames sent to viewers.', self.frames_sent, labels)
+        exposition.counter(
+            'frames_coalesced_total',
+            'Snapshots merged into a queued frame because a viewer was behind.',
+            self.frames_coalesced, labels)
+        for v_class, count in sorted(self.vehicle_counts.items()):
+            exposition.gauge('agents', 'Vehicles and persons in the simulation, by vClass.',
+                             count, dict(labels, vclass=v_class))
+        exposition.gauge('frame_rate', 'Frames per second, over the last %d s.' %
+                         FRAME_RATE_WINDOW_SECS, self.frame_rate(), labels)
+        exposition.gauge(
+            'target_frame_rate', 'Frames per second which the session is trying for.',
+            1 / self.period_secs if running and self.period_secs else 0, labels)
+
+
+async def monitor_loop_lag(histogram, interval_secs=LOOP_LAG_INTERVAL_SECS):
+    """Observe how late the event loop wakes up from a sleep, forever.
+
+    Lag means that something is hogging the loop, which delays every frame and request.
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval_secs)
+        histogram.observe(max(0, loop.time() - start - interval_secs))
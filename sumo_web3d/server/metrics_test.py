@@ -0,0 +1,47 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+from nose.tools import eq_
+
+from .metrics import Exposition, Histogram, SessionMetrics
+
+
+def test_histogram():
+    histogram = Histogram([1, 2, 5])
+    for value in [0.5, 1, 1.5, 3, 10]:
+        histogram.observe(value)
+    eq_([(1, 2), (2, 3), (5, 4)], list(histogram.cumulative_counts()))
+    eq_((5, 16), (histogram.count, histogram.sum))
+
+
+def test_exposition():
+    exposition = Exposition()
+    histogram = Histogram([0.1])
+    histogram.observe(0.05)
+    exposition.histogram('secs', 'Seconds.', histogram, {'scenario': 'a'})
+    exposition.gauge('viewers', 'Viewers.', 2, {'scenario': 'a'})
+    # Samples of a metric are grouped under one HELP and TYPE, even if they're added later.
+    exposition.histogram('secs', 'Seconds.', Histogram([0.1]), {'scenario': 'b"c'})
+    eq_('\n'.join([
+        '# HELP sumo_web3d_secs Seconds.',
+        '# TYPE sumo_web3d_secs histogram',
+        'sumo_web3d_secs_bucket{le="0.1",scenario="a"} 1',
+        'sumo_web3d_secs_bucket{le="+Inf",scenario="a"} 1',
+        'sumo_web3d_secs_sum{scenario="a"} 0.05',
+        'sumo_web3d_secs_count{scenario="a"} 1',
+        'sumo_web3d_secs_bucket{le="0.1",scenario="b\\"c"} 0',
+        'sumo_web3d_secs_bucket{le="+Inf",scenario="b\\"c"} 0',
+        'sumo_web3d_secs_sum{scenario="b\\"c"} 0',
+        'sumo_web3d_secs_count{scenario="b\\"c"} 0',
+        '# HELP sumo_web3d_viewers Viewers.',
+        '# TYPE sumo_web3d_viewers gauge',
+        'sumo_web3d_viewers{scenario="a"} 2',
+    ]) + '\n', exposition.render())
+
+
+def test_frame_rate():
+    metrics = SessionMetrics()
+    eq_(0, metrics.frame_rate(now=0))
+    for i in range(11):
+        metrics.observe_frame({'passenger': 3}, 0.1, now=100 + i * 0.2)
+    eq_(5, round(metrics.frame_rate(now=102)))
+    # Frames older than the window don't count.
+    eq_(0, metrics.frame_rate(now=200))
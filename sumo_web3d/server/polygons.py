@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Simplify the polygons of a scenario's additional files, to make them smaller to send.
+
+    sumo-web3d-polygons sumo_web3d/scenarios/bologna-acosta --simplify 0.3:5:1
+
+Polygon files from polyconvert have every vertex of every OSM way, with centimeter precision,
+down to footprints of a few square meters which can't be seen from any distance. Each polygon's
+outline is simplified with Douglas-Peucker to within a tolerance, filled polygons (footprints)
+smaller than a minimum area are dropped, and the remaining coordinates are rounded.
+
+Scenarios apply this to their additional files when they're given SimplifyOptions, and cache the
+result with the parsed files. Running this on a scenario directory (or .sumocfg file) fills that
+cache ahead of time and reports how much smaller the polygons became.
+"""
+import argparse
+from collections import namedtuple
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+
+from .cache import DEFAULT_CACHE_DIR, ParsedFileCache
+from .xml_utils import force_list
+
+# Outlines are simplified to within tolerance_m meters, filled polygons of less than min_area_m2
+# square meters are dropped, and coordinates are rounded to `decimals` decimal places.
+SimplifyOptions = namedtuple('SimplifyOptions', ['tolerance_m', 'min_area_m2', 'decimals'])
+
+# Used by --simplify-polygons when it's given without a value.
+DEFAULT_SIMPLIFY = '0.3:5:1'
+
+# Bump this whenever the output of simplify_additional changes.
+SIMPLIFY_VERSION = 1
+
+
+def parse_simplify_options(spec):
+    """Parse options like '0.3:5:1' (tolerance_m:min_area_m2:decimals) into SimplifyOptions."""
+    tolerance_m, min_area_m2, decimals = spec.split(':')
+    options = SimplifyOptions(float(tolerance_m), float(min_area_m2), int(decimals))
+    if options.tolerance_m < 0 or options.min_area_m2 < 0 or options.decimals < 0:
+        raise ValueError('Polygon simplification options must not be negative: %s' % spec)
+    return options
+
+
+def options_key(options):
+    """Distinguishes the cached output of different options."""
+    return 'polygons-%d:%r:%r:%d' % (
+        SIMPLIFY_VERSION, options.tolerance_m, options.min_area_m2, options.decimals)
+
+
+def segment_distances(points, start, end):
+    """Distance of each of points from the segment between start and end."""
+    direction = end - start
+    length2 = direction.dot(direction)
+    if length2 == 0:
+        return np.hypot(*(points - start).T)
+    t = np.clip((points - start).dot(direction) / length2, 0, 1)
+    return np.hypot(*(points - start - t[:, np.newaxis] * direction).T)
+
+
+def simplify_line(points, tolerance):
+    """Douglas-Peucker: the points which keep a polyline within tolerance of the original.
+
+    Both ends are kept, so a closed ring (whose first and last points are the same) stays closed.
+    """
+    points = np.asarray(points, dtype=float)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        distances = segment_distances(points[i + 1:j, :2], points[i, :2], points[j, :2])
+        k = int(np.argmax(distances))
+        if distances[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack += [(i, k), (k, j)]
+    return points[keep]
+
+
+def polygon_area(points):
+    """The area of a polygon, by the shoelace formula. It needn't be closed."""
+    x, y = points[:, 0], points[:, 1]
+    return abs(x.dot(np.roll(y, -1)) - y.dot(np.roll(x, -1))) / 2
+
+
+def parse_shape(shape):
+    """A SUMO shape as an array of points, or None if its points have different dimensions."""
+    points = [[float(v) for v in point.split(',')] for point in shape.split()]
+    if not points or len({len(point) for point in points}) != 1:
+        return None
+    return np.array(points)
+
+
+def format_shape(points, decimals):
+    """Round points, dropping any which become the same as the one before."""
+    points = np.round(points, decimals)
+    if len(points) > 1:
+        points = points[np.r_[True, np.any(points[1:] != points[:-1], axis=1)]]
+    return ' '.join(','.join('%.*f' % (decimals, v) for v in point) for point in points)
+
+
+def is_filled(polygon):
+    return polygon.get('fill') in ('1', 'true')
+
+
+def simplify_polygon(polygon, options):
+    """A copy of a polygon with a simplified shape, or None if it's too small to keep."""
+    points = parse_shape(polygon.get('shape') or '')
+    if points is None or len(points) < 2:
+        return polygon
+    if is_filled(polygon) and polygon_area(points) < options.min_area_m2:
+        return None
+    simplified = simplify_line(points, options.tolerance_m)
+    if is_filled(polygon) and len(np.unique(simplified[:, :2], axis=0)) < 3:
+        simplified = points  # Too thin to simplify without it collapsing.
+    return dict(polygon, shape=format_shape(simplified, options.decimals))
+
+
+def count_vertices(polygons):
+    return sum(len((p.get('shape') or '').split()) for p in polygons)
+
+
+def simplify_additional(additional, options):
+    """Simplify the polygons of a parsed additional file.
+
+    Returns the simplified additional and stats, which map 'polygons', 'vertices' and 'bytes' (of
+    the polygons' JSON) to [before, after].
+    """
+    polygons = force_list((additional or {}).get('poly'))
+    simplified = [p for p in (simplify_polygon(p, options) for p in polygons) if p is not None]
+    if additional is not None:
+        additional = {k: v for k, v in additional.items() if k != 'poly'}
+        if simplified:
+            additional['poly'] = simplified
+    stats = {
+        'polygons': [len(polygons), len(simplified)],
+        'vertices': [count_vertices(polygons), count_vertices(simplified)],
+        'bytes': [len(json.dumps(polygons)), len(json.dumps(simplified))],
+    }
+    return additional, stats
+
+
+def format_stats(stats):
+    parts = []
+    for name in ('polygons', 'vertices', 'bytes'):
+        before, after = stats[name]
+        change = ' (%+.0f%%)' % (100 * (after - before) / before) if before else ''
+        parts.append('%s: %d -> %d%s' % (name, before, after, change))
+    return ', '.join(parts)
+
+
+parser = argparse.ArgumentParser(
+    description='Simplify the polygons of scenarios, caching the result for the server.')
+parser.add_argument(
+    'paths', nargs='+', metavar='PATH',
+    help='Scenario directories, or their .sumocfg files.')
+parser.add_argument(
+    '--simplify', dest='simplify', default=DEFAULT_SIMPLIFY,
+    help='Simplification options as tolerance_m:min_area_m2:decimals. Use the same ones as the ' +
+         'server\'s --simplify-polygons. The default is %(default)s.')
+parser.add_argument(
+    '--cache-dir', dest='cache_dir', default=DEFAULT_CACHE_DIR,
+    help='Directory in which to cache the simplified polygons. The default is %(default)s.')
+
+
+def config_files(path):
+    """The .sumocfg files of a scenario directory, or the path itself if it's a file."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.sumocfg')) +
+                      glob.glob(os.path.join(path, '*.sumo.cfg')))
+    return [path]
+
+
+def main(args):
+    # scenario imports this module to simplify its polygons.
+    from .scenario import Scenario
+
+    try:
+        options = parse_simplify_options(args.simplify)
+    except ValueError as e:
+        parser.error(str(e))
+    cache = ParsedFileCache(args.cache_dir)
+    failures = 0
+    for path in args.paths:
+        configs = config_files(path)
+        if not configs:
+            failures += 1
+            print('%s: no .sumocfg files' % path)
+        for config_file in configs:
+            try:
+                scenario = Scenario.from_config_json({
+                    'name': os.path.basename(config_file),
+                    'config_file': os.path.abspath(config_file),
+                }, cache, options)
+                stats = scenario.polygon_stats
+            except Exception as e:
+                failures += 1
+                print('%s failed: %s' % (config_file, e))
+                continue
+            print('%s: %s' % (config_file, format_stats(stats) if stats else 'no polygons'))
+    return failures
+
+
+def run():
+    args = parser.parse_args()
+    if main(args):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
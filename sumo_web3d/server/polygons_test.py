@@ -0,0 +1,84 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import shutil
+import tempfile
+
+from nose.tools import eq_
+import numpy as np
+
+from .cache import ParsedFileCache
+from .polygons import (parse_simplify_options, polygon_area, simplify_additional, simplify_line,
+                       SimplifyOptions)
+from .scenario_test import person_number_scenario
+
+OPTIONS = SimplifyOptions(tolerance_m=0.5, min_area_m2=10, decimals=1)
+
+
+def test_parse_simplify_options():
+    eq_(SimplifyOptions(0.3, 5, 1), parse_simplify_options('0.3:5:1'))
+    for spec in ('0.3:5', '-1:5:1', '0.3:5:x'):
+        try:
+            parse_simplify_options(spec)
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected %s to be invalid' % spec
+
+
+def test_simplify_line():
+    # The bump of 0.1 in the middle of a straight line is dropped, the corner is kept.
+    line = [[0, 0], [5, 0.1], [10, 0], [10, 10]]
+    eq_([[0, 0], [10, 0], [10, 10]], simplify_line(line, 0.5).tolist())
+    eq_(line, simplify_line(line, 0.05).tolist())
+
+    # Closed rings stay closed.
+    ring = [[0, 0], [5, 0.1], [10, 0], [10, 10], [0, 10], [0, 0]]
+    eq_([[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]], simplify_line(ring, 0.5).tolist())
+    eq_(99.5, polygon_area(np.array(ring[:-1])))
+
+
+def test_simplify_additional():
+    additional = {
+        'busStop': [{'id': 'stop'}],
+        'poly': [
+            {'id': 'big', 'type': 'building', 'fill': '1',
+             'shape': '0.00,0.00 5.04,0.10 10.00,0.00 10.00,10.00 0.00,10.00 0.00,0.00',
+             'param': {'key': 'building:levels', 'value': '3'}},
+            {'id': 'shed', 'type': 'building', 'fill': '1', 'shape': '0,0 3,0 3,3 0,3 0,0'},
+            # Unfilled polygons are outlines, so they're kept however small they are.
+            {'id': 'fence', 'type': 'barrier', 'fill': '0', 'shape': '0,0 1.23,0 1.26,0'},
+        ],
+    }
+    simplified, stats = simplify_additional(additional, OPTIONS)
+    eq_({'busStop': [{'id': 'stop'}], 'poly': [
+        {'id': 'big', 'type': 'building', 'fill': '1',
+         'shape': '0.0,0.0 10.0,0.0 10.0,10.0 0.0,10.0 0.0,0.0',
+         'param': {'key': 'building:levels', 'value': '3'}},
+        {'id': 'fence', 'type': 'barrier', 'fill': '0', 'shape': '0.0,0.0 1.3,0.0'},
+    ]}, simplified)
+    eq_([3, 2], stats['polygons'])
+    eq_([14, 7], stats['vertices'])
+    assert stats['bytes'][1] < stats['bytes'][0]
+
+    # The input isn't changed, and files without polygons are left as they are.
+    eq_(3, len(additional['poly']))
+    simplified, stats = simplify_additional({'busStop': []}, OPTIONS)
+    eq_({'busStop': []}, simplified)
+    eq_([0, 0], stats['polygons'])
+
+
+def test_scenario_simplified_polygons():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        scenario = person_number_scenario(ParsedFileCache(cache_dir), OPTIONS)
+        eq_([0, 0], scenario.polygon_stats['polygons'])
+        eq_(['busStop0', 'busStop1'], [s['id'] for s in scenario.additional['busStop']])
+        eq_(None, person_number_scenario().polygon_stats)
+
+        cache = ParsedFileCache(cache_dir)
+        scenario = person_number_scenario(cache, OPTIONS)
+        eq_(['busStop0', 'busStop1'], [s['id'] for s in scenario.additional['busStop']])
+        # The simplified polygons are cached, so the additional files aren't parsed again.
+        eq_(False, hasattr(scenario, '_lazy_raw_additional'))
+        eq_((1, 0), (cache.hits, cache.misses))
+    finally:
+        shutil.rmtree(cache_dir)
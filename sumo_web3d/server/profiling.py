@@ -0,0 +1,134 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Profiling the next N steps of a running session, without restarting the server.
+
+A step's work happens on two threads: TraCI calls on the session's SimulationWorker, and
+diffing, broadcasting and encoding on the event loop. Both profilers cover both threads, from
+the frame after they start until N frames have been sent.
+
+- CProfile uses cProfile, which is deterministic but slows everything down. Its result is a
+  pstats file, for `python -m pstats` or snakeviz. Only one session can be profiled this way at
+  a time.
+- SamplingProfile samples each thread's stack from a thread of its own, which costs little. Its
+  result is in the collapsed-stack format of flamegraph.pl and speedscope: a line per distinct
+  stack, with frames separated by semicolons, and the number of samples in which it was seen.
+
+Nothing is profiled or sampled unless a profile is running.
+"""
+import cProfile
+from collections import Counter
+import marshal
+import os
+import pstats
+import sys
+import threading
+
+DEFAULT_SAMPLE_INTERVAL_SECS = 0.005
+
+THREAD_NAMES = ['event-loop', 'simulation']
+
+# Before Python 3.12, a cProfile.Profile only sees the thread which enabled it. From 3.12 it's
+# built on sys.monitoring, which covers every thread, and only one can be enabled at a time.
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+
+class ProfilingError(Exception):
+    """Raised when a session can't be profiled, e.g. because it isn't running."""
+
+
+class CProfile(object):
+    """Profiles both threads with cProfile: with a Profile each if they're per-thread, else one."""
+
+    extension = 'pstats'
+    content_type = 'application/octet-stream'
+
+    # The CProfile which is running, if any. Sessions share the event loop's thread, and a second
+    # Profile enabled on it would take over from the first (or raise ValueError, from 3.12).
+    active = None
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.loop_profile = cProfile.Profile()
+        self.worker_profile = cProfile.Profile() if PER_THREAD_PROFILES else None
+
+    async def start(self, worker):
+        if CProfile.active:
+            raise ProfilingError('Another session is being profiled; try format=collapsed')
+        CProfile.active = self
+        try:
+            if self.worker_profile:
+                # The worker has a single thread, so this enables profiling for whatever it runs
+                # next.
+                await worker.run(self.worker_profile.enable)
+            self.loop_profile.enable()
+        except ValueError:
+            # Another profiling tool, e.g. a debugger, is using sys.monitoring.
+            await self.stop(worker)
+            raise ProfilingError('Another profiler is running; try format=collapsed')
+
+    async def stop(self, worker):
+        self.loop_profile.disable()
+        if self.worker_profile:
+            await worker.run(self.worker_profile.disable)
+        if CProfile.active is self:
+            CProfile.active = None
+
+    def result(self):
+        stats = pstats.Stats(self.loop_profile)
+        if self.worker_profile:
+            stats.add(self.worker_profile)
+        # This is what Stats.dump_stats writes to a file.
+        return marshal.dumps(stats.stats)
+
+
+def collapse_stack(thread_name, frame):
+    """A stack as thread;outermost;...;innermost, one function (file:line) per frame."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (
+            code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names))
+
+
+class SamplingProfile(object):
+    """Samples the stacks of the event loop's and the worker's threads every interval_secs."""
+
+    extension = 'collapsed.txt'
+    content_type = 'text/plain; charset=utf-8'
+
+    def __init__(self, steps, interval_secs=DEFAULT_SAMPLE_INTERVAL_SECS):
+        self.steps = steps
+        self.interval_secs = interval_secs
+        self.counts = Counter()  # collapsed stack -> samples
+        self.stopped = threading.Event()
+        self.thread = None
+
+    async def start(self, worker):
+        thread_ids = [threading.get_ident(), await worker.run(threading.get_ident)]
+        self.thread = threading.Thread(
+            target=self.sample, args=(dict(zip(thread_ids, THREAD_NAMES)),), daemon=True)
+        self.thread.start()
+
+    def sample(self, thread_names):
+        while not self.stopped.wait(self.interval_secs):
+            frames = sys._current_frames()
+            for thread_id, name in thread_names.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.counts[collapse_stack(name, frame)] += 1
+
+    async def stop(self, worker):
+        self.stopped.set()
+        self.thread.join()
+
+    def result(self):
+        return ''.join('%s %d\n' % (stack, count)
+                       for stack, count in sorted(self.counts.items())).encode('utf8')
+
+
+PROFILERS = {
+    'pstats': CProfile,
+    'collapsed': SamplingProfile,
+}
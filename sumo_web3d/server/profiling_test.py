@@ -0,0 +1,148 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import asyncio
+import marshal
+import sys
+
+from nose.tools import eq_
+
+from .fake_websocket import FakeWebSocket, run
+from .profiling import collapse_stack, CProfile, ProfilingError, SamplingProfile
+from .session_test import close_all, make_manager, START
+from .simulation import SimulationWorker
+
+
+def test_collapse_stack():
+    def inner():
+        return collapse_stack('main', sys._getframe())
+    stack = inner().split(';')
+    eq_('main', stack[0])
+    assert stack[-2].startswith('test_collapse_stack (profiling_test.py:'), stack
+    assert stack[-1].startswith('inner (profiling_test.py:'), stack
+
+
+def profile(profile):
+    async def go():
+        manager = make_manager()
+        session = manager.get('a')
+        try:
+            await session.profile_steps(profile)
+        except ProfilingError as e:
+            error = e
+        ws = FakeWebSocket()
+        session.subscribe(ws)
+        await manager.handle_message(session, ws, START)
+        result = await session.profile_steps(profile)
+        session.unsubscribe(ws)
+        await close_all(manager)
+        return error, result
+
+    return run(go)
+
+
+def test_cprofile():
+    error, result = profile(CProfile(5))
+    assert isinstance(error, ProfilingError)
+    functions = {name for _, _, name in marshal.loads(result)}
+    # It covers both the worker's thread and the event loop's.
+    assert 'step' in functions
+    assert 'broadcast' in functions
+
+
+def test_sampling_profile():
+    error, result = profile(SamplingProfile(100, interval_secs=0.001))
+    assert isinstance(error, ProfilingError)
+    lines = result.decode('utf8').splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert stack.split(';')[0] in ('event-loop', 'simulation'), stack
+        assert int(count) > 0
+
+
+def test_profile_ends_with_session():
+    async def go():
+        manager = make_manager()
+        session = manager.get('a')
+        await manager.handle_message(session, FakeWebSocket(), START)
+        result = asyncio.ensure_future(session.profile_steps(CProfile(1000000)))
+        await asyncio.sleep(0.05)
+        await manager.handle_message(session, FakeWebSocket(), {
+            'type': 'action', 'action': 'cancel'})
+        await close_all(manager)
+        return await result
+
+    # The profile ends, with what it has, if the simulation stops first.
+    functions = {name for _, _, name in marshal.loads(run(go))}
+    assert 'step' in functions
+
+
+def test_profile_ends_when_paused():
+    async def go():
+        manager = make_manager()
+        session = manager.get('a')
+        ws = FakeWebSocket()
+        await manager.handle_message(session, ws, START)
+        result = asyncio.ensure_future(session.profile_steps(CProfile(1000000)))
+        await asyncio.sleep(0.05)
+        await manager.handle_message(session, ws, {'type': 'action', 'action': 'pause'})
+        result = await asyncio.wait_for(result, 1)
+        # A paused session sends no frames, so it can't be profiled.
+        try:
+            await asyncio.wait_for(session.profile_steps(CProfile(1)), 1)
+        except ProfilingError as e:
+            error = e
+        await close_all(manager)
+        return result, error
+
+    result, error = run(go)
+    assert 'step' in {name for _, _, name in marshal.loads(result)}
+    assert isinstance(error, ProfilingError)
+
+
+class ActiveProfile(object):
+    """Stands in for a cProfile.Profile when another profiler is already running (Python 3.12+)."""
+
+    def enable(self):
+        raise ValueError('Another profiling tool is already active')
+
+    def disable(self):
+        pass
+
+
+def test_cprofile_conflict():
+    async def go():
+        manager = make_manager()
+        session = manager.get('a')
+        await manager.handle_message(session, FakeWebSocket(), START)
+        profile = CProfile(1)
+        profile.loop_profile = ActiveProfile()
+        try:
+            await session.profile_steps(profile)
+        except ProfilingError as e:
+            error = e
+        # The session can still be profiled once the other profiler is done.
+        result = await session.profile_steps(CProfile(1))
+        await close_all(manager)
+        return error, result
+
+    error, result = run(go)
+    assert isinstance(error, ProfilingError)
+    assert marshal.loads(result)
+
+
+def test_one_cprofile_at_a_time():
+    async def go():
+        worker = SimulationWorker(None)
+        first, second = CProfile(1), CProfile(1)
+        await first.start(worker)
+        try:
+            await second.start(worker)
+        except ProfilingError as e:
+            error = e
+        await first.stop(worker)
+        # Once the first is done, another can start.
+        await second.start(worker)
+        await second.stop(worker)
+        return error
+
+    assert isinstance(run(go), ProfilingError)
@@ -0,0 +1,147 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Wire formats for simulation snapshots sent over the websocket.
+
+Clients pick a format with the websocket subprotocol. Clients which don't ask for one get JSON.
+
+The binary format stores the numeric vehicle fields as columns, little-endian:
+
+    uint32      length L of the JSON header (padded with spaces to a multiple of 4)
+    L bytes     JSON header: the snapshot, with vehicles replaced by
+                {ids, numCreations, extra, removals}
+    float32[n]  x, y, z          (one column each; n = len(ids))
+    int16[n]    speed, angle
+    uint16[n]   signals
+    uint8[n]    mask of which numeric fields are present in each row
+
+Rows [0, numCreations) are creations, the rest are updates. Fields which aren't numeric (e.g. type
+and vClass) are in extra, keyed by vehicle ID or handle (see handles.py). See
+frontend/src/protocol.ts for the decoder.
+"""
+from array import array
+import json
+import struct
+import sys
+
+JSON_SUBPROTOCOL = 'sumo-web3d-json'
+BINARY_SUBPROTOCOL = 'sumo-web3d-binary'
+# In order of preference.
+SUBPROTOCOLS = [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]
+
+# (field, array typecode), in the order the columns appear.
+NUMERIC_FIELDS = [
+    ('x', 'f'),
+    ('y', 'f'),
+    ('z', 'f'),
+    ('speed', 'h'),
+    ('angle', 'h'),
+    ('signals', 'H'),
+]
+NUMERIC_FIELD_NAMES = set(f for f, _ in NUMERIC_FIELDS)
+
+# Integer columns are clamped to the range of their type.
+INTEGER_RANGES = {
+    'h': (-2 ** 15, 2 ** 15 - 1),
+    'H': (0, 2 ** 16 - 1),
+}
+
+# Number of bits set in each possible row mask.
+POPCOUNT = [bin(m).count('1') for m in range(2 ** len(NUMERIC_FIELDS))]
+
+
+def to_little_endian(column):
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def encode_json(snapshot):
+    return json.dumps(snapshot)
+
+
+def encode_binary(snapshot):
+    vehicles = snapshot['vehicles']
+    rows = list(vehicles['creations'].items()) + list(vehicles['updates'].items())
+    ids = [veh_id for veh_id, _ in rows]
+    values = [fields for _, fields in rows]
+
+    # This is done column-by-column since list comprehensions are much faster than nested loops.
+    columns = []
+    mask = [0] * len(rows)
+    for i, (field, typecode) in enumerate(NUMERIC_FIELDS):
+        column = [fields.get(field) for fields in values]
+        bit = 1 << i
+        mask = [m if v is None else m | bit for m, v in zip(mask, column)]
+        if typecode in INTEGER_RANGES:
+            low, high = INTEGER_RANGES[typecode]
+            column = [0 if v is None else min(max(int(v), low), high) for v in column]
+        else:
+            column = [0 if v is None else v for v in column]
+        columns.append(array(typecode, column))
+
+    # Rows with more fields than numeric ones have extra fields to send in the header.
+    extra = {}
+    for veh_id, fields, row_mask in zip(ids, values, mask):
+        if len(fields) > POPCOUNT[row_mask]:
+            # JSON object keys are strings, even if veh_id is an integer handle.
+            extra[str(veh_id)] = {k: v for k, v in fields.items() if k not in NUMERIC_FIELD_NAMES}
+
+    header = dict(snapshot)
+    header['vehicles'] = {
+        'ids': ids,
+        'numCreations': len(vehicles['creations']),
+        'extra': extra,
+        'removals': vehicles['removals'],
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-len(header_bytes) % 4)
+
+    parts = [struct.pack('<I', len(header_bytes)), header_bytes]
+    parts.extend(to_little_endian(column).tobytes() for column in columns)
+    parts.append(bytes(mask))
+    return b''.join(parts)
+
+
+def decode_binary(data):
+    """Inverse of encode_binary. Float fields come back with float32 precision."""
+    (header_length,) = struct.unpack_from('<I', data)
+    offset = 4 + header_length
+    header = json.loads(data[4:offset].decode('utf-8'))
+    vehicles = header['vehicles']
+    ids = vehicles['ids']
+    n = len(ids)
+
+    columns = []
+    for _, typecode in NUMERIC_FIELDS:
+        column = array(typecode)
+        size = column.itemsize * n
+        column.frombytes(data[offset:offset + size])
+        columns.append(to_little_endian(column))
+        offset += size
+    mask = array('B', data[offset:offset + n])
+
+    creations = {}
+    updates = {}
+    for row, veh_id in enumerate(ids):
+        fields = {}
+        for i, (field, _) in enumerate(NUMERIC_FIELDS):
+            if mask[row] & (1 << i):
+                fields[field] = columns[i][row]
+        fields.update(vehicles['extra'].get(str(veh_id), {}))
+        if row < vehicles['numCreations']:
+            creations[veh_id] = fields
+        else:
+            updates[veh_id] = fields
+
+    header['vehicles'] = {
+        'creations': creations,
+        'updates': updates,
+        'removals': vehicles['removals'],
+    }
+    return header
+
+
+def encode_snapshot(snapshot, subprotocol):
+    """Encode a snapshot for a websocket with the given (possibly None) subprotocol."""
+    if subprotocol == BINARY_SUBPROTOCOL:
+        return encode_binary(snapshot)
+    return encode_json(snapshot)
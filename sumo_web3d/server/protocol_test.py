@@ -0,0 +1,73 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import json
+
+from nose.tools import eq_
+
+from .handles import SnapshotInterner
+from .protocol import (
+    BINARY_SUBPROTOCOL,
+    decode_binary,
+    encode_binary,
+    encode_snapshot,
+    JSON_SUBPROTOCOL,
+)
+
+
+def make_snapshot():
+    return {
+        'type': 'snapshot',
+        'time': 1000,
+        'vehicles': {
+            'creations': {
+                'veh0': {
+                    'x': 1.5, 'y': 2.25, 'z': 0.0, 'speed': 12, 'angle': 359, 'signals': 8,
+                    'type': 'passenger', 'length': 5.0, 'width': 1.8, 'vClass': 'passenger',
+                },
+                'ped0': {
+                    'x': 10.5, 'y': -3.75, 'z': 0, 'speed': 1, 'angle': 90,
+                    'type': 'DEFAULT_PEDTYPE', 'length': 0.215, 'width': 0.478,
+                    'person': None, 'vClass': 'pedestrian',
+                },
+            },
+            'updates': {
+                'veh1': {'x': 100.25},
+                'veh2': {'angle': -90, 'signals': 1},
+            },
+            'removals': ['veh3'],
+        },
+        'lights': {'creations': {}, 'updates': {'tl0': {'phase': 2}}, 'removals': []},
+        'vehicle_counts': {'passenger': 3, 'pedestrian': 1},
+        'simulate_secs': 0.01,
+        'snapshot_secs': 0.002,
+    }
+
+
+def test_binary_roundtrip():
+    snapshot = make_snapshot()
+    data = encode_binary(snapshot)
+    # Float columns must be 4-byte aligned for Float32Array views.
+    eq_(0, (4 + int.from_bytes(data[:4], 'little')) % 4)
+    # All the test values are exactly representable as float32.
+    eq_(snapshot, decode_binary(data))
+
+
+def test_integer_clamping():
+    snapshot = make_snapshot()
+    snapshot['vehicles']['updates'] = {'veh1': {'speed': -1073741824, 'signals': -1}}
+    eq_({'veh1': {'speed': -32768, 'signals': 0}},
+        decode_binary(encode_binary(snapshot))['vehicles']['updates'])
+
+
+def test_encode_snapshot():
+    snapshot = make_snapshot()
+    eq_(snapshot, json.loads(encode_snapshot(snapshot, None)))
+    eq_(snapshot, json.loads(encode_snapshot(snapshot, JSON_SUBPROTOCOL)))
+    eq_(bytes, type(encode_snapshot(snapshot, BINARY_SUBPROTOCOL)))
+
+
+def test_binary_roundtrip_with_handles():
+    snapshot = SnapshotInterner().intern(make_snapshot())
+    decoded = decode_binary(encode_binary(snapshot))
+    eq_(snapshot['vehicles'], decoded['vehicles'])
+    # Everything other than vehicles goes through JSON, which turns the handles into strings.
+    eq_({'0': {'id': 'tl0', 'phase': 2}}, decoded['lights']['creations'])
@@ -0,0 +1,250 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Recording snapshots to a file, and replaying them without SUMO.
+
+A recording is an append-only log. After a short magic string, it's a sequence of records, each
+a header (kind, simulation time in ms and payload length) followed by a zlib-compressed JSON
+payload. The first record describes the recording. After that:
+
+- KEYFRAME records hold the full state after a step: every vehicle and light, keyed by ID.
+- DELTA records hold the vehicle and light deltas of a step, as sent to viewers.
+
+There's a keyframe every keyframe_interval steps. Their times and offsets are also appended to a
+small index file alongside the log, so that seeking only has to read from the nearest keyframe
+before the target. If the index is missing (e.g. the recording was interrupted), replaying
+rebuilds it by reading the record headers.
+
+Replay has the same interface as Simulation, so the server can serve a recording through the
+usual snapshot pipeline. Each step returns the full state, which the server diffs as usual; this
+is what makes seeking simple.
+"""
+import bisect
+import json
+import struct
+import time
+import zlib
+
+MAGIC = b'SUMOWEB3D-RECORDING-1\n'
+RECORD_HEADER = struct.Struct('<BqI')  # kind, time in ms, payload length.
+
+INFO = 0
+KEYFRAME = 1
+DELTA = 2
+
+DEFAULT_KEYFRAME_INTERVAL = 100
+
+# Fields of snapshots which are recorded, besides the vehicles and lights.
+RECORDED_FIELDS = ['time', 'vehicle_counts']
+
+
+def index_path(path):
+    return path + '.index'
+
+
+def encode_payload(payload, level=6):
+    return zlib.compress(json.dumps(payload).encode('utf8'), level)
+
+
+def decode_payload(data):
+    return json.loads(zlib.decompress(data).decode('utf8'))
+
+
+def apply_delta(objects, delta):
+    """Apply a delta keyed by ID to a dict of objects, in place."""
+    for obj_id in delta['removals']:
+        objects.pop(obj_id, None)
+    for obj_id, fields in delta['creations'].items():
+        objects[obj_id] = dict(fields)
+    for obj_id, fields in delta['updates'].items():
+        if obj_id in objects:
+            objects[obj_id].update(fields)
+        else:
+            objects[obj_id] = dict(fields)
+
+
+class Recorder(object):
+    """Appends the snapshots of one run of a simulation to a recording."""
+
+    def __init__(self, path, scenario=None, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.steps = 0
+        self.log = open(path, 'wb')
+        self.log.write(MAGIC)
+        self.index = open(index_path(path), 'w')
+        self._write(INFO, 0, {'scenario': scenario, 'keyframe_interval': keyframe_interval})
+
+    def _write(self, kind, time_ms, payload):
+        data = encode_payload(payload)
+        self.log.write(RECORD_HEADER.pack(kind, time_ms, len(data)))
+        self.log.write(data)
+
+    def record(self, snapshot, full_state_fn):
+        """Append a snapshot keyed by ID.
+
+        full_state_fn returns (vehicles, lights) as of the snapshot. It's only called for
+        keyframes.
+        """
+        payload = {field: snapshot[field] for field in RECORDED_FIELDS}
+        if self.steps % self.keyframe_interval == 0:
+            payload['vehicles'], payload['lights'] = full_state_fn()
+            offset = self.log.tell()
+            self._write(KEYFRAME, snapshot['time'], payload)
+            # Only index keyframes which are safely on disk.
+            self.log.flush()
+            self.index.write('%d %d\n' % (snapshot['time'], offset))
+            self.index.flush()
+        else:
+            payload['vehicles'] = snapshot['vehicles']
+            payload['lights'] = snapshot['lights']
+            self._write(DELTA, snapshot['time'], payload)
+        self.steps += 1
+
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+
+def read_header(f):
+    """Read a record header, or return None at the end of the file (or a truncated record)."""
+    header = f.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    return RECORD_HEADER.unpack(header)
+
+
+def scan_keyframes(f, offset):
+    """Find the (time, offset) of each keyframe from offset on, and the time of the last record.
+
+    This only reads the records' headers.
+    """
+    size = f.seek(0, 2)
+    f.seek(offset)
+    keyframes = []
+    last_time_ms = None
+    while True:
+        header = read_header(f)
+        if header is None:
+            break
+        kind, time_ms, length = header
+        if offset + RECORD_HEADER.size + length > size:
+            break  # A record which was only partly written.
+        if kind == KEYFRAME:
+            keyframes.append((time_ms, offset))
+        if kind != INFO:
+            last_time_ms = time_ms
+        offset = f.seek(length, 1)
+    return keyframes, last_time_ms
+
+
+class Replay(object):
+    """Plays back a recording, with the interface of Simulation.
+
+    When the recording runs out, it starts again from the beginning.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a recording' % path)
+            kind, _, payload = self._read_record(f)
+            if kind != INFO:
+                raise ValueError('%s has no header record' % path)
+            self.info = payload
+            self.keyframes = self._read_index()
+            if self.keyframes:
+                # Only the records after the last keyframe need to be read for the end time.
+                _, self.end_ms = scan_keyframes(f, self.keyframes[-1][1])
+            else:
+                self.keyframes, self.end_ms = scan_keyframes(f, f.tell())
+        if not self.keyframes:
+            raise ValueError('%s has no keyframes' % path)
+        self.start_ms = self.keyframes[0][0]
+        self.scenario = self.info.get('scenario')
+        self.log = None
+        self.seeked = False
+
+    def _read_index(self):
+        try:
+            with open(index_path(self.path)) as f:
+                return [tuple(int(v) for v in line.split()) for line in f if line.strip()]
+        except IOError:
+            return []
+
+    @staticmethod
+    def _read_record(f):
+        """Read the next (kind, time, payload), or None at the end of the recording."""
+        header = read_header(f)
+        if header is None:
+            return None
+        kind, time_ms, length = header
+        data = f.read(length)
+        if len(data) < length:
+            return None
+        return kind, time_ms, decode_payload(data)
+
+    def start(self, args=None):
+        """Start from the beginning. args are ignored."""
+        self.log = open(self.path, 'rb')
+        self.seek(self.start_ms)
+
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
+
+    def _apply(self, kind, payload):
+        if kind == KEYFRAME:
+            self.vehicles = payload['vehicles']
+            self.lights = payload['lights']
+        else:
+            apply_delta(self.vehicles, payload['vehicles'])
+            apply_delta(self.lights, payload['lights'])
+        self.time_ms = payload['time']
+        self.vehicle_counts = payload['vehicle_counts']
+
+    def seek(self, time_ms):
+        """Move to the last step at or before time_ms, which the next step() will return."""
+        times = [t for t, _ in self.keyframes]
+        i = max(0, bisect.bisect_right(times, time_ms) - 1)
+        self.log.seek(self.keyframes[i][1])
+        kind, _, payload = self._read_record(self.log)
+        self._apply(kind, payload)
+        while True:
+            offset = self.log.tell()
+            record = self._read_record(self.log)
+            if record is None or record[1] > time_ms:
+                self.log.seek(offset)
+                break
+            self._apply(record[0], record[2])
+        self.seeked = True
+
+    def step(self):
+        start_secs = time.time()
+        if self.seeked:
+            self.seeked = False
+        else:
+            record = self._read_record(self.log)
+            if record is None:
+                self.seek(self.start_ms)
+                self.seeked = False
+            else:
+                self._apply(record[0], record[2])
+        end_read_secs = time.time()
+        return {
+            'time': self.time_ms,
+            # The next step may be read while the server diffs this one (see Session.run), and
+            # the server keeps the last lights to diff against, so neither may change under it.
+            'vehicles': {veh_id: dict(vehicle) for veh_id, vehicle in self.vehicles.items()},
+            'lights': {light_id: dict(light) for light_id, light in self.lights.items()},
+            'vehicle_counts': self.vehicle_counts,
+            'simulate_secs': end_read_secs - start_secs,
+            'read_secs': 0,
+        }
+
+    def get_route(self, obj_id, v_class):
+        """Routes aren't recorded."""
+        return None
+
+    def get_routes(self, objs):
+        return {}
@@ -0,0 +1,149 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_raises, eq_
+
+from .deltas import diff_dicts
+from .fake_traci import FakeTraci
+from .fake_websocket import run
+from .recording import index_path, Recorder, Replay
+from .simulation import Simulation, SimulationWorker
+from .vehicle_table import VehicleTable
+
+
+def record(path, num_steps, keyframe_interval):
+    """Record a fake simulation, and return the states which were recorded, keyed by time."""
+    simulation = Simulation(FakeTraci(num_vehicles=20, num_persons=5, num_lights=3,
+                                      trip_steps=10))
+    simulation.start(['sumo'])
+    table = VehicleTable()
+    lights = {}
+    recorder = Recorder(path, 'fake', keyframe_interval)
+    states = {}
+    for _ in range(num_steps):
+        step = simulation.step()
+        snapshot = {
+            'time': step['time'],
+            'vehicles': table.update(step['vehicles']),
+            'lights': diff_dicts(lights, step['lights']),
+            'vehicle_counts': step['vehicle_counts'],
+        }
+        lights = step['lights']
+        recorder.record(snapshot, lambda: (table.to_dict(), lights))
+        states[step['time']] = (table.to_dict(), lights)
+    recorder.close()
+    return states
+
+
+def setup_recording():
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'recording')
+    return tmp_dir, path, record(path, 25, keyframe_interval=10)
+
+
+def check_step(replay, states, time_ms):
+    step = replay.step()
+    eq_(time_ms, step['time'])
+    vehicles, lights = states[time_ms]
+    eq_(vehicles, step['vehicles'])
+    eq_(lights, step['lights'])
+
+
+def test_replay():
+    tmp_dir, path, states = setup_recording()
+    try:
+        replay = Replay(path)
+        eq_('fake', replay.scenario)
+        eq_((1000, 25000), (replay.start_ms, replay.end_ms))
+        eq_([1000, 11000, 21000], [t for t, _ in replay.keyframes])
+        replay.start()
+        for time_ms in sorted(states):
+            check_step(replay, states, time_ms)
+        # Then it starts again.
+        check_step(replay, states, 1000)
+        replay.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_pipelined_replay():
+    tmp_dir, path, states = setup_recording()
+    try:
+        worker = SimulationWorker(Replay(path))
+
+        async def go():
+            await worker.start(None)
+            steps = []
+            next_step = worker.step()
+            for _ in range(len(states)):
+                step = await next_step
+                # Like Session.run, read the next step while this one is being used.
+                next_step = worker.step()
+                await next_step
+                steps.append((step['time'], step['vehicles'], step['lights']))
+            await worker.close()
+            return steps
+
+        steps = run(go)
+        worker.shutdown()
+        eq_(sorted(states), [time_ms for time_ms, _, _ in steps])
+        for time_ms, vehicles, lights in steps:
+            eq_(states[time_ms], (vehicles, lights))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_seek():
+    tmp_dir, path, states = setup_recording()
+    try:
+        replay = Replay(path)
+        replay.start()
+        for time_ms in [14000, 3000, 24000, 11000, 14500]:
+            replay.seek(time_ms)
+            check_step(replay, states, time_ms // 1000 * 1000)
+            check_step(replay, states, time_ms // 1000 * 1000 + 1000)
+        replay.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_missing_index():
+    tmp_dir, path, states = setup_recording()
+    try:
+        os.remove(index_path(path))
+        replay = Replay(path)
+        eq_([1000, 11000, 21000], [t for t, _ in replay.keyframes])
+        eq_(25000, replay.end_ms)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_interrupted_recording():
+    tmp_dir, path, states = setup_recording()
+    try:
+        os.remove(index_path(path))
+        with open(path, 'rb+') as f:
+            f.truncate(os.path.getsize(path) - 10)
+        replay = Replay(path)
+        eq_(24000, replay.end_ms)
+        replay.start()
+        replay.seek(23000)
+        check_step(replay, states, 23000)
+        check_step(replay, states, 24000)
+        check_step(replay, states, 1000)
+        replay.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_not_a_recording():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'net.xml')
+        with open(path, 'w') as f:
+            f.write('<net/>')
+        assert_raises(ValueError, Replay, path)
+    finally:
+        shutil.rmtree(tmp_dir)
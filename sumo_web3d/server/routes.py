@@ -0,0 +1,122 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Routes of vehicles and persons, and their geometry.
+
+Looking up a route is a TraCI round trip per vehicle, so a session keeps the routes it has looked
+up in a RouteCache. A route stays cached until its vehicle is removed, or is rerouted: SUMO gives
+a rerouted vehicle a new route ID, which the session learns with each step (see
+Simulation.step's 'route_ids'). A person's route is only that of their current stage (e.g. a walk
+or a ride), so it stays cached until the stage changes, which stands in for its route ID.
+Lookups of uncached routes are batched into one call to the simulation's worker, and concurrent
+requests for the same route share one lookup.
+
+edge_shapes indexes the shapes of a network's edges, so that a route's edges can be turned into
+a polyline without the client having to.
+"""
+import asyncio
+import functools
+
+# The most routes which can be requested at once.
+MAX_ROUTES_PER_REQUEST = 1000
+
+
+class RouteCache(object):
+    """Routes as lists of edge IDs, keyed by vehicle or person ID."""
+
+    def __init__(self):
+        self.routes = {}  # ID -> (route ID, edge IDs)
+        self.pending = {}  # ID -> future of {ID: edge IDs}, for lookups in progress.
+        self.route_ids = {}  # ID -> route ID, as of the last step.
+
+    def __len__(self):
+        return len(self.routes)
+
+    def clear(self):
+        self.routes = {}
+        self.pending = {}
+        self.route_ids = {}
+
+    def update(self, removed_ids, route_ids):
+        """Forget the routes of removed vehicles, and of vehicles whose route ID has changed.
+
+        route_ids maps vehicles' IDs to their route IDs as of the latest step, and persons' IDs to
+        something which changes with their stage. Routes of IDs which aren't in it last until
+        they're removed.
+        """
+        for obj_id in removed_ids:
+            self.routes.pop(obj_id, None)
+            self.pending.pop(obj_id, None)
+        self.route_ids = route_ids
+        for obj_id, (route_id, _) in list(self.routes.items()):
+            if route_ids.get(obj_id) != route_id:
+                del self.routes[obj_id]
+
+    async def get_many(self, ids, fetch_fn):
+        """The routes of ids, as {ID: edge IDs}, leaving out those which don't exist.
+
+        fetch_fn(ids) returns an awaitable of {ID: edge IDs} for the routes which aren't cached.
+        """
+        missing = [obj_id for obj_id in ids
+                   if obj_id not in self.routes and obj_id not in self.pending]
+        if missing:
+            # A route is at least as new as the route ID before it was looked up.
+            route_ids = {obj_id: self.route_ids.get(obj_id) for obj_id in missing}
+            future = asyncio.ensure_future(fetch_fn(missing))
+            for obj_id in missing:
+                self.pending[obj_id] = future
+            future.add_done_callback(functools.partial(self._fetched, route_ids))
+        fetched = {}
+        for future in {self.pending[obj_id] for obj_id in ids if obj_id in self.pending}:
+            # Other requests may be waiting for the same lookup, so it outlives this one.
+            fetched.update(await asyncio.shield(future))
+        routes = {}
+        for obj_id in ids:
+            edges = self.routes[obj_id][1] if obj_id in self.routes else fetched.get(obj_id)
+            if edges:
+                routes[obj_id] = edges
+        return routes
+
+    def _fetched(self, route_ids, future):
+        # Vehicles which were removed during the lookup aren't cached.
+        valid = [obj_id for obj_id in route_ids if self.pending.get(obj_id) is future]
+        for obj_id in valid:
+            del self.pending[obj_id]
+        if future.cancelled() or future.exception():
+            return
+        fetched = future.result()
+        for obj_id in valid:
+            if fetched.get(obj_id):
+                # If it was rerouted during the lookup, the next update() drops this.
+                self.routes[obj_id] = (route_ids[obj_id], fetched[obj_id])
+
+
+def parse_shape(shape):
+    """SUMO's "x,y x,y ..." (or x,y,z) as [[x, y], ...]."""
+    return [[float(v) for v in point.split(',')[:2]] for point in shape.split()]
+
+
+def edge_shapes(network):
+    """Map each edge's ID to the shape of its middle lane, from a parsed network."""
+    shapes = {}
+    edges = (network or {}).get('net', {}).get('edge', [])
+    for edge in edges if isinstance(edges, list) else [edges]:
+        if edge.get('function') == 'internal':
+            continue  # Routes only consist of normal edges.
+        lanes = edge.get('lane')
+        if not lanes:
+            continue
+        if not isinstance(lanes, list):
+            lanes = [lanes]
+        lane = sorted(lanes, key=lambda lane: int(lane.get('index', 0)))[len(lanes) // 2]
+        if lane.get('shape'):
+            shapes[edge['id']] = parse_shape(lane['shape'])
+    return shapes
+
+
+def route_shape(shapes, edge_ids):
+    """A polyline along a route's edges, skipping any whose shape is unknown."""
+    polyline = []
+    for edge_id in edge_ids:
+        for point in shapes.get(edge_id, []):
+            if not polyline or polyline[-1] != point:
+                polyline.append(point)
+    return polyline
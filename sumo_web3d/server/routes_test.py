@@ -0,0 +1,132 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import asyncio
+import functools
+
+from nose.tools import eq_
+
+from .fake_traci import FakeTraci
+from .fake_websocket import run
+from .routes import edge_shapes, RouteCache, route_shape
+from .session import Session
+from .simulation import Simulation, SimulationWorker
+
+EDGES = {'veh0': ['a', 'b'], 'veh1': ['c'], 'ped0': ['d']}
+
+
+class FakeFetcher(object):
+    def __init__(self):
+        self.requests = []
+        self.ready = asyncio.Event()
+        self.ready.set()
+
+    async def __call__(self, ids):
+        self.requests.append(sorted(ids))
+        await self.ready.wait()
+        return {obj_id: EDGES[obj_id] for obj_id in ids if obj_id in EDGES}
+
+
+def test_route_cache():
+    async def go():
+        cache = RouteCache()
+        fetch = FakeFetcher()
+        cache.update([], {'veh0': 'r0', 'veh1': 'r1'})
+        fetch.ready.clear()
+        # Concurrent requests share lookups, and unknown IDs are left out.
+        first = asyncio.ensure_future(cache.get_many(['veh0', 'nope'], fetch))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_many(['veh0', 'veh1', 'ped0'], fetch))
+        await asyncio.sleep(0)
+        fetch.ready.set()
+        eq_([{'veh0': ['a', 'b']}, EDGES], [await first, await second])
+        eq_([['nope', 'veh0'], ['ped0', 'veh1']], fetch.requests)
+        eq_(EDGES, await cache.get_many(list(EDGES), fetch))
+        eq_(2, len(fetch.requests))
+
+        # Rerouted or removed vehicles are looked up again, but persons stay cached.
+        cache.update(['veh1'], {'veh0': 'r0-rerouted'})
+        eq_(1, len(cache))
+        await cache.get_many(list(EDGES), fetch)
+        eq_(['veh0', 'veh1'], fetch.requests[-1])
+
+        # Nor are vehicles which are removed while they're looked up.
+        cache.clear()
+        fetch.ready.clear()
+        lookup = asyncio.ensure_future(cache.get_many(['veh0'], fetch))
+        await asyncio.sleep(0)
+        cache.update(['veh0'], {})
+        fetch.ready.set()
+        eq_({'veh0': ['a', 'b']}, await lookup)
+        eq_(0, len(cache))
+
+    run(go)
+
+
+def test_route_shape():
+    network = {'net': {'edge': [
+        {'id': ':internal', 'function': 'internal', 'lane': {'index': '0', 'shape': '0,0 1,1'}},
+        {'id': 'a', 'lane': {'index': '0', 'shape': '0,0 10,0'}},
+        {'id': 'b', 'lane': [
+            {'index': '0', 'shape': '10,-2 10,10'},
+            {'index': '1', 'shape': '10,0,0 10,10,0'},
+            {'index': '2', 'shape': '10,2 10,10'},
+        ]},
+    ]}}
+    shapes = edge_shapes(network)
+    eq_(['a', 'b'], sorted(shapes))
+    eq_([[0, 0], [10, 0], [10, 10]], route_shape(shapes, ['a', 'b', 'unknown']))
+
+
+def test_session_routes():
+    async def go():
+        traci = FakeTraci(num_vehicles=10, trip_steps=100000)
+        simulation = SimulationWorker(Simulation(traci))
+        session = Session('a', simulation, functools.partial(simulation.start, ['sumo']))
+        session.delay_length_ms = 1
+        fetches = []
+        get_routes = simulation.get_routes
+        simulation.get_routes = lambda objs: fetches.append(objs) or get_routes(objs)
+        await session.start()
+        await asyncio.sleep(0.05)
+        veh_id = next(iter(traci.vehicles))
+        route = await session.get_routes([veh_id, 'nope'])
+        cached = await session.get_routes([veh_id])
+        traci.vehicles[veh_id].reroute(['x', 'y'])
+        await asyncio.sleep(0.05)
+        rerouted = await session.get_routes([veh_id])
+        await session.cleanup()
+        simulation.shutdown()
+        return route, cached, rerouted, veh_id, fetches
+
+    route, cached, rerouted, veh_id, fetches = run(go)
+    eq_([veh_id], list(route))
+    eq_(route, cached)
+    eq_({veh_id: ['x', 'y']}, rerouted)
+    # Unknown IDs aren't looked up, and cached routes aren't looked up again until a reroute.
+    eq_([[(veh_id, 'passenger')]] * 2, fetches)
+
+
+def test_session_person_routes():
+    async def go():
+        traci = FakeTraci(num_vehicles=0, num_persons=5, trip_steps=100000)
+        simulation = SimulationWorker(Simulation(traci))
+        session = Session('a', simulation, functools.partial(simulation.start, ['sumo']))
+        session.delay_length_ms = 1
+        await session.start()
+        await asyncio.sleep(0.05)
+        ped_id = next(iter(traci.persons))
+        walk = await session.get_routes([ped_id])
+        # A person's route is that of their current stage, so it changes with the stage.
+        traci.persons[ped_id].next_stage(['ride'], vehicle='bus0')
+        await asyncio.sleep(0.05)
+        ride = await session.get_routes([ped_id])
+        traci.persons[ped_id].next_stage(['walk'])
+        await asyncio.sleep(0.05)
+        last_walk = await session.get_routes([ped_id])
+        await session.cleanup()
+        simulation.shutdown()
+        return ped_id, walk, ride, last_walk
+
+    ped_id, walk, ride, last_walk = run(go)
+    eq_([ped_id], list(walk))
+    eq_({ped_id: ['ride']}, ride)
+    eq_({ped_id: ['walk']}, last_walk)
@@ -0,0 +1,259 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Scenarios are SUMO configurations which the server can run and visualize.
+
+Only the (small) .sumocfg file is read when a scenario is loaded. The network, additional
+files, settings and water are parsed the first time they're requested, via a ParsedFileCache.
+Network and additional files are parsed with a streaming parser which only keeps what the
+frontend uses. With SimplifyOptions, the additional files' polygons are simplified (see polygons).
+The network's geometry and tiles are made from both, and cached in the same way.
+"""
+import functools
+import json
+import os
+import re
+
+import xmltodict
+
+from .cache import ParsedFileCache
+from .polygons import options_key, simplify_additional
+from .routes import edge_shapes
+from .tessellation import (encode_geometry, FORMAT_VERSION, tessellate_network,
+                           untessellated_network)
+from .tiles import ADDITIONAL_KINDS, TileIndex
+from .vtypes import vtype_definitions
+from .xml_utils import get_only_key, iterparse_xml_file, parse_xml_file, VTYPE_PROJECTIONS
+
+# Base directory for sumo_web3d
+DIR = os.path.join(os.path.dirname(__file__), '..')
+
+# Cache namespaces for the different ways we parse files.
+# Change SUMO_XML_NAMESPACE whenever the projections in xml_utils change.
+XML_NAMESPACE = 'xmltodict'
+SUMO_XML_NAMESPACE = 'sumo-projected-1'
+JSON_NAMESPACE = 'json'
+GEOMETRY_NAMESPACE = 'geometry-%d' % FORMAT_VERSION
+SLIM_NETWORK_NAMESPACE = 'slim-network-1:' + SUMO_XML_NAMESPACE
+# Simplification options are added to this, since each gives different output.
+SIMPLIFIED_NAMESPACE = 'simplified-1:' + SUMO_XML_NAMESPACE
+TILES_NAMESPACE = 'tiles-1'
+VTYPES_NAMESPACE = 'vtypes-1'
+
+
+def to_kebab_case(scenario_name):
+    return scenario_name.lower().replace(' ', '-').replace('_', '-')
+
+
+def parse_json_file(filepath):
+    with open(filepath, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def lazy_property(func):
+    """Like @property, but the value is only computed on first access."""
+    attr = '_lazy_' + func.__name__
+
+    def getter(self):
+        if not hasattr(self, attr):
+            setattr(self, attr, func(self))
+        return getattr(self, attr)
+
+    getter.__doc__ = func.__doc__
+    return property(getter)
+
+
+class Scenario(object):
+
+    @classmethod
+    def from_config_json(cls, scenarios_json, cache=None, simplify=None):
+        name = scenarios_json['name']
+        config_file = scenarios_json['config_file']
+        sumocfg_file = os.path.join(DIR, os.path.expanduser(os.path.expandvars(config_file)))
+        is_default = scenarios_json.get('is_default', False)
+        config_dir = os.path.dirname(sumocfg_file)
+        config = xmltodict.parse(open(sumocfg_file).read(), attr_prefix='')['configuration']
+        net_file, additional_files, settings_file = parse_config_file(config_dir, config)
+
+        return cls(
+            sumocfg_file,
+            name,
+            is_default,
+            net_file,
+            additional_files,
+            settings_file,
+            cache,
+            simplify
+        )
+
+    def __init__(self, config_file, name, is_default, net_file, additional_files, settings_file,
+                 cache=None, simplify=None):
+        self.config_file = config_file
+        self.config_dir = os.path.dirname(config_file)
+        self.display_name = name
+        self.name = to_kebab_case(name)
+        self.is_default = is_default
+        self.net_file = net_file
+        self.additional_files = additional_files
+        self.settings_file = settings_file
+        self.cache = cache or ParsedFileCache(None)
+        self.simplify = simplify
+
+    def parse_xml(self, path):
+        if not path:
+            return None
+        return self.cache.load(path, XML_NAMESPACE, parse_xml_file)
+
+    def parse_sumo_xml(self, path):
+        """Parse a network or additional file, keeping only what the frontend needs."""
+        if not path:
+            return None
+        return self.cache.load(path, SUMO_XML_NAMESPACE, iterparse_xml_file)
+
+    @lazy_property
+    def network(self):
+        return self.parse_sumo_xml(self.net_file)
+
+    @lazy_property
+    def edge_shapes(self):
+        """The shape of each edge in the network, for drawing routes."""
+        return edge_shapes(self.network)
+
+    @lazy_property
+    def geometry(self):
+        """The network's lanes, junctions and bus stops as binary vertex buffers."""
+        if not self.net_file:
+            return None
+        # On a cache hit, neither the network nor the additional files need to be parsed.
+        paths = (self.net_file,) + tuple(self.additional_files or [])
+        return self.cache.load(paths, GEOMETRY_NAMESPACE, lambda paths: encode_geometry(
+            tessellate_network(self.network, self.additional)))
+
+    @lazy_property
+    def slim_network(self):
+        """The parts of the network which clients that draw geometry still need."""
+        if not self.net_file:
+            return None
+        return self.cache.load(self.net_file, SLIM_NETWORK_NAMESPACE, lambda path: (
+            untessellated_network(self.network)))
+
+    @lazy_property
+    def tiles(self):
+        """The network's edges and junctions and the additional polygons, in a TileIndex."""
+        if not self.net_file:
+            return None
+        paths = (self.net_file,) + tuple(self.additional_files or [])
+        namespace = TILES_NAMESPACE
+        if self.simplify:
+            namespace += ':' + options_key(self.simplify)
+        return self.cache.load(paths, namespace, lambda paths: TileIndex(
+            self.network, self.additional))
+
+    @lazy_property
+    def additional(self):
+        if self.simplify and self.additional_files:
+            return self.simplified_additional[0]
+        return self.raw_additional
+
+    @lazy_property
+    def polygon_stats(self):
+        """How much simplifying the polygons shrank them, or None if they're not simplified."""
+        if not self.simplify or not self.additional_files:
+            return None
+        return self.simplified_additional[1]
+
+    @lazy_property
+    def simplified_additional(self):
+        """The additional files with their polygons simplified, and stats of the reductions."""
+        return self.cache.load(
+            tuple(self.additional_files), SIMPLIFIED_NAMESPACE + ':' + options_key(self.simplify),
+            lambda paths: simplify_additional(self.raw_additional, self.simplify))
+
+    @lazy_property
+    def raw_additional(self):
+        if not self.additional_files:
+            return None
+        additionals = {}
+        for xml in [self.parse_sumo_xml(f) for f in self.additional_files]:
+            # Files with other root tags, e.g. <routes> of vTypes, have nothing for the frontend.
+            additional = xml and (xml.get('additional') or xml.get('add'))
+            if additional:
+                additionals.update(additional)
+        return additionals
+
+    @lazy_property
+    def untiled_additional(self):
+        """additional without what's in tiles, for clients which load those from tiles."""
+        if not self.additional:
+            return None
+        return {k: v for k, v in self.additional.items() if k not in ADDITIONAL_KINDS}
+
+    @lazy_property
+    def vtypes(self):
+        """The fields of each vType defined in the additional files, by ID (see vtypes.py)."""
+        return vtype_definitions(
+            self.cache.load(f, VTYPES_NAMESPACE, functools.partial(
+                iterparse_xml_file, projections=VTYPE_PROJECTIONS))
+            for f in self.additional_files or [])
+
+    @lazy_property
+    def settings(self):
+        return self.parse_xml(self.settings_file)
+
+    @lazy_property
+    def water(self):
+        water = {'type': 'FeatureCollection', 'features': []}
+        if self.settings:
+            water_tag = get_only_key(self.settings).get('water-geojson')
+            if water_tag:
+                water_file = os.path.join(self.config_dir, water_tag['value'])
+                water = self.cache.load(water_file, JSON_NAMESPACE, parse_json_file)
+        return water
+
+
+def parse_config_file(config_dir, config):
+    input_config = config['input']
+    net_file = os.path.join(config_dir, input_config['net-file']['value'])
+
+    additionals = input_config.get('additional-files', [])
+    if additionals:
+        # With a single additional file, additionals is an OrderedDict.
+        # With multiple additional files, it's a list of OrderedDicts.
+        # This logic normalizes it to always be the latter.
+        # Additionally, files may be specified either via multiple tags or via
+        # space-separated or comma-separated file names in the value attribute.
+        if not isinstance(additionals, list):
+            additionals = [additionals]
+        additional_files = []
+        for additional in additionals:
+            values = re.split(r'[ ,]+', additional['value'])
+            for value in values:
+                additional_files.append(os.path.join(config_dir, value))
+    else:
+        additional_files = None
+
+    settings_file = None
+    if 'gui_only' in config and 'gui-settings-file' in config['gui_only']:
+        settings_file = os.path.join(config_dir, config['gui_only']['gui-settings-file']['value'])
+    return (net_file, additional_files, settings_file)
+
+
+def load_scenarios_file(prev_scenarios, scenarios_file, cache=None, simplify=None):
+    next_scenarios = prev_scenarios
+    if not scenarios_file:
+        return next_scenarios
+
+    with open(scenarios_file) as f:
+        new_scenarios = json.loads(f.read())
+        new_scenarios_names = [to_kebab_case(x['name']) for x in new_scenarios]
+        # throw error if there are duplicate name fields
+        duplicates = len(new_scenarios_names) == len(set(new_scenarios_names))
+        if not duplicates:
+            raise Exception(
+                'Invalid scenarios.json, cannot have two scenarios with the'
+                'same kebab case name'
+            )
+        prev_scenario_names = set([s.name for s in prev_scenarios.values()])
+        updates = [s for s in new_scenarios if to_kebab_case(s['name']) not in prev_scenario_names]
+        for new_scenario in updates:
+            scenario = Scenario.from_config_json(new_scenario, cache, simplify)
+            next_scenarios.update({scenario.name: scenario})
+        return next_scenarios
@@ -0,0 +1,80 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from nose.tools import eq_
+
+from .cache import ParsedFileCache
+from . import scenario as scenario_module
+from .polygons import SimplifyOptions
+from .scenario import DIR, load_scenarios_file, Scenario
+
+
+def person_number_scenario(cache=None, simplify=None):
+    return Scenario.from_config_json({
+        'name': 'person_number',
+        'config_file': 'scenarios/person_number/person_number.sumocfg',
+    }, cache, simplify)
+
+
+def test_scenario_is_lazy():
+    scenario = person_number_scenario()
+    eq_('person-number', scenario.name)
+    eq_('net.net.xml', os.path.basename(scenario.net_file))
+    eq_(False, hasattr(scenario, '_lazy_network'))
+
+    eq_(['busStop0', 'busStop1'], [s['id'] for s in scenario.additional['busStop']])
+    eq_(None, scenario.settings)
+    eq_([], scenario.water['features'])
+    eq_(False, hasattr(scenario, '_lazy_network'))
+    eq_({'net'}, set(scenario.network.keys()))
+
+
+def test_scenario_cache():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        network = person_number_scenario(ParsedFileCache(cache_dir)).network
+        cache = ParsedFileCache(cache_dir)
+        eq_(network, person_number_scenario(cache).network)
+        eq_((1, 0), (cache.hits, cache.misses))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_load_scenarios_file():
+    scenarios = load_scenarios_file({}, os.path.join(DIR, 'scenarios.json'))
+    eq_(True, scenarios['bologna-acosta'].is_default)
+    # Scenarios are loaded without parsing their (possibly missing) networks.
+    eq_('toronto.net.xml', os.path.basename(scenarios['downtown-toronto'].net_file))
+
+
+def test_scenario_geometry_cache():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        geometry = person_number_scenario(ParsedFileCache(cache_dir)).geometry
+        scenario = person_number_scenario(ParsedFileCache(cache_dir))
+        eq_(geometry, scenario.geometry)
+        # Cached geometry doesn't need the network to be parsed.
+        eq_(False, hasattr(scenario, '_lazy_network'))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_simplified_additional_cache():
+    cache_dir = tempfile.mkdtemp()
+    simplify = SimplifyOptions(0.5, 0, 1)
+    try:
+        additional = person_number_scenario(ParsedFileCache(cache_dir), simplify).additional
+        cache = ParsedFileCache(cache_dir)
+        eq_(additional, person_number_scenario(cache, simplify).additional)
+        eq_((1, 0), (cache.hits, cache.misses))
+        # A change to how the files are parsed invalidates what was simplified from them.
+        with mock.patch.object(
+                scenario_module, 'SIMPLIFIED_NAMESPACE', 'simplified-1:sumo-projected-0'):
+            cache = ParsedFileCache(cache_dir)
+            eq_(additional, person_number_scenario(cache, simplify).additional)
+        eq_(1, cache.misses)
+    finally:
+        shutil.rmtree(cache_dir)
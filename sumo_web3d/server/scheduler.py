@@ -0,0 +1,51 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Pacing of simulation frames."""
+import time
+
+
+class FrameScheduler(object):
+    """Releases frames at a fixed rate, without drift.
+
+    Each frame is due one period after the previous one was due, rather than one period after it
+    was sent, so the time spent stepping, diffing and encoding comes out of the period instead of
+    being added to it.
+
+    A frame which is ready after its slot is released at once. If it's less than a period late,
+    later frames make up the time; otherwise the schedule restarts from now rather than sending a
+    burst of frames, and the frame counts as missed. lag_secs is how late the last frame was.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.missed_frames = 0
+        self.reset()
+
+    def reset(self):
+        """Start a new schedule, e.g. after the simulation was paused."""
+        self.next_due = None
+        self.period_secs = 0.0
+        self.lag_secs = 0.0
+
+    @property
+    def behind(self):
+        """Whether the last frame missed its slot by a whole period or more."""
+        return self.lag_secs >= self.period_secs > 0
+
+    def wait_secs(self, period_secs):
+        """How long to wait before releasing the next frame, given the period between frames.
+
+        With a period of zero, frames are released as soon as they're ready.
+        """
+        now = self.clock()
+        self.period_secs = period_secs
+        if self.next_due is None or period_secs <= 0:
+            due = now
+        else:
+            due = self.next_due
+        self.lag_secs = max(0.0, now - due)
+        if self.behind:
+            # Don't try to make up whole frames.
+            self.missed_frames += 1
+            due = now
+        self.next_due = due + period_secs
+        return max(0.0, due - now)
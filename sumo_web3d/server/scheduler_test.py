@@ -0,0 +1,69 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+from nose.tools import eq_
+
+from .scheduler import FrameScheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_no_drift():
+    clock = FakeClock()
+    scheduler = FrameScheduler(clock)
+    eq_(0, scheduler.wait_secs(0.1))  # The first frame goes out immediately.
+    # Each frame takes 30ms to prepare, which comes out of the 100ms period.
+    for i in range(1, 5):
+        clock.now = 100.0 + (i - 1) * 0.1 + 0.03
+        eq_(70, round(scheduler.wait_secs(0.1) * 1000))
+        clock.now += 0.07
+    eq_(0, scheduler.missed_frames)
+
+
+def test_late_frames_catch_up():
+    clock = FakeClock()
+    scheduler = FrameScheduler(clock)
+    scheduler.wait_secs(0.1)
+    clock.now += 0.15  # 50ms late.
+    eq_(0, scheduler.wait_secs(0.1))
+    eq_(50, round(scheduler.lag_secs * 1000))
+    assert not scheduler.behind
+    # The next frame is still due on the original schedule.
+    eq_(50, round(scheduler.wait_secs(0.1) * 1000))
+
+
+def test_missed_frames_restart_schedule():
+    clock = FakeClock()
+    scheduler = FrameScheduler(clock)
+    scheduler.wait_secs(0.1)
+    clock.now += 0.5  # SUMO took 500ms, missing four slots.
+    eq_(0, scheduler.wait_secs(0.1))
+    assert scheduler.behind
+    eq_(1, scheduler.missed_frames)
+    # Rather than sending a burst of frames, wait a whole period for the next one.
+    eq_(100, round(scheduler.wait_secs(0.1) * 1000))
+    assert not scheduler.behind
+
+
+def test_zero_period():
+    clock = FakeClock()
+    scheduler = FrameScheduler(clock)
+    for _ in range(3):
+        eq_(0, scheduler.wait_secs(0))
+        clock.now += 0.5
+    eq_(0, scheduler.lag_secs)
+    eq_(0, scheduler.missed_frames)
+
+
+def test_reset():
+    clock = FakeClock()
+    scheduler = FrameScheduler(clock)
+    scheduler.wait_secs(0.1)
+    clock.now += 10  # e.g. paused
+    scheduler.reset()
+    eq_(0, scheduler.wait_secs(0.1))
+    eq_(0, scheduler.missed_frames)
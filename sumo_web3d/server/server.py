@@ -2,26 +2,30 @@
 # Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
 import argparse
 import asyncio
-from collections import Counter
 import functools
 import json
 import os
-import re
 import shlex
-import time
 
 from aiohttp import web
 import websockets
-import xmltodict
 
-from . import constants  # noqa
-from .deltas import round_vehicles, diff_dicts
-import sumolib
-import traci
+from .assets import AssetCache
+from .cache import DEFAULT_CACHE_DIR, ParsedFileCache
+from .history import DEFAULT_HISTORY_MB, DEFAULT_HISTORY_SECS, History
+from .interest import DEFAULT_LOD_TIERS, parse_lod_tiers
+from .metrics import CONTENT_TYPE, Exposition, Histogram, monitor_loop_lag
+from .polygons import DEFAULT_SIMPLIFY, format_stats, parse_simplify_options
+from .profiling import PROFILERS, ProfilingError
+from .protocol import SUBPROTOCOLS
+from .recording import DEFAULT_KEYFRAME_INTERVAL, Replay
+from .routes import MAX_ROUTES_PER_REQUEST, route_shape
+from .scenario import DIR, XML_NAMESPACE, load_scenarios_file, Scenario, to_kebab_case
+from .session import (DEFAULT_IDLE_SECS, DEFAULT_MAX_SESSIONS, Session, SessionLimitError,
+                      SessionManager)
+from .simulation import Simulation, SimulationWorker, TraciConnection
 from .xml_utils import get_only_key, parse_xml_file
 
-tc = traci.constants
-
 parser = argparse.ArgumentParser(description='Run the microsim python server.')
 parser.add_argument(
     '-c', '--configuration-file', dest='configuration_file', default='',
@@ -34,203 +38,106 @@ parser.add_argument(
 parser.add_argument(
     '--gui', action='store_true', default=False,
     help='Run sumo-gui rather than sumo. This is useful for debugging.')
-
-# Base directory for sumo_web3d
-DIR = os.path.join(os.path.dirname(__file__), '..')
+parser.add_argument(
+    '--realtime-factor', dest='realtime_factor', type=float, default=None,
+    help='Pace frames to run the simulation this many times faster than real time, e.g. 1 for ' +
+         'real time, rather than with a fixed delay between frames.')
+parser.add_argument(
+    '--lod-tiers', dest='lod_tiers', nargs='?', const=DEFAULT_LOD_TIERS, default=None,
+    help='Send updates of vehicles far from each viewer\'s camera less often and with coarser ' +
+         'positions. Tiers are max_distance:every_n_frames:decimal_places, e.g. the default of ' +
+         '%s.' % DEFAULT_LOD_TIERS)
+parser.add_argument(
+    '--record', dest='record', default=None, metavar='FILE',
+    help='Record each run of the simulation to FILE (and FILE.index), for --replay. Each run ' +
+         'replaces the last. With several scenarios, each is recorded to FILE with its name ' +
+         'added before the extension.')
+parser.add_argument(
+    '--keyframe-interval', dest='keyframe_interval', type=int, default=DEFAULT_KEYFRAME_INTERVAL,
+    help='Steps between the full-state keyframes of --record, which seeking starts from. The ' +
+         'default is %(default)s.')
+parser.add_argument(
+    '--replay', dest='replay', default=None, metavar='FILE',
+    help='Serve a recording made with --record, rather than running SUMO.')
+parser.add_argument(
+    '--history-secs', dest='history_secs', type=float, default=DEFAULT_HISTORY_SECS,
+    help='Keep at least this many seconds of simulation time in memory, for viewers to rewind ' +
+         'and replay. 0 disables rewinding. The default is %(default)s.')
+parser.add_argument(
+    '--history-mb', dest='history_mb', type=float, default=DEFAULT_HISTORY_MB,
+    help='Memory to keep the --history-secs in, in megabytes. When it\'s full, the oldest ' +
+         'history is dropped. The default is %(default)s.')
+parser.add_argument(
+    '--max-sessions', dest='max_sessions', type=int, default=DEFAULT_MAX_SESSIONS,
+    help='Most scenarios to simulate at once, each with a SUMO of its own. The default is ' +
+         '%(default)s.')
+parser.add_argument(
+    '--session-idle-secs', dest='session_idle_secs', type=float, default=DEFAULT_IDLE_SECS,
+    help='Stop simulating a scenario once nobody has watched it for this long. The default is ' +
+         '%(default)s.')
+parser.add_argument(
+    '--profiling', action='store_true', default=False,
+    help='Serve /scenarios/<name>/profile?steps=N&format=pstats|collapsed, which profiles the ' +
+         'next N steps of a running scenario and responds with the result.')
+parser.add_argument(
+    '--simplify-polygons', dest='simplify_polygons', nargs='?', const=DEFAULT_SIMPLIFY,
+    default=None,
+    help='Simplify the outlines of the scenarios\' polygons, drop small footprints and round ' +
+         'their coordinates, at startup. Options are tolerance_m:min_area_m2:decimals, e.g. ' +
+         'the default of %s. The result is cached, see sumo-web3d-polygons.' % DEFAULT_SIMPLIFY)
+parser.add_argument(
+    '--cache-dir', dest='cache_dir', default=DEFAULT_CACHE_DIR,
+    help='Directory in which to cache parsed scenario files. The default is %(default)s.')
+parser.add_argument(
+    '--no-cache', dest='cache_dir', action='store_const', const=None,
+    help='Parse scenario files on every start rather than caching them on disk.')
 
 SCENARIOS_PATH = os.path.join(DIR, 'scenarios.json')
 NO_CACHE_HEADER = {'cache-control': 'no-cache'}
+MAX_PROFILE_STEPS = 10000
 
-# We use these to tell TraCI which parameters we want to track.
-TRACI_CONSTANTS = [
-    tc.VAR_TYPE,
-    tc.VAR_SPEED,
-    tc.VAR_ANGLE,
-    tc.VAR_LENGTH,
-    tc.VAR_WIDTH,
-]
-
-TRACI_PERSON_CONSTANTS = TRACI_CONSTANTS + [
-    tc.VAR_POSITION,
-    tc.VAR_VEHICLE
-]
-
-TRACI_VEHICLE_CONSTANTS = TRACI_CONSTANTS + [
-    tc.VAR_POSITION3D,
-    tc.VAR_SIGNALS,
-    tc.VAR_VEHICLECLASS,
-]
-
-snapshot = {}
-server = None
-
-STATUS_OFF = 'off'
-STATUS_RUNNING = 'running'
-STATUS_PAUSED = 'paused'
-simulation_status = STATUS_OFF
-delay_length_ms = 30  # in ms
-current_scenario = None
 scenarios = {}  # map from kebab-case-name to Scenario object.
+default_scenario_name = None
+simplify = None  # SimplifyOptions for scenarios' polygons, if they're simplified. Set by main.
+# Each scenario which is being watched has a session. It's set by main.
+sessions = None
+# Scenario files, pre-serialized for serving. Its thread is the only one which reads scenarios'
+# lazy properties, since they aren't thread-safe. It's set by main.
+assets = None
+loop_lag = Histogram()  # How late the event loop wakes up, in seconds.
 
-last_vehicles = {}
-last_lights = {}
 
-
-# meant to be used as decorator, will not work with coroutines
-def send_as_http_response(func):
-    def func_wrapper(*args, **kwargs):
-        data = func(*args, **kwargs)
-        if data and type(data) == str:
-            return web.Response(text=data)
-        elif data and type(data) != str:
-            raise Exception(
-                'fail to send as response, expecting string, recieved: {}'.format(type(data))
-            )
-        else:
-            return web.Response(status=404, text='Not found')
-
-    return func_wrapper
-
-
-# meant to be used as decorator, will not work with coroutines
-def serialize_as_json_string(func):
-    def func_wrapper(*args, **kwargs):
-        data = func(*args, **kwargs)
-        if data:
-            return json.dumps(data)
-        else:
-            return None
-
-    return func_wrapper
-
-
-class Scenario(object):
-
-    @classmethod
-    def from_config_json(cls, scenarios_json):
-        name = scenarios_json['name']
-        config_file = scenarios_json['config_file']
-        sumocfg_file = os.path.join(DIR, os.path.expanduser(os.path.expandvars(config_file)))
-        is_default = scenarios_json.get('is_default', False)
-        config_dir = os.path.dirname(sumocfg_file)
-        config = xmltodict.parse(open(sumocfg_file).read(), attr_prefix='')['configuration']
-        net_file, additional_files, settings_file = parse_config_file(config_dir, config)
-        additionals = {} if additional_files else None
-        if additional_files:
-            for xml in [parse_xml_file(f) for f in additional_files]:
-                additional = xml.get('additional') or xml.get('add')
-                if additional:
-                    additionals.update(additional)
-
-        settings = parse_xml_file(settings_file)
-        water = {'type': 'FeatureCollection', 'features': []}
-        if settings:
-            water_tag = get_only_key(settings).get('water-geojson')
-            if water_tag:
-                water = json.load(open(os.path.join(config_dir, water_tag['value'])))
-
-        return cls(
-            sumocfg_file,
-            name,
-            is_default,
-            parse_xml_file(net_file),
-            additionals,
-            settings,
-            water
-        )
-
-    def __init__(self, config_file, name, is_default, network, additional, settings, water):
-        self.config_file = config_file
-        self.display_name = name
-        self.name = to_kebab_case(name)
-        self.is_default = is_default
-        self.network = network
-        self.additional = additional
-        self.settings = settings
-        self.water = water
-
-
-def person_to_dict(person):
-    """Extracts relevant information from what traci.person.getSubscriptionResults."""
-    return {
-        'x': person[tc.VAR_POSITION][0],
-        'y': person[tc.VAR_POSITION][1],
-        'z': 0,
-        'speed': person[tc.VAR_SPEED],
-        'angle': person[tc.VAR_ANGLE],
-        'type': person[tc.VAR_TYPE],
-        'length': person[tc.VAR_LENGTH],
-        'width': person[tc.VAR_WIDTH],
-        'person': person.get(tc.VAR_VEHICLE),
-        'vClass': 'pedestrian',
-    }
-
-
-def vehicle_to_dict(vehicle):
-    """Extracts relevant information from what traci.vehicle.getSubscriptionResults."""
-    return {
-        'x': vehicle[tc.VAR_POSITION3D][0],
-        'y': vehicle[tc.VAR_POSITION3D][1],
-        'z': vehicle[tc.VAR_POSITION3D][2],
-        'speed': vehicle[tc.VAR_SPEED],
-        'angle': vehicle[tc.VAR_ANGLE],
-        'type': vehicle[tc.VAR_TYPE],
-        'length': vehicle[tc.VAR_LENGTH],
-        'width': vehicle[tc.VAR_WIDTH],
-        'signals': vehicle[tc.VAR_SIGNALS],
-        'vClass': vehicle.get(tc.VAR_VEHICLECLASS),
-    }
-
-
-def light_to_dict(light):
-    """Extract relevant information from traci.trafficlights.getSubscriptionResults."""
-    return {
-        'phase': light[tc.TL_CURRENT_PHASE],
-        'programID': light[tc.TL_CURRENT_PROGRAM],
-    }
-
-
-def to_kebab_case(scenario_name):
-    return scenario_name.lower().replace(' ', '-').replace('_', '-')
-
-
-def get_state():
-    return {
-        'delayMs': delay_length_ms,
-        'scenario': to_kebab_case(getattr(current_scenario, 'name')),
-        'simulationStatus': simulation_status
-    }
-
-
-async def post_state(scenarios, request):
-    global current_scenario, delay_length_ms, simulation_status
+async def post_state(request):
     body = await request.json()
-    if body['scenario'] not in scenarios.keys():
-        return None
-    current_scenario = scenarios[body['scenario']]
-    delay_length_ms = body['delay_length_ms']
-    simulation_status = body['simulation_status']
+    # Only viewers' websockets start sessions.
+    session = sessions.find(body['scenario'])
+    if not session:
+        return web.Response(status=404, text='No session')
+    session.delay_length_ms = body['delay_length_ms']
+    session.status = body['simulation_status']
     return web.Response(text=json.dumps({
-        'delayMs': delay_length_ms,
-        'scenario': to_kebab_case(getattr(current_scenario, 'name')),
-        'simulationStatus': simulation_status
+        'delayMs': session.delay_length_ms,
+        'scenario': session.name,
+        'simulationStatus': session.status
     }))
 
 
 def state_http_response(request):
+    name = request.match_info.get('scenario', default_scenario_name)
+    # Only viewers' websockets start sessions. They're sent the state when they connect.
+    session = sessions.find(name)
+    if not session:
+        return web.Response(status=404, text='No session')
     return web.Response(
-        text=json.dumps(get_state())
+        text=json.dumps(session.get_state())
     )
 
 
-def vehicle_route_http_response(request):
+async def vehicle_route_http_response(request):
+    session = sessions.find(request.match_info.get('scenario', default_scenario_name))
     vehicle_id = request.query_string
-    vehicle = last_vehicles.get(vehicle_id)
-    if vehicle:
-        if vehicle['vClass'] == 'pedestrian':
-            edge_ids = traci.person.getEdges(vehicle_id)
-        else:
-            edge_ids = traci.vehicle.getRoute(vehicle_id)
+    if session:
+        edge_ids = (await session.get_routes([vehicle_id])).get(vehicle_id)
         if edge_ids:
             return web.Response(
                 text=json.dumps(edge_ids)
@@ -238,202 +145,138 @@ def vehicle_route_http_response(request):
     return web.Response(status=404)
 
 
-def get_state_websocket_message():
-    state = get_state()
-    state['type'] = 'state'
-    return state
-
-
-def make_xml_endpoint(path):
-    text = None
-    if path:
-        r = xmltodict.parse(open(path).read(), attr_prefix='')
-        text = json.dumps(r)
-
-    async def handler(request):
-        if text:
-            return web.Response(text=text)
-        else:
-            return web.Response(status=404, text='Not found')
-
-    return handler
-
-
-def make_additional_endpoint(paths):
-    """Make an endpoint for the "additional-files" setting.
+async def vehicle_routes_http_response(request):
+    """The routes of many vehicles, posted as {"ids": [...], "geometry": true|false}.
 
-    Since there can be several of these, we read them all and merge the results.
+    Responds with {ID: {"edges": [...], "shape": [[x, y], ...]}}, leaving out vehicles which
+    don't exist. The shape is only included with geometry.
+    """
+    name = request.match_info['scenario']
+    if name not in scenarios:
+        return web.Response(status=404, text='Not found')
+    body = await request.json()
+    ids = body.get('ids')
+    if not isinstance(ids, list) or len(ids) > MAX_ROUTES_PER_REQUEST:
+        return web.Response(status=400, text='Expected at most %d ids' % MAX_ROUTES_PER_REQUEST)
+    session = sessions.find(name)
+    routes = await session.get_routes([str(obj_id) for obj_id in ids]) if session else {}
+    shapes = None
+    if body.get('geometry'):
+        # This parses the network the first time, so it's done off the event loop.
+        shapes = await assets.run(lambda: scenarios[name].edge_shapes)
+    response = {}
+    for obj_id, edge_ids in routes.items():
+        response[obj_id] = {'edges': edge_ids}
+        if shapes is not None:
+            response[obj_id]['shape'] = route_shape(shapes, edge_ids)
+    return web.Response(text=json.dumps(response))
+
+
+def metrics_http_response(request):
+    """Metrics of the server and each session, for Prometheus to scrape."""
+    exposition = Exposition()
+    exposition.histogram(
+        'event_loop_lag_seconds', 'How late the event loop wakes up from a sleep.', loop_lag)
+    exposition.gauge('sessions', 'Scenarios with a session.', len(sessions))
+    for session in sessions.sessions.values():
+        session.export_metrics(exposition)
+    return web.Response(body=exposition.render().encode('utf8'),
+                        headers={'Content-Type': CONTENT_TYPE})
+
+
+async def profile_http_response(request):
+    """Profile the next ?steps=N steps of a scenario, as a ?format=pstats or collapsed file."""
+    session = sessions.find(request.match_info['scenario'])
+    if not session:
+        return web.Response(status=404, text='Not found')
+    try:
+        steps = int(request.query.get('steps', 100))
+        profiler = PROFILERS[request.query.get('format', 'pstats')]
+    except (KeyError, ValueError):
+        return web.Response(status=400, text='Expected steps=N and format=%s' % '|'.join(
+            sorted(PROFILERS)))
+    if not 0 < steps <= MAX_PROFILE_STEPS:
+        return web.Response(status=400, text='steps must be from 1 to %d' % MAX_PROFILE_STEPS)
+    try:
+        data = await session.profile_steps(profiler(steps))
+    except ProfilingError as e:
+        return web.Response(status=409, text=str(e))
+    filename = '%s-%d-steps.%s' % (session.name, steps, profiler.extension)
+    return web.Response(body=data, headers={
+        'Content-Type': profiler.content_type,
+        'Content-Disposition': 'attachment; filename="%s"' % filename,
+    })
+
+
+def make_xml_endpoint(path, cache, assets):
+    """Make an endpoint which serves an XML file as JSON.
+
+    The file is parsed on the first request, on the asset cache's thread.
     """
-    if not paths:  # Either None or empty list
-        return make_xml_endpoint(paths)  # generate a generic 404.
-    additionals = {}
-    for path in paths:
-        r = xmltodict.parse(open(path).read(), attr_prefix='')
-        additionals.update(r['additional'])
-    text = json.dumps({'additional': additionals})
+    def make_obj():
+        if path and os.path.exists(path):
+            return cache.load(path, XML_NAMESPACE, parse_xml_file)
 
     async def handler(request):
-        return web.Response(text=text)
+        return await assets.response(('xml', path), make_obj, request)
 
     return handler
 
 
-async def run_simulation(websocket):
-    while True:
-        if simulation_status is STATUS_RUNNING:
-            snapshot = simulate_next_step()
-            snapshot['type'] = 'snapshot'
-            await websocket.send(json.dumps(snapshot))
-            await asyncio.sleep(delay_length_ms / 1000)
-        else:
-            await asyncio.sleep(0)
-
-
-def cleanup_sumo_simulation(simulation_task):
-    global last_lights, last_vehicles
-    if simulation_task:
-        if simulation_task.cancel():
-            simulation_task = None
-        last_vehicles = {}
-        last_lights = {}
-        traci.close()
-
-
-async def websocket_simulation_control(sumo_start_fn, task, websocket, path):
-    # We use globals to communicate with the simulation coroutine for simplicity
-    global delay_length_ms
-    global simulation_status
-    while True:
-        try:
+def websocket_scenario_name(websocket, path):
+    """The scenario in a websocket's URL, /scenarios/<name>/, or the default one."""
+    if path is None:
+        # Newer versions of websockets only pass the handler the connection.
+        path = websocket.request.path
+    parts = path.strip('/').split('/')
+    if len(parts) >= 2 and parts[0] == 'scenarios':
+        return parts[1]
+    return default_scenario_name
+
+
+async def websocket_simulation_control(websocket, path=None):
+    name = websocket_scenario_name(websocket, path)
+    if name not in scenarios:
+        await websocket.close(code=1008, reason='No such scenario: %s' % name)
+        return
+    vtypes = None
+    if not sessions.find(name):
+        # This parses the scenario's route and additional files the first time.
+        vtypes = await assets.run(lambda: scenarios[name].vtypes)
+    session = sessions.get(name, vtypes=vtypes)
+    session.subscribe(websocket)
+    try:
+        while True:
             raw_msg = await websocket.recv()
             msg = json.loads(raw_msg)
-            if msg['type'] == 'action':
-                if msg['action'] == 'start':
-                    sumo_start_fn()
-                    simulation_status = STATUS_RUNNING
-                    loop = asyncio.get_event_loop()
-                    task = loop.create_task(run_simulation(websocket))
-                elif msg['action'] == 'pause':
-                    simulation_status = STATUS_PAUSED
-                elif msg['action'] == 'resume':
-                    simulation_status = STATUS_RUNNING
-                elif msg['action'] == 'cancel':
-                    simulation_status = STATUS_OFF
-                    cleanup_sumo_simulation(task)
-                elif msg['action'] == 'changeDelay':
-                    delay_length_ms = msg['delayLengthMs']
-                else:
-                    raise Exception('unrecognized action websocket message')
-                await websocket.send(json.dumps(get_state_websocket_message()))
-            else:
-                raise Exception('unrecognized websocket message')
-        # we need to handle implicit cancelling, ie the client closing their browser
-        except websockets.exceptions.ConnectionClosed:
-            cleanup_sumo_simulation(task)
-            break
+            try:
+                await sessions.handle_message(session, websocket, msg)
+            except SessionLimitError as e:
+                await websocket.send(json.dumps({'type': 'error', 'message': str(e)}))
+    # we need to handle implicit cancelling, ie the client closing their browser
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        # The session keeps running until it's reaped, in case the viewer comes back.
+        session.unsubscribe(websocket)
 
 
 # TraCI business logic
-def start_sumo_executable(gui, sumo_args, sumocfg_file):
+def start_sumo_executable(simulation, gui, sumo_args, sumocfg_file):
+    import sumolib
     sumoBinary = sumolib.checkBinary('sumo' if not gui else 'sumo-gui')
     additional_args = shlex.split(sumo_args) if sumo_args else []
     args = [sumoBinary, '-c', sumocfg_file] + additional_args
     print('Executing %s' % ' '.join(args))
-    traci.start(args)
-    traci.simulation.subscribe()
-
-    # Subscribe to all traffic lights. This set of IDs should never change.
-    for light_id in traci.trafficlights.getIDList():
-        traci.trafficlights.subscribe(light_id, [
-            tc.TL_CURRENT_PHASE,
-            tc.TL_CURRENT_PROGRAM
-        ])
-
-
-def simulate_next_step():
-    global last_lights, last_vehicles
-    start_secs = time.time()
-    traci.simulationStep()
-    end_sim_secs = time.time()
-    # Update Vehicles
-    for veh_id in traci.simulation.getDepartedIDList():
-        # SUMO will not resubscribe to vehicles that are already subscribed, so this is safe.
-        traci.vehicle.subscribe(veh_id, TRACI_VEHICLE_CONSTANTS)
-
-    # acquire the relevant vehicle information
-    ids = tuple(set(traci.vehicle.getIDList() +
-                    traci.simulation.getSubscriptionResults()
-                    [tc.VAR_DEPARTED_VEHICLES_IDS]))
-    vehicles = {veh_id: vehicle_to_dict(traci.vehicle.getSubscriptionResults(veh_id))
-                for veh_id in ids}
-    # Vehicles are automatically unsubscribed upon arrival
-    # and deleted from vehicle list on next
-    # timestep. Persons are also automatically unsubscribed.
-    # See: http://sumo.dlr.de/wiki/TraCI/Object_Variable_Subscription).
-
-    # Update persons
-    # Workaround for people: traci does not return person objects in the getDepartedIDList() call
-    # See: http://sumo.dlr.de/trac.wsgi/ticket/3477
-    for ped_id in traci.person.getIDList():
-        traci.person.subscribe(ped_id, TRACI_PERSON_CONSTANTS)
-    person_ids = traci.person.getIDList()
-
-    persons = {p_id: person_to_dict(traci.person.getSubscriptionResults(p_id))
-               for p_id in person_ids}
-
-    # Note: we might have to separate vehicles and people if their data models or usage deviate
-    # but for now we'll combine them into a single object
-    vehicles.update(persons)
-    vehicle_counts = Counter(v['vClass'] for veh_id, v in vehicles.items())
-    round_vehicles(vehicles)
-    vehicles_update = diff_dicts(last_vehicles, vehicles)
-
-    # Update lights
-    light_ids = traci.trafficlight.getIDList()
-    lights = {l_id: light_to_dict(traci.trafficlight.getSubscriptionResults(l_id))
-              for l_id in light_ids}
-    lights_update = diff_dicts(last_lights, lights)
-
-    end_update_secs = time.time()
-
-    snapshot = {
-        'time': traci.simulation.getCurrentTime(),
-        'vehicles': vehicles_update,
-        'lights': lights_update,
-        'vehicle_counts': vehicle_counts,
-        'simulate_secs': end_sim_secs - start_secs,
-        'snapshot_secs': end_update_secs - end_sim_secs
-    }
-    last_vehicles = vehicles
-    last_lights = lights
-    return snapshot
-
-
-def parse_config_file(config_dir, config):
-    input_config = config['input']
-    net_file = os.path.join(config_dir, input_config['net-file']['value'])
-
-    additionals = input_config.get('additional-files', [])
-    if additionals:
-        # With a single additional file, additionals is an OrderedDict.
-        # With multiple additional files, it's a list of OrderedDicts.
-        # This logic normalizes it to always be the latter.
-        # Additionally, files may be specified either via multiple tags or via
-        # space-separated or comma-separated file names in the value attribute.
-        if not isinstance(additionals, list):
-            additionals = [additionals]
-        additional_files = []
-        for additional in additionals:
-            values = re.split(r'[ ,]+', additional['value'])
-            for value in values:
-                additional_files.append(os.path.join(config_dir, value))
-    else:
-        additional_files = None
+    return simulation.start(args)
 
-    settings_file = None
-    if 'gui_only' in config and 'gui-settings-file' in config['gui_only']:
-        settings_file = os.path.join(config_dir, config['gui_only']['gui-settings-file']['value'])
-    return (net_file, additional_files, settings_file)
+
+def session_record_path(record_path, name):
+    """Where to record a scenario, with --record."""
+    if not record_path or len(scenarios) == 1:
+        return record_path
+    root, ext = os.path.splitext(record_path)
+    return '%s.%s%s' % (root, name, ext)
 
 
 def scenario_to_response_body(scenario):
@@ -443,55 +286,72 @@ def scenario_to_response_body(scenario):
     }
 
 
-def get_scenarios_route(scenarios_file, scenarios):
-    scenarios = load_scenarios_file(scenarios, scenarios_file)
+def get_scenarios_route(scenarios_file, scenarios, cache):
+    scenarios = load_scenarios_file(scenarios, scenarios_file, cache, simplify)
 
 
-@send_as_http_response
-@serialize_as_json_string
-def scenario_attribute_route(scenarios_file, scenarios, attribute, normalized_key, request):
+async def scenario_attribute_route(scenarios_file, scenarios, cache, assets, attribute,
+                                   normalized_key, request):
+    """Serve a scenario attribute as a pre-serialized, pre-compressed JSON (or binary) asset."""
     requested_scenario = request.match_info['scenario']
     if requested_scenario not in scenarios:
-        scenarios = load_scenarios_file(scenarios, scenarios_file)
-    if requested_scenario in scenarios:
+        scenarios = load_scenarios_file(scenarios, scenarios_file, cache, simplify)
+    if requested_scenario not in scenarios:
+        return web.Response(status=404, text='Not found')
+
+    def make_obj():
         obj = getattr(scenarios[requested_scenario], attribute)
         if normalized_key and obj:
             obj = {normalized_key: get_only_key(obj)}
         return obj
-    else:
-        return None
-
-
-def load_scenarios_file(prev_scenarios, scenarios_file):
-    next_scenarios = prev_scenarios
-    if not scenarios_file:
-        return next_scenarios
-
-    with open(scenarios_file) as f:
-        new_scenarios = json.loads(f.read())
-        new_scenarios_names = [to_kebab_case(x['name']) for x in new_scenarios]
-        # throw error if there are duplicate name fields
-        duplicates = len(new_scenarios_names) == len(set(new_scenarios_names))
-        if not duplicates:
-            raise Exception(
-                'Invalid scenarios.json, cannot have two scenarios with the'
-                'same kebab case name'
-            )
-        prev_scenario_names = set([s.name for s in prev_scenarios.values()])
-        updates = [s for s in new_scenarios if to_kebab_case(s['name']) not in prev_scenario_names]
-        for new_scenario in updates:
-            scenario = Scenario.from_config_json(new_scenario)
-            next_scenarios.update({scenario.name: scenario})
-        return next_scenarios
+
+    return await assets.response((requested_scenario, attribute), make_obj, request)
+
+
+async def additional_route(scenarios_file, scenarios, cache, assets, request):
+    """Serve a scenario's additional files. With ?tiled, what's in its tiles is left out."""
+    attribute = 'untiled_additional' if 'tiled' in request.query else 'additional'
+    return await scenario_attribute_route(
+        scenarios_file, scenarios, cache, assets, attribute, None, request)
+
+
+async def network_route(scenarios_file, scenarios, cache, assets, request):
+    """Serve a scenario's network. With ?slim, only what's needed alongside its geometry."""
+    attribute = 'slim_network' if 'slim' in request.query else 'network'
+    return await scenario_attribute_route(
+        scenarios_file, scenarios, cache, assets, attribute, None, request)
+
+
+async def tile_route(scenarios_file, scenarios, cache, assets, request):
+    """Serve the manifest of a scenario's tiles, or a tile from /tiles/{z}/{x}/{y}."""
+    requested_scenario = request.match_info['scenario']
+    if requested_scenario not in scenarios:
+        scenarios = load_scenarios_file(scenarios, scenarios_file, cache, simplify)
+    if requested_scenario not in scenarios:
+        return web.Response(status=404, text='Not found')
+    # Tiling a scenario parses and tessellates it, so it's done off the event loop too.
+    tiles = await assets.run(lambda: scenarios[requested_scenario].tiles)
+    if 'z' not in request.match_info:
+        return await assets.response(
+            (requested_scenario, 'tiles'), lambda: tiles and tiles.manifest(), request)
+    try:
+        z, x, y = [int(request.match_info[k]) for k in ('z', 'x', 'y')]
+    except ValueError:
+        return web.Response(status=400, text='Expected /tiles/{z}/{x}/{y}')
+    if not tiles or not tiles.has_tile(z, x, y):
+        # Checked here so that the asset cache doesn't fill up with missing tiles.
+        return web.Response(status=404, text='Not found')
+    return await assets.response(
+        (requested_scenario, 'tiles', z, x, y), lambda: tiles and tiles.tile(z, x, y), request)
 
 
 def get_new_scenario(request):
-    """Set a new scenario and respond with index.html"""
-    global current_scenario
-    scenario_name = request.match_info['scenario']
-    print('Switching to %s' % scenario_name)
-    # The simulation will be restarted via a websocket message.
-    current_scenario = scenarios[scenario_name]
+    """Respond with index.html for a scenario.
+
+    The page connects to the scenario's session, which is started via a websocket message.
+    """
+    if request.match_info['scenario'] not in scenarios:
+        return web.Response(status=404, text='Not found')
     # We avoid web.FileResponse here because we want to disable caching.
     html = open(os.path.join(DIR, 'static', 'index.html')).read()
     return web.Response(text=html, content_type='text/html', headers=NO_CACHE_HEADER)
@@ -507,42 +367,66 @@ def get_default_scenario_name(scenarios):
     return defaults[0]
 
 
-def setup_http_server(task, scenario_file, scenarios):
+def setup_http_server(task, scenario_file, scenarios, cache, assets, profiling=False):
     app = web.Application()
 
     scenarios_response = [scenario_to_response_body(x) for x in scenarios.values()]
-    default_scenario_name = get_default_scenario_name(scenarios)
 
     app.router.add_get(
         '/scenarios/{scenario}/additional',
-        functools.partial(scenario_attribute_route, scenario_file, scenarios, 'additional', None)
+        functools.partial(additional_route, scenario_file, scenarios, cache, assets)
     )
     app.router.add_get(
         '/scenarios/{scenario}/network',
-        functools.partial(scenario_attribute_route, scenario_file, scenarios, 'network', None)
+        functools.partial(network_route, scenario_file, scenarios, cache, assets)
+    )
+    # The network, pre-tessellated into binary vertex buffers (see tessellation.py).
+    app.router.add_get(
+        '/scenarios/{scenario}/geometry',
+        functools.partial(
+            scenario_attribute_route, scenario_file, scenarios, cache, assets, 'geometry', None)
     )
+    # Edges, junctions and polygons in spatial tiles, and a manifest of them (see tiles.py).
+    tile_handler = functools.partial(tile_route, scenario_file, scenarios, cache, assets)
+    app.router.add_get('/scenarios/{scenario}/tiles', tile_handler)
+    app.router.add_get('/scenarios/{scenario}/tiles/{z}/{x}/{y}', tile_handler)
     app.router.add_get(
         '/scenarios/{scenario}/water',
-        functools.partial(scenario_attribute_route, scenario_file, scenarios, 'water', None)
+        functools.partial(
+            scenario_attribute_route, scenario_file, scenarios, cache, assets, 'water', None)
     )
     app.router.add_get(
         '/scenarios/{scenario}/settings',
         functools.partial(
-            scenario_attribute_route, scenario_file, scenarios, 'settings', 'viewsettings')
+            scenario_attribute_route, scenario_file, scenarios, cache, assets, 'settings',
+            'viewsettings')
     )
     app.router.add_get('/scenarios/{scenario}/', get_new_scenario)
+    app.router.add_get('/scenarios/{scenario}/state', state_http_response)
+    app.router.add_post('/scenarios/{scenario}/state', post_state)
+    app.router.add_get('/scenarios/{scenario}/vehicle_route', vehicle_route_http_response)
+    app.router.add_post('/scenarios/{scenario}/vehicle_routes', vehicle_routes_http_response)
+    if profiling:
+        app.router.add_get('/scenarios/{scenario}/profile', profile_http_response)
 
     app.router.add_get(
         '/scenarios',
         lambda request: web.Response(text=json.dumps(scenarios_response))
     )
+    sumo_home = os.environ.get('SUMO_HOME')
     app.router.add_get(
         '/poly-convert',
-        make_xml_endpoint(os.path.join(constants.SUMO_HOME, 'data/typemap/osmPolyconvert.typ.xml'))
+        make_xml_endpoint(
+            sumo_home and os.path.join(sumo_home, 'data/typemap/osmPolyconvert.typ.xml'), cache,
+            assets)
     )
+    # These are for the default scenario.
     app.router.add_get('/state', state_http_response)
-    app.router.add_post('/state', functools.partial(post_state, scenarios))
+    app.router.add_post('/state', post_state)
     app.router.add_get('/vehicle_route', vehicle_route_http_response)
+    app.router.add_get(
+        '/sessions', lambda request: web.Response(text=json.dumps(sessions.stats())))
+    app.router.add_get('/metrics', metrics_http_response)
     app.router.add_get('/', lambda req: web.HTTPFound(
         '/scenarios/%s/' % default_scenario_name, headers=NO_CACHE_HEADER))
     app.router.add_static('/', path=os.path.join(DIR, 'static'))
@@ -550,10 +434,39 @@ def setup_http_server(task, scenario_file, scenarios):
     return app
 
 
+def simplify_polygons(scenarios):
+    """Simplify each scenario's polygons up front, rather than on its first request."""
+    for name, scenario in sorted(scenarios.items()):
+        try:
+            stats = scenario.polygon_stats
+        except Exception as e:
+            # As when they're requested, a scenario with broken files shouldn't stop the server.
+            print('Unable to simplify the polygons of %s: %s' % (name, e))
+            continue
+        if stats:
+            print('Simplified the polygons of %s: %s' % (name, format_stats(stats)))
+
+
 def main(args):
-    global current_scenario, scenarios, SCENARIOS_PATH
+    global assets, default_scenario_name, scenarios, sessions, simplify, SCENARIOS_PATH
     task = None
-    sumo_start_fn = functools.partial(start_sumo_executable, args.gui, args.sumo_args)
+    lod_tiers = parse_lod_tiers(args.lod_tiers) if args.lod_tiers else None
+    max_sessions = args.max_sessions
+    if args.replay:
+        # Replays don't need SUMO, or even traci. There's only one, so only one scenario can
+        # play it at a time.
+        replay = Replay(args.replay)
+        max_sessions = 1
+    else:
+        from . import constants  # noqa: F401 (this puts SUMO's tools on the path)
+        import traci
+        replay = None
+    cache = ParsedFileCache(args.cache_dir)
+    if args.simplify_polygons:
+        try:
+            simplify = parse_simplify_options(args.simplify_polygons)
+        except ValueError as e:
+            parser.error(str(e))
 
     if args.configuration_file:
         # Replace the built-in scenarios with a single, user-specified one.
@@ -566,26 +479,51 @@ def main(args):
                 'description': 'User-specified scenario',
                 'config_file': args.configuration_file,
                 'is_default': True
-            })
+            }, cache, simplify)
         }
     else:
-        scenarios = load_scenarios_file({}, SCENARIOS_PATH)
+        scenarios = load_scenarios_file({}, SCENARIOS_PATH, cache, simplify)
 
-    def setup_websockets_server():
-        return functools.partial(
-            websocket_simulation_control,
-            lambda: sumo_start_fn(getattr(current_scenario, 'config_file')),
-            task
-        )
+    if replay and replay.scenario in scenarios:
+        # Only the recorded scenario makes sense.
+        scenarios = {replay.scenario: scenarios[replay.scenario]}
+        scenarios[replay.scenario].is_default = True
+    default_scenario_name = get_default_scenario_name(scenarios)
+    if simplify:
+        simplify_polygons(scenarios)
+
+    def make_session(name, vtypes=None):
+        # All of a session's TraCI calls go through its worker, so that they happen off the
+        # event loop.
+        if replay:
+            simulation = SimulationWorker(replay)
+            start_fn = functools.partial(simulation.start, None)
+        else:
+            simulation = SimulationWorker(Simulation(TraciConnection(traci, name)))
+            start_fn = functools.partial(start_sumo_executable, simulation, args.gui,
+                                         args.sumo_args, scenarios[name].config_file)
+        history = None
+        if args.history_secs > 0 and not replay:
+            # Replays can seek anywhere already.
+            history = History(args.history_secs, int(args.history_mb * 2 ** 20))
+        return Session(
+            name, simulation, start_fn, realtime_factor=args.realtime_factor,
+            lod_tiers=lod_tiers, history=history,
+            record_path=session_record_path(args.record, name),
+            keyframe_interval=args.keyframe_interval, replay=replay,
+            vtypes=vtypes)
+
+    sessions = SessionManager(make_session, max_sessions, args.session_idle_secs)
+    assets = AssetCache()
 
     loop = asyncio.get_event_loop()
 
     # websockets
-    ws_handler = setup_websockets_server()
-    ws_server = websockets.serve(ws_handler, '0.0.0.0', 5678)
+    ws_server = websockets.serve(
+        websocket_simulation_control, '0.0.0.0', 5678, subprotocols=SUBPROTOCOLS)
 
     # http
-    app = setup_http_server(task, SCENARIOS_PATH, scenarios)
+    app = setup_http_server(task, SCENARIOS_PATH, scenarios, cache, assets, args.profiling)
     http_server = loop.create_server(
         app.make_handler(),
         '0.0.0.0',
@@ -594,6 +532,8 @@ def main(args):
 
     loop.run_until_complete(http_server)
     loop.run_until_complete(ws_server)
+    loop.create_task(sessions.reap_forever())
+    loop.create_task(monitor_loop_lag(loop_lag))
 
     print("""Listening on:
     127.0.0.1:5000 (HTTP)
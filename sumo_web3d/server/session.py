@@ -0,0 +1,400 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Sessions: the simulation of one scenario, and the viewers watching it.
+
+Each scenario which someone is looking at has a Session, with a simulation of its own (for SUMO,
+on a labeled TraCI connection; see simulation.TraciConnection), its own status, delay and delta
+state. Viewers are routed to the session of the scenario in their websocket URL, so different
+viewers can watch different scenarios at once, while viewers of the same scenario share one
+simulation.
+
+SessionManager creates sessions as they're needed. It caps how many may run a simulation at once,
+and reaps sessions which nobody has watched for a while, so that the host doesn't run out of
+memory. A session keeps running for a while after its last viewer leaves, so that a viewer which
+reloads the page picks up where it left off.
+"""
+import asyncio
+import functools
+import json
+import time
+
+from .broadcast import BroadcastHub
+from .deltas import diff_dicts
+from .interest import parse_bounds, parse_camera, SpatialGrid
+from .metrics import SessionMetrics
+from .profiling import ProfilingError
+from .recording import DEFAULT_KEYFRAME_INTERVAL, Recorder
+from .routes import RouteCache
+from .scheduler import FrameScheduler
+from .vehicle_table import VehicleTable
+
+STATUS_OFF = 'off'
+STATUS_RUNNING = 'running'
+STATUS_PAUSED = 'paused'
+
+DEFAULT_DELAY_MS = 30
+DEFAULT_MAX_SESSIONS = 4
+DEFAULT_IDLE_SECS = 60
+
+# How often SessionManager.reap_forever looks for idle sessions.
+REAP_INTERVAL_SECS = 5
+
+
+class SessionLimitError(Exception):
+    """Raised when starting a session would run more simulations than allowed."""
+
+
+class Session(object):
+    """The simulation of a scenario, and the websockets watching it.
+
+    simulation is a SimulationWorker, for a Simulation or a Replay, and start_fn starts it,
+    returning an awaitable. history is a History for viewers to rewind, if any. With record_path,
+    each run of the simulation is recorded there. vtypes are the scenario's vType definitions.
+    """
+
+    def __init__(self, name, simulation, start_fn, realtime_factor=None, lod_tiers=None,
+                 history=None, record_path=None, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                 replay=None, vtypes=None):
+        self.name = name
+        self.simulation = simulation
+        self.start_fn = start_fn
+        # Set while run() has something to do: the simulation is running, or a replay is seeking.
+        self.wake = asyncio.Event()
+        self.status = STATUS_OFF
+        self.delay_length_ms = DEFAULT_DELAY_MS  # time between frames, in ms
+        # If set, frames are paced to run this many times faster than real time.
+        self.realtime_factor = realtime_factor
+        self.record_path = record_path
+        self.keyframe_interval = keyframe_interval
+        self.recorder = None  # A Recorder for the current run, with record_path.
+        self.replay = replay  # The Replay which simulation runs, if it is one.
+        self.seek_to_ms = None  # Set by the 'seek' action of replays until run() has seeked.
+        self.vehicle_table = VehicleTable()  # vehicles and persons as of the last snapshot.
+        self.vehicle_grid = SpatialGrid(self.vehicle_table)
+        self.last_lights = {}
+        self.routes = RouteCache()
+        self.task = None
+        self.metrics = SessionMetrics()
+        self.profile = None  # A CProfile or SamplingProfile of the next steps, if any.
+        self.profile_done = None  # A future which is resolved once profile has started and ended.
+        self.hub = BroadcastHub(lambda: (self.vehicle_table.to_dict(), self.last_lights),
+                                grid=self.vehicle_grid, lod_tiers=lod_tiers, history=history,
+                                metrics=self.metrics, vtypes=vtypes,
+                                frame_period_fn=self.frame_period_secs)
+        self.idle_since = time.monotonic()  # None while anyone is watching.
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        self._status = status
+        if status == STATUS_RUNNING:
+            self.wake.set()
+
+    @property
+    def is_running(self):
+        """Whether the session has a simulation, even if it's paused."""
+        return self.task is not None
+
+    def get_state(self):
+        return {
+            'delayMs': self.delay_length_ms,
+            'scenario': self.name,
+            'simulationStatus': self.status,
+            'replay': self.replay and {
+                'startMs': self.replay.start_ms, 'endMs': self.replay.end_ms},
+        }
+
+    def get_state_websocket_message(self):
+        state = self.get_state()
+        state['type'] = 'state'
+        return state
+
+    def subscribe(self, websocket):
+        self.hub.subscribe(websocket)
+        self.hub.send_message(websocket, json.dumps(self.get_state_websocket_message()))
+        self.idle_since = None
+
+    def unsubscribe(self, websocket):
+        self.hub.unsubscribe(websocket)
+        if not self.hub.subscribers:
+            self.idle_since = time.monotonic()
+
+    def frame_period_secs(self, step, last_step):
+        """The time between frames: either the delay, or as set by realtime_factor."""
+        if self.realtime_factor and last_step:
+            return (step['time'] - last_step['time']) / 1000 / self.realtime_factor
+        return self.delay_length_ms / 1000
+
+    def make_snapshot(self, step):
+        """Turn the state read by Simulation.step into a snapshot of what changed."""
+        start_secs = time.time()
+        vehicles_update = self.vehicle_table.update(step['vehicles'])
+        self.routes.update(vehicles_update['removals'], step.get('route_ids', {}))
+        lights = step['lights']
+        lights_update = diff_dicts(self.last_lights, lights)
+        self.last_lights = lights
+        end_update_secs = time.time()
+        self.metrics.observe_stage('simulate', step['simulate_secs'])
+        self.metrics.observe_stage('collect', step['read_secs'])
+        self.metrics.observe_stage('diff', end_update_secs - start_secs)
+
+        return {
+            'time': step['time'],
+            'vehicles': vehicles_update,
+            'lights': lights_update,
+            'vehicle_counts': step['vehicle_counts'],
+            'simulate_secs': step['simulate_secs'],
+            'snapshot_secs': step['read_secs'] + end_update_secs - start_secs,
+        }
+
+    async def run(self):
+        simulation = self.simulation
+        scheduler = FrameScheduler()
+        # SUMO computes the next step while the current one is diffed, encoded and sent.
+        next_step = None
+        last_step = None
+        while True:
+            seeked = False
+            if self.seek_to_ms is not None:
+                if next_step:
+                    await next_step  # This was read before the seek.
+                    next_step = None
+                await simulation.run(self.replay.seek, self.seek_to_ms)
+                self.seek_to_ms = None
+                # Show where the replay seeked to, even if it's paused.
+                seeked = True
+                last_step = None
+            if self.status is STATUS_RUNNING or seeked:
+                step = await (next_step or simulation.step())
+                next_step = simulation.step()
+                was_behind = scheduler.behind
+                period_secs = self.frame_period_secs(step, last_step)
+                await asyncio.sleep(scheduler.wait_secs(period_secs))
+                if scheduler.behind and not was_behind:
+                    print('%s is behind schedule: frame was %d ms late for a %d ms period' % (
+                        self.name, scheduler.lag_secs * 1000, scheduler.period_secs * 1000))
+                # The vehicle table has to match what viewers have been sent, since a viewer may
+                # join or report its viewport at any time between frames.
+                snapshot = self.make_snapshot(step)
+                snapshot['type'] = 'snapshot'
+                snapshot['frame_lag_secs'] = scheduler.lag_secs
+                # Keyframes of the recording and the history both need the full state, so it's
+                # built at most once a step.
+                full_state_fn = functools.lru_cache(maxsize=None)(self.hub.full_state_fn)
+                if self.recorder:
+                    self.recorder.record(snapshot, full_state_fn)
+                broadcast_secs = time.perf_counter()
+                self.hub.broadcast(snapshot, full_state_fn)
+                self.metrics.observe_stage('broadcast', time.perf_counter() - broadcast_secs)
+                self.metrics.observe_frame(step['vehicle_counts'], period_secs)
+                last_step = step
+                if self.profile_done:
+                    self.profile.steps -= 1
+                    if self.profile.steps <= 0:
+                        await self.finish_profile()
+            else:
+                # Time spent paused shouldn't count as lag.
+                scheduler.reset()
+                self.wake.clear()
+                await self.wake.wait()
+
+    async def start(self):
+        """Start the simulation, unless it's already running."""
+        if self.task:
+            return
+        await self.start_fn()
+        if self.record_path:
+            self.recorder = Recorder(self.record_path, self.name, self.keyframe_interval)
+        self.status = STATUS_RUNNING
+        self.task = asyncio.ensure_future(self.run())
+
+    async def get_routes(self, ids):
+        """The routes of vehicles and persons, as {ID: edge IDs}, leaving out unknown IDs."""
+        def fetch(ids):
+            return self.simulation.get_routes([
+                (obj_id, self.vehicle_table.get(obj_id)['vClass']) for obj_id in ids
+                if obj_id in self.vehicle_table])
+        return await self.routes.get_many(ids, fetch)
+
+    async def profile_steps(self, profile):
+        """Profile the next profile.steps frames. Returns the result, once they've been sent.
+
+        If the session is paused or stopped first, the result covers the frames which were sent.
+        """
+        if not self.task or self.status != STATUS_RUNNING:
+            raise ProfilingError('%s is not running' % self.name)
+        if self.profile:
+            raise ProfilingError('%s is already being profiled' % self.name)
+        self.profile = profile
+        try:
+            await profile.start(self.simulation)
+        except ProfilingError:
+            self.profile = None
+            raise
+        if not self.task or self.status != STATUS_RUNNING:
+            # The simulation stopped or paused while the profiler was starting.
+            await profile.stop(self.simulation)
+            self.profile = None
+            raise ProfilingError('%s is not running' % self.name)
+        self.profile_done = done = asyncio.get_event_loop().create_future()
+        await done
+        return profile.result()
+
+    async def finish_profile(self):
+        profile, done = self.profile, self.profile_done
+        self.profile = self.profile_done = None
+        try:
+            await profile.stop(self.simulation)
+        finally:
+            done.set_result(None)
+
+    async def cleanup(self):
+        """Stop the simulation, if it's running."""
+        self.status = STATUS_OFF
+        if self.task:
+            self.task.cancel()
+            self.task = None
+            if self.profile_done:
+                # Whoever asked for the profile gets the steps which ran.
+                await self.finish_profile()
+            if self.recorder:
+                self.recorder.close()
+                self.recorder = None
+            self.vehicle_table.clear()
+            self.vehicle_grid.clear()
+            self.last_lights = {}
+            self.routes.clear()
+            self.hub.reset()
+            # This runs after any step which is still in progress.
+            await self.simulation.close()
+
+    async def handle_message(self, websocket, msg):
+        """Act on a message from one of the session's websockets."""
+        if msg['type'] == 'action':
+            if msg['action'] == 'start':
+                # Viewers which join a running simulation watch it rather than restarting it.
+                await self.start()
+            elif msg['action'] == 'pause':
+                self.status = STATUS_PAUSED
+                if self.profile_done:
+                    # No more frames will be sent until it resumes.
+                    await self.finish_profile()
+            elif msg['action'] == 'resume':
+                self.status = STATUS_RUNNING
+            elif msg['action'] == 'cancel':
+                await self.cleanup()
+            elif msg['action'] == 'changeDelay':
+                # This sets the time between frames, which overrides realtime_factor.
+                self.delay_length_ms = msg['delayLengthMs']
+                self.realtime_factor = None
+            elif msg['action'] == 'seek':
+                if not self.replay:
+                    raise Exception('only replays can seek')
+                # The next frame is the last step of the replay at or before timeMs.
+                self.seek_to_ms = int(msg['timeMs'])
+                self.wake.set()
+            else:
+                raise Exception('unrecognized action websocket message')
+            # Every viewer sees the effects of every viewer's actions.
+            self.hub.broadcast_message(json.dumps(self.get_state_websocket_message()))
+        elif msg['type'] == 'viewport':
+            # The area which the viewer's camera can see, as [left, bottom, right, top] in SUMO
+            # coordinates, or null to be sent every vehicle, and the camera's position.
+            try:
+                bounds = parse_bounds(msg['bounds'])
+                camera = parse_camera(msg.get('camera'))
+            except (KeyError, TypeError, ValueError) as e:
+                # The viewer keeps its last viewport, and its connection.
+                self.hub.send_message(websocket, json.dumps({
+                    'type': 'error', 'message': 'Invalid viewport: %r' % (e,)}))
+                return
+            self.hub.set_viewport(websocket, bounds, camera)
+        elif msg['type'] == 'rewind':
+            # Watch the recent history from timeMs, or go back to the live simulation if it's
+            # null. This only affects the viewer which sent it.
+            time_ms = msg['timeMs']
+            self.hub.rewind(websocket, None if time_ms is None else int(time_ms))
+        else:
+            raise Exception('unrecognized websocket message')
+
+    def export_metrics(self, exposition):
+        """Add the session's metrics, and those of its viewers, to an Exposition.
+
+        Viewers come and go, so they're summarized rather than labelled one by one.
+        """
+        labels = {'scenario': self.name}
+        self.metrics.export(exposition, labels, running=self.status == STATUS_RUNNING)
+        exposition.gauge('viewers', 'Websockets watching the session.', len(self.hub), labels)
+        depths = [len(subscriber.queue) for subscriber in self.hub.subscribers.values()]
+        exposition.gauge('viewer_queue_depth_max', 'Most messages waiting to be sent to a viewer.',
+                         max(depths or [0]), labels)
+        exposition.gauge('viewer_queued_messages', 'Messages waiting to be sent to all viewers.',
+                         sum(depths), labels)
+
+    def stats(self):
+        return {
+            'simulationStatus': self.status,
+            'idleSecs': self.idle_since and time.monotonic() - self.idle_since,
+            'clients': self.hub.stats(),
+            'history': self.hub.history and self.hub.history.stats(),
+        }
+
+
+class SessionManager(object):
+    """The sessions of all scenarios, created on demand by make_session(name).
+
+    At most max_sessions may run a simulation at once. Sessions which nobody has watched for
+    idle_secs are stopped and forgotten.
+    """
+
+    def __init__(self, make_session, max_sessions=DEFAULT_MAX_SESSIONS,
+                 idle_secs=DEFAULT_IDLE_SECS):
+        self.make_session = make_session
+        self.max_sessions = max_sessions
+        self.idle_secs = idle_secs
+        self.sessions = {}  # name -> Session
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, name, **session_args):
+        """The session of a scenario, which is created if there isn't one.
+
+        session_args are passed to make_session, if it's called.
+        """
+        session = self.sessions.get(name)
+        if session is None:
+            session = self.sessions[name] = self.make_session(name, **session_args)
+        return session
+
+    def find(self, name):
+        """The session of a scenario, or None if there isn't one."""
+        return self.sessions.get(name)
+
+    async def handle_message(self, session, websocket, msg):
+        """Pass a message to a session, unless it would start one simulation too many."""
+        if (msg['type'] == 'action' and msg['action'] == 'start' and not session.is_running and
+                sum(s.is_running for s in self.sessions.values()) >= self.max_sessions):
+            raise SessionLimitError(
+                'The server is already running %d simulations, which is as many as it can. ' %
+                self.max_sessions + 'Try again once someone else is done.')
+        await session.handle_message(websocket, msg)
+
+    async def reap(self):
+        """Stop and forget the sessions which have been idle for too long."""
+        now = time.monotonic()
+        for name, session in list(self.sessions.items()):
+            if session.idle_since is not None and now - session.idle_since >= self.idle_secs:
+                del self.sessions[name]
+                await session.cleanup()
+                session.simulation.shutdown()
+
+    async def reap_forever(self, interval_secs=REAP_INTERVAL_SECS):
+        while True:
+            await asyncio.sleep(interval_secs)
+            await self.reap()
+
+    def stats(self):
+        return {name: session.stats() for name, session in self.sessions.items()}
@@ -0,0 +1,247 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import asyncio
+import functools
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+from .fake_traci import FakeTraci
+from .fake_websocket import FakeWebSocket, run
+from .history import History
+from .metrics import Exposition, STAGES
+from .session import Session, SessionLimitError, SessionManager, STATUS_PAUSED, STATUS_RUNNING
+from .simulation import Simulation, SimulationWorker
+
+START = {'type': 'action', 'action': 'start'}
+
+
+def make_manager(max_sessions=4, idle_secs=60):
+    def make_session(name, vtypes=None):
+        # Each session gets a simulation of its own, with its own vehicles.
+        traci = FakeTraci(num_vehicles=10, num_lights=2, seed=len(name))
+        simulation = SimulationWorker(Simulation(traci))
+        session = Session(name, simulation, functools.partial(simulation.start, ['sumo']),
+                          vtypes=vtypes)
+        session.delay_length_ms = 1
+        return session
+    return SessionManager(make_session, max_sessions, idle_secs)
+
+
+async def close_all(manager):
+    for session in manager.sessions.values():
+        await session.cleanup()
+        session.simulation.shutdown()
+
+
+def snapshots(ws):
+    return [m for m in (json.loads(m) for m in ws.sent) if m['type'] == 'snapshot']
+
+
+def test_sessions_are_independent():
+    async def go():
+        manager = make_manager()
+        viewers = {}
+        for name in ('a', 'bb'):
+            session = manager.get(name)
+            ws = viewers[name] = FakeWebSocket()
+            session.subscribe(ws)
+            await manager.handle_message(session, ws, START)
+        await asyncio.sleep(0.1)
+        await manager.handle_message(manager.get('a'), viewers['a'], {
+            'type': 'action', 'action': 'pause'})
+        statuses = [manager.get(name).status for name in ('a', 'bb')]
+        await close_all(manager)
+        return viewers, statuses
+
+    viewers, statuses = run(go)
+    eq_([STATUS_PAUSED, STATUS_RUNNING], statuses)
+    a = snapshots(viewers['a'])
+    b = snapshots(viewers['bb'])
+    assert a and b
+    # Each viewer only hears about its own session's simulation.
+    eq_(1000, a[0]['time'])
+    eq_(1000, b[0]['time'])
+    assert a[0]['vehicles'] != b[0]['vehicles']
+    eq_(['a'], list({m['scenario'] for m in map(json.loads, viewers['a'].sent)
+                     if m['type'] == 'state'}))
+
+
+def test_session_args():
+    bus = {'bus': {'type': 'bus', 'vClass': 'bus'}}
+
+    async def go():
+        manager = make_manager()
+        session = manager.get('a', vtypes=bus)
+        eq_(bus, session.hub.vtypes)
+        # They're only used when the session is created.
+        eq_(session, manager.get('a', vtypes={}))
+        eq_(bus, session.hub.vtypes)
+
+    run(go)
+
+
+def test_paused_session_waits():
+    async def go():
+        manager = make_manager()
+        session = manager.get('a')
+        ws = FakeWebSocket()
+        session.subscribe(ws)
+        await manager.handle_message(session, ws, START)
+        await asyncio.sleep(0.05)
+        await manager.handle_message(session, ws, {'type': 'action', 'action': 'pause'})
+        await asyncio.sleep(0.05)
+        # Rather than polling, run() waits to be woken.
+        paused_frames = len(snapshots(ws))
+        waiting = not session.wake.is_set()
+        await asyncio.sleep(0.05)
+        eq_(paused_frames, len(snapshots(ws)))
+        await manager.handle_message(session, ws, {'type': 'action', 'action': 'resume'})
+        await asyncio.sleep(0.05)
+        resumed_frames = len(snapshots(ws))
+        await close_all(manager)
+        return ws, waiting, paused_frames, resumed_frames
+
+    ws, waiting, paused_frames, resumed_frames = run(go)
+    assert waiting
+    assert resumed_frames > paused_frames
+    # New viewers are sent the session's state as soon as they subscribe.
+    eq_({'type': 'state', 'scenario': 'a', 'simulationStatus': 'off'},
+        {k: v for k, v in json.loads(ws.sent[0]).items()
+         if k in ('type', 'scenario', 'simulationStatus')})
+
+
+def test_full_state_is_built_once_a_step():
+    record_dir = tempfile.mkdtemp()
+
+    async def go():
+        traci = FakeTraci(num_vehicles=10, num_lights=2)
+        simulation = SimulationWorker(Simulation(traci))
+        session = Session('a', simulation, functools.partial(simulation.start, ['sumo']),
+                          history=History(keyframe_interval=1),
+                          record_path=os.path.join(record_dir, 'a.rec'), keyframe_interval=1)
+        session.delay_length_ms = 1
+        full_state_fn = session.hub.full_state_fn
+        calls = []
+
+        def counted_full_state():
+            calls.append(session.last_lights)
+            return full_state_fn()
+
+        session.hub.full_state_fn = counted_full_state
+        await session.start()
+        await asyncio.sleep(0.05)
+        steps = session.hub.history.steps
+        await session.cleanup()
+        simulation.shutdown()
+        return steps, calls
+
+    try:
+        steps, calls = run(go)
+    finally:
+        shutil.rmtree(record_dir)
+    # Every step is a keyframe of both the recording and the history.
+    assert steps > 0
+    eq_(steps, len(calls))
+
+
+def test_session_limit():
+    async def go():
+        manager = make_manager(max_sessions=1)
+        first = manager.get('a')
+        await manager.handle_message(first, FakeWebSocket(), START)
+        second = manager.get('b')
+        error = None
+        try:
+            await manager.handle_message(second, FakeWebSocket(), START)
+        except SessionLimitError as e:
+            error = e
+        # Viewers can still join the running session, and once it's done, the other can start.
+        await manager.handle_message(first, FakeWebSocket(), START)
+        await manager.handle_message(first, FakeWebSocket(), {
+            'type': 'action', 'action': 'cancel'})
+        await manager.handle_message(second, FakeWebSocket(), START)
+        running = [s.is_running for s in (first, second)]
+        await close_all(manager)
+        return error, running
+
+    error, running = run(go)
+    assert isinstance(error, SessionLimitError)
+    eq_([False, True], running)
+
+
+def test_idle_sessions_are_reaped():
+    async def go():
+        manager = make_manager(idle_secs=0)
+        watched = manager.get('a')
+        ws = FakeWebSocket()
+        watched.subscribe(ws)
+        await manager.handle_message(watched, ws, START)
+        left = manager.get('b')
+        left_ws = FakeWebSocket()
+        left.subscribe(left_ws)
+        await manager.handle_message(left, left_ws, START)
+        await manager.reap()
+        eq_(['a', 'b'], sorted(manager.sessions))
+        left.unsubscribe(left_ws)
+        await manager.reap()
+        eq_(['a'], sorted(manager.sessions))
+        is_running = left.is_running
+        await close_all(manager)
+        return is_running
+
+    eq_(False, run(go))
+
+
+def test_bad_viewport():
+    bad = [{}, {'bounds': 3}, {'bounds': [0, 1]}, {'bounds': [2, 1, 0, 3]},
+           {'bounds': None, 'camera': [1]}, {'bounds': None, 'camera': ['x', 'y']}]
+
+    async def go():
+        manager = make_manager()
+        session = manager.get('a')
+        ws = FakeWebSocket()
+        session.subscribe(ws)
+        for msg in bad:
+            await manager.handle_message(session, ws, dict(msg, type='viewport'))
+        await manager.handle_message(session, ws, {
+            'type': 'viewport', 'bounds': [0, 1, 2, 3], 'camera': [1, 2]})
+        await asyncio.sleep(0)
+        viewport = session.hub.subscribers[ws].viewport
+        await close_all(manager)
+        return ws, viewport
+
+    # Each bad message gets an error, and the viewer stays subscribed.
+    ws, viewport = run(go)
+    eq_(['state'] + ['error'] * len(bad), [json.loads(m)['type'] for m in ws.sent])
+    eq_(((0.0, 1.0, 2.0, 3.0), (1.0, 2.0)), (viewport.bounds, viewport.camera))
+
+
+def test_metrics():
+    async def go():
+        manager = make_manager()
+        session = manager.get('a')
+        ws = FakeWebSocket()
+        session.subscribe(ws)
+        await manager.handle_message(session, ws, START)
+        await asyncio.sleep(0.1)
+        exposition = Exposition()
+        session.export_metrics(exposition)
+        await close_all(manager)
+        return exposition.render().split('\n')
+
+    lines = run(go)
+    for stage in STAGES:
+        count = [line for line in lines if line.startswith(
+            'sumo_web3d_stage_seconds_count{scenario="a",stage="%s"}' % stage)]
+        assert count and int(count[0].split()[-1]) > 0, stage
+    assert 'sumo_web3d_agents{scenario="a",vclass="passenger"} 10' in lines
+    assert 'sumo_web3d_target_frame_rate{scenario="a"} 1000.0' in lines
+    assert any(line.startswith('sumo_web3d_viewer_queue_depth_max{scenario="a"} ')
+               for line in lines)
+    # Viewers aren't labelled one by one, since each reconnection would add series.
+    assert not any('client=' in line for line in lines)
+    sent = [line for line in lines if line.startswith('sumo_web3d_frames_sent_total{')]
+    assert sent and int(sent[0].split()[-1]) > 0
@@ -0,0 +1,237 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Running a SUMO simulation and reading its state over TraCI.
+
+TraCI calls block on a socket, so the server makes them on a dedicated thread via a
+SimulationWorker, which keeps the event loop free to serve HTTP requests while SUMO steps.
+
+The traci module is passed in rather than imported, so that tests and benchmarks can use a
+stand-in (see fake_traci.py). To run several SUMOs at once, pass each Simulation a
+TraciConnection.
+"""
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import time
+
+
+class Simulation(object):
+    """A SUMO simulation, controlled via a traci module (or something with the same interface)."""
+
+    def __init__(self, traci):
+        self.traci = traci
+        tc = self.tc = traci.constants
+        # We use these to tell TraCI which parameters we want to track.
+        common_vars = [tc.VAR_TYPE, tc.VAR_SPEED, tc.VAR_ANGLE, tc.VAR_LENGTH, tc.VAR_WIDTH]
+        self.person_vars = common_vars + [tc.VAR_POSITION, tc.VAR_VEHICLE]
+        # A person's route is that of their current stage, so it changes with the stage. Older
+        # versions of SUMO can't report stages, but boarding or leaving a vehicle still shows.
+        self.stages_var = getattr(tc, 'VAR_STAGES_REMAINING', None)
+        if self.stages_var is not None:
+            self.person_vars.append(self.stages_var)
+        # The route ID changes when a vehicle is rerouted, which invalidates its cached route.
+        self.vehicle_vars = common_vars + [
+            tc.VAR_POSITION3D, tc.VAR_SIGNALS, tc.VAR_VEHICLECLASS, tc.VAR_ROUTE_ID]
+        self.light_vars = [tc.TL_CURRENT_PHASE, tc.TL_CURRENT_PROGRAM]
+
+    def start(self, args):
+        """Start SUMO with a command line, e.g. ['sumo', '-c', 'foo.sumocfg']."""
+        traci = self.traci
+        tc = self.tc
+        traci.start(args)
+        # Older versions of SUMO can't report which persons departed; see step().
+        self.departed_persons_var = getattr(tc, 'VAR_DEPARTED_PERSONS_IDS', None)
+        self.person_ids = set()
+        simulation_vars = [
+            tc.VAR_TIME_STEP, tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_MIN_EXPECTED_VEHICLES]
+        if self.departed_persons_var is not None:
+            simulation_vars.append(self.departed_persons_var)
+        traci.simulation.subscribe(simulation_vars)
+
+        # Subscribe to all traffic lights. This set of IDs should never change.
+        for light_id in traci.trafficlight.getIDList():
+            traci.trafficlight.subscribe(light_id, self.light_vars)
+
+    def close(self):
+        self.traci.close()
+
+    def person_to_dict(self, person):
+        """Extracts relevant information from what traci.person.getSubscriptionResults."""
+        tc = self.tc
+        return {
+            'x': person[tc.VAR_POSITION][0],
+            'y': person[tc.VAR_POSITION][1],
+            'z': 0,
+            'speed': person[tc.VAR_SPEED],
+            'angle': person[tc.VAR_ANGLE],
+            'type': person[tc.VAR_TYPE],
+            'length': person[tc.VAR_LENGTH],
+            'width': person[tc.VAR_WIDTH],
+            'person': person.get(tc.VAR_VEHICLE),
+            'vClass': 'pedestrian',
+        }
+
+    def vehicle_to_dict(self, vehicle):
+        """Extracts relevant information from what traci.vehicle.getSubscriptionResults."""
+        tc = self.tc
+        return {
+            'x': vehicle[tc.VAR_POSITION3D][0],
+            'y': vehicle[tc.VAR_POSITION3D][1],
+            'z': vehicle[tc.VAR_POSITION3D][2],
+            'speed': vehicle[tc.VAR_SPEED],
+            'angle': vehicle[tc.VAR_ANGLE],
+            'type': vehicle[tc.VAR_TYPE],
+            'length': vehicle[tc.VAR_LENGTH],
+            'width': vehicle[tc.VAR_WIDTH],
+            'signals': vehicle[tc.VAR_SIGNALS],
+            'vClass': vehicle.get(tc.VAR_VEHICLECLASS),
+        }
+
+    def light_to_dict(self, light):
+        """Extract relevant information from traci.trafficlights.getSubscriptionResults."""
+        tc = self.tc
+        return {
+            'phase': light[tc.TL_CURRENT_PHASE],
+            'programID': light[tc.TL_CURRENT_PROGRAM],
+        }
+
+    def step(self):
+        """Advance the simulation by one step and read the new state of everything in it.
+
+        Returns a dict with the simulation time, the vehicles (including persons) and lights,
+        keyed by ID, the number of vehicles of each vClass, the number which are running or have
+        yet to depart (0 once the simulation is over), each vehicle's route ID (or person's stage)
+        and how long the step and reading the state took.
+        """
+        traci = self.traci
+        tc = self.tc
+        start_secs = time.time()
+        traci.simulationStep()
+        end_sim_secs = time.time()
+
+        # Subscription results arrive with the step, so reading them doesn't go back to SUMO.
+        # The only round trips are subscribing to vehicles and persons as they depart. They're
+        # unsubscribed automatically when they arrive.
+        # See: http://sumo.dlr.de/wiki/TraCI/Object_Variable_Subscription
+        departures = traci.simulation.getSubscriptionResults()
+        for veh_id in departures[tc.VAR_DEPARTED_VEHICLES_IDS]:
+            traci.vehicle.subscribe(veh_id, self.vehicle_vars)
+
+        if self.departed_persons_var is not None:
+            new_person_ids = departures[self.departed_persons_var]
+        else:
+            # Workaround for older versions of SUMO, which don't report persons' departures.
+            # See: http://sumo.dlr.de/trac.wsgi/ticket/3477
+            person_ids = set(traci.person.getIDList())
+            new_person_ids = person_ids - self.person_ids
+            self.person_ids = person_ids
+        for ped_id in new_person_ids:
+            traci.person.subscribe(ped_id, self.person_vars)
+
+        vehicle_results = traci.vehicle.getAllSubscriptionResults()
+        vehicles = {veh_id: self.vehicle_to_dict(vehicle)
+                    for veh_id, vehicle in vehicle_results.items()}
+        route_ids = {veh_id: vehicle[tc.VAR_ROUTE_ID]
+                     for veh_id, vehicle in vehicle_results.items()}
+        person_results = traci.person.getAllSubscriptionResults()
+        persons = {p_id: self.person_to_dict(person) for p_id, person in person_results.items()}
+        # Persons don't have route IDs, so their stage stands in for one.
+        route_ids.update({p_id: ('stage', person.get(self.stages_var), person.get(tc.VAR_VEHICLE))
+                          for p_id, person in person_results.items()})
+
+        # Note: we might have to separate vehicles and people if their data models or usage
+        # deviate but for now we'll combine them into a single object
+        vehicles.update(persons)
+        vehicle_counts = Counter(v['vClass'] for veh_id, v in vehicles.items())
+
+        lights = {l_id: self.light_to_dict(light)
+                  for l_id, light in traci.trafficlight.getAllSubscriptionResults().items()}
+
+        return {
+            'time': departures[tc.VAR_TIME_STEP],
+            'vehicles': vehicles,
+            'lights': lights,
+            'vehicle_counts': vehicle_counts,
+            'expected_vehicles': departures[tc.VAR_MIN_EXPECTED_VEHICLES],
+            'route_ids': route_ids,
+            'simulate_secs': end_sim_secs - start_secs,
+            'read_secs': time.time() - end_sim_secs,
+        }
+
+    def get_route(self, obj_id, v_class):
+        """The IDs of the edges on a vehicle's or person's route."""
+        if v_class == 'pedestrian':
+            return self.traci.person.getEdges(obj_id)
+        return self.traci.vehicle.getRoute(obj_id)
+
+    def get_routes(self, objs):
+        """The routes of (ID, vClass) pairs, as {ID: edge IDs}, leaving out any which are gone."""
+        routes = {}
+        for obj_id, v_class in objs:
+            try:
+                routes[obj_id] = list(self.get_route(obj_id, v_class))
+            except self.traci.TraCIException:
+                pass  # It arrived since the last step.
+        return routes
+
+
+class TraciConnection(object):
+    """The traci module's interface, for a labeled connection to a SUMO of its own.
+
+    The traci module's functions act on its current connection, which is shared by every thread.
+    This calls the methods of one connection instead. Each start() uses a new label, since a
+    closed connection's label may not be reusable.
+    """
+
+    def __init__(self, traci, label):
+        self.traci = traci
+        self.constants = traci.constants
+        self.TraCIException = traci.TraCIException
+        self.label = label
+        self.starts = 0
+        self.connection = None
+
+    def start(self, args):
+        label = '%s-%d' % (self.label, self.starts)
+        self.starts += 1
+        self.traci.start(args, label=label)
+        self.connection = self.traci.getConnection(label)
+
+    def __getattr__(self, name):
+        # Domains (vehicle, simulation, ...), simulationStep and close.
+        return getattr(self.connection, name)
+
+
+class SimulationWorker(object):
+    """Runs a Simulation's methods on a dedicated thread.
+
+    Calls are queued and run one at a time in the order they're made, since TraCI isn't
+    thread-safe. Each method returns an awaitable for its result.
+    """
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+    def start(self, args):
+        return self.run(self.simulation.start, args)
+
+    def step(self):
+        return self.run(self.simulation.step)
+
+    def close(self):
+        return self.run(self.simulation.close)
+
+    def get_route(self, obj_id, v_class):
+        return self.run(self.simulation.get_route, obj_id, v_class)
+
+    def get_routes(self, objs):
+        return self.run(self.simulation.get_routes, objs)
+
+    def shutdown(self):
+        """Stop the worker's thread once any calls in progress are done."""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,102 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import asyncio
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from nose.tools import eq_
+
+from .fake_traci import FakeTraci
+from .simulation import Simulation, SimulationWorker
+
+
+def test_step():
+    simulation = Simulation(FakeTraci(num_vehicles=20, num_persons=5, num_lights=3,
+                                      trip_steps=10))
+    simulation.start(['sumo'])
+    for _ in range(20):
+        step = simulation.step()
+    eq_(1000 * 20, step['time'])
+    counts = step['vehicle_counts']
+    assert 0 < counts['passenger'] <= 20 and 0 < counts['pedestrian'] <= 5, counts
+    eq_(counts['passenger'] + counts['pedestrian'], len(step['vehicles']))
+    vehicle = next(v for v in step['vehicles'].values() if v['vClass'] == 'passenger')
+    eq_({'x', 'y', 'z', 'speed', 'angle', 'type', 'length', 'width', 'signals', 'vClass'},
+        set(vehicle.keys()))
+    eq_({'tl0', 'tl1', 'tl2'}, set(step['lights'].keys()))
+    eq_({'phase', 'programID'}, set(step['lights']['tl0'].keys()))
+
+
+def checked_steps(traci):
+    """Steps a simulation, checking its state, and yields the calls made and departures."""
+    simulation = Simulation(traci)
+    simulation.start(['sumo'])
+    for _ in range(30):
+        calls = traci.calls
+        step = simulation.step()
+        eq_(set(traci.vehicles) | set(traci.persons), set(step['vehicles']))
+        eq_(set(traci.lights), set(step['lights']))
+        for veh_id, vehicle in traci.vehicles.items():
+            eq_((vehicle.x, vehicle.y), (step['vehicles'][veh_id]['x'],
+                                         step['vehicles'][veh_id]['y']))
+        for person_id, person in traci.persons.items():
+            eq_(person.angle, step['vehicles'][person_id]['angle'])
+        # Only the step and subscribing to new departures should go back to SUMO.
+        departures = len(traci.departed_vehicles) + len(traci.departed_persons)
+        yield calls, departures, traci.calls
+
+
+def test_step_calls_dont_grow_with_agents():
+    traci = FakeTraci(num_vehicles=200, num_persons=50, trip_steps=10)
+    for calls, departures, end_calls in checked_steps(traci):
+        eq_(calls + 1 + departures, end_calls)
+
+
+def test_step_without_person_departures():
+    """Older versions of SUMO can't subscribe to persons' departures, so they're listed."""
+    traci = FakeTraci(num_vehicles=200, num_persons=50, trip_steps=10, legacy=True)
+    for calls, departures, end_calls in checked_steps(traci):
+        eq_(calls + 2 + departures, end_calls)
+
+
+def test_slow_steps_dont_block_http():
+    """While SUMO takes 500ms per step, HTTP requests should still be answered promptly."""
+    step_secs = 0.5
+    worker = SimulationWorker(Simulation(FakeTraci(num_vehicles=10, step_secs=step_secs)))
+
+    async def handler(request):
+        return web.Response(text='{}')
+
+    async def go():
+        app = web.Application()
+        app.router.add_get('/state', handler)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            await worker.start(['sumo'])
+            steps = asyncio.ensure_future(asyncio.gather(worker.step(), worker.step()))
+            await asyncio.sleep(0.05)  # Make sure the first step is under way.
+
+            latencies = []
+            while not steps.done():
+                start_secs = time.perf_counter()
+                response = await client.get('/state')
+                await response.text()
+                latencies.append(time.perf_counter() - start_secs)
+                await asyncio.sleep(0.05)
+            await steps
+            return latencies
+        finally:
+            await client.close()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        latencies = loop.run_until_complete(go())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    # If the steps blocked the event loop, there'd be one or two requests taking ~500ms each.
+    assert len(latencies) >= 5, latencies
+    assert max(latencies) < step_secs / 5, latencies
@@ -0,0 +1,440 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Tessellation of a scenario's network into binary vertex buffers for the frontend.
+
+Building a mesh for every lane and junction of a city-scale network takes the browser a long
+time, so the server does it once per scenario instead. The lanes (including crossings),
+junctions and bus stops are triangulated in the same way as the frontend's network.ts did, in
+three.js coordinates. The result is a binary blob which the frontend turns into BufferGeometry
+without any further processing:
+
+    'SW3M' | uint32 header length | JSON header, padded to 4 bytes | buffers
+
+Everything is little-endian. The header lists the layers (edges, junctions and bus stops). Each
+has [offset, length] of its float32 position, normal and uv and uint32 index buffers (relative
+to the start of the buffers), its material groups and the range of indices of each object in it
+(e.g. each lane), with its userData and the IDs by which the frontend looks it up.
+"""
+import json
+import struct
+
+import numpy as np
+
+from .xml_utils import force_list
+
+MAGIC = b'SW3M'
+FORMAT_VERSION = 1
+
+# These mirror the defaults in frontend/src/network.ts.
+DEFAULT_LANE_WIDTH_M = 3.2
+
+# Materials are named, and the frontend maps the names to three.js materials.
+EDGE_MATERIALS = ['road', 'crossing', 'cycleway', 'railway', 'walkway']
+ROAD, CROSSING, CYCLEWAY, RAILWAY, WALKWAY = range(len(EDGE_MATERIALS))
+
+RAIL_CLASSES = {'rail_electric', 'rail', 'rail_urban', 'tram'}
+
+
+def parse_shape_xyz(shape):
+    """SUMO's "x,y x,y,z ..." as an (n, 3) array, with z=0 where it's missing."""
+    points = []
+    for point in shape.split():
+        xyz = [float(v) for v in point.split(',')]
+        points.append(xyz + [0.0] * (3 - len(xyz)))
+    return np.array(points, dtype=float).reshape(-1, 3)
+
+
+def lane_material(edge, lane, edge_type):
+    """The material of a lane, as in laneToMaterial in network.ts."""
+    type_allow = (edge_type or {}).get('allow')
+    allowed = set((type_allow or '').split())
+    if edge.get('function') == 'crossing':
+        return CROSSING
+    elif 'pedestrian' in (lane.get('allow') or ''):
+        return WALKWAY
+    elif 'bicycle' in (lane.get('allow') or ''):
+        return CYCLEWAY
+    elif type_allow == 'pedestrian':
+        return WALKWAY
+    elif type_allow == 'bicycle':
+        return CYCLEWAY
+    elif allowed & RAIL_CLASSES and 'passenger' not in allowed:
+        return RAILWAY
+    return ROAD
+
+
+def tessellate_polylines(polylines, widths):
+    """Triangulate polylines as flat ribbons of the given widths, as lineString in three-utils.ts.
+
+    polylines are (n, 3) arrays of SUMO x, y, z. Each segment is a quad, with a square cap at
+    either end of the polyline and a bevel at each bend. Returns the positions and uvs of the
+    vertices, the (t, 3) vertex indices of the triangles and the polyline of each triangle.
+    Polylines with fewer than two distinct points have no triangles.
+    """
+    points, owners = [], []
+    for i, polyline in enumerate(polylines):
+        distinct = np.r_[True, np.any(np.diff(polyline[:, :2], axis=0) != 0, axis=1)]
+        polyline = polyline[distinct]
+        if len(polyline) >= 2:
+            points.append(polyline)
+            owners.append(np.full(len(polyline), i))
+    if not points:
+        return np.zeros((0, 3)), np.zeros((0, 2)), np.zeros((0, 3), dtype=int), np.zeros(0, int)
+    points = np.concatenate(points)
+    owners = np.concatenate(owners)
+
+    # Segment s runs from point seg[s] to seg[s] + 1.
+    seg = np.flatnonzero(owners[:-1] == owners[1:])
+    a, b = points[seg], points[seg + 1]
+    delta = b[:, :2] - a[:, :2]
+    length = np.hypot(delta[:, 0], delta[:, 1])
+    along = delta / length[:, np.newaxis]
+    left = np.column_stack([-along[:, 1], along[:, 0]])
+    half_width = np.asarray(widths, dtype=float)[owners[seg]] / 2
+    first = np.r_[True, seg[1:] != seg[:-1] + 1]
+    last = np.r_[seg[1:] != seg[:-1] + 1, True]
+
+    # Distance along the polyline, for the u coordinate of textures.
+    ends = np.cumsum(length)
+    starts = ends - length
+    d_a = starts - starts[first][np.cumsum(first) - 1]
+    d_b = d_a + length
+
+    # Square caps extend the ends of the polyline by half its width.
+    cap_a = (half_width * first)[:, np.newaxis]
+    cap_b = (half_width * last)[:, np.newaxis]
+    a_xy = a[:, :2] - along * cap_a
+    b_xy = b[:, :2] + along * cap_b
+    d_a = d_a - cap_a[:, 0]
+    d_b = d_b + cap_b[:, 0]
+
+    offset = left * half_width[:, np.newaxis]
+    # Each segment has four vertices: a-left, a-right, b-left and b-right.
+    xy = np.stack([a_xy + offset, a_xy - offset, b_xy + offset, b_xy - offset], axis=1)
+    z = np.stack([a[:, 2], a[:, 2], b[:, 2], b[:, 2]], axis=1)
+    positions = np.concatenate([xy, z[:, :, np.newaxis]], axis=2).reshape(-1, 3)
+    u = np.stack([d_a, d_a, d_b, d_b], axis=1)
+    v = np.tile([1.0, 0.0, 1.0, 0.0], (len(seg), 1))
+    uvs = np.stack([u, v], axis=2).reshape(-1, 2)
+
+    base = 4 * np.arange(len(seg))
+    quads = np.concatenate([
+        np.column_stack([base, base + 1, base + 3]),
+        np.column_stack([base, base + 3, base + 2]),
+    ])
+    # The bevel at a bend is the rectangle between the end of one segment and the start of the
+    # next. Its inner half overlaps the segments, which is invisible.
+    join = np.flatnonzero(~last)
+    turn = along[join, 0] * along[join + 1, 1] - along[join, 1] * along[join + 1, 0]
+    join = join[np.abs(turn) > 1e-9]
+    b_left, b_right, a_left, a_right = 4 * join + 2, 4 * join + 3, 4 * join + 4, 4 * join + 5
+    bevels = np.concatenate([
+        np.column_stack([b_left, a_left, b_right]),
+        np.column_stack([b_left, b_right, a_right]),
+    ])
+    triangles = np.concatenate([quads, bevels])
+    triangle_owners = np.concatenate([np.tile(owners[seg], 2), np.tile(owners[seg[join]], 2)])
+    return positions, uvs, triangles, triangle_owners
+
+
+def cross2(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def triangulate_polygon(points):
+    """Triangulate a simple polygon, given as (n, 2) points in either winding, by ear clipping.
+
+    Returns a list of index triples. Self-intersecting polygons may be left partly unfilled.
+    """
+    n = len(points)
+    area = sum(cross2(points[0], points[i], points[i + 1]) for i in range(1, n - 1))
+    order = list(range(n)) if area >= 0 else list(reversed(range(n)))
+
+    def is_reflex(idx):
+        m = len(order)
+        return cross2(points[order[idx - 1]], points[order[idx]], points[order[(idx + 1) % m]]) < 0
+
+    def inside(p, a, b, c):
+        # Points on the boundary count, since a reflex vertex on an ear's diagonal breaks it.
+        if p in (a, b, c):
+            return False
+        return cross2(a, b, p) >= 0 and cross2(b, c, p) >= 0 and cross2(c, a, p) >= 0
+
+    # Only reflex vertices can lie inside an ear, and clipping an ear never makes one.
+    reflex = {order[idx] for idx in range(n) if is_reflex(idx)}
+    triangles = []
+    while len(order) > 3:
+        m = len(order)
+        for idx in range(m):
+            i, j, k = order[idx - 1], order[idx], order[(idx + 1) % m]
+            if j in reflex:
+                continue
+            a, b, c = points[i], points[j], points[k]
+            if any(inside(points[r], a, b, c) for r in reflex if r not in (i, k)):
+                continue
+            triangles.append((i, j, k))
+            del order[idx]
+            for neighbor in (idx - 1, idx % len(order)):
+                if order[neighbor] in reflex and not is_reflex(neighbor):
+                    reflex.discard(order[neighbor])
+            break
+        else:
+            return triangles
+    triangles.append(tuple(order))
+    return triangles
+
+
+def tessellate_polygons(polygons):
+    """Triangulate flat polygons, like flatMeshFromVertices in three-utils.ts.
+
+    polygons are (n, 3) arrays of SUMO x, y, z. The uvs map each polygon's bounding box to the
+    unit square. Returns positions, uvs, triangles and the polygon of each triangle.
+    """
+    positions, uvs, triangles, owners = [], [], [], []
+    num_vertices = 0
+    for i, polygon in enumerate(polygons):
+        polygon_triangles = triangulate_polygon(polygon[:, :2].tolist())
+        if not polygon_triangles:
+            continue
+        lo, hi = polygon[:, :2].min(axis=0), polygon[:, :2].max(axis=0)
+        positions.append(polygon)
+        uvs.append((polygon[:, :2] - lo) / np.where(hi > lo, hi - lo, 1))
+        triangles.append(np.array(polygon_triangles) + num_vertices)
+        owners.append(np.full(len(polygon_triangles), i))
+        num_vertices += len(polygon)
+    if not positions:
+        return np.zeros((0, 3)), np.zeros((0, 2)), np.zeros((0, 3), dtype=int), np.zeros(0, int)
+    return (np.concatenate(positions), np.concatenate(uvs), np.concatenate(triangles),
+            np.concatenate(owners))
+
+
+def point_along_polyline(points, distance):
+    """The point at a distance along a polyline, or None if it's too short."""
+    total = 0.0
+    for a, b in zip(points[:-1], points[1:]):
+        length = np.hypot(*(b[:2] - a[:2]))
+        if total + length >= distance:
+            frac = (distance - total) / length if length else 0.0
+            return a * (1 - frac) + b * frac
+        total += length
+    return None
+
+
+def runs(values):
+    """The (start, end) of each run of equal values in an array."""
+    if not len(values):
+        return []
+    breaks = np.flatnonzero(values[1:] != values[:-1]) + 1
+    return list(zip(np.r_[0, breaks], np.r_[breaks, len(values)]))
+
+
+def make_layer(name, materials, bottom, geometry, triangle_materials, objects):
+    """Turn tessellated SUMO geometry into a layer of three.js vertex buffers.
+
+    geometry is (positions, uvs, triangles, triangle_owners) and objects is the (keys, userData)
+    of each owner. Triangles are sorted by material and then by object, so that both are
+    contiguous ranges of the index buffer.
+    """
+    positions, uvs, triangles, owners = geometry
+    order = np.lexsort((owners, triangle_materials))
+    triangles, owners, triangle_materials = (
+        triangles[order], owners[order], triangle_materials[order])
+
+    # SUMO's ground is the xy-plane with y pointing down the screen; three.js's is the xz-plane.
+    # This mirrors Transform.sumoXyzToXyz in coords.ts.
+    positions = np.column_stack([positions[:, 0], positions[:, 2], bottom - positions[:, 1]])
+
+    # Faces point down, which gives roads consistent shadows (see lineString in three-utils.ts).
+    corners = positions[triangles]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    flip = face_normals[:, 1] > 0
+    triangles[flip] = triangles[flip][:, ::-1]
+    face_normals[flip] *= -1
+    normals = np.zeros_like(positions)
+    for k in range(3):
+        np.add.at(normals, triangles[:, k], face_normals)
+    lengths = np.linalg.norm(normals, axis=1)
+    normals[lengths == 0] = [0, -1, 0]
+    normals /= np.where(lengths == 0, 1, lengths)[:, np.newaxis]
+
+    layer_objects = []
+    for start, end in runs(owners):
+        keys, user_data = objects[owners[start]]
+        lo = corners[start:end].min(axis=(0, 1))
+        hi = corners[start:end].max(axis=(0, 1))
+        layer_objects.append({
+            'start': int(start) * 3,
+            'count': int(end - start) * 3,
+            'center': [round(float(c), 2) for c in (lo + hi) / 2],
+            'keys': keys,
+            'userData': user_data,
+        })
+    return {
+        'name': name,
+        'materials': materials,
+        'positions': positions.astype('<f4'),
+        'normals': normals.astype('<f4'),
+        'uvs': uvs.astype('<f4'),
+        'indices': triangles.astype('<u4'),
+        'groups': [{'start': int(start) * 3, 'count': int(end - start) * 3,
+                    'materialIndex': int(triangle_materials[start])}
+                   for start, end in runs(triangle_materials)],
+        'objects': layer_objects,
+    }
+
+
+def tessellate_edges(net, bottom):
+    """Lanes of normal edges and crossings, as in makeMergedEdgeGeometry in network.ts."""
+    types = {t['id']: t for t in force_list(net.get('type'))}
+    polylines, widths, materials, objects = [], [], [], []
+    for edge in force_list(net.get('edge')):
+        if edge.get('function') in ('internal', 'walkingarea'):
+            continue
+        for lane in force_list(edge.get('lane')):
+            if not lane.get('shape'):
+                continue
+            polylines.append(parse_shape_xyz(lane['shape']))
+            widths.append(float(lane.get('width') or DEFAULT_LANE_WIDTH_M))
+            materials.append(lane_material(edge, lane, types.get(edge.get('type'))))
+            objects.append(([edge['id'], lane['id']], {
+                'name': 'Edge %s, Lane %s' % (edge['id'], lane['id']),
+                'osmId': {'id': edge['id'], 'type': 'way'},
+            }))
+    geometry = tessellate_polylines(polylines, widths)
+    return make_layer('edges', EDGE_MATERIALS, bottom, geometry,
+                      np.array(materials, dtype=int)[geometry[3]], objects)
+
+
+def tessellate_junctions(net, bottom):
+    """Junction polygons, as in makeMergedJunctions in network.ts."""
+    polygons, objects = [], []
+    for junction in force_list(net.get('junction')):
+        if junction.get('type') == 'internal' or not junction.get('shape'):
+            continue
+        polygon = parse_shape_xyz(junction['shape'])
+        if len(polygon) < 4:
+            continue  # These are just lines, not polygons.
+        # Junction shapes are flat, at the junction's z.
+        polygon[:, 2] = float(junction.get('z') or 0)
+        polygons.append(polygon)
+        objects.append(([junction['id']], {
+            'type': 'junction',
+            'name': 'Junction %s' % junction['id'],
+            'osmId': {'id': junction['id'], 'type': 'node'},
+        }))
+    geometry = tessellate_polygons(polygons)
+    return make_layer('junctions', ['junction'], bottom, geometry,
+                      np.zeros(len(geometry[3]), dtype=int), objects)
+
+
+def tessellate_bus_stops(net, additional, bottom):
+    """Bus stops along the right edge of their lanes, as in makeBusStop in network.ts."""
+    lanes = {}
+    for edge in force_list(net.get('edge')):
+        for lane in force_list(edge.get('lane')):
+            lanes[lane['id']] = lane
+    polylines, widths, objects = [], [], []
+    for bus_stop in force_list((additional or {}).get('busStop')):
+        lane = lanes.get(bus_stop.get('lane'))
+        if not lane or not lane.get('shape'):
+            continue
+        shape = parse_shape_xyz(lane['shape'])
+        shape[:, 2] = 0
+        start = point_along_polyline(shape, float(bus_stop.get('startPos') or 0))
+        if start is None:
+            continue
+        end = point_along_polyline(shape, float(bus_stop.get('endPos') or 0))
+        if end is None:
+            end = shape[-1]  # SUMO is tolerant of this, e.g. bus stop 603 in the LuST scenario.
+        # By default, a bus stop is half the width of a lane and straddles its right edge.
+        lane_width = float(lane.get('width') or DEFAULT_LANE_WIDTH_M)
+        direction = end[:2] - start[:2]
+        norm = np.hypot(*direction)
+        if not norm:
+            continue
+        right = np.array([direction[1], -direction[0], 0]) / norm * lane_width / 2
+        polylines.append(np.array([start + right, end + right]))
+        widths.append(lane_width / 2)
+        objects.append(([bus_stop['id']], {
+            'type': 'busstop',
+            'name': 'Bus Stop %s; Lines: %s' % (bus_stop['id'], bus_stop.get('lines')),
+        }))
+    geometry = tessellate_polylines(polylines, widths)
+    return make_layer('busStops', ['bus_stop'], bottom, geometry,
+                      np.zeros(len(geometry[3]), dtype=int), objects)
+
+
+def untessellated_network(network):
+    """What clients which draw the geometry still need of a parsed network.
+
+    That's its location and traffic light programs, and the connections which traffic lights
+    control with the edges they come from, for placing the lights. It's shaped like the network,
+    with no types or junctions.
+    """
+    net = network['net']
+    connections = [c for c in force_list(net.get('connection')) if c.get('tl')]
+    from_edges = {c['from'] for c in connections}
+    slim = {k: net[k] for k in ('version', 'location', 'tlLogic') if k in net}
+    slim.update({
+        'type': [],
+        'junction': [],
+        'edge': [e for e in force_list(net.get('edge')) if e['id'] in from_edges],
+        'connection': connections,
+    })
+    return {'net': slim}
+
+
+def tessellate_network(network, additional=None):
+    """Tessellate a parsed network (and the bus stops of its additional files) into layers."""
+    net = network['net']
+    bottom = float(net['location']['convBoundary'].split(',')[3])
+    layers = [tessellate_edges(net, bottom), tessellate_junctions(net, bottom)]
+    if additional and additional.get('busStop'):
+        layers.append(tessellate_bus_stops(net, additional, bottom))
+    return layers
+
+
+BUFFERS = [('position', 'positions'), ('normal', 'normals'), ('uv', 'uvs'), ('index', 'indices')]
+
+
+def encode_geometry(layers):
+    """Encode tessellated layers in the binary format described at the top of this module."""
+    header = {'version': FORMAT_VERSION, 'layers': []}
+    buffers = []
+    offset = 0
+    for layer in layers:
+        entry = {
+            'name': layer['name'],
+            'materials': layer['materials'],
+            'vertexCount': len(layer['positions']),
+            'indexCount': layer['indices'].size,
+        }
+        for key, attr in BUFFERS:
+            data = layer[attr].tobytes()
+            entry[key] = [offset, len(data)]
+            buffers.append(data)
+            offset += len(data)  # Always a multiple of 4, so every buffer is aligned.
+        entry['groups'] = layer['groups']
+        entry['objects'] = layer['objects']
+        header['layers'].append(entry)
+    # json.dumps escapes non-ASCII characters, which the frontend relies on to decode the header.
+    header_json = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header_json += b' ' * (-len(header_json) % 4)
+    return MAGIC + struct.pack('<I', len(header_json)) + header_json + b''.join(buffers)
+
+
+def decode_geometry(data):
+    """The header of encoded geometry, and each layer's buffers as numpy arrays."""
+    if data[:4] != MAGIC:
+        raise ValueError('Not tessellated geometry')
+    header_length, = struct.unpack('<I', data[4:8])
+    header = json.loads(data[8:8 + header_length].decode('utf-8'))
+    base = 8 + header_length
+    buffers = []
+    for layer in header['layers']:
+        arrays = {}
+        for key, dtype, width in [('position', '<f4', 3), ('normal', '<f4', 3), ('uv', '<f4', 2),
+                                  ('index', '<u4', 1)]:
+            offset, length = layer[key]
+            arrays[key] = np.frombuffer(data, dtype, length // 4, base + offset).reshape(-1, width)
+        buffers.append(arrays)
+    return header, buffers
@@ -0,0 +1,106 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import numpy as np
+from nose.tools import eq_
+
+from .scenario_test import person_number_scenario
+from .tessellation import (CROSSING, decode_geometry, encode_geometry, lane_material, RAILWAY,
+                           ROAD, tessellate_network, tessellate_polylines, triangulate_polygon,
+                           untessellated_network, WALKWAY)
+
+
+def triangle_area(points, triangles):
+    a, b, c = (points[triangles[:, k]] for k in range(3))
+    return np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) -
+                  (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])).sum() / 2
+
+
+def test_tessellate_polylines():
+    straight = np.array([[0, 0, 0], [10, 0, 0], [10, 0, 0]], dtype=float)
+    bend = np.array([[0, 0, 0], [10, 0, 0], [10, 10, 5]], dtype=float)
+    point = np.array([[1, 1, 0]], dtype=float)
+    positions, uvs, triangles, owners = tessellate_polylines([straight, point, bend], [2, 2, 4])
+
+    # The repeated point is dropped, and the lone point has no triangles.
+    eq_([0, 0, 2, 2, 2, 2, 2, 2], sorted(owners.tolist()))
+    # Square caps extend the ends by half the width.
+    straight_vertices = np.unique(triangles[owners == 0])
+    xy = positions[straight_vertices, :2]
+    eq_([[-1, -1], [11, 1]], [xy.min(axis=0).tolist(), xy.max(axis=0).tolist()])
+    eq_(24, triangle_area(positions, triangles[owners == 0]))
+    eq_([-1, 11], [uvs[straight_vertices, 0].min(), uvs[straight_vertices, 0].max()])
+    eq_([0, 1], sorted(set(uvs[straight_vertices, 1])))
+    # The bend has a bevel, and its z follows the polyline.
+    eq_(5, positions[np.unique(triangles[owners == 2]), 2].max())
+
+
+def test_triangulate_polygon():
+    # An L shape is concave, so some of its corners aren't ears. Either winding works.
+    l_shape = [[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2]]
+    for points in (l_shape, l_shape[::-1]):
+        triangles = triangulate_polygon(points)
+        eq_(4, len(triangles))
+        eq_(3, triangle_area(np.array(points, dtype=float), np.array(triangles)))
+
+
+def test_lane_material():
+    eq_(CROSSING, lane_material({'function': 'crossing'}, {}, None))
+    eq_(WALKWAY, lane_material({}, {'allow': 'pedestrian'}, None))
+    eq_(RAILWAY, lane_material({}, {}, {'allow': 'rail tram'}))
+    eq_(ROAD, lane_material({}, {}, {'allow': 'rail passenger'}))
+
+
+def test_encode_geometry():
+    scenario = person_number_scenario()
+    header, buffers = decode_geometry(
+        encode_geometry(tessellate_network(scenario.network, scenario.additional)))
+    eq_(['edges', 'junctions', 'busStops'], [layer['name'] for layer in header['layers']])
+    for layer, arrays in zip(header['layers'], buffers):
+        eq_(layer['vertexCount'], len(arrays['position']))
+        eq_(layer['indexCount'], arrays['index'].size)
+        assert arrays['index'].max() < layer['vertexCount']
+        # Faces point down, like the frontend's roads.
+        assert np.all(arrays['normal'][:, 1] < 0)
+        # Groups and objects each cover the index buffer without gaps.
+        for ranges in (layer['groups'], layer['objects']):
+            eq_(layer['indexCount'], sum(r['count'] for r in ranges))
+            eq_([r['start'] for r in ranges],
+                np.cumsum([0] + [r['count'] for r in ranges[:-1]]).tolist())
+
+    edges, junctions, bus_stops = header['layers']
+    lane = next(o for o in edges['objects'] if '0/0to0/1_0' in o['keys'])
+    eq_(['0/0to0/1', '0/0to0/1_0'], lane['keys'])
+    eq_({'name': 'Edge 0/0to0/1, Lane 0/0to0/1_0', 'osmId': {'id': '0/0to0/1', 'type': 'way'}},
+        lane['userData'])
+    eq_(['busStop0', 'busStop1'], sorted(o['keys'][0] for o in bus_stops['objects']))
+    eq_('junction', junctions['objects'][0]['userData']['type'])
+    # Positions are in three.js coordinates: y is up, and z is SUMO's y, flipped.
+    network_bottom = float(scenario.network['net']['location']['convBoundary'].split(',')[3])
+    junction = next(j for j in scenario.network['net']['junction'] if j['id'] == '0/1')
+    x, y = [float(v) for v in junction['shape'].split()[0].split(',')]
+    assert [x, 0, network_bottom - y] in buffers[1]['position'].tolist()
+
+
+def test_untessellated_network():
+    lit = {'id': 'lit', 'lane': [{'id': 'lit_0', 'shape': '0,0 10,0'}]}
+    network = {'net': {
+        'version': '0.27',
+        'location': {'convBoundary': '0,0,10,10'},
+        'type': [{'id': 'road'}],
+        'edge': [lit, {'id': 'dark', 'lane': {'id': 'dark_0', 'shape': '10,0 20,0'}}],
+        'junction': [{'id': 'j'}],
+        'connection': [{'from': 'lit', 'fromLane': '0', 'tl': 'j', 'linkIndex': '0'},
+                       {'from': 'dark', 'fromLane': '0'}],
+        'tlLogic': {'id': 'j', 'phase': []},
+    }}
+    eq_({'net': {
+        'version': '0.27',
+        'location': {'convBoundary': '0,0,10,10'},
+        'type': [],
+        'edge': [lit],
+        'junction': [],
+        'connection': [{'from': 'lit', 'fromLane': '0', 'tl': 'j', 'linkIndex': '0'}],
+        'tlLogic': {'id': 'j', 'phase': []},
+    }}, untessellated_network(network))
+    eq_(['location', 'version'], sorted(
+        k for k, v in untessellated_network(person_number_scenario().network)['net'].items()
+        if v))
@@ -0,0 +1,137 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""A pyramid of spatial tiles of a scenario's edges, junctions and polygons.
+
+The whole network and every building can be too much for a browser to load at once, so they're
+also served in tiles, of which clients only load the ones near their camera.
+
+Tiles are squares of the network's area, from a single tile at zoom 0 down to tiles of at most
+tile_size_m meters at max_zoom, each zoom halving their size. Tile (z, x, y) is the x-th from the
+left and y-th from the bottom (in SUMO coordinates, where y points up) at zoom z. Each edge,
+junction and polygon belongs to the tile which contains the center of its bounding box, so a
+zoom's tiles partition them without duplicates. Since features may stick out of their tiles, the
+manifest lists the bounds of each non-empty tile's contents.
+"""
+import math
+
+from .xml_utils import force_list
+
+DEFAULT_TILE_SIZE_M = 500
+
+# The parts of the network and additional files which are tiled.
+NET_KINDS = ['edge', 'junction']
+ADDITIONAL_KINDS = ['poly']
+
+
+def shape_bounds(shapes):
+    """[xmin, ymin, xmax, ymax] of SUMO shapes ("x,y x,y ..."), or None if they're all empty."""
+    xs, ys = [], []
+    for shape in shapes:
+        for point in (shape or '').split():
+            x, y = point.split(',')[:2]
+            xs.append(float(x))
+            ys.append(float(y))
+    if not xs:
+        return None
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def feature_bounds(kind, feature):
+    if kind == 'edge':
+        return shape_bounds(lane.get('shape') for lane in force_list(feature.get('lane')))
+    elif kind == 'junction':
+        bounds = shape_bounds([feature.get('shape')])
+        if bounds is None and feature.get('x') is not None and feature.get('y') is not None:
+            x, y = float(feature['x']), float(feature['y'])
+            bounds = [x, y, x, y]
+        return bounds
+    return shape_bounds([feature.get('shape')])
+
+
+def union_bounds(a, b):
+    if a is None:
+        return list(b)
+    return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+
+
+class TileIndex(object):
+    """Edges, junctions and polygons, partitioned into tiles at max_zoom.
+
+    Tiles at lower zooms are made by merging these on request.
+    """
+
+    def __init__(self, network, additional=None, tile_size_m=DEFAULT_TILE_SIZE_M):
+        net = network['net']
+        xmin, ymin, xmax, ymax = [float(v) for v in net['location']['convBoundary'].split(',')]
+        self.origin = [xmin, ymin]
+        extent = max(xmax - xmin, ymax - ymin, tile_size_m)
+        self.max_zoom = int(math.ceil(math.log2(extent / tile_size_m)))
+        self.size = tile_size_m * 2 ** self.max_zoom
+        self.leaves = {}  # (x, y) at max_zoom -> {kind: [feature, ...]}
+        self.leaf_bounds = {}  # (x, y) at max_zoom -> bounds of its features
+
+        sources = [(kind, net.get(kind)) for kind in NET_KINDS]
+        sources += [(kind, (additional or {}).get(kind)) for kind in ADDITIONAL_KINDS]
+        for kind, features in sources:
+            for feature in force_list(features):
+                bounds = feature_bounds(kind, feature)
+                if bounds is None:
+                    continue
+                leaf = self.leaf_for((bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2)
+                if leaf not in self.leaves:
+                    self.leaves[leaf] = {k: [] for k in NET_KINDS + ADDITIONAL_KINDS}
+                self.leaves[leaf][kind].append(feature)
+                self.leaf_bounds[leaf] = union_bounds(self.leaf_bounds.get(leaf), bounds)
+
+    def leaf_for(self, x, y):
+        """The tile at max_zoom which contains a point. Points outside the network are clamped."""
+        n = 2 ** self.max_zoom
+        leaf_size = self.size / n
+        return tuple(min(max(int((v - o) // leaf_size), 0), n - 1)
+                     for v, o in zip((x, y), self.origin))
+
+    def leaves_in(self, z, x, y):
+        """The non-empty tiles at max_zoom within a tile."""
+        if not 0 <= z <= self.max_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return []
+        shift = self.max_zoom - z
+        return sorted(leaf for leaf in self.leaves
+                      if (leaf[0] >> shift, leaf[1] >> shift) == (x, y))
+
+    def has_tile(self, z, x, y):
+        return bool(self.leaves_in(z, x, y))
+
+    def tile(self, z, x, y):
+        """The contents of a tile, shaped like the network and additional responses.
+
+        Returns None if the tile doesn't exist or is empty.
+        """
+        leaves = self.leaves_in(z, x, y)
+        if not leaves:
+            return None
+        merged = {kind: [f for leaf in leaves for f in self.leaves[leaf][kind]]
+                  for kind in NET_KINDS + ADDITIONAL_KINDS}
+        return {
+            'net': {kind: merged[kind] for kind in NET_KINDS},
+            'additional': {kind: merged[kind] for kind in ADDITIONAL_KINDS},
+        }
+
+    def manifest(self):
+        """The pyramid's geometry, and the bounds and feature counts of each non-empty tile."""
+        tiles = []
+        for z in range(self.max_zoom + 1):
+            shift = self.max_zoom - z
+            merged = {}
+            for leaf, features in self.leaves.items():
+                key = (leaf[0] >> shift, leaf[1] >> shift)
+                bounds, counts = merged.get(key, (None, {}))
+                for kind, kind_features in features.items():
+                    counts[kind] = counts.get(kind, 0) + len(kind_features)
+                merged[key] = (union_bounds(bounds, self.leaf_bounds[leaf]), counts)
+            for (x, y), (bounds, counts) in sorted(merged.items()):
+                tiles.append({'z': z, 'x': x, 'y': y, 'bounds': bounds, 'counts': counts})
+        return {
+            'origin': self.origin,
+            'size': self.size,
+            'maxZoom': self.max_zoom,
+            'tiles': tiles,
+        }
@@ -0,0 +1,72 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+from nose.tools import eq_
+
+from .scenario_test import person_number_scenario
+from .tiles import TileIndex
+
+
+def edge(edge_id, *shapes):
+    return {'id': edge_id, 'lane': [{'id': '%s_%d' % (edge_id, i), 'shape': shape}
+                                    for i, shape in enumerate(shapes)]}
+
+
+NETWORK = {'net': {
+    'location': {'convBoundary': '0.00,0.00,1000.00,1000.00'},
+    'edge': [
+        edge('bottom-left', '10,10 100,10', '10,13 100,13'),
+        edge('top-right', '900,900 990,990'),
+        # This one is centered in the bottom-right tile, but sticks out of it.
+        edge('long', '500,100 1000,100'),
+        {'id': 'no-lanes'},
+    ],
+    'junction': [
+        {'id': 'j0', 'x': '10', 'y': '10', 'shape': '5,5 15,5 15,15 5,15'},
+        {'id': 'j1', 'x': '650', 'y': '650'},
+    ],
+}}
+ADDITIONAL = {
+    # Polygons outside the network's boundary go in the nearest tile.
+    'poly': {'id': 'building', 'shape': '-50,-50 -40,-50 -40,-40'},
+    'busStop': [{'id': 'stop'}],
+}
+
+
+def test_tile_index():
+    index = TileIndex(NETWORK, ADDITIONAL, tile_size_m=300)
+    # 1000m needs four 300m tiles across, which is zoom 2.
+    eq_((2, 1200), (index.max_zoom, index.size))
+
+    eq_(['bottom-left'], [e['id'] for e in index.tile(2, 0, 0)['net']['edge']])
+    eq_(['j0'], [j['id'] for j in index.tile(2, 0, 0)['net']['junction']])
+    eq_(['building'], [p['id'] for p in index.tile(2, 0, 0)['additional']['poly']])
+    eq_(['long'], [e['id'] for e in index.tile(2, 2, 0)['net']['edge']])
+    eq_(['top-right'], [e['id'] for e in index.tile(2, 3, 3)['net']['edge']])
+    # Lower zooms merge tiles.
+    eq_(['long'], [e['id'] for e in index.tile(1, 1, 0)['net']['edge']])
+    eq_(['top-right'], [e['id'] for e in index.tile(1, 1, 1)['net']['edge']])
+    eq_(3, len(index.tile(0, 0, 0)['net']['edge']))
+    # Empty or nonexistent tiles.
+    for z, x, y in [(2, 1, 3), (3, 0, 0), (2, 4, 0), (-1, 0, 0)]:
+        eq_(None, index.tile(z, x, y))
+        eq_(False, index.has_tile(z, x, y))
+
+
+def test_manifest():
+    manifest = TileIndex(NETWORK, ADDITIONAL, tile_size_m=300).manifest()
+    eq_(([0, 0], 1200, 2), (manifest['origin'], manifest['size'], manifest['maxZoom']))
+    tiles = {(t['z'], t['x'], t['y']): t for t in manifest['tiles']}
+    eq_([(0, 0, 0), (1, 0, 0), (1, 1, 0), (1, 1, 1), (2, 0, 0), (2, 2, 0), (2, 2, 2), (2, 3, 3)],
+        sorted(tiles))
+    # Bounds are those of the contents, which needn't fit in the tile.
+    eq_([-50, -50, 100, 15], tiles[2, 0, 0]['bounds'])
+    eq_([500, 100, 1000, 100], tiles[2, 2, 0]['bounds'])
+    eq_({'edge': 3, 'junction': 2, 'poly': 1}, tiles[0, 0, 0]['counts'])
+
+
+def test_scenario_tiles():
+    scenario = person_number_scenario()
+    manifest = scenario.tiles.manifest()
+    leaves = [t for t in manifest['tiles'] if t['z'] == manifest['maxZoom']]
+    # Every edge is in exactly one tile at each zoom.
+    eq_(len(scenario.network['net']['edge']), sum(t['counts']['edge'] for t in leaves))
+    eq_(['busStop'], list(scenario.untiled_additional))
@@ -0,0 +1,131 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Recording what TraCI returns, and playing it back without SUMO.
+
+RecordingTraci wraps a traci module (or a TraciConnection, or a FakeTraci) and logs the result of
+every call made through it. save() writes the log, along with the TraCI constants, to a fixture
+file. RecordedTraci reads a fixture and has the traci module's interface: each call returns the
+next result in the log, so a Simulation which makes the same calls as the one which was recorded
+sees the same responses as it did from SUMO, with no socket or subprocess involved. This is for
+benchmarking the server's side of a step against real traffic.
+
+Fixtures are gzipped pickles, since TraCI results are keyed by integer constants and contain
+tuples, which JSON wouldn't preserve. Only load fixtures you made.
+"""
+import gzip
+import pickle
+
+FIXTURE_VERSION = 1
+
+# The traci module's domains which the server uses.
+DOMAINS = ['simulation', 'vehicle', 'person', 'trafficlight']
+
+# Methods of the traci module itself, as opposed to of one of its domains.
+TOP_LEVEL = None
+
+
+class FixtureMismatchError(Exception):
+    """Raised when a RecordedTraci is called differently from the traci it recorded."""
+
+
+def constants_to_dict(constants):
+    return {name: value for name, value in vars(constants).items() if name.isupper()}
+
+
+class RecordingDomain(object):
+    def __init__(self, recorder, name, domain):
+        self.recorder = recorder
+        self.name = name
+        self.domain = domain
+
+    def __getattr__(self, method):
+        fn = getattr(self.domain, method)
+
+        def call(*args, **kwargs):
+            result = fn(*args, **kwargs)
+            self.recorder.log.append((self.name, method, result))
+            return result
+        return call
+
+
+class RecordingTraci(object):
+    """The traci module's interface, logging the result of every call made to traci."""
+
+    def __init__(self, traci):
+        self.traci = traci
+        self.constants = traci.constants
+        self.log = []  # (domain or None, method, result)
+        for name in DOMAINS:
+            setattr(self, name, RecordingDomain(self, name, getattr(traci, name)))
+        # Old versions of TraCI call this trafficlights.
+        self.trafficlights = self.trafficlight
+
+    def __getattr__(self, method):
+        # start, simulationStep, close, ...
+        return RecordingDomain(self, TOP_LEVEL, self.traci).__getattr__(method)
+
+    def save(self, path):
+        with gzip.open(path, 'wb') as f:
+            pickle.dump({
+                'version': FIXTURE_VERSION,
+                'constants': constants_to_dict(self.constants),
+                'log': self.log,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class RecordedDomain(object):
+    def __init__(self, traci, name):
+        self.traci = traci
+        self.name = name
+
+    def __getattr__(self, method):
+        return lambda *args, **kwargs: self.traci.next_result(self.name, method)
+
+
+class RecordedTraci(object):
+    """The traci module's interface, replaying the calls in a fixture saved by RecordingTraci.
+
+    calls counts the calls replayed. Each start() plays the fixture again from the beginning.
+    steps is the number of simulation steps in the fixture.
+    """
+
+    def __init__(self, path):
+        with gzip.open(path, 'rb') as f:
+            fixture = pickle.load(f)
+        if fixture['version'] != FIXTURE_VERSION:
+            raise ValueError('%s is a version %s fixture; expected %s' % (
+                path, fixture['version'], FIXTURE_VERSION))
+        self.path = path
+        self.constants = type('constants', (object,), fixture['constants'])
+        self.log = fixture['log']
+        self.steps = sum(1 for domain, method, _ in self.log
+                         if domain is TOP_LEVEL and method == 'simulationStep')
+        for name in DOMAINS:
+            setattr(self, name, RecordedDomain(self, name))
+        self.trafficlights = self.trafficlight
+        self.position = 0
+        self.calls = 0
+
+    def next_result(self, domain, method):
+        if self.position >= len(self.log):
+            raise FixtureMismatchError('%s ended before a call to %s' % (
+                self.path, '.'.join(filter(None, [domain, method]))))
+        expected_domain, expected_method, result = self.log[self.position]
+        if (expected_domain, expected_method) != (domain, method):
+            raise FixtureMismatchError('%s has a call to %s at %d, not %s' % (
+                self.path, '.'.join(filter(None, [expected_domain, expected_method])),
+                self.position, '.'.join(filter(None, [domain, method]))))
+        self.position += 1
+        self.calls += 1
+        return result
+
+    def start(self, args, **kwargs):
+        self.position = 0
+        return self.next_result(TOP_LEVEL, 'start')
+
+    def close(self):
+        # This may come before the end of the fixture, if fewer steps were replayed.
+        self.calls += 1
+        self.position = len(self.log)
+
+    def __getattr__(self, method):
+        return RecordedDomain(self, TOP_LEVEL).__getattr__(method)
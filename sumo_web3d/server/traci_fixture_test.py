@@ -0,0 +1,43 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_raises, eq_
+
+from .fake_traci import FakeTraci
+from .simulation import Simulation
+from .traci_fixture import FixtureMismatchError, RecordedTraci, RecordingTraci
+
+STEP_FIELDS = ['time', 'vehicles', 'lights', 'vehicle_counts', 'expected_vehicles']
+
+
+def run_steps(simulation, num_steps):
+    simulation.start(['sumo'])
+    steps = []
+    for _ in range(num_steps):
+        step = simulation.step()
+        steps.append({k: step[k] for k in STEP_FIELDS})
+    simulation.close()
+    return steps
+
+
+def test_record_and_replay():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for legacy in (False, True):
+            path = os.path.join(tmp_dir, 'fake.traci.gz')
+            recorder = RecordingTraci(FakeTraci(num_vehicles=20, num_persons=5, legacy=legacy))
+            expected = run_steps(Simulation(recorder), 15)
+            recorder.save(path)
+
+            traci = RecordedTraci(path)
+            eq_(15, traci.steps)
+            eq_(expected, run_steps(Simulation(traci), 15))
+            # It can be played again.
+            eq_(expected[:3], run_steps(Simulation(traci), 3))
+
+            traci.start(['sumo'])
+            assert_raises(FixtureMismatchError, traci.simulationStep)
+    finally:
+        shutil.rmtree(tmp_dir)
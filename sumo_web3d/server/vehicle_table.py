@@ -0,0 +1,237 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""Columnar store of vehicle state, used to compute deltas between frames.
+
+Computing deltas with round_vehicles and diff_dicts loops over every field of every vehicle in
+Python. The VehicleTable instead gives each vehicle a stable slot and keeps each field in a NumPy
+array, so that rounding, NaN filtering and change detection are array operations.
+
+The deltas are the same as round_vehicles followed by diff_dicts against the previous frame,
+except that NaN values are left out of creations (they aren't valid JSON).
+"""
+import numpy as np
+
+# Fields which are rounded to a number of decimal places before diffing.
+DEFAULT_ROUNDING = {
+    'x': 2,
+    'y': 2,
+    'speed': 0,
+    'angle': 0,
+}
+
+# Fields stored as floats, with NaN for missing values. All other fields are stored as Python
+# objects, with ABSENT for missing values.
+DEFAULT_NUMERIC_FIELDS = ['x', 'y', 'z', 'speed', 'angle', 'signals', 'length', 'width']
+
+# Numeric fields which are sent as ints. Like round_vehicles, speed and angle are rounded to ints.
+DEFAULT_INT_FIELDS = {'speed', 'angle', 'signals'}
+
+
+class _Absent(object):
+    """Marker for a field which a vehicle doesn't have."""
+
+    def __repr__(self):
+        return '<absent>'
+
+
+ABSENT = _Absent()
+
+
+class VehicleTable(object):
+    """Current state of all vehicles, stored by column.
+
+    Slots of removed vehicles are recycled for new ones.
+    """
+
+    def __init__(self, numeric_fields=DEFAULT_NUMERIC_FIELDS, rounding=DEFAULT_ROUNDING,
+                 int_fields=DEFAULT_INT_FIELDS, capacity=1024):
+        self.numeric_fields = list(numeric_fields)
+        self.rounding = rounding
+        self.int_fields = int_fields
+        self.initial_capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self.ids = []  # vehicle IDs in the order of the last update.
+        self.slots = {}  # vehicle ID -> slot
+        self.free_slots = []
+        self.size = 0  # number of slots ever used, including free ones.
+        self.capacity = self.initial_capacity
+        self.columns = {f: self._empty_column(f, self.capacity) for f in self.numeric_fields}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, veh_id):
+        return veh_id in self.slots
+
+    def is_numeric(self, field):
+        return field in self.numeric_fields
+
+    def _empty_column(self, field, size):
+        if self.is_numeric(field):
+            return np.full(size, np.nan)
+        column = np.empty(size, dtype=object)
+        column[:] = ABSENT
+        return column
+
+    def _missing(self, field):
+        return np.nan if self.is_numeric(field) else ABSENT
+
+    def _to_python(self, field, values):
+        """Convert an array of numeric values to a list of Python ints or floats."""
+        if field in self.int_fields:
+            return values.astype(np.int64).tolist()
+        return values.tolist()
+
+    def get(self, veh_id, default=None):
+        """Get the current (rounded) state of a vehicle as a dict."""
+        slot = self.slots.get(veh_id)
+        if slot is None:
+            return default
+        vehicle = {}
+        for field, column in self.columns.items():
+            value = column[slot]
+            if self.is_numeric(field):
+                if not np.isnan(value):
+                    vehicle[field] = self._to_python(field, column[slot:slot + 1])[0]
+            elif value is not ABSENT:
+                vehicle[field] = value
+        return vehicle
+
+    def to_dict(self):
+        return {veh_id: self.get(veh_id) for veh_id in self.ids}
+
+    def _grow(self, size):
+        capacity = self.capacity
+        while capacity < size:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+        for field, column in self.columns.items():
+            grown = self._empty_column(field, capacity)
+            grown[:self.capacity] = column
+            self.columns[field] = grown
+        self.capacity = capacity
+
+    def _assign_slots(self, new_ids):
+        slots = []
+        for veh_id in new_ids:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+            else:
+                slot = self.size
+                self.size += 1
+            self.slots[veh_id] = slot
+            slots.append(slot)
+        self._grow(self.size)
+        return np.array(slots, dtype=np.int64)
+
+    def make_column(self, field, values):
+        """Build a column from a list of values, which may be ABSENT.
+
+        Numeric columns are rounded here.
+        """
+        if self.is_numeric(field):
+            column = np.array([np.nan if v is ABSENT else v for v in values], dtype=float)
+            places = self.rounding.get(field)
+            return column if places is None else np.round(column, places)
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+
+    def update(self, vehicles):
+        """Replace the current state with vehicles, a dict of vehicle ID -> dict of fields.
+
+        Returns a delta in the same format as diff_dicts.
+        """
+        ids = list(vehicles.keys())
+        values = list(vehicles.values())
+        fields = set().union(*values) if values else set()
+        columns = {
+            field: self.make_column(field, [v.get(field, ABSENT) for v in values])
+            for field in fields
+        }
+        return self.update_columns(ids, columns)
+
+    def update_columns(self, ids, columns):
+        """Like update, but with the new state given column-wise.
+
+        columns maps field name -> array parallel to ids, as returned by make_column.
+        """
+        slots = self.slots
+        current = set(ids)
+        removals = [veh_id for veh_id in self.ids if veh_id not in current]
+        for veh_id in removals:
+            slot = slots.pop(veh_id)
+            self.free_slots.append(slot)
+            for field, column in self.columns.items():
+                column[slot] = self._missing(field)
+
+        existing = np.array([veh_id in slots for veh_id in ids], dtype=bool)
+        created_rows = np.flatnonzero(~existing)
+        existing_rows = np.flatnonzero(existing)
+        existing_slots = np.array([slots[veh_id] for veh_id in ids if veh_id in slots],
+                                  dtype=np.int64)
+        created_ids = [ids[i] for i in created_rows.tolist()]
+        created_slots = self._assign_slots(created_ids)
+
+        creations = {veh_id: {} for veh_id in created_ids}
+        updates = {}
+        for field in sorted(columns, key=self._field_order):
+            new_values = columns[field]
+            if field not in self.columns:
+                self.columns[field] = self._empty_column(field, self.capacity)
+            column = self.columns[field]
+
+            if self.is_numeric(field):
+                present = ~np.isnan(new_values)
+            else:
+                present = new_values != ABSENT
+
+            # Creations get every field they have.
+            created_present = created_rows[present[created_rows]]
+            if len(created_present):
+                created_values = new_values[created_present]
+                if self.is_numeric(field):
+                    created_values = self._to_python(field, created_values)
+                for i, value in zip(created_present.tolist(), created_values):
+                    creations[ids[i]][field] = value
+
+            # Updates get fields which changed and aren't NaN. A field missing from the previous
+            # frame counts as None, like dict.get in diff.
+            if len(existing_rows):
+                old = column[existing_slots]
+                new = new_values[existing_rows]
+                if self.is_numeric(field):
+                    changed = (new != old) & present[existing_rows]
+                else:
+                    old[old == ABSENT] = None
+                    # x == x is only false for NaN.
+                    changed = (new != old) & (new == new) & present[existing_rows]
+                changed_rows = existing_rows[changed]
+                changed_values = new[changed]
+                if self.is_numeric(field):
+                    changed_values = self._to_python(field, changed_values)
+                for i, value in zip(changed_rows.tolist(), changed_values):
+                    veh_id = ids[i]
+                    if veh_id in updates:
+                        updates[veh_id][field] = value
+                    else:
+                        updates[veh_id] = {field: value}
+
+            column[existing_slots] = new_values[existing_rows]
+            column[created_slots] = new_values[created_rows]
+
+        # Fields which no vehicle has this frame are missing for all of them.
+        for field, column in self.columns.items():
+            if field not in columns:
+                column[existing_slots] = self._missing(field)
+
+        self.ids = ids
+        return {'creations': creations, 'updates': updates, 'removals': removals}
+
+    def _field_order(self, field):
+        # Numeric fields first, in their declared order; then the rest alphabetically.
+        if self.is_numeric(field):
+            return (0, self.numeric_fields.index(field), field)
+        return (1, 0, field)
@@ -0,0 +1,110 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import copy
+import random
+
+from nose.tools import eq_
+
+from .deltas import diff_dicts, round_vehicles
+from .vehicle_table import VehicleTable
+
+
+def table_diff(before, after):
+    table = VehicleTable(capacity=1)
+    table.update(before)
+    return table.update(after)
+
+
+def test_diff_vehicles():
+    # These are the cases from deltas_test.test_diff_vehicles.
+    eq_({
+        'creations': {},
+        'updates': {'veh2': {'x': 12.1, 'y': 23.2}},
+        'removals': []
+    }, table_diff({
+        'veh1': {'x': 1.234, 'y': 3.456, 'angle': 354},
+        'veh2': {'x': 1.234, 'y': 3.456, 'angle': 234},
+    }, {
+        'veh1': {'x': 1.234, 'y': 3.456, 'angle': 354},
+        'veh2': {'x': 12.1, 'y': 23.2, 'angle': 234},
+    }))
+
+    eq_({
+        'creations': {'obj1': {'x': 1}},
+        'updates': {},
+        'removals': ['obj2']
+    }, table_diff({'obj2': {'x': 2}}, {'obj1': {'x': 1}}))
+
+    eq_({
+        'creations': {},
+        'updates': {'veh1': {'angle': 270}},
+        'removals': []
+    }, table_diff({
+        'veh1': {'x': 1.234, 'y': 3.456, 'angle': 354},
+    }, {
+        'veh1': {'x': float('nan'), 'y': float('nan'), 'angle': 270},
+    }))
+
+
+def test_rounding_and_types():
+    table = VehicleTable()
+    delta = table.update({
+        'veh1': {
+            'x': 1234.5678901234,
+            'y': 2345.6789012346,
+            'speed': 12.123456789,
+            'angle': 359.002355689,
+            'type': 'passenger',
+        }
+    })
+    eq_({
+        'veh1': {'x': 1234.57, 'y': 2345.68, 'speed': 12, 'angle': 359, 'type': 'passenger'}
+    }, delta['creations'])
+    eq_(int, type(delta['creations']['veh1']['speed']))
+    eq_({'x': 1234.57, 'y': 2345.68, 'speed': 12, 'angle': 359, 'type': 'passenger'},
+        table.get('veh1'))
+
+
+def test_object_fields():
+    # A person getting out of a vehicle must be sent, even though the new value is None.
+    table = VehicleTable()
+    table.update({'ped1': {'x': 1, 'person': 'bus1'}})
+    eq_({'ped1': {'person': None}}, table.update({'ped1': {'x': 1, 'person': None}})['updates'])
+    eq_({}, table.update({'ped1': {'x': 1, 'person': None}})['updates'])
+
+
+def test_slot_recycling():
+    table = VehicleTable(capacity=2)
+    table.update({'a': {'x': 1}, 'b': {'x': 2}})
+    table.update({'b': {'x': 2}, 'c': {'x': 3, 'type': 'bus'}})
+    eq_(2, table.size)
+    eq_(None, table.get('a'))
+    eq_({'x': 3, 'type': 'bus'}, table.get('c'))
+    eq_({'creations': {}, 'updates': {'c': {'x': 4}}, 'removals': ['b']},
+        table.update({'c': {'x': 4, 'type': 'bus'}}))
+
+
+def test_matches_diff_dicts():
+    rng = random.Random(0)
+    table = VehicleTable(capacity=4)
+    last_vehicles = {}
+    vehicles = {}
+    for step in range(50):
+        for veh_id in list(vehicles.keys()):
+            if rng.random() < 0.1:
+                del vehicles[veh_id]
+        for i in range(rng.randint(0, 5)):
+            vehicles['veh%d.%d' % (step, i)] = {
+                'x': 0.0, 'y': 0.0, 'z': 0.0, 'speed': 0.0, 'angle': 0.0, 'signals': 0,
+                'type': 'passenger', 'vClass': rng.choice(['passenger', 'bus']),
+            }
+        for v in vehicles.values():
+            v['x'] += rng.uniform(0, 2)
+            v['speed'] = rng.choice([v['speed'], rng.uniform(0, 15)])
+            v['signals'] = rng.choice([0, 0, 8])
+
+        current = copy.deepcopy(vehicles)
+        delta = table.update(current)
+        round_vehicles(current)
+        eq_(diff_dicts(last_vehicles, current), delta)
+        eq_(current, table.to_dict())
+        last_vehicles = current
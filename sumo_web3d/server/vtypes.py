@@ -0,0 +1,96 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+"""A catalog of vehicle types, so that creations don't repeat what their type already says.
+
+Every vehicle and person's creation would otherwise carry its type, vClass, length and width,
+which are the same for all agents of a type unless one has been changed over TraCI. Instead, each
+type gets an index in a stream of snapshots, and is sent once, in the 'vTypes' of the first
+snapshot which creates something of that type. Creations refer to it by index, and only carry
+the fields in which they differ from it:
+
+    {'vTypes': {0: {'type': 'bus', 'vClass': 'bus', 'length': 12.0, 'width': 2.5}},
+     'vehicles': {'creations': {7: {'id': 'bus1', 'vType': 0, 'x': ...}}, ...}}
+
+Like handles, a catalog belongs to a stream of snapshots (see handles.py): a client which joins
+part way through is sent the whole catalog with its full delta. Indices aren't reused, so a
+client never needs to forget an entry.
+
+A type's fields come from its definition in the scenario's additional files, if it has one, and
+otherwise from the first agent of that type.
+"""
+from .xml_utils import force_list, get_only_key
+
+# Fields of creations which are the same for every agent of a type.
+TYPE_FIELDS = ['type', 'vClass', 'length', 'width']
+
+
+def vtype_definitions(parsed_files):
+    """Map each vType ID to its fields, from files parsed with VTYPE_PROJECTIONS."""
+    definitions = {}
+    for parsed in parsed_files:
+        root = parsed and get_only_key(parsed)
+        if not root:
+            continue
+        vtypes = force_list(root.get('vType'))
+        for distribution in force_list(root.get('vTypeDistribution')):
+            vtypes += force_list((distribution or {}).get('vType'))
+        for vtype in vtypes:
+            fields = {'type': vtype['id']}
+            if vtype.get('vClass'):
+                fields['vClass'] = vtype['vClass']
+            for k in ('length', 'width'):
+                if vtype.get(k):
+                    fields[k] = float(vtype[k])
+            definitions[vtype['id']] = fields
+    return definitions
+
+
+class TypeCatalog(object):
+    """Assigns indices to the types of a stream of creations, and compacts the creations.
+
+    definitions map type IDs to their fields, e.g. from vtype_definitions.
+    """
+
+    def __init__(self, definitions=None):
+        self.definitions = definitions or {}
+        self.indices = {}  # type ID -> index
+        self.entries = []  # fields of each type, by index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, creation):
+        """Add the type of a creation, using its fields for any which aren't defined."""
+        type_id = creation['type']
+        entry = {k: creation[k] for k in TYPE_FIELDS if k in creation}
+        entry.update(self.definitions.get(type_id, {}))
+        self.indices[type_id] = len(self.entries)
+        self.entries.append(entry)
+        return self.indices[type_id]
+
+    def compact(self, creation, add=False):
+        """A copy of a creation which refers to its type's index rather than repeating it.
+
+        With add, a type which isn't in the catalog is added to it. Without, the creation is left
+        as it is: a client can only be sent entries which every client sharing the catalog gets.
+        """
+        type_id = creation.get('type')
+        index = self.indices.get(type_id)
+        if index is None:
+            if type_id is None or not add:
+                return creation
+            index = self.add(creation)
+        entry = self.entries[index]
+        compacted = {k: v for k, v in creation.items() if k not in entry or entry[k] != v}
+        compacted['vType'] = index
+        return compacted
+
+    def compact_delta(self, delta, add=False):
+        """Compact the creations of a delta, which may add types with add."""
+        compacted = dict(delta)
+        compacted['creations'] = {k: self.compact(creation, add)
+                                  for k, creation in delta['creations'].items()}
+        return compacted
+
+    def entries_since(self, count):
+        """The entries added after the first count, keyed by index."""
+        return {i: self.entries[i] for i in range(count, len(self.entries))}
@@ -0,0 +1,53 @@
+# Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+from nose.tools import eq_
+
+from .scenario_test import person_number_scenario
+from .vtypes import TypeCatalog, vtype_definitions
+
+CAR = {'type': 'car', 'vClass': 'passenger', 'length': 5.0, 'width': 1.8}
+
+
+def test_compact():
+    catalog = TypeCatalog()
+    eq_({'id': 'veh0', 'x': 1, 'vType': 0}, catalog.compact(dict(CAR, id='veh0', x=1), add=True))
+    eq_([CAR], catalog.entries)
+    # Only fields which differ from the type's are sent.
+    eq_({'id': 'veh1', 'length': 4.5, 'vType': 0},
+        catalog.compact(dict(CAR, id='veh1', length=4.5), add=True))
+    eq_(1, len(catalog))
+
+    # Without add, creations of unknown types are left as they are.
+    bus = {'id': 'bus0', 'type': 'bus', 'vClass': 'bus'}
+    eq_(bus, catalog.compact(bus))
+    eq_({'x': 1}, catalog.compact({'x': 1}, add=True))
+    eq_({'id': 'bus0', 'vType': 1}, catalog.compact(bus, add=True))
+    eq_({1: {'type': 'bus', 'vClass': 'bus'}}, catalog.entries_since(1))
+
+
+def test_definitions():
+    definitions = vtype_definitions([
+        {'routes': {
+            'vType': {'id': 'bus', 'vClass': 'bus', 'length': '12'},
+            'vTypeDistribution': {'id': 'private', 'vType': [
+                {'id': 'car', 'vClass': 'passenger', 'length': '5', 'width': '1.8'},
+                {'id': 'van', 'length': '6'},
+            ]},
+        }},
+        None,
+        {'additional': None},
+    ])
+    eq_({
+        'bus': {'type': 'bus', 'vClass': 'bus', 'length': 12.0},
+        'car': CAR,
+        'van': {'type': 'van', 'length': 6.0},
+    }, definitions)
+
+    # A defined type's fields come from its definition, and the rest from the first agent.
+    catalog = TypeCatalog(definitions)
+    eq_({'id': 'bus0', 'length': 11.0, 'vType': 0}, catalog.compact(
+        {'id': 'bus0', 'type': 'bus', 'vClass': 'bus', 'length': 11.0, 'width': 2.5}, add=True))
+    eq_({'type': 'bus', 'vClass': 'bus', 'length': 12.0, 'width': 2.5}, catalog.entries[0])
+
+
+def test_scenario_vtypes():
+    eq_({}, person_number_scenario().vtypes)
@@ -1,6 +1,9 @@
 # Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
 """Utility code for working with XML files."""
+from collections import namedtuple
+import sys
 
+from lxml import etree
 import xmltodict
 
 
@@ -20,3 +23,133 @@ def get_only_key(d):
     assert d, 'Expected dict but got %s' % d
     assert len(d.keys()) == 1, 'Expected one key but got multiple %s' % d.keys()
     return d[list(d.keys())[0]]
+
+
+def force_list(value):
+    """xmltodict-style values are a dict for one child, and a list for several."""
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+ALL_ATTRIBUTES = '*'
+
+# Describes which parts of an element to keep when parsing with iterparse_xml_file.
+#   attributes: names of the attributes to keep, or ALL_ATTRIBUTES.
+#   children: map from child tag name to Projection. Other children are dropped.
+#   where: optional predicate on the element's attributes. Elements failing it are dropped.
+Projection = namedtuple('Projection', ['attributes', 'children', 'where'])
+
+
+def project(attributes=ALL_ATTRIBUTES, children=None, where=None):
+    return Projection(attributes, children or {}, where)
+
+
+# The parts of SUMO network and additional files which the frontend uses.
+# See the Network and AdditionalResponse types in frontend/src/api.ts.
+TL_LOGIC_PROJECTION = project(['id', 'offset', 'programID', 'type'], {
+    'phase': project(['duration', 'state']),
+})
+
+NET_PROJECTION = project(['version'], {
+    'location': project(),
+    'type': project(
+        ['id', 'priority', 'numLanes', 'speed', 'allow', 'disallow', 'oneway', 'width']),
+    'edge': project(['id', 'function', 'from', 'to', 'priority', 'type', 'spreadType'], {
+        'lane': project(['id', 'index', 'length', 'shape', 'speed', 'allow', 'width']),
+    }),
+    'junction': project(['id', 'type', 'x', 'y', 'z', 'incLanes', 'intLanes', 'shape']),
+    'connection': project(
+        ['dir', 'from', 'fromLane', 'linkIndex', 'state', 'tl', 'to', 'toLane', 'via']),
+    'tlLogic': TL_LOGIC_PROJECTION,
+})
+
+# Polygon params other than these are dropped.
+POLYGON_PARAM_KEYS = {'building:levels'}
+
+ADDITIONAL_PROJECTION = project([], {
+    'poly': project(['id', 'type', 'color', 'fill', 'layer', 'shape'], {
+        'param': project(['key', 'value'], where=lambda a: a.get('key') in POLYGON_PARAM_KEYS),
+    }),
+    'busStop': project(['id', 'lane', 'startPos', 'endPos', 'lines']),
+    'tlLogic': TL_LOGIC_PROJECTION,
+})
+
+# vType definitions, which may be in additional files or in <routes> files listed as additional.
+VTYPE_PROJECTION = project(['id', 'vClass', 'length', 'width'])
+VTYPES_PROJECTION = project([], {
+    'vType': VTYPE_PROJECTION,
+    'vTypeDistribution': project(['id'], {'vType': VTYPE_PROJECTION}),
+})
+VTYPE_PROJECTIONS = {
+    'additional': VTYPES_PROJECTION,
+    'add': VTYPES_PROJECTION,
+    'routes': VTYPES_PROJECTION,
+}
+
+# Network files have a <net> root, additional files either <additional> or <add>.
+SUMO_PROJECTIONS = {
+    'net': NET_PROJECTION,
+    'additional': ADDITIONAL_PROJECTION,
+    'add': ADDITIONAL_PROJECTION,
+}
+
+
+def add_child(parent, tag, value):
+    """Add a child value in the same way as xmltodict: one child is a value, several a list."""
+    if tag not in parent:
+        parent[tag] = value
+    elif isinstance(parent[tag], list):
+        parent[tag].append(value)
+    else:
+        parent[tag] = [parent[tag], value]
+
+
+def iterparse_xml_file(filepath, projections=SUMO_PROJECTIONS):
+    """Parse an XML file element-by-element, keeping only the projected elements and attributes.
+
+    The output has the same shape as parse_xml_file. Unlike it, this never holds the whole file
+    or its full DOM in memory, which matters for city-scale networks. Text content is ignored,
+    since SUMO files keep everything in attributes.
+
+    projections maps the allowed root tag names to a Projection.
+    """
+    if not filepath:
+        return None
+
+    root = None
+    # Each entry is (value dict or None if the element is being skipped, child projections).
+    stack = []
+    context = etree.iterparse(
+        filepath, events=('start', 'end'), remove_comments=True, remove_pis=True, huge_tree=True)
+    for event, elem in context:
+        if event == 'start':
+            children = stack[-1][1] if stack else projections
+            projection = children.get(elem.tag)
+            if projection and projection.where and not projection.where(elem.attrib):
+                projection = None
+            if not projection:
+                stack.append((None, {}))
+                continue
+            attrib = elem.attrib
+            if projection.attributes == ALL_ATTRIBUTES:
+                value = {sys.intern(k): v for k, v in attrib.items()}
+            else:
+                # Using the projection's attribute names shares one key string across elements.
+                value = {k: attrib[k] for k in projection.attributes if k in attrib}
+            stack.append((value, projection.children))
+        else:
+            value, _ = stack.pop()
+            if value is not None:
+                # Like xmltodict, an element with neither attributes nor children is None.
+                if stack:
+                    add_child(stack[-1][0], elem.tag, value or None)
+                else:
+                    root = {elem.tag: value or None}
+            # Free the element and any earlier siblings; we've extracted what we need.
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+    return root
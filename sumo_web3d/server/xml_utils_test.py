@@ -1,7 +1,10 @@
 # Copyright 2018 Sidewalk Labs | http://www.eclipse.org/legal/epl-v20.html
+import os
+import tempfile
+
 from nose.tools import assert_raises, eq_
 
-from .xml_utils import get_only_key
+from .xml_utils import get_only_key, iterparse_xml_file, parse_xml_file, project
 
 
 def test_get_only_key():
@@ -9,3 +12,96 @@ def test_get_only_key():
     eq_({'foo': 1}, get_only_key({'foo': {'foo': 1}}))
     assert_raises(AssertionError, lambda: get_only_key({'foo': 'bar', 'baz': 'quux'}))
     assert_raises(AssertionError, lambda: get_only_key(None))
+
+
+def write_temp_xml(text):
+    f = tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False)
+    f.write(text)
+    f.close()
+    return f.name
+
+
+def test_iterparse_projection():
+    path = write_temp_xml("""<?xml version="1.0" encoding="UTF-8"?>
+<!-- a comment -->
+<net version="0.27" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+    <location netOffset="0.00,0.00" convBoundary="0,0,10,10"/>
+    <edge id="a" from="1" to="2" priority="1" shape="0,0 1,1">
+        <lane id="a_0" index="0" speed="13.89" length="10" shape="0,0 10,0"/>
+    </edge>
+    <edge id="b" function="crossing">
+        <lane id="b_0" index="0" allow="pedestrian" shape="0,0 0,10"/>
+        <lane id="b_1" index="1" shape="0,0 0,10"/>
+    </edge>
+    <junction id="1" type="priority" x="0" y="0" shape="0,0 1,1">
+        <request index="0" response="00" foes="00" cont="0"/>
+    </junction>
+    <roundabout nodes="1 2" edges="a b"/>
+</net>""")
+    try:
+        eq_({
+            'net': {
+                'version': '0.27',
+                'location': {'netOffset': '0.00,0.00', 'convBoundary': '0,0,10,10'},
+                'edge': [
+                    {
+                        'id': 'a', 'from': '1', 'to': '2', 'priority': '1',
+                        'lane': {
+                            'id': 'a_0', 'index': '0', 'speed': '13.89', 'length': '10',
+                            'shape': '0,0 10,0'
+                        },
+                    },
+                    {
+                        'id': 'b', 'function': 'crossing',
+                        'lane': [
+                            {'id': 'b_0', 'index': '0', 'allow': 'pedestrian',
+                             'shape': '0,0 0,10'},
+                            {'id': 'b_1', 'index': '1', 'shape': '0,0 0,10'},
+                        ]
+                    },
+                ],
+                'junction': {
+                    'id': '1', 'type': 'priority', 'x': '0', 'y': '0', 'shape': '0,0 1,1'
+                },
+            }
+        }, iterparse_xml_file(path))
+    finally:
+        os.remove(path)
+
+
+def test_iterparse_where():
+    path = write_temp_xml("""<additional>
+    <poly id="1" type="building" shape="0,0 1,0 1,1">
+        <param key="building:levels" value="3"/>
+        <param key="name" value="City Hall"/>
+    </poly>
+    <poi id="2" x="0" y="0"/>
+</additional>""")
+    try:
+        eq_({
+            'additional': {
+                'poly': {
+                    'id': '1', 'type': 'building', 'shape': '0,0 1,0 1,1',
+                    'param': {'key': 'building:levels', 'value': '3'},
+                },
+            }
+        }, iterparse_xml_file(path))
+        # Unknown root tags produce nothing.
+        eq_(None, iterparse_xml_file(path, {'net': project()}))
+    finally:
+        os.remove(path)
+
+
+def test_iterparse_matches_xmltodict():
+    # The projected parse should agree with xmltodict on everything it keeps.
+    path = os.path.join(
+        os.path.dirname(__file__), '..', 'scenarios', 'person_number', 'net.net.xml')
+    full = parse_xml_file(path)['net']
+    projected = iterparse_xml_file(path)['net']
+    eq_(len(full['edge']), len(projected['edge']))
+    for full_edge, edge in zip(full['edge'], projected['edge']):
+        eq_(full_edge['id'], edge['id'])
+        eq_(full_edge['lane'], edge['lane'])
+    eq_([j.get('shape') for j in full['junction']],
+        [j.get('shape') for j in projected['junction']])
+    eq_(full['location'], projected['location'])